@@ -0,0 +1,135 @@
+# --- anomalies.py (labelled rule violations for stress-testing e-billing rule engines) ---
+"""Inject known fractions of billing-rule violations into invoice rows and label them.
+
+params["anomalies"] maps a kind from ANOMALY_KINDS to the fraction of each invoice's lines that
+should carry it, e.g. {"rate_deviation": 0.05, "duplicate_line": 0.02}. The rows stage picks the
+lines for every kind at once from the stage's seeded RNG (a line gets at most one anomaly; fee-only
+kinds pick fee lines), draws all replacement values as arrays and writes them back. Each altered
+or added line is tagged with ANOMALY, ANOMALY_FIELD and ANOMALY_ORIGINAL, and package_batch turns
+the tags into anomaly_labels.csv: the ground truth a downstream rule engine should flag.
+"""
+from __future__ import annotations
+import csv
+import datetime as dt
+import io
+from typing import Any, Dict
+
+import numpy as np
+
+from money import from_cents, line_cents, to_cents
+
+ANOMALY_KINDS = {
+    "rate_deviation": "Fee billed above the timekeeper's rate (+10% to +50%)",
+    "excessive_hours": "Fee line alone exceeds the daily hours cap",
+    "missing_task_code": "Fee line without a task code",
+    "out_of_period": "Line dated 1-30 days outside the billing period",
+    "weekend_date": "Line dated on a Saturday or Sunday inside the billing period",
+    "duplicate_line": "Exact copy of another line on the same invoice",
+}
+FEE_ONLY = frozenset({"rate_deviation", "excessive_hours", "missing_task_code"})
+RATE_DEVIATION = (0.10, 0.50)
+EXCESS_HOURS = (0.5, 8.0)  # above max_daily_hours
+OUT_OF_PERIOD_DAYS = 30
+LABELS_NAME = "anomaly_labels.csv"
+LABEL_COLUMNS = ["INVOICE_NUMBER", "MATTER_NUMBER", "LINE_ITEM_NUMBER", "ANOMALY", "FIELD", "ORIGINAL", "INJECTED"]
+_FIELDS = {"rate_deviation": "RATE", "excessive_hours": "HOURS", "missing_task_code": "TASK_CODE",
+           "out_of_period": "LINE_ITEM_DATE", "weekend_date": "LINE_ITEM_DATE", "duplicate_line": "LINE_ITEM_NUMBER"}
+
+
+def anomaly_fractions(spec: Dict[str, Any] | None) -> Dict[str, float]:
+    """Validated {kind: fraction} with zero entries dropped, in ANOMALY_KINDS order. Raises ValueError."""
+    spec = spec or {}
+    unknown = set(spec) - set(ANOMALY_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown anomaly kind(s) {sorted(unknown)}; expected {list(ANOMALY_KINDS)}")
+    fractions = {kind: float(spec[kind]) for kind in ANOMALY_KINDS if spec.get(kind)}
+    if any(not 0.0 <= f <= 1.0 for f in fractions.values()):
+        raise ValueError("Anomaly fractions must be between 0 and 1")
+    if sum(fractions.values()) > 1.0:
+        raise ValueError("Anomaly fractions must add up to at most 1")
+    return fractions
+
+
+def inject_anomalies(rows: list[Dict], fractions: Dict[str, float], billing_start_date: dt.date,
+                     billing_end_date: dt.date, max_daily_hours: float, rng: np.random.Generator) -> list[Dict]:
+    """Apply `fractions` (from anomaly_fractions) to rows in place; duplicates are appended. Returns rows."""
+    n = len(rows)
+    if not n or not fractions:
+        return rows
+    is_fee = np.fromiter((not r.get("EXPENSE_CODE") for r in rows), dtype=bool, count=n)
+    start, end = billing_start_date.toordinal(), billing_end_date.toordinal()
+    weekend_days = np.array([d for d in range(start, end + 1) if dt.date.fromordinal(d).weekday() >= 5], dtype=np.int64)
+
+    available = np.ones(n, dtype=bool)
+    none = np.empty(0, dtype=np.int64)
+    picked: Dict[str, np.ndarray] = {}
+    for kind, fraction in fractions.items():
+        eligible = available & is_fee if kind in FEE_ONLY else available.copy()
+        if kind == "weekend_date" and not len(weekend_days):
+            eligible[:] = False
+        candidates = np.flatnonzero(eligible)
+        count = min(int(round(fraction * n)), len(candidates))
+        picked[kind] = np.sort(rng.choice(candidates, size=count, replace=False)) if count else none
+        available[picked[kind]] = False
+
+    def tag(row: Dict, kind: str, original: Any) -> None:
+        row["ANOMALY"], row["ANOMALY_FIELD"], row["ANOMALY_ORIGINAL"] = kind, _FIELDS[kind], original
+
+    idx = picked.get("rate_deviation", none)
+    if len(idx):
+        rates = np.fromiter((float(rows[i]["RATE"]) for i in idx), dtype=float, count=len(idx))
+        new_rates = np.rint(rates * (1 + rng.uniform(*RATE_DEVIATION, len(idx))) * 100).astype(np.int64)
+        for i, rate_c in zip(idx.tolist(), new_rates.tolist()):
+            row = rows[i]
+            tag(row, "rate_deviation", row["RATE"])
+            row["RATE"] = from_cents(rate_c)
+            row["LINE_ITEM_TOTAL"] = from_cents(line_cents(row["HOURS"], rate_c))
+
+    idx = picked.get("excessive_hours", none)
+    if len(idx):
+        new_hours = np.round(float(max_daily_hours) + rng.uniform(*EXCESS_HOURS, len(idx)), 1)
+        for i, hours in zip(idx.tolist(), new_hours.tolist()):
+            row = rows[i]
+            tag(row, "excessive_hours", row["HOURS"])
+            row["HOURS"] = hours
+            row["LINE_ITEM_TOTAL"] = from_cents(line_cents(hours, to_cents(row["RATE"])))
+
+    for i in picked.get("missing_task_code", none).tolist():
+        tag(rows[i], "missing_task_code", rows[i]["TASK_CODE"])
+        rows[i]["TASK_CODE"] = ""
+
+    idx = picked.get("out_of_period", none)
+    if len(idx):
+        shift = rng.integers(1, OUT_OF_PERIOD_DAYS + 1, len(idx))
+        days = np.where(rng.random(len(idx)) < 0.5, start - shift, end + shift)
+        for i, day in zip(idx.tolist(), days.tolist()):
+            tag(rows[i], "out_of_period", rows[i]["LINE_ITEM_DATE"])
+            rows[i]["LINE_ITEM_DATE"] = dt.date.fromordinal(day).isoformat()
+
+    idx = picked.get("weekend_date", none)
+    if len(idx):
+        for i, day in zip(idx.tolist(), rng.choice(weekend_days, len(idx)).tolist()):
+            tag(rows[i], "weekend_date", rows[i]["LINE_ITEM_DATE"])
+            rows[i]["LINE_ITEM_DATE"] = dt.date.fromordinal(day).isoformat()
+
+    for i in picked.get("duplicate_line", none).tolist():
+        copy = dict(rows[i])
+        tag(copy, "duplicate_line", i + 1)
+        rows.append(copy)
+    return rows
+
+
+def anomaly_labels(jobs: list[Dict[str, Any]], built: list[Dict[str, Any]]) -> bytes | None:
+    """CSV of every labelled line across the built invoices (LEDES line numbering), or None when there are none."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(LABEL_COLUMNS)
+    labelled = 0
+    for job, out in zip(jobs, built):
+        for line, row in enumerate(out["rows"], start=1):
+            kind = row.get("ANOMALY")
+            if kind:
+                writer.writerow([job["invoice_number"], job["matter_number"], line, kind, row["ANOMALY_FIELD"],
+                                 row["ANOMALY_ORIGINAL"], row[row["ANOMALY_FIELD"]] if kind != "duplicate_line" else line])
+                labelled += 1
+    return buf.getvalue().encode("utf-8") if labelled else None
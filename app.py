@@ -5,34 +5,39 @@ sys.path.append(os.path.dirname(__file__))
 import pandas as pd
 import random
 import datetime as dt
+import calendar
+import contextlib
+import hashlib
 import io
 import os
+import time
 import logging
-import re
 import smtplib
+import sqlite3
+import tempfile
 
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Dict, Any
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
-from faker import Faker
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
-from PIL import Image as PILImage, ImageDraw, ImageFont
-import zipfile
-
-
+from ledes_parser import validate_ledes_1998b
+from ledes_ingest import learn_ledes_model, learned_model_summary
+from invoice_engine import (
+    CONFIG, ID_PROFILES_STR, RECEIPT_FORMATS, _calculate_max_expenses, _calculate_max_fees, _expense_settings_from_state, _generate_invoice_data,
+    _get_logo_bytes, _is_valid_client_id, _is_valid_law_firm_id, _parse_profiles, _receipt_settings_from_state,
+)
+from anomalies import ANOMALY_KINDS, anomaly_fractions
+from batch_manifest import write_zip
+from invoice_pipeline import PREVIEW_COLUMNS, PREVIEW_LINES, StageCache, generate_batch, preview_lines, shortest_period
+from period_planner import CADENCES
+from portfolio import entities_from_ids_store, generate_portfolio, plan_portfolio
+from roster_synth import CLASSIFICATION_MIX, roster_summary, synthesize_roster
+from run_metrics import artifact_bytes, clear_runs, compare_configs, load_runs, record_run, stage_seconds
+from run_profiler import RunProfiler
+from sidecar import SIDECAR_NAMES, sidecar_format
+from spend_rules import DEFAULT_RULES, parse_rules
+from spill_store import DEFAULT_SPILL_MB, select_attachments
 
-# --- Safety Guards to avoid NameError after refactor (static profiles build) ---
-try:
-    import streamlit as st  # ensure st exists even if moved
-except Exception:
-    pass
 
 # timekeeper_data: None means "not loaded"
 if 'timekeeper_data' not in st.session_state:
@@ -53,13 +58,6 @@ matter_number_base = st.session_state.matter_number_base
 
 
 
-# --- Tax rules ---
-TAX_EXEMPT = {
-    "E110","E109","E108","E120","E122","E118","E121","E119","E112","E113","E114"
-}
-DEFAULT_TAX_RATE = 0.085
-
-# Helper: prefer previously generated rows for email/download
 def _rows_for_email(fallback_args: dict | None = None):
     try:
         import streamlit as st
@@ -114,165 +112,6 @@ def slider_or_fixed(label, min_value, max_value, *, value=None, step=1, help=Non
 # --- Logging Setup ---
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# --- Constants ---
-CONFIG = {
-    'EXPENSE_CODES': {
-        "Copying": "E101", "Outside printing": "E102", "Word processing": "E103",
-        "Facsimile": "E104", "Telephone": "E105", "Online research": "E106",
-        "Delivery services/messengers": "E107", "Postage": "E108", "Local travel": "E109",
-        "Out-of-town travel": "E110", "Meals": "E111", "Court fees": "E112",
-        "Subpoena fees": "E113", "Witness fees": "E114", "Deposition transcripts": "E115",
-        "Trial transcripts": "E116", "Trial exhibits": "E117",
-        "Litigation support vendors": "E118", "Experts": "E119",
-        "Private investigators": "E120", "Arbitrators/mediators": "E121",
-        "Local counsel": "E122", "Other professionals": "E123", "Other": "E124",
-    },
-    'DEFAULT_TASK_ACTIVITY_DESC': [
-        ("L100", "A101", "Legal Research: Analyze legal precedents"),
-        ("L110", "A101", "Legal Research: Review statutes and regulations"),
-        ("L120", "A101", "Legal Research: Draft research memorandum"),
-        ("L130", "A102", "Case Assessment: Initial case evaluation"),
-        ("L140", "A102", "Case Assessment: Develop case strategy"),
-        ("L150", "A102", "Case Assessment: Identify key legal issues"),
-        ("L160", "A103", "Fact Investigation: Interview witnesses"),
-        ("L190", "A104", "Pleadings: Draft complaint/petition"),
-        ("L200", "A104", "Pleadings: Prepare answer/response"),
-        ("L210", "A104", "Pleadings: File motion to dismiss"),
-        ("L220", "A105", "Discovery: Draft interrogatories"),
-        ("L230", "A105", "Discovery: Prepare requests for production"),
-        ("L240", "A105", "Discovery: Review opposing party's discovery responses"),
-        ("L250", "A106", "Depositions: Prepare for deposition"),
-        ("L260", "A106", "Depositions: Attend deposition"),
-        ("L300", "A107", "Motions: Argue motion in court"),
-        ("L310", "A108", "Settlement/Mediation: Prepare for mediation"),
-        ("L320", "A108", "Settlement/Mediation: Attend mediation"),
-        ("L330", "A108", "Settlement/Mediation: Draft settlement agreement"),
-        ("L340", "A109", "Trial Preparation: Prepare witness for trial"),
-        ("L350", "A109", "Trial Preparation: Organize trial exhibits"),
-        ("L390", "A110", "Trial: Present closing argument"),
-        ("L400", "A111", "Appeals: Research appellate issues"),
-        ("L410", "A111", "Appeals: Draft appellate brief"),
-        ("L420", "A111", "Appeals: Argue before appellate court"),
-        ("L430", "A112", "Client Communication: Client meeting"),
-        ("L440", "A112", "Client Communication: Phone call with client"),
-        ("L450", "A112", "Client Communication: Email correspondence with client"),
-    ],
-    'MAJOR_TASK_CODES': {"L110", "L120", "L130", "L140", "L150", "L160", "L170", "L180", "L190"},
-    'DEFAULT_CLIENT_ID': "02-4388252",
-    'DEFAULT_LAW_FIRM_ID': "02-1234567",
-    'DEFAULT_INVOICE_DESCRIPTION': "Monthly Legal Services",
-    'MANDATORY_ITEMS': {
-        'KBCG': {
-            'desc': ("Commenced data entry into the KBCG e-licensing portal for Piers Walter Vermont "
-                     "form 1005 application; Drafted deficiency notice to send to client re: same; "
-                     "Scheduled follow-up call with client to review application status and address outstanding deficiencies."),
-            'tk_name': "Tom Delaganis",
-            'task': "L140",
-            'activity': "A107",
-            'is_expense': False
-        },
-        'John Doe': {
-            'desc': ("Reviewed and summarized deposition transcript of John Doe; prepared exhibit index; "
-                     "updated case chronology spreadsheet for attorney review"),
-            'tk_name': "Ryan Kinsey",
-            'task': "L120",
-            'activity': "A102",
-            'is_expense': False
-        },
-        'Uber E110': {
-            'desc': "10-mile Uber ride to client's office",
-            'expense_code': "E110",
-            'is_expense': True
-        },
-    }
-}
-EXPENSE_DESCRIPTIONS = list(CONFIG['EXPENSE_CODES'].keys())
-OTHER_EXPENSE_DESCRIPTIONS = [desc for desc in EXPENSE_DESCRIPTIONS if CONFIG['EXPENSE_CODES'][desc] != "E101"]
-
-# --- Helper Functions ---
-
-# --- Utility: compute a safe upper bound for expense lines ---
-def _calculate_max_expenses(billing_start_date=None, billing_end_date=None, num_days=None, config=None):
-    try:
-        if num_days is None:
-            start = billing_start_date
-            end = billing_end_date or billing_start_date
-            if isinstance(start, dt.datetime):
-                start = start.date()
-            if isinstance(end, dt.datetime):
-                end = end.date()
-            if isinstance(start, dt.date) and isinstance(end, dt.date):
-                nd = (end - start).days + 1
-            else:
-                nd = 1
-        else:
-            nd = int(num_days)
-    except Exception:
-        nd = 1
-    nd = max(1, int(nd))
-    cap = int((config or {}).get('expense_lines_cap', 120))
-    # heuristic: up to 6 expense lines per day, clamped by cap
-    return max(1, min(cap, nd * 6))
-
-
-def _find_timekeeper_by_name(timekeepers: list[Dict], name: str) -> Dict | None:
-    """Find a timekeeper by name (case-insensitive)."""
-    if not timekeepers:
-        return None
-    for tk in timekeepers:
-        if str(tk.get("TIMEKEEPER_NAME", "")).strip().lower() == str(name).strip().lower():
-            return tk
-    return None
-
-def _force_timekeeper_on_row(row: Dict, forced_name: str, timekeepers: list[Dict]) -> Dict:
-    """Assign timekeeper details to a row if applicable."""
-    if row.get("EXPENSE_CODE"):
-        return row
-    tk = _find_timekeeper_by_name(timekeepers, forced_name)
-    if tk is None and timekeepers:
-        tk = timekeepers[0]
-    if tk is None:
-        row["TIMEKEEPER_NAME"] = forced_name
-        return row
-    row["TIMEKEEPER_NAME"] = forced_name
-    row["TIMEKEEPER_ID"] = tk.get("TIMEKEEPER_ID", row.get("TIMEKEEPER_ID", ""))
-    row["TIMEKEEPER_CLASSIFICATION"] = tk.get("TIMEKEEPER_CLASSIFICATION", row.get("TIMEKEEPER_CLASSIFICATION", ""))
-    try:
-        row["RATE"] = float(tk.get("RATE", row.get("RATE", 0.0)))
-        hours = float(row.get("HOURS", 0))
-        row["LINE_ITEM_TOTAL"] = round(hours * float(row["RATE"]), 2)
-    except Exception as e:
-        logging.error(f"Error setting timekeeper rate: {e}")
-    return row
-
-def _process_description(description: str, faker_instance: Faker) -> str:
-    """Process description by replacing placeholders and dates."""
-    pattern = r"\b(\d{2}/\d{2}/\d{4})\b"
-    if re.search(pattern, description):
-        days_ago = random.randint(15, 90)
-        new_date = (dt.date.today() - dt.timedelta(days=days_ago)).strftime("%m/%d/%Y")
-        description = re.sub(pattern, new_date, description)
-    description = description.replace("{NAME_PLACEHOLDER}", faker_instance.name())
-    return description
-
-def _is_valid_client_id(client_id: str) -> bool:
-    """Client ID is considered valid if it is a non-empty string."""
-    return bool(str(client_id).strip())
-
-def _is_valid_law_firm_id(law_firm_id: str) -> bool:
-    """Law Firm ID is considered valid if it is a non-empty string."""
-    return bool(str(law_firm_id).strip())
-
-def _calculate_max_fees(timekeeper_data: list[Dict | None], billing_start_date: dt.date, billing_end_date: dt.date, max_daily_hours: int) -> int:
-    """Calculate maximum feasible fee lines based on timekeeper data and billing period."""
-    if not timekeeper_data:
-        return 1
-    num_timekeepers = len(timekeeper_data)
-    delta = billing_end_date - billing_start_date
-    num_days = max(1, delta.days + 1)
-    max_lines = int((num_timekeepers * num_days * max_daily_hours) / 0.5)
-    return max(1, min(200, max_lines))
-
 def _load_timekeepers(uploaded_file: Any | None) -> list[Dict | None]:
     """Load timekeepers from CSV file."""
     if uploaded_file is None:
@@ -311,775 +150,6 @@ def _load_custom_task_activity_data(uploaded_file: Any | None) -> list[tuple[str
         logging.error(f"Custom tasks load error: {e}")
         return None
 
-def _create_ledes_line_1998b(row: Dict, line_no: int, inv_total: float, bill_start: dt.date, bill_end: dt.date, invoice_number: str, matter_number: str) -> list[str]:
-    """Create a single LEDES 1998B line."""
-    try:
-        date_obj = dt.dt.dt.datetime.strptime(row["LINE_ITEM_DATE"], "%Y-%m-%d").date()
-        hours = float(row["HOURS"])
-        rate = float(row["RATE"])
-        line_total = float(row["LINE_ITEM_TOTAL"])
-        is_expense = bool(row["EXPENSE_CODE"])
-        adj_type = "E" if is_expense else "F"
-        task_code = "" if is_expense else row.get("TASK_CODE", "")
-        activity_code = "" if is_expense else row.get("ACTIVITY_CODE", "")
-        expense_code = row.get("EXPENSE_CODE", "") if is_expense else ""
-        timekeeper_id = "" if is_expense else row.get("TIMEKEEPER_ID", "")
-        timekeeper_class = "" if is_expense else row.get("TIMEKEEPER_CLASSIFICATION", "")
-        timekeeper_name = "" if is_expense else row.get("TIMEKEEPER_NAME", "")
-        description = str(row.get("DESCRIPTION", "")).replace("|", " - ")
-        return [
-            bill_end.strftime("%Y%m%d"),
-            invoice_number,
-            str(row.get("CLIENT_ID", "")),
-            matter_number,
-            f"{inv_total:.2f}",
-            bill_start.strftime("%Y%m%d"),
-            bill_end.strftime("%Y%m%d"),
-            str(row.get("INVOICE_DESCRIPTION", "")),
-            str(line_no),
-            adj_type,
-            f"{hours:.1f}" if adj_type == "F" else f"{int(hours)}",
-            "0.00",
-            f"{line_total:.2f}",
-            date_obj.strftime("%Y%m%d"),
-            task_code,
-            expense_code,
-            activity_code,
-            timekeeper_id,
-            description,
-            str(row.get("LAW_FIRM_ID", "")),
-            f"{rate:.2f}",
-            timekeeper_name,
-            timekeeper_class,
-            matter_number
-        ]
-    except Exception as e:
-        logging.error(f"Error creating LEDES line: {e}")
-        return []
-
-def _create_ledes_1998b_content(rows: list[Dict], inv_total: float, bill_start: dt.date, bill_end: dt.date, invoice_number: str, matter_number: str, is_first_invoice: bool = True) -> str:
-    """Generate LEDES 1998B content from invoice rows."""
-    lines = []
-    if is_first_invoice:
-        header = "LEDES1998B[]"
-        fields = ("INVOICE_DATE|INVOICE_NUMBER|CLIENT_ID|LAW_FIRM_MATTER_ID|INVOICE_TOTAL|BILLING_START_DATE|"
-                  "BILLING_END_DATE|INVOICE_DESCRIPTION|LINE_ITEM_NUMBER|EXP/FEE/INV_ADJ_TYPE|"
-                  "LINE_ITEM_NUMBER_OF_UNITS|LINE_ITEM_ADJUSTMENT_AMOUNT|LINE_ITEM_TOTAL|LINE_ITEM_DATE|"
-                  "LINE_ITEM_TASK_CODE|LINE_ITEM_EXPENSE_CODE|LINE_ITEM_ACTIVITY_CODE|TIMEKEEPER_ID|"
-                  "LINE_ITEM_DESCRIPTION|LAW_FIRM_ID|LINE_ITEM_UNIT_COST|TIMEKEEPER_NAME|"
-                  "TIMEKEEPER_CLASSIFICATION|CLIENT_MATTER_ID[]")
-        lines = [header, fields]
-    for i, row in enumerate(rows, start=1):
-        line = _create_ledes_line_1998b(row, i, inv_total, bill_start, bill_end, invoice_number, matter_number)
-        if line:
-            lines.append("|".join(map(str, line)) + "[]")
-    return "\n".join(lines)
-
-def _generate_fees(fee_count: int, timekeeper_data: list[Dict], billing_start_date: dt.date, billing_end_date: dt.date, task_activity_desc: list[tuple[str, str, str]], major_task_codes: set, max_hours_per_tk_per_day: int, faker_instance: Faker, client_id: str, law_firm_id: str, invoice_desc: str) -> list[Dict]:
-    """Generate fee line items for an invoice."""
-    rows = []
-    delta = billing_end_date - billing_start_date
-    num_days = max(1, delta.days + 1)
-    major_items = [item for item in task_activity_desc if item[0] in major_task_codes]
-    other_items = [item for item in task_activity_desc if item[0] not in major_task_codes]
-    daily_hours_tracker = {}
-    MAX_DAILY_HOURS = max_hours_per_tk_per_day
-
-    for _ in range(fee_count):
-        if not task_activity_desc:
-            break
-        tk_row = random.choice(timekeeper_data)
-        timekeeper_id = tk_row["TIMEKEEPER_ID"]
-        if major_items and random.random() < 0.7:
-            task_code, activity_code, description = random.choice(major_items)
-        elif other_items:
-            task_code, activity_code, description = random.choice(other_items)
-        else:
-            continue
-        random_day_offset = random.randint(0, num_days - 1)
-        line_item_date = billing_start_date + dt.timedelta(days=random_day_offset)
-        line_item_date_str = line_item_date.strftime("%Y-%m-%d")
-        current_billed_hours = daily_hours_tracker.get((line_item_date_str, timekeeper_id), 0)
-        remaining_hours_capacity = MAX_DAILY_HOURS - current_billed_hours
-        if remaining_hours_capacity <= 0:
-            continue
-        hours_to_bill = round(random.uniform(0.5, min(8.0, remaining_hours_capacity)), 1)
-        if hours_to_bill == 0:
-            continue
-        hourly_rate = tk_row["RATE"]
-        line_item_total = round(hours_to_bill * hourly_rate, 2)
-        daily_hours_tracker[(line_item_date_str, timekeeper_id)] = current_billed_hours + hours_to_bill
-        description = _process_description(description, faker_instance)
-        row = {
-            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
-            "LINE_ITEM_DATE": line_item_date_str, "TIMEKEEPER_NAME": tk_row["TIMEKEEPER_NAME"],
-            "TIMEKEEPER_CLASSIFICATION": tk_row["TIMEKEEPER_CLASSIFICATION"],
-            "TIMEKEEPER_ID": timekeeper_id, "TASK_CODE": task_code,
-            "ACTIVITY_CODE": activity_code, "EXPENSE_CODE": "", "DESCRIPTION": description,
-            "HOURS": hours_to_bill, "RATE": hourly_rate, "LINE_ITEM_TOTAL": line_item_total
-        }
-        rows.append(row)
-    return rows
-
-
-
-def _generate_expenses(
-    expense_count: int,
-    billing_start_date: dt.date,
-    billing_end_date: dt.date,
-    client_id: str,
-    law_firm_id: str,
-    invoice_desc: str
-) -> list[Dict]:
-    """Generate expense line items for an invoice with realistic amounts."""
-
-    # --- normalize dates (accepts date, datetime, or common string formats) ---
-    def _to_date(x) -> dt.date:
-        if isinstance(x, dt.date) and not isinstance(x, dt.datetime):
-            return x
-        if isinstance(x, dt.datetime):
-            return x.date()
-        if isinstance(x, str):
-            for fmt in ("%Y-%m-%d", "%m/%d/%Y"):
-                try:
-                    return dt.dt.datetime.strptime(x, fmt).date()
-                except Exception:
-                    pass
-        return dt.dt.datetime.today().date()
-
-    start = _to_date(billing_start_date)
-    end   = _to_date(billing_end_date)
-
-    delta = end - start
-    num_days = max(1, delta.days + 1)
-
-    # --- tunable expense settings from UI (with safe fallbacks) ---
-    try:
-        import streamlit as st
-    except Exception:
-        st = None
-
-    mileage_rate_cfg = float(st.session_state.get("mileage_rate_e109", 0.65)) if st else 0.65
-    travel_rng = st.session_state.get("travel_range_e110", (100.0, 800.0)) if st else (100.0, 800.0)
-    tel_rng    = st.session_state.get("telephone_range_e105", (5.0, 15.0)) if st else (5.0, 15.0)
-    copying_rate = float(st.session_state.get("copying_rate_e101", 0.24)) if st else 0.24
-
-    try:
-        travel_min, travel_max = float(travel_rng[0]), float(travel_rng[1])
-    except Exception:
-        travel_min, travel_max = 100.0, 800.0
-    try:
-        tel_min, tel_max = float(tel_rng[0]), float(tel_rng[1])
-    except Exception:
-        tel_min, tel_max = 5.0, 15.0
-
-    rows: list[Dict] = []
-
-    # --- Always include some Copying (E101) if we have at least 1 expense slot ---
-    e101_actual_count = 0
-    if expense_count > 0:
-        e101_actual_count = random.randint(1, min(3, expense_count))
-
-    for _ in range(e101_actual_count):
-        description = "Copying"
-        expense_code = "E101"
-        pages = random.randint(50, 300)     # number of pages
-        rate  = round(copying_rate, 2)      # per-page
-        random_day_offset = random.randint(0, num_days - 1)
-        line_item_date = start + dt.timedelta(days=random_day_offset)
-        line_item_total = round(pages * rate, 2)
-        row = {
-            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
-            "LINE_ITEM_DATE": line_item_date.strftime("%Y-%m-%d"), "TIMEKEEPER_NAME": "",
-            "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "",
-            "TASK_CODE": "", "ACTIVITY_CODE": "", "EXPENSE_CODE": expense_code, "DESCRIPTION": description,
-            "HOURS": pages, "RATE": rate, "LINE_ITEM_TOTAL": line_item_total
-        }
-        rows.append(row)
-
-    # --- Remaining expenses with category-aware amounts ---
-    # Requires OTHER_EXPENSE_DESCRIPTIONS and CONFIG['EXPENSE_CODES'] to exist in your module.
-    remaining = max(0, expense_count - e101_actual_count)
-    for _ in range(remaining):
-        description = random.choice(OTHER_EXPENSE_DESCRIPTIONS)
-        expense_code = CONFIG['EXPENSE_CODES'][description]
-        random_day_offset = random.randint(0, num_days - 1)
-        line_item_date = start + dt.timedelta(days=random_day_offset)
-
-        if expense_code == "E109":  # Local travel (mileage)
-            miles = random.randint(5, 50)
-            hours = miles  # store miles in HOURS
-            rate = mileage_rate_cfg
-            line_item_total = round(miles * rate, 2)
-
-        elif expense_code == "E110":  # Out-of-town travel (ticket/transport)
-            hours = 1
-            rate = round(random.uniform(travel_min, travel_max), 2)
-            line_item_total = rate
-
-        elif expense_code == "E105":  # Telephone
-            hours = 1
-            rate = round(random.uniform(tel_min, tel_max), 2)
-            line_item_total = rate
-
-        elif expense_code == "E107":  # Delivery/messenger
-            hours = 1
-            rate = round(random.uniform(20.0, 100.0), 2)
-            line_item_total = rate
-
-        elif expense_code == "E108":  # Postage
-            hours = 1
-            rate = round(random.uniform(5.0, 50.0), 2)
-            line_item_total = rate
-
-        elif expense_code == "E111":  # Meals
-            hours = 1
-            rate = round(random.uniform(15.0, 150.0), 2)
-            line_item_total = rate
-
-        else:
-            hours = random.randint(1, 5)
-            rate = round(random.uniform(10.0, 150.0), 2)
-            line_item_total = round(hours * rate, 2)
-
-        row = {
-            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
-            "LINE_ITEM_DATE": line_item_date.strftime("%Y-%m-%d"), "TIMEKEEPER_NAME": "",
-            "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "",
-            "TASK_CODE": "", "ACTIVITY_CODE": "", "EXPENSE_CODE": expense_code, "DESCRIPTION": description,
-            "HOURS": hours, "RATE": rate, "LINE_ITEM_TOTAL": line_item_total
-        }
-        rows.append(row)
-
-    return rows
-    
-def _generate_invoice_data(fee_count: int, expense_count: int, timekeeper_data: list[Dict], client_id: str, law_firm_id: str, invoice_desc: str, billing_start_date: dt.date, billing_end_date: dt.date, task_activity_desc: list[tuple[str, str, str]], major_task_codes: set, max_hours_per_tk_per_day: int, include_block_billed: bool, faker_instance: Faker) -> tuple[list[Dict], float]:
-    """Generate invoice data with fees and expenses."""
-    rows = []
-    rows.extend(_generate_fees(fee_count, timekeeper_data, billing_start_date, billing_end_date, task_activity_desc, major_task_codes, max_hours_per_tk_per_day, faker_instance, client_id, law_firm_id, invoice_desc))
-    rows.extend(_generate_expenses(expense_count, billing_start_date, billing_end_date, client_id, law_firm_id, invoice_desc))
-    total_amount = sum(float(row["LINE_ITEM_TOTAL"]) for row in rows)
-
-    # Filter for fees only before creating block billed items
-    fee_rows = [row for row in rows if not row.get("EXPENSE_CODE")]
-    
-    if include_block_billed and fee_rows:
-        block_size = random.randint(2, 5)
-        selected_rows = random.sample(fee_rows, min(block_size, len(fee_rows)))
-        total_hours = sum(float(row["HOURS"]) for row in selected_rows)
-        total_amount_block = sum(float(row["LINE_ITEM_TOTAL"]) for row in selected_rows)
-        descriptions = [row["DESCRIPTION"] for row in selected_rows]
-        block_description = "; ".join(descriptions)
-        block_row = {
-            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
-            "LINE_ITEM_DATE": selected_rows[0]["LINE_ITEM_DATE"], "TIMEKEEPER_NAME": selected_rows[0]["TIMEKEEPER_NAME"],
-            "TIMEKEEPER_CLASSIFICATION": selected_rows[0]["TIMEKEEPER_CLASSIFICATION"],
-            "TIMEKEEPER_ID": selected_rows[0]["TIMEKEEPER_ID"], "TASK_CODE": selected_rows[0]["TASK_CODE"],
-            "ACTIVITY_CODE": selected_rows[0]["ACTIVITY_CODE"], "EXPENSE_CODE": "",
-            "DESCRIPTION": block_description, "HOURS": total_hours, "RATE": selected_rows[0]["RATE"],
-            "LINE_ITEM_TOTAL": total_amount_block
-        }
-        rows = [row for row in rows if row not in selected_rows]
-        rows.append(block_row)
-        total_amount = sum(float(row["LINE_ITEM_TOTAL"]) for row in rows)
-
-    return rows, total_amount
-
-def _ensure_mandatory_lines(rows: list[Dict], timekeeper_data: list[Dict], invoice_desc: str, client_id: str, law_firm_id: str, billing_start_date: dt.date, billing_end_date: dt.date, selected_items: list[str]) -> list[Dict]:
-    """Ensure mandatory line items are included."""
-    delta = billing_end_date - billing_start_date
-    num_days = max(1, delta.days + 1)
-    for item_name in selected_items:
-        item = CONFIG['MANDATORY_ITEMS'][item_name]
-        random_day_offset = random.randint(0, num_days - 1)
-        line_item_date = billing_start_date + dt.timedelta(days=random_day_offset)
-        if item['is_expense']:
-            row = {
-                "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
-                "LINE_ITEM_DATE": line_item_date.strftime("%Y-%m-%d"), "TIMEKEEPER_NAME": "",
-                "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "", "TASK_CODE": "",
-                "ACTIVITY_CODE": "", "EXPENSE_CODE": item['expense_code'], "DESCRIPTION": item['desc'],
-                "HOURS": random.randint(1, 10), "RATE": round(random.uniform(5.0, 100.0), 2)
-            }
-            row["LINE_ITEM_TOTAL"] = round(row["HOURS"] * row["RATE"], 2)
-        else:
-            row = {
-                "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
-                "LINE_ITEM_DATE": line_item_date.strftime("%Y-%m-%d"), "TIMEKEEPER_NAME": item['tk_name'],
-                "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "", "TASK_CODE": item['task'],
-                "ACTIVITY_CODE": item['activity'], "EXPENSE_CODE": "", "DESCRIPTION": item['desc'],
-                "HOURS": round(random.uniform(0.5, 8.0), 1), "RATE": 0.0
-            }
-            row = _force_timekeeper_on_row(row, item['tk_name'], timekeeper_data)
-        rows.append(row)
-    return rows
-
-def _validate_image_bytes(image_bytes: bytes) -> bool:
-    """Validate that the provided bytes represent a valid image."""
-    try:
-        img = PILImage.open(io.BytesIO(image_bytes))
-        img.verify()
-        return True
-    except Exception:
-        return False
-
-def _get_logo_bytes(uploaded_logo: Any | None, law_firm_id: str, use_custom: bool) -> bytes:
-    """Get logo bytes from uploaded file or default path."""
-    if use_custom and uploaded_logo:
-        try:
-            logo_bytes = uploaded_logo.read()
-            if _validate_image_bytes(logo_bytes):
-                return logo_bytes
-            st.warning("Uploaded logo is not a valid JPEG or PNG. Using default logo.")
-        except Exception as e:
-            logging.error(f"Error reading uploaded logo: {e}")
-            st.warning("Failed to read uploaded logo. Using default logo.")
-    
-    logo_file_name = "nelsonmurdock2.jpg" if law_firm_id == CONFIG['DEFAULT_LAW_FIRM_ID'] else "icon.jpg"
-    script_dir = os.path.dirname(__file__)
-    logo_path = os.path.join(script_dir, "assets", logo_file_name)
-    try:
-        with open(logo_path, "rb") as f:
-            logo_bytes = f.read()
-        if _validate_image_bytes(logo_bytes):
-            return logo_bytes
-        st.warning(f"Default logo ({logo_file_name}) is not a valid JPEG or PNG. Using placeholder.")
-    except Exception as e:
-        logging.error(f"Logo load failed: {e}")
-        st.warning(f"Logo file ({logo_file_name}) not found or invalid. Using placeholder.")
-    
-    img = PILImage.new("RGB", (128, 128), color="white")
-    draw = ImageDraw.Draw(img)
-    try:
-        font = ImageFont.load_default()
-    except Exception:
-        font = ImageFont.load_default()
-    draw.text((10, 20), "Logo", font=font, fill=(0, 0, 0))
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.getvalue()
-
-def _create_pdf_invoice(df: pd.DataFrame, total_amount: float, invoice_number: str, invoice_date: dt.date, billing_start_date: dt.date, billing_end_date: dt.date, client_id: str, law_firm_id: str, logo_bytes: bytes, include_logo: bool = True) -> io.BytesIO:
-    """Generate a PDF invoice matching the provided format."""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    # Define new styles
-    header_info_style = ParagraphStyle(
-        'HeaderInfo',
-        parent=styles['Normal'],
-        fontName='Helvetica-Bold',
-        fontSize=12,
-        leading=14,
-        alignment=TA_LEFT
-    )
-    
-    client_info_style = ParagraphStyle(
-        'ClientInfo',
-        parent=header_info_style,
-        alignment=TA_RIGHT
-    )
-
-    table_header_style = ParagraphStyle(
-        'TableHeader',
-        parent=styles['Normal'],
-        fontName='Helvetica-Bold',
-        fontSize=10,
-        leading=12,
-        alignment=TA_CENTER,
-        wordWrap='CJK'
-    )
-
-    table_data_style = ParagraphStyle(
-        'TableData',
-        parent=styles['Normal'],
-        fontName='Helvetica',
-        fontSize=10,
-        leading=12,
-        alignment=TA_LEFT,
-        wordWrap='CJK'
-    )
-    
-    right_align_style = styles['Heading4']
-
-    # Header with Law Firm on left and Client on right
-    law_firm_info = f"Nelson and Murdock<br/>{law_firm_id}<br/>One Park Avenue<br/>Manhattan, NY 10003"
-    client_info = f"A Onit Inc.<br/>{client_id}<br/>1360 Post Oak Blvd<br/>Houston, TX 77056"
-    
-    law_firm_para = Paragraph(law_firm_info, header_info_style)
-    client_para = Paragraph(client_info, client_info_style)
-
-    header_left_content = law_firm_para
-    if include_logo:
-        try:
-            if not _validate_image_bytes(logo_bytes):
-                raise ValueError("Invalid logo bytes")
-            img = Image(io.BytesIO(logo_bytes), width=0.6 * inch, height=0.6 * inch, kind='direct', hAlign='LEFT')
-            img._restrictSize(0.6 * inch, 0.6 * inch)
-            img.alt = "Law Firm Logo"
-            inner_table_data = [[img, Paragraph(law_firm_info, header_info_style)]]
-            inner_table = Table(inner_table_data, colWidths=[0.7 * inch, None])
-            inner_table.setStyle(TableStyle([
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('LEFTPADDING', (1, 0), (1, 0), 6),
-            ]))
-            header_left_content = inner_table
-        except Exception as e:
-            logging.error(f"Error adding logo to PDF: {e}")
-            st.warning("Could not add logo to PDF. Using text instead.")
-            header_left_content = law_firm_para
-
-    header_data = [[header_left_content, client_para]]
-    header_table = Table(header_data, colWidths=[3.5 * inch, 4.0 * inch])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('LEFTPADDING', (0, 0), (0, 0), 0),
-        ('RIGHTPADDING', (0, 0), (0, 0), 0),
-        ('TOPPADDING', (0, 0), (-1, -1), 0),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 0.1 * inch))
-
-    # Invoice details
-    invoice_info = f"Invoice #: {invoice_number}<br/>Invoice Date: {invoice_date.strftime('%Y-%m-%d')}<br/>Billing Period: {billing_start_date.strftime('%Y-%m-%d')} to {billing_end_date.strftime('%Y-%m-%d')}"
-    invoice_para = Paragraph(invoice_info, right_align_style)
-    invoice_table = Table([[invoice_para]], colWidths=[7.5 * inch])
-    invoice_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    elements.append(invoice_table)
-    elements.append(Spacer(1, 0.1 * inch))
-
-    # Table with updated columns and wrapped text
-    data = [
-        [
-            Paragraph("Date", table_header_style), 
-            Paragraph("Task<br/>Code", table_header_style), 
-            Paragraph("Activity<br/>Code", table_header_style), 
-            Paragraph("Timekeeper", table_header_style), 
-            Paragraph("Description", table_header_style), 
-            Paragraph("Hours", table_header_style), 
-            Paragraph("Rate", table_header_style), 
-            Paragraph("Total", table_header_style)
-        ]
-    ]
-    for _, row in df.iterrows():
-        date_str = row["LINE_ITEM_DATE"]
-        timekeeper = Paragraph(row["TIMEKEEPER_NAME"] if row["TIMEKEEPER_NAME"] else "N/A", table_data_style)
-        task_code = row.get("TASK_CODE", "") if not row["EXPENSE_CODE"] else ""
-        activity_code = row.get("ACTIVITY_CODE", "") if not row["EXPENSE_CODE"] else ""
-        description = Paragraph(row["DESCRIPTION"], table_data_style)
-        hours = f"{row['HOURS']:.1f}" if not row["EXPENSE_CODE"] else f"{int(row['HOURS'])}"
-        rate = f"${row['RATE']:.2f}" if row["RATE"] else "N/A"
-        total = f"${row['LINE_ITEM_TOTAL']:.2f}"
-        data.append([date_str, task_code, activity_code, timekeeper, description, hours, rate, total])
-
-    table = Table(data, colWidths=[0.8 * inch, 0.7 * inch, 0.7 * inch, 1.3 * inch, 1.8 * inch, 0.8 * inch, 0.8 * inch, 0.8 * inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-        ('ALIGN', (1, 1), (2, -1), 'CENTER'), # Center Task Code and Activity Code data
-        ('ALIGN', (5, 0), (5, -1), 'CENTER'),
-        ('ALIGN', (6, 0), (6, -1), 'RIGHT'),
-        ('ALIGN', (7, 0), (7, -1), 'RIGHT'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 2),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
-        ('TOPPADDING', (0, 0), (-1, -1), 2),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
-    ]))
-    elements.append(table)
-
-    elements.append(Spacer(1, 0.25 * inch))
-    total_para = Paragraph(f"Total: ${total_amount:.2f}", right_align_style)
-    elements.append(total_para)
-
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
-
-
-def _create_receipt_image(expense_row: dict, faker_instance: Faker) -> tuple[str, io.BytesIO]:
-    """Enhanced realistic receipt generator (see chat notes for details)."""
-    width, height = 600, 950
-    bg = (252, 252, 252)
-    fg = (20, 20, 20)
-    faint = (90, 90, 90)
-    line_y_gap = 28
-
-    
-    # === Receipt Settings read from UI ===
-    try:
-        import streamlit as st
-    except Exception:
-        st = None
-    rcpt_scale = (st.session_state.get("rcpt_scale", 1.0) if st else 1.0)
-    rcpt_line_weight = int(st.session_state.get("rcpt_line_weight", 1)) if st else 1
-    rcpt_dashed = bool(st.session_state.get("rcpt_dashed", False)) if st else False
-    
-    show_policy_map = {
-        "travel": bool(st.session_state.get("rcpt_show_policy_travel", True)) if st else True,
-        "meal": bool(st.session_state.get("rcpt_show_policy_meal", True)) if st else True,
-        "mileage": bool(st.session_state.get("rcpt_show_policy_mileage", True)) if st else True,
-        "supplies": bool(st.session_state.get("rcpt_show_policy_supplies", True)) if st else True,
-        "generic": bool(st.session_state.get("rcpt_show_policy_generic", True)) if st else True,
-        "delivery": True,
-        "postage": True,
-        "rideshare": True,
-    }
-    
-    travel_overrides = {
-        "carrier": (st.session_state.get("rcpt_travel_carrier", "") if st else ""),
-        "flight": (st.session_state.get("rcpt_travel_flight", "") if st else ""),
-        "seat": (st.session_state.get("rcpt_travel_seat", "") if st else ""),
-        "fare": (st.session_state.get("rcpt_travel_fare", "") if st else ""),
-        "from": (st.session_state.get("rcpt_travel_from", "") if st else ""),
-        "to": (st.session_state.get("rcpt_travel_to", "") if st else ""),
-        "autogen": bool(st.session_state.get("rcpt_travel_autogen", True)) if st else True,
-    }
-    
-    meal_overrides = {
-        "table": (st.session_state.get("rcpt_meal_table", "") if st else ""),
-        "server": (st.session_state.get("rcpt_meal_server", "") if st else ""),
-        "show_cashier": bool(st.session_state.get("rcpt_meal_show_cashier", True)) if st else True,
-    }
-    
-
-    TAX_MAP = {
-        "E111": 0.085,
-        "E110": 0.000,
-        "E109": 0.000,
-        "E108": 0.000,
-        "E115": 0.085,
-        "E116": 0.085,
-        "E117": 0.085,
-    }
-
-    def money(x):
-        return f"${x:,.2f}"
-
-    def mask_card():
-        brands = ["VISA", "MC", "AMEX", "DISC"]
-        brand = random.choice(brands)
-        if brand == "AMEX":
-            masked = f"{brand} ****-******-*{random.randint(1000,9999)}"
-        else:
-            masked = f"{brand} ****-****-****-{random.randint(1000,9999)}"
-        return masked
-
-    def auth_code():
-        return f"APPROVED  AUTH {random.randint(100000,999999)}  REF {random.randint(1000,9999)}"
-
-    def pick_items(expense_code: str, desc: str, total: float):
-        items = []
-        if expense_code == "E111":
-            qtys = [1, 2]
-            entree_qty = random.choice(qtys)
-            entree_unit = round(total * 0.45 / max(entree_qty,1), 2)
-            drink_unit = round(total * 0.15, 2)
-            items = [
-                ("Entree", entree_qty, entree_unit, round(entree_qty*entree_unit,2)),
-                ("Beverage", 1, drink_unit, drink_unit),
-            ]
-        elif expense_code == "E110":
-            miles = random.randint(3, 20)
-            base = round(max(2.5, total * 0.15), 2)
-            per_mile = round(max(0.9, (total - base) / max(miles,1)), 2)
-            items = [
-                ("Base Fare", 1, base, base),
-                (f"Distance {miles} mi", 1, per_mile*miles, round(per_mile*miles,2)),
-            ]
-        elif expense_code == "E108":
-            weight = random.uniform(0.5, 4.0)
-            unit = round(total, 2)
-            items = [(f"USPS Priority Mail {weight:.1f} lb", 1, unit, unit)]
-        elif expense_code in ("E115","E116"):
-            pages = random.randint(50, 300)
-            unit = round(max(2.0, min(6.0, total/pages)), 2)
-            items = [(f"Transcript ({pages} pages)", pages, unit, round(pages*unit,2))]
-        else:
-            n = random.choice([2,3])
-            remaining = total
-            for i in range(n-1):
-                part = round(total * random.uniform(0.2, 0.5), 2)
-                remaining = round(remaining - part, 2)
-                items.append((f"{desc[:20]} {i+1}", 1, part, part))
-            items.append((f"{desc[:20]} {n}", 1, remaining, remaining))
-        return items
-
-    merchant = faker_instance.company()
-    m_addr = faker_instance.address().replace("\n", ", ")
-    m_phone = faker_instance.phone_number()
-    cashier = faker_instance.first_name()
-
-    try:
-        line_item_date = dt.dt.dt.datetime.strptime(expense_row["LINE_ITEM_DATE"], "%Y-%m-%d").date()
-    except Exception:
-        line_item_date = dt.dt.dt.datetime.today().date()
-    exp_code = str(expense_row.get("EXPENSE_CODE", "")).strip()
-    desc = str(expense_row.get("DESCRIPTION","")).strip() or "Item"
-    total_amount = float(expense_row.get("LINE_ITEM_TOTAL", 0.0))
-
-    items = pick_items(exp_code, desc, total_amount)
-    subtotal = round(sum(x[3] for x in items), 2)
-    # Compute tax per new rules
-    if exp_code in TAX_EXEMPT:
-        tax_rate = 0.0
-    elif exp_code == "E111":
-        tax_rate = DEFAULT_TAX_RATE
-    else:
-        tax_rate = DEFAULT_TAX_RATE if subtotal > 0 else 0.0
-    tax = round(subtotal * tax_rate, 2)
-
-    tax_rate = TAX_MAP.get(exp_code, 0.085 if subtotal>0 else 0.0)
-    tax = round(subtotal * tax_rate, 2)
-
-    tip = 0.0
-    if exp_code in ("E111","E110"):
-        target_total = total_amount
-        tip_guess = 0.15 if exp_code=="E111" else 0.10
-        tip = round(subtotal * tip_guess, 2)
-        over = round((subtotal + tax + tip) - target_total, 2)
-        if over > 0:
-            tip = max(0.0, round(tip - over, 2))
-        else:
-            tip = round(tip + abs(over), 2)
-
-    grand = round(subtotal + tax + tip, 2)
-    drift = round(total_amount - grand, 2)
-    if abs(drift) >= 0.01 and items:
-        name, qty, unit, line_total = items[-1]
-        line_total = round(line_total + drift, 2)
-        unit = round(line_total / max(qty,1), 2)
-        items[-1] = (name, qty, unit, line_total)
-        subtotal = round(sum(x[3] for x in items), 2)
-        grand = round(subtotal + tax + tip, 2)
-
-    img = PILImage.new("RGB", (width, height), bg)
-    draw = ImageDraw.Draw(img)
-
-    try:
-        title_font = ImageFont.truetype("arial.ttf", max(12, int(34*rcpt_scale)))
-        header_font = ImageFont.truetype("arial.ttf", max(10, int(22*rcpt_scale)))
-        mono_font = ImageFont.truetype("arial.ttf", max(10, int(22*rcpt_scale)))
-        small_font = ImageFont.truetype("arial.ttf", max(8, int(18*rcpt_scale)))
-        tiny_font = ImageFont.truetype("arial.ttf", max(8, int(15*rcpt_scale)))
-    except Exception:
-        title_font = ImageFont.load_default()
-        header_font = ImageFont.load_default()
-        mono_font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
-        tiny_font = ImageFont.load_default()
-
-    def draw_hr(y, pad_left=40, pad_right=40, weight=1, dashed=False):
-        if dashed:
-            x = pad_left
-            dash = 8
-            gap = 6
-            while x < width - pad_right:
-                x2 = min(x + dash, width - pad_right)
-                draw.line([(x, y), (x2, y)], fill=faint, width=weight)
-                x = x2 + gap
-        else:
-            draw.line([(pad_left, y), (width - pad_right, y)], fill=faint, width=weight)
-
-    y = 30
-    title = "RECEIPT"
-    tw = draw.textlength(title, font=title_font)
-    draw.text(((width - tw) / 2, y), title, font=title_font, fill=fg)
-    y += 42
-
-    for line in (merchant, m_addr, f"Tel: {m_phone}"):
-        draw.text((40, y), line, font=header_font, fill=fg)
-        y += 26
-    y += 6
-    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
-
-    rnum = f"{random.randint(100000, 999999)}-{random.randint(10,99)}"
-    draw.text((40, y), f"Date: {line_item_date.strftime('%a %b %d, %Y')}", font=mono_font, fill=fg)
-    draw.text((width-300, y), f"Receipt #: {rnum}", font=mono_font, fill=fg)
-    y += 30
-    draw.text((40, y), f"Cashier: {cashier}", font=mono_font, fill=(90,90,90))
-    y += 10
-    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 16
-
-    draw.text((40, y), "Item", font=small_font, fill=(90,90,90))
-    draw.text((width-255, y), "Qty", font=small_font, fill=(90,90,90))
-    draw.text((width-180, y), "Price", font=small_font, fill=(90,90,90))
-    draw.text((width-95, y), "Total", font=small_font, fill=(90,90,90))
-    y += 22
-
-    import textwrap as _tw
-    for name, qty, unit, line_total in items:
-        lines = _tw.wrap(name, width=32) or ["Item"]
-        first = True
-        for wrap_line in lines:
-            draw.text((40, y), wrap_line, font=mono_font, fill=fg)
-            if first:
-                draw.text((width-245, y), str(qty), font=mono_font, fill=fg)
-                draw.text((width-180, y), money(unit), font=mono_font, fill=fg)
-                draw.text((width-95, y), money(line_total), font=mono_font, fill=fg)
-                first = False
-            y += line_y_gap-8
-        y += 2
-    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
-
-    def right_label(label, val):
-        nonlocal y
-        draw.text((width-220, y), label, font=mono_font, fill=fg)
-        draw.text((width-95, y), money(val), font=mono_font, fill=fg)
-        y += 24
-
-    right_label("Subtotal", subtotal)
-    if tax > 0:
-        right_label(f"Tax ({int(tax_rate*100)}%)", tax)
-    if tip > 0:
-        right_label("Tip", tip)
-    draw.text((width-220, y), "TOTAL", font=header_font, fill=fg)
-    draw.text((width-95, y), money(round(subtotal + tax + tip, 2)), font=header_font, fill=fg)
-    y += 30
-    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
-
-    pm = mask_card()
-    draw.text((40, y), pm, font=mono_font, fill=fg)
-    y += 26
-    draw.text((40, y), auth_code(), font=mono_font, fill=(90,90,90))
-    y += 10
-    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
-
-    policy = "Returns within 30 days with receipt. Items must be unused and in original packaging."
-    for line in _tw.wrap(policy, width=70):
-        draw.text((40, y), line, font=tiny_font, fill=(90,90,90))
-        y += 20
-
-    y = height - 80
-    x = 40
-    random.seed(rnum)
-    for _ in range(60):
-        bar_h = random.randint(20, 50)
-        bar_w = random.choice([1,1,2])
-        draw.rectangle([x, y, x+bar_w, y+bar_h], fill=(90,90,90))
-        x += bar_w + 3
-        if x > width - 40:
-            break
-
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format="PNG")
-    img_buffer.seek(0)
-
-    filename = f"Receipt_{exp_code}_{line_item_date.strftime('%Y%m%d')}.png"
-    return filename, img_buffer
 def _customize_email_body(matter_number: str, invoice_number: str) -> tuple[str, str]:
     """Customize email subject and body with matter and invoice number."""
     subject = st.session_state.get("email_subject", f"LEDES Invoice for {matter_number} (Invoice #{invoice_number})")
@@ -1135,7 +205,7 @@ def update_send_email():
 with st.expander("Help & FAQs"):
     st.markdown("""
     ### FAQs
-    - **What is Spend Agent mode?** Ensures specific mandatory line items (e.g., KBCG, John Doe, Uber E110) are included for testing or compliance. Select items in the Advanced Settings tab.
+    - **What is Spend Agent mode?** Ensures specific mandatory line items (e.g., KBCG, John Doe, Uber E110) are included for testing or compliance. Select items in the Advanced Settings tab, or upload a YAML/JSON rules file to define your own, each optionally injected with a probability or once every N invoices.
     - **How to format timekeeper CSV?** Columns: TIMEKEEPER_NAME, TIMEKEEPER_CLASSIFICATION, TIMEKEEPER_ID, RATE  
       Example: "John Doe,Partner,TK001,300.0"
     - **How to format custom tasks CSV?** Columns: TASK_CODE, ACTIVITY_CODE, DESCRIPTION  
@@ -1152,23 +222,87 @@ st.checkbox(
     on_change=update_send_email
 )
 
+# --- Cached static data: built once per server process instead of on every rerun ---
+@st.cache_data(show_spinner=False)
+def _sample_csvs() -> tuple[bytes, bytes]:
+    sample_timekeeper = pd.DataFrame({
+        "TIMEKEEPER_NAME": ["Tom Delaganis", "Ryan Kinsey"],
+        "TIMEKEEPER_CLASSIFICATION": ["Partner", "Associate"],
+        "TIMEKEEPER_ID": ["TD001", "RK001"],
+        "RATE": [250.0, 200.0]
+    })
+    sample_custom = pd.DataFrame({
+        "TASK_CODE": ["L100"],
+        "ACTIVITY_CODE": ["A101"],
+        "DESCRIPTION": ["Legal Research: Analyze legal precedents"]
+    })
+    return sample_timekeeper.to_csv(index=False).encode('utf-8'), sample_custom.to_csv(index=False).encode('utf-8')
+
+@st.cache_data(show_spinner=False)
+def _billing_profiles() -> list[Dict[str, str]]:
+    return _parse_profiles(ID_PROFILES_STR)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _saved_entities(entity_type: str) -> list[Dict[str, Any]]:
+    return entities_from_ids_store(entity_type)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _read_timekeeper_csv(data: bytes) -> list[Dict]:
+    return pd.read_csv(io.BytesIO(data)).to_dict(orient="records")
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _validate_ledes_bytes(data: bytes):
+    return validate_ledes_1998b(io.BytesIO(data))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _parse_rules_bytes(data: bytes):
+    return parse_rules(data)
+
+class _WarningCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.levelno == logging.WARNING and record.getMessage() not in self.messages:
+            self.messages.append(record.getMessage())
+
+@contextlib.contextmanager
+def _engine_warnings():
+    """Show the fallbacks invoice_engine logs (e.g. an unusable logo) as st.warning, once each."""
+    engine_logger = logging.getLogger("invoice_engine")
+    collector = _WarningCollector()
+    engine_logger.addHandler(collector)
+    try:
+        yield
+    finally:
+        engine_logger.removeHandler(collector)
+        for message in collector.messages:
+            st.warning(message)
+
+def _zip_for_download(files, dedup: bool) -> bytes:
+    """The zip streamed to a temporary file, reading spilled attachments one at a time, then read back
+    once for st.download_button (which holds downloads in memory)."""
+    with tempfile.TemporaryFile() as f:
+        write_zip(files, f, dedup)
+        f.seek(0)
+        return f.read()
+
+def _attachment_mime(filename: str) -> str:
+    if filename.endswith(".txt"):
+        return "text/plain"
+    if filename.endswith(".csv"):
+        return "text/csv"
+    if filename.endswith(".parquet"):
+        return "application/vnd.apache.parquet"
+    if filename.endswith(".gz"):
+        return "application/gzip"
+    return "application/pdf" if filename.endswith(".pdf") else "image/png"
+
 # Sidebar
 st.sidebar.markdown("<h2 style='color: #1E1E1E;'>Quick Links</h2>", unsafe_allow_html=True)
-sample_timekeeper = pd.DataFrame({
-    "TIMEKEEPER_NAME": ["Tom Delaganis", "Ryan Kinsey"],
-    "TIMEKEEPER_CLASSIFICATION": ["Partner", "Associate"],
-    "TIMEKEEPER_ID": ["TD001", "RK001"],
-    "RATE": [250.0, 200.0]
-})
-csv_timekeeper = sample_timekeeper.to_csv(index=False).encode('utf-8')
+csv_timekeeper, csv_custom = _sample_csvs()
 st.sidebar.download_button("Download Sample Timekeeper CSV", csv_timekeeper, "sample_timekeeper.csv", "text/csv")
-
-sample_custom = pd.DataFrame({
-    "TASK_CODE": ["L100"],
-    "ACTIVITY_CODE": ["A101"],
-    "DESCRIPTION": ["Legal Research: Analyze legal precedents"]
-})
-csv_custom = sample_custom.to_csv(index=False).encode('utf-8')
 st.sidebar.download_button("Download Sample Custom Tasks CSV", csv_custom, "sample_custom_tasks.csv", "text/csv")
 
 # Dynamic Tabs
@@ -1181,30 +315,7 @@ with tab_objects[0]:
     
 with tab_objects[1]:
     st.markdown("<h2 style='color: #1E1E1E;'>Invoice Details</h2>", unsafe_allow_html=True)
-    # ---------- Static Billing ID Profiles (edit in code) ----------
-    ID_PROFILES_STR = """
-    Onit ELM|A Onit Inc.|02-4388252|Nelson and Murdock|02-1234567,
-    SimpleLegal|Penguin LLC|C004|JDL|JDL001,
-    Unity|Unity Demo|uniti-demo|Gold USD|Gold USD
-    """.strip()
-
-    def _parse_profiles(s: str):
-        out = []
-        for raw in [chunk.strip() for chunk in s.split(",") if chunk.strip()]:
-            parts = [p.strip() for p in raw.split("|")]
-            if len(parts) != 5:
-                continue
-            env, c_name, c_id, lf_name, lf_id = parts
-            out.append({
-                "environment": env,
-                "client_name": c_name,
-                "client_id": c_id,
-                "law_firm_name": lf_name,
-                "law_firm_id": lf_id,
-            })
-        return out
-
-    PROFILES = _parse_profiles(ID_PROFILES_STR)
+    PROFILES = _billing_profiles()
 
     st.markdown("<h3 style='color: #1E1E1E;'>Billing Profiles</h3>", unsafe_allow_html=True)
     if not PROFILES:
@@ -1235,6 +346,27 @@ with tab_objects[1]:
         client_id = client_id_input if use_override else defaults["client_id"]
         law_firm_id = law_firm_id_input if use_override else defaults["law_firm_id"]
         st.caption(f"Using: **{selected_env}** — Client ID: `{client_id}` · Law Firm ID: `{law_firm_id}`")
+
+    portfolio_mode = False
+    with st.expander("Portfolio Mode (many clients, law firms and matters)", expanded=False):
+        portfolio_mode = st.checkbox("Generate a portfolio", value=False, key="portfolio_mode",
+                                     help="Fan the invoice settings out across several clients, law firms and matters in one run. Outputs are grouped into one folder per client/law firm.")
+        if portfolio_mode:
+            portfolio_clients = _saved_entities("client")
+            portfolio_firms = _saved_entities("law_firm")
+            if not portfolio_clients or not portfolio_firms:
+                st.caption("No saved client/law firm IDs found; using the billing profiles.")
+                portfolio_clients = [{"name": p["client_name"], "ext_id": p["client_id"], "weight": 1.0} for p in PROFILES]
+                portfolio_firms = [{"name": p["law_firm_name"], "ext_id": p["law_firm_id"], "weight": 1.0} for p in PROFILES]
+            client_options = {f"{c['name']} ({c['ext_id']})": c for c in portfolio_clients}
+            firm_options = {f"{f['name']} ({f['ext_id']})": f for f in portfolio_firms}
+            selected_clients = st.multiselect("Clients", list(client_options), default=list(client_options), key="portfolio_clients")
+            selected_firms = st.multiselect("Law Firms", list(firm_options), default=list(firm_options), key="portfolio_firms")
+            portfolio_firms_per_client = st.number_input("Law Firms per Client", min_value=1, max_value=max(1, len(selected_firms)), value=1, step=1, key="portfolio_firms_per_client")
+            portfolio_matters = st.slider("Matters per Client/Law Firm", 1, 50, (1, 3), key="portfolio_matters",
+                                          help="Each engagement gets a number of matters drawn from this range.")
+            portfolio_clients = [client_options[k] for k in selected_clients]
+            portfolio_firms = [firm_options[k] for k in selected_firms]
     st.text_input("Matter Number:", "2025-XXXXXX")
     invoice_number_base = st.text_input("Invoice Number:", "2025MMM-XXXXXX")
     LEDES_OPTIONS = ["1998B", "XML 2.1"]
@@ -1269,10 +401,22 @@ with tab_objects[2]:
         st.info("No timekeeper CSV detected. Fee line configuration is disabled, but expenses can still be generated.")
         max_fees = 0
         fees = 0
-    else:
-        max_fees = _calculate_max_fees(timekeeper_data, billing_start_date, billing_end_date, 16)
-        st.caption(f"Maximum fee lines allowed: {max_fees} (based on timekeepers and billing period)")
-        fees = slider_or_fixed("Number of Fee Line Items", 1, max_fees, value=min(20, max_fees), step=1, format="%d")
+    max_daily_hours = st.number_input("Max Daily Timekeeper Hours:", min_value=1, max_value=24, value=16, step=1)
+    if timekeeper_data is not None:
+        # The period settings are on a later tab, so read them from session state; every invoice's period must fit the fees
+        fee_start, fee_end = shortest_period({
+            "billing_start_date": billing_start_date, "billing_end_date": billing_end_date, "matter_number_base": "",
+            "num_invoices": int(st.session_state.get("num_periods", 2)),
+            "multiple_periods": st.session_state.get("generate_multiple") and st.session_state.get("multiple_periods"),
+            "period_cadence": st.session_state.get("period_cadence", "monthly"),
+            "fiscal_start_month": st.session_state.get("fiscal_start_month", 1), "period_days": int(st.session_state.get("period_days", 28)),
+        })
+        max_fees = _calculate_max_fees(timekeeper_data, fee_start, fee_end, max_daily_hours)
+        st.caption(f"Maximum fee lines allowed: {max_fees} (based on timekeepers, max daily hours and the shortest billing period)")
+        if max_fees > CONFIG['FEE_SLIDER_MAX']:
+            fees = st.number_input("Number of Fee Line Items", min_value=1, max_value=max_fees, value=20, step=1)
+        else:
+            fees = slider_or_fixed("Number of Fee Line Items", 1, max_fees, value=min(20, max_fees), step=1, format="%d")
         st.markdown("<h3 style='color: #1E1E1E;'>Expense Settings</h3>", unsafe_allow_html=True)
         with st.expander("Adjust Expense Amounts", expanded=False):
             st.number_input(
@@ -1322,26 +466,52 @@ with tab_objects[2]:
     max_expenses = max(1, int(max_expenses))
 
     expenses = slider_or_fixed("Number of Expense Line Items", 1, max_expenses, value=min(10, max_expenses), step=1)
-    max_daily_hours = st.number_input("Max Daily Timekeeper Hours:", min_value=1, max_value=24, value=16, step=1)
+    fee_target_total = st.number_input(
+        "Target Fee Total per Invoice ($, 0 = no target):", min_value=0.0, value=0.0, step=100.0,
+        help="Fee hours are scaled so each invoice's fees land just under this amount (0.1h granularity) while keeping the exact fee line count."
+    )
     
+    spend_rules = None
     if spend_agent:
         st.markdown("<h3 style='color: #1E1E1E;'>Mandatory Items</h3>", unsafe_allow_html=True)
-        selected_items = st.multiselect("Select Mandatory Items to Include", list(CONFIG['MANDATORY_ITEMS'].keys()), default=list(CONFIG['MANDATORY_ITEMS'].keys()))
+        rules_file = st.file_uploader("Spend rules (YAML or JSON, optional)", type=["yaml", "yml", "json"], key="spend_rules_file",
+                                      help="Declarative mandatory items, optionally injected with a probability or once every N invoices. Without a file, the built-in items below apply to every invoice.")
+        available_rules = DEFAULT_RULES
+        if rules_file is not None:
+            try:
+                available_rules = _parse_rules_bytes(rules_file.getvalue())
+            except ValueError as e:
+                st.error(f"Invalid spend rules: {e}")
+        selected_items = st.multiselect("Select Mandatory Items to Include", available_rules.names, default=available_rules.names)
+        spend_rules = available_rules.only(selected_items)
     else:
         selected_items = []
 
+    with st.expander("Anomaly Injection", expanded=False):
+        st.caption("Deliberate billing-rule violations for testing e-billing rule engines. "
+                   "Every injected line is listed in anomaly_labels.csv alongside the invoices.")
+        anomaly_spec = {kind: st.number_input(f"{label} (% of lines)", min_value=0.0, max_value=100.0, value=0.0, step=1.0,
+                                              key=f"anomaly_{kind}") / 100 for kind, label in ANOMALY_KINDS.items()}
+
 
 with tab_objects[3]:
     st.markdown("<h2 style='color: #1E1E1E;'>Output</h2>", unsafe_allow_html=True)
     st.markdown("<h3 style='color: #1E1E1E;'>Output Settings</h3>", unsafe_allow_html=True)
     include_block_billed = st.checkbox("Include Block Billed Line Items", value=True)
     include_pdf = st.checkbox("Include PDF Invoice", value=False)
+    export_sidecar = st.checkbox(f"Export All Lines as {SIDECAR_NAMES[sidecar_format()]}", value=False,
+                                 help="Every line with its invoice number, matter, period and anomaly labels in one columnar file, "
+                                      "for loading into pandas or analytics tools without parsing LEDES.")
     
     uploaded_logo = None
     logo_width = None
     logo_height = None
+    pdf_mode = "individual"
     
     if include_pdf:
+        pdf_mode = st.radio("PDF Output", ["individual", "combined"], horizontal=True, key="pdf_mode",
+                            format_func={"individual": "One PDF per invoice", "combined": "Single PDF with bookmarks"}.get,
+                            help="A single PDF shares the logo and fonts across all invoices, which keeps large batches small.")
         include_logo = st.checkbox("Include Logo in PDF", value=True, help="Uncheck to exclude logo from PDF header, using only law firm text.")
         if include_logo:
             use_custom_logo = st.checkbox("Use Custom Logo", value=False)
@@ -1355,77 +525,127 @@ with tab_objects[3]:
                 logo_width = st.slider("Logo Width (inches):", 0.5, 2.0, 0.6, step=0.1)
                 logo_height = st.slider("Logo Height (inches):", 0.5, 2.0, 0.6, step=0.1)
     
-    generate_multiple = st.checkbox("Generate Multiple Invoices", help="Create more than one invoice.")
+    generate_multiple = st.checkbox("Generate Multiple Invoices", help="Create more than one invoice.", key="generate_multiple")
     num_invoices = 1
     multiple_periods = False
+    period_cadence, fiscal_start_month, period_days = "monthly", 1, 30
+    extra_matters, per_matter_ledes, generation_workers = [], False, 1
     if generate_multiple:
         combine_ledes = st.checkbox("Combine LEDES into single file", help="If checked, all generated LEDES invoices will be combined into a single file with one header.")
-        multiple_periods = st.checkbox("Multiple Billing Periods", help="Backfills one invoice per prior month from the given end date, newest to oldest.")
+        multiple_periods = st.checkbox("Multiple Billing Periods", help="Backfills one invoice per prior period from the given dates, newest to oldest.", key="multiple_periods")
         if multiple_periods:
-            num_periods = st.number_input("How Many Billing Periods:", min_value=2, max_value=6, value=2, step=1, help="Number of month-long periods to create (overrides Number of Invoices).")
+            period_cadence = st.selectbox("Billing Cadence", list(CADENCES), format_func=CADENCES.get, key="period_cadence")
+            if period_cadence == "fiscal-quarter":
+                fiscal_start_month = st.selectbox("Fiscal Year Starts In", list(range(1, 13)), format_func=lambda m: calendar.month_name[m], key="fiscal_start_month")
+            elif period_cadence == "custom-days":
+                period_days = st.number_input("Period Length (days)", min_value=1, max_value=366, value=28, step=1, key="period_days")
+            num_periods = st.number_input("How Many Billing Periods:", min_value=2, max_value=1200, value=2, step=1, key="num_periods", help="Number of periods to create (overrides Number of Invoices). The first period uses the billing dates above.")
             num_invoices = num_periods
         else:
             num_invoices = st.number_input("Number of Invoices to Create:", min_value=1, value=1, step=1, help="Creates N invoices. When 'Multiple Billing Periods' is enabled, one invoice per period.")
+        matters_text = st.text_area("Additional Matter Numbers (optional, one per line)", value="", height=80,
+                                    help="Generate the same invoices for each listed matter as well as the Matter Number above.")
+        extra_matters = [m.strip() for m in matters_text.split("\n") if m.strip()]
+        if extra_matters:
+            per_matter_ledes = st.checkbox("One LEDES file per matter", value=False, disabled=combine_ledes,
+                                           help="Merge each matter's invoices into its own LEDES file (ignored when combining into a single file).")
+        generation_workers = st.number_input("Parallel Workers", min_value=1, max_value=max(1, os.cpu_count() or 1), value=1, step=1,
+                                             help="Build invoices in separate processes. Output is identical to a single worker for the same seed.")
+        dedup_zip = st.checkbox("Store identical files once in ZIP", value=False,
+                                help="Byte-identical PDFs and receipts are added to the ZIP once; duplicates.json maps each skipped name to the stored copy.")
+        spill_to_disk = st.checkbox("Spill finished invoices to disk", value=False,
+                                    help="For very large batches: once the app's memory passes the limit below, finished invoices and files are kept in a temporary file and read back one at a time.")
+        spill_threshold_mb = None
+        if spill_to_disk:
+            spill_threshold_mb = st.number_input("Spill Above (MB of memory)", min_value=0, value=DEFAULT_SPILL_MB, step=256)
     else:
         combine_ledes = False
+        dedup_zip = False
+        spill_threshold_mb = None
 
     generate_receipts = st.checkbox("Generate Sample Receipts for Expenses?", value=False)
+    if "generation_seed" not in st.session_state:
+        st.session_state.generation_seed = random.randint(1, 999_999)
+    generation_seed = st.number_input(
+        "Random Seed", min_value=0, step=1, key="generation_seed",
+        help="The same seed and settings reproduce the same invoices, and only sections whose settings changed are regenerated. Change it for fresh data."
+    )
+    preview_count = st.number_input(
+        "Preview Lines", min_value=0, max_value=500, value=PREVIEW_LINES, step=5,
+        help="Show the first line items of the first invoice as soon as they exist, before PDFs, receipts and the rest of the batch. 0 turns the preview off."
+    )
+
+# Panels below are fragments: interacting with them reruns only the panel, not the whole script.
+# Their widgets are keyed and read from st.session_state when generating.
+@st.experimental_fragment
+def _receipt_settings_panel():
+    st.caption("These settings affect only the generated sample receipts.")
+    with st.expander("Global Style", expanded=False):
+        st.slider(
+            "Receipt scale (affects font sizes)",
+            min_value=0.8, max_value=1.4, value=1.0, step=0.05,
+            key="rcpt_scale"
+        )
+        st.slider(
+            "Divider line weight",
+            min_value=1, max_value=4, value=1, step=1,
+            key="rcpt_line_weight"
+        )
+        st.checkbox(
+            "Use dashed dividers",
+            value=False,
+            key="rcpt_dashed"
+        )
+        st.selectbox(
+            "Receipt format",
+            options=list(RECEIPT_FORMATS),
+            format_func=RECEIPT_FORMATS.get,
+            key="rcpt_format",
+            help="Vector PDFs are a fraction of the size of PNGs and render much faster."
+        )
+    with st.expander("Footer Policy Visibility", expanded=False):
+        st.checkbox("Show policy on Travel (E110)", value=True, key="rcpt_show_policy_travel")
+        st.checkbox("Show policy on Meals (E111)", value=True, key="rcpt_show_policy_meal")
+        st.checkbox("Show policy on Mileage (E109)", value=True, key="rcpt_show_policy_mileage")
+        st.checkbox("Show policy on Supplies/Other (E124)", value=True, key="rcpt_show_policy_supplies")
+        st.checkbox("Show policy on Other (generic)", value=True, key="rcpt_show_policy_generic")
+    with st.expander("Travel Details (E110)", expanded=False):
+        st.text_input("Carrier code (e.g., AA, UA)", value="", key="rcpt_travel_carrier")
+        st.text_input("Flight number", value="", key="rcpt_travel_flight")
+        st.text_input("Seat", value="", key="rcpt_travel_seat")
+        st.text_input("Fare class", value="", key="rcpt_travel_fare")
+        st.text_input("From (city)", value="", key="rcpt_travel_from")
+        st.text_input("To (city)", value="", key="rcpt_travel_to")
+        st.checkbox("Auto-generate blank travel fields", value=True, key="rcpt_travel_autogen")
+    with st.expander("Meal Details (E111)", expanded=False):
+        st.text_input("Table #", value="", key="rcpt_meal_table")
+        st.text_input("Server ID", value="", key="rcpt_meal_server")
+        st.checkbox("Include cashier line", value=True, key="rcpt_meal_show_cashier")
+
 if generate_receipts:
     receipt_tabs = st.tabs(["Receipt Settings"])
     with receipt_tabs[0]:
-        st.caption("These settings affect only the generated sample receipts.")
-        with st.expander("Global Style", expanded=False):
-            st.slider(
-                "Receipt scale (affects font sizes)",
-                min_value=0.8, max_value=1.4, value=1.0, step=0.05,
-                key="rcpt_scale"
-            )
-            st.slider(
-                "Divider line weight",
-                min_value=1, max_value=4, value=1, step=1,
-                key="rcpt_line_weight"
-            )
-            st.checkbox(
-                "Use dashed dividers",
-                value=False,
-                key="rcpt_dashed"
-            )
-        with st.expander("Footer Policy Visibility", expanded=False):
-            st.checkbox("Show policy on Travel (E110)", value=True, key="rcpt_show_policy_travel")
-            st.checkbox("Show policy on Meals (E111)", value=True, key="rcpt_show_policy_meal")
-            st.checkbox("Show policy on Mileage (E109)", value=True, key="rcpt_show_policy_mileage")
-            st.checkbox("Show policy on Supplies/Other (E124)", value=True, key="rcpt_show_policy_supplies")
-            st.checkbox("Show policy on Other (generic)", value=True, key="rcpt_show_policy_generic")
-        with st.expander("Travel Details (E110)", expanded=False):
-            st.text_input("Carrier code (e.g., AA, UA)", value="", key="rcpt_travel_carrier")
-            st.text_input("Flight number", value="", key="rcpt_travel_flight")
-            st.text_input("Seat", value="", key="rcpt_travel_seat")
-            st.text_input("Fare class", value="", key="rcpt_travel_fare")
-            st.text_input("From (city)", value="", key="rcpt_travel_from")
-            st.text_input("To (city)", value="", key="rcpt_travel_to")
-            st.checkbox("Auto-generate blank travel fields", value=True, key="rcpt_travel_autogen")
-        with st.expander("Meal Details (E111)", expanded=False):
-            st.text_input("Table #", value="", key="rcpt_meal_table")
-            st.text_input("Server ID", value="", key="rcpt_meal_server")
-            st.checkbox("Include cashier line", value=True, key="rcpt_meal_show_cashier")
-
+        _receipt_settings_panel()
 
 
 # Email Configuration Tab (only created if send_email is True)
+@st.experimental_fragment
+def _email_panel(matter_number_base: str):
+    st.markdown("<h2 style='color: #1E1E1E;'>Email Configuration</h2>", unsafe_allow_html=True)
+    st.text_input("Recipient Email Address:", key="recipient_email")
+    try:
+        st.secrets.email.email_from  # AttributeError when email is not configured
+        st.caption(f"Sender Email will be from: {st.secrets.get('email', {}).get('username', 'N/A')}")
+    except AttributeError:
+        st.caption("Sender Email: Not configured (check secrets.toml)")
+    st.text_input("Email Subject Template:", value=f"LEDES Invoice for {matter_number_base} (Invoice #{{invoice_number}})", key="email_subject")
+    st.text_area("Email Body Template:", value="Please find the attached invoice files for matter {matter_number}.\n\nBest regards,\nYour Law Firm", height=150, key="email_body")
+
 if st.session_state.send_email:
     email_tab_index = len(tabs) - 1
     with tab_objects[email_tab_index]:
-        st.markdown("<h2 style='color: #1E1E1E;'>Email Configuration</h2>", unsafe_allow_html=True)
-        recipient_email = st.text_input("Recipient Email Address:")
-        try:
-            sender_email = st.secrets.email.email_from
-            st.caption(f"Sender Email will be from: {st.secrets.get('email', {}).get('username', 'N/A')}")
-        except AttributeError:
-            st.caption("Sender Email: Not configured (check secrets.toml)")
-        st.text_input("Email Subject Template:", value=f"LEDES Invoice for {matter_number_base} (Invoice #{{invoice_number}})", key="email_subject")
-        st.text_area("Email Body Template:", value=f"Please find the attached invoice files for matter {{matter_number}}.\n\nBest regards,\nYour Law Firm", height=150, key="email_body")
-else:
-    recipient_email = ""
+        _email_panel(matter_number_base)
+recipient_email = st.session_state.get("recipient_email", "") if st.session_state.send_email else ""
 
 # Validation Logic
 is_valid_input = True
@@ -1435,15 +655,20 @@ if timekeeper_data is None and (("fees" in locals() and fees > 0) or ("fees" in
 if billing_start_date >= billing_end_date:
     st.error("Billing start date must be before end date.")
     is_valid_input = False
+try:
+    anomalies = anomaly_fractions(anomaly_spec)
+except ValueError as e:
+    st.error(str(e))
+    is_valid_input = False
 if not _is_valid_client_id(client_id):is_valid_input = False
 if not _is_valid_law_firm_id(law_firm_id):is_valid_input = False
-if st.session_state.send_email and not recipient_email:
-    st.error("Please provide a recipient email address.")
-    is_valid_input = False
 if not invoice_number_base or not matter_number_base:
     st.error("Invoice Number and Matter Number cannot be empty.")
     is_valid_input = False
-if combine_ledes and num_invoices <= 1:
+if portfolio_mode and not (portfolio_clients and portfolio_firms):
+    st.error("Select at least one client and one law firm for the portfolio.")
+    is_valid_input = False
+if combine_ledes and num_invoices * (1 + len(extra_matters)) <= 1:
     st.error("Cannot combine LEDES file if only one invoice is being generated.")
     is_valid_input = False
 st.markdown("---")
@@ -1451,115 +676,140 @@ generate_button = st.button("Generate Invoice(s)", disabled=not is_valid_input)
 
 # Main App Logic
 if generate_button:
+    # Checked on click: the recipient is typed in the email fragment, which does not rerun this check.
+    if st.session_state.send_email and not recipient_email:
+        st.error("Please provide a recipient email address.")
+        st.stop()
     if ledes_version == "XML 2.1":
         st.error("LEDES XML 2.1 is not yet implemented. Please switch to 1998B.")
         st.stop()
     
-    faker = Faker()
+    learned_model = st.session_state.get("learned_model") if st.session_state.get("use_learned_model") else None
+    stage_cache = st.session_state.setdefault("stage_cache", StageCache())
+    stage_cache.reset_counters()
+    expense_settings = _expense_settings_from_state()
+    receipt_settings = _receipt_settings_from_state()
+    logo_bytes = b""
+    if include_pdf and include_logo:
+        use_custom_logo = st.session_state.get('use_custom_logo_checkbox', False)
+        with _engine_warnings():
+            logo_bytes = _get_logo_bytes(uploaded_logo, law_firm_id, use_custom_logo)
     descriptions = [d.strip() for d in invoice_desc.split('\n') if d.strip()]
     num_invoices = int(num_invoices)
+    profiler = RunProfiler(
+        capture_cprofile=st.session_state.get("profile_cprofile", False),
+        capture_memory=st.session_state.get("profile_tracemalloc", False),
+    )
     
-    if multiple_periods and len(descriptions) != num_invoices:
-        st.warning(f"You have selected to generate {num_invoices} invoices, but provided {len(descriptions)} descriptions. Please provide one description per period.")
+    if multiple_periods and len(descriptions) > num_invoices:
+        st.warning(f"You have selected to generate {num_invoices} invoices, but provided {len(descriptions)} descriptions. Please provide at most one description per period.")
+    elif not descriptions:
+        st.warning("Please provide an invoice description.")
     else:
-        attachments_list = []
-        combined_ledes_content = ""
+        if multiple_periods and len(descriptions) < num_invoices:
+            st.caption(f"{len(descriptions)} description(s) for {num_invoices} periods; descriptions repeat in order.")
+        preview_area = st.container()
         with st.status("Generating invoices...") as status:
-            current_end_date = billing_end_date
-            current_start_date = billing_start_date
-            
-            for i in range(num_invoices):
-                if multiple_periods and i > 0:
-                    current_end_date = current_start_date - dt.timedelta(days=1)
-                    current_start_date = current_end_date.replace(day=1)
-                
-                status.update(label=f"Generating Invoice {i+1}/{num_invoices} for period {current_start_date} to {current_end_date}")
-                
-                current_invoice_desc = descriptions[i] if multiple_periods and i < len(descriptions) else descriptions[0]
-                fees_used = max(0, fees - (2 if spend_agent and selected_items else 0))
-                expenses_used = max(0, expenses - (1 if spend_agent and 'Uber E110' in selected_items else 0))
-                
-                rows, total_amount = _generate_invoice_data(
-                    fees_used, expenses_used, timekeeper_data, client_id, law_firm_id,
-                    current_invoice_desc, current_start_date, current_end_date,
-                    task_activity_desc, CONFIG['MAJOR_TASK_CODES'], max_daily_hours, include_block_billed, faker
-                )
-
-                # Persist the generated payload for later email/download
-
-                try:
-
-                    import streamlit as st
-
-                    st.session_state.generated_rows = rows
-
-                    st.session_state.generated_total = float(total_amount) if isinstance(total_amount, (int, float)) else total_amount
-
-                except Exception:
-
-                    pass
-                # Persist the generated payload for later email/download
-
-                try:
-
-                    import streamlit as st
-
-                    st.session_state.generated_rows = rows
-
-                    st.session_state.generated_total = float(total_amount) if isinstance(total_amount, (int, float)) else total_amount
-
-                    st.session_state.generated_invoice_meta = {
-
-                        "client_id": locals().get("client_id"),
-
-                        "law_firm_id": locals().get("law_firm_id"),
-
-                        "invoice_number": locals().get("invoice_number"),
-
-                        "billing_start": locals().get("current_start_date") or locals().get("billing_start_date"),
-
-                        "billing_end": locals().get("current_end_date") or locals().get("billing_end_date"),
-
-                        "invoice_desc": locals().get("current_invoice_desc") or locals().get("invoice_desc"),
-
-                        "fees_used": locals().get("fees_used"),
-
-                        "expenses_used": locals().get("expenses_used"),
-
-                    }
+            profiler.start()
+            batch_params = {
+                "seed": generation_seed, "num_invoices": num_invoices, "multiple_periods": multiple_periods,
+                "period_cadence": period_cadence, "fiscal_start_month": fiscal_start_month, "period_days": int(period_days),
+                "matters": [matter_number_base] + extra_matters if extra_matters else None,
+                "per_matter_ledes": per_matter_ledes, "workers": int(generation_workers),
+                "spill_threshold_mb": spill_threshold_mb,
+                "combine_ledes": combine_ledes, "descriptions": descriptions,
+                "invoice_number_base": invoice_number_base, "matter_number_base": matter_number_base,
+                "fees": fees, "expenses": expenses, "timekeeper_data": timekeeper_data,
+                "client_id": client_id, "law_firm_id": law_firm_id,
+                "billing_start_date": billing_start_date, "billing_end_date": billing_end_date,
+                "task_activity_desc": task_activity_desc, "major_task_codes": CONFIG['MAJOR_TASK_CODES'],
+                "max_daily_hours": max_daily_hours, "include_block_billed": include_block_billed,
+                "fee_target_total": fee_target_total or None,
+                "learned_model": learned_model, "expense_settings": expense_settings,
+                "spend_rules": spend_rules, "anomalies": anomalies, "sidecar": export_sidecar,
+                "include_pdf": include_pdf, "pdf_mode": pdf_mode, "include_logo": include_pdf and include_logo, "logo_bytes": logo_bytes,
+                "generate_receipts": generate_receipts, "receipt_settings": receipt_settings,
+            }
+            on_invoice = lambda i, n, start, end: status.update(label=f"Generating Invoice {i+1}/{n} for period {start} to {end}")
+            first_params = batch_params
+            if portfolio_mode:
+                engagements = plan_portfolio(portfolio_clients, portfolio_firms, generation_seed, int(portfolio_firms_per_client),
+                                             tuple(portfolio_matters), matter_number_base)
+                if engagements:
+                    first_params = {**batch_params, "client_id": engagements[0]["client_id"],
+                                    "law_firm_id": engagements[0]["law_firm_id"], "matters": engagements[0]["matters"]}
+            # The preview only runs the first invoice's row stages, so it appears as fast for 1,000 invoices as for one.
+            # Those stages stay in stage_cache and the batch below reuses them.
+            if preview_count:
+                with profiler.stage("preview") as preview_stats:
+                    preview_job, preview_rows = preview_lines(first_params, stage_cache, int(preview_count))
+                    preview_stats.lines += len(preview_rows)
+                with preview_area:
+                    st.caption(f"Preview: first {len(preview_rows)} line(s) of invoice {preview_job['invoice_number']} "
+                               f"({preview_job['billing_start_date']} to {preview_job['billing_end_date']})")
+                    st.dataframe(pd.DataFrame(preview_rows).reindex(columns=PREVIEW_COLUMNS), use_container_width=True, hide_index=True)
+            with preview_area:
+                finished_table = st.empty()
+            finished_invoices = []
+            last_drawn = [0.0]
+
+            def on_built(job, out):
+                finished_invoices.append({
+                    "Invoice": job["invoice_number"], "Matter": job["matter_number"],
+                    "Period": f"{job['billing_start_date']} to {job['billing_end_date']}",
+                    "Lines": len(out["rows"]), "Total": round(float(out["total_amount"]), 2),
+                })
+                # Redrawing ships the whole table to the browser, so large batches refresh twice a second
+                if time.monotonic() - last_drawn[0] >= 0.5:
+                    finished_table.dataframe(pd.DataFrame(finished_invoices), use_container_width=True, hide_index=True)
+                    last_drawn[0] = time.monotonic()
 
-                except Exception:
+            try:
+                with _engine_warnings():
+                    if portfolio_mode:
+                        custom_logo = st.session_state.get('use_custom_logo_checkbox', False) and uploaded_logo is not None
+                        batch = generate_portfolio(batch_params, engagements, stage_cache, profiler, on_invoice,
+                                                   logo_for_firm=None if custom_logo else lambda firm_id: _get_logo_bytes(None, firm_id, False),
+                                                   on_built=on_built)
+                    else:
+                        batch = generate_batch(batch_params, stage_cache, profiler, on_invoice, on_built)
+            except ValueError as e:
+                # Settings the generators cannot satisfy, e.g. more fee lines than the timekeepers' hours allow
+                status.update(label="Invoice generation failed", state="error")
+                st.error(f"Cannot generate these invoices: {e}")
+                st.stop()
+            if portfolio_mode:
+                st.dataframe(pd.DataFrame(batch["partitions"]), use_container_width=True, hide_index=True)
+                # Each partition folder carries its own combined LEDES file, so package everything as one ZIP
+                batch["combined_ledes"] = None
+                combine_ledes = False
+            if len(finished_invoices) > 1:
+                finished_table.dataframe(pd.DataFrame(finished_invoices), use_container_width=True, hide_index=True)
+            else:
+                finished_table.empty()
+            attachments_list = batch["attachments"]
+            combined_ledes_content = batch["combined_ledes"] or ""
+            last_invoice = batch["invoices"][-1]
+            current_invoice_number = last_invoice["invoice_number"]
+            current_matter_number = last_invoice["matter_number"]
+
+            # Persist the generated payload for later email/download
+            st.session_state.generated_rows = list(last_invoice["rows"])
+            st.session_state.generated_total = float(last_invoice["total_amount"])
+            st.session_state.generated_invoice_meta = {
+                "client_id": client_id,
+                "law_firm_id": law_firm_id,
+                "invoice_number": current_invoice_number,
+                "billing_start": last_invoice["billing_start"],
+                "billing_end": last_invoice["billing_end"],
+                "invoice_desc": last_invoice["invoice_desc"],
+                "fees_used": last_invoice["fees_used"],
+                "expenses_used": last_invoice["expenses_used"],
+            }
 
-                    pass
-                if spend_agent:
-                    rows = _ensure_mandatory_lines(rows, timekeeper_data, current_invoice_desc, client_id, law_firm_id, current_start_date, current_end_date, selected_items)
-                
-                df_invoice = pd.DataFrame(rows)
-                current_invoice_number = f"{invoice_number_base}-{i+1}"
-                current_matter_number = matter_number_base
-                
-                is_first = (i == 0) and combine_ledes
-                ledes_content_part = _create_ledes_1998b_content(df_invoice.to_dict(orient='records'), total_amount, current_start_date, current_end_date, current_invoice_number, current_matter_number, is_first_invoice=not combine_ledes or is_first)
-                
-                if combine_ledes:
-                    combined_ledes_content += ledes_content_part + "\n"
-                else:
-                    ledes_filename = f"LEDES_1998B_{current_invoice_number}.txt"
-                    attachments_list.append((ledes_filename, ledes_content_part.encode('utf-8')))
-                
-                if include_pdf:
-                    use_custom_logo = st.session_state.get('use_custom_logo_checkbox', False)
-                    logo_bytes = _get_logo_bytes(uploaded_logo, law_firm_id, use_custom_logo)
-                    pdf_buffer = _create_pdf_invoice(df_invoice, total_amount, current_invoice_number, current_end_date, current_start_date, current_end_date, client_id, law_firm_id, logo_bytes, include_logo)
-                    pdf_filename = f"Invoice_{current_invoice_number}.pdf"
-                    attachments_list.append((pdf_filename, pdf_buffer.getvalue()))
-                
-                if generate_receipts:
-                    for row in rows:
-                        if row.get("EXPENSE_CODE") and row.get("EXPENSE_CODE") != "E101":  # Exclude Copying (E101)
-                            receipt_filename, receipt_data_buf = _create_receipt_image(row, faker)
-                            if receipt_data_buf:
-                                attachments_list.append((receipt_filename, receipt_data_buf.getvalue()))
+            reused = sum(stage_cache.hits.values())
+            if reused:
+                st.caption(f"Reused {reused} unchanged stage result(s); re-ran {sum(stage_cache.runs.values())}.")
 
             # Final download/email logic
             if st.session_state.send_email:
@@ -1567,16 +817,22 @@ if generate_button:
                 
                 if combine_ledes:
                     attachments_to_send = [("LEDES_Combined.txt", combined_ledes_content.encode('utf-8'))]
-                    attachments_to_send.extend([item for item in attachments_list if item[0].endswith(".pdf") or item[0].endswith(".png")])
-                    if not _send_email_with_attachment(recipient_email, subject, body, attachments_to_send):
+                    attachments_to_send.extend(select_attachments(attachments_list, lambda name: name.endswith((".pdf", ".png", ".csv", ".parquet", ".gz"))))
+                    with profiler.stage("smtp") as smtp_stats:
+                        sent = _send_email_with_attachment(recipient_email, subject, body, attachments_to_send)
+                        smtp_stats.bytes += sum(len(data) for _, data in attachments_to_send)
+                    if not sent:
                         st.subheader("Invoice(s) Failed to Email - Download below:")
                         for filename, data in attachments_to_send:
-                            st.download_button(label=f"Download {filename}", data=data, file_name=filename, mime="text/plain" if filename.endswith(".txt") else ("application/pdf" if filename.endswith(".pdf") else "image/png"), key=f"download_failed_{filename}")
+                            st.download_button(label=f"Download {filename}", data=data, file_name=filename, mime=_attachment_mime(filename), key=f"download_failed_{filename}")
                 else:
-                    if not _send_email_with_attachment(recipient_email, subject, body, attachments_list):
+                    with profiler.stage("smtp") as smtp_stats:
+                        sent = _send_email_with_attachment(recipient_email, subject, body, attachments_list)
+                        smtp_stats.bytes += sum(len(data) for _, data in attachments_list)
+                    if not sent:
                         st.subheader("Invoice(s) Failed to Email - Download below:")
                         for filename, data in attachments_list:
-                            st.download_button(label=f"Download {filename}", data=data, file_name=filename, mime="text/plain" if filename.endswith(".txt") else ("application/pdf" if filename.endswith(".pdf") else "image/png"), key=f"download_failed_{filename}")
+                            st.download_button(label=f"Download {filename}", data=data, file_name=filename, mime=_attachment_mime(filename), key=f"download_failed_{filename}")
             else:
                 if combine_ledes:
                     st.subheader("Generated Combined LEDES Invoice")
@@ -1587,29 +843,27 @@ if generate_button:
                         mime="text/plain",
                         key="download_combined_ledes"
                     )
-                    pdf_and_receipt_attachments = [item for item in attachments_list if item[0].endswith(".pdf") or item[0].endswith(".png")]
+                    pdf_and_receipt_attachments = select_attachments(attachments_list, lambda name: name.endswith((".pdf", ".png", ".csv", ".parquet", ".gz")))
                     if pdf_and_receipt_attachments:
-                        zip_buf = io.BytesIO()
-                        with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            for filename, data in pdf_and_receipt_attachments:
-                                zip_file.writestr(filename, data)
-                        zip_buf.seek(0)
+                        with profiler.stage("zip") as zip_stats:
+                            zip_bytes = _zip_for_download(pdf_and_receipt_attachments, dedup_zip)
+                            zip_stats.lines += len(pdf_and_receipt_attachments)
+                            zip_stats.bytes += len(zip_bytes)
                         st.download_button(
                             label="Download All PDF Invoices & Receipts as ZIP",
-                            data=zip_buf.getvalue(),
+                            data=zip_bytes,
                             file_name="invoices_and_receipts.zip",
                             mime="application/zip",
                             key="download_pdf_zip"
                         )
-                elif num_invoices > 1:
-                    zip_buf = io.BytesIO()
-                    with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        for filename, data in attachments_list:
-                            zip_file.writestr(filename, data)
-                    zip_buf.seek(0)
+                elif len(batch["invoices"]) > 1:
+                    with profiler.stage("zip") as zip_stats:
+                        zip_bytes = _zip_for_download(attachments_list, dedup_zip)
+                        zip_stats.lines += len(attachments_list)
+                        zip_stats.bytes += len(zip_bytes)
                     st.download_button(
                         label="Download All Invoices as ZIP",
-                        data=zip_buf.getvalue(),
+                        data=zip_bytes,
                         file_name="invoices.zip",
                         mime="application/zip",
                         key="download_zip"
@@ -1621,13 +875,86 @@ if generate_button:
                             label=f"Download {filename}",
                             data=data,
                             file_name=filename,
-                            mime="text/plain" if filename.endswith(".txt") else ("application/pdf" if filename.endswith(".pdf") else "image/png"),
+                            mime=_attachment_mime(filename),
                             key=f"download_{filename}"
                         )
+            profiler.stop()
+            st.session_state.last_run_profile = profiler
+            try:
+                record_run(profiler, batch_params, batch["invoices"], "app")
+            except sqlite3.Error as e:
+                logging.error(f"Run metrics not recorded: {e}")
             status.update(label="Invoice generation complete!", state="complete")
 
+# --- Admin tab: run profiling ---
+with tab_objects[tabs.index("Admin")]:
+    st.markdown("<h2 style='color: #1E1E1E;'>Performance</h2>", unsafe_allow_html=True)
+    st.caption("Per-stage wall/CPU timings are always recorded. cProfile and tracemalloc add overhead and are off by default.")
+    pc1, pc2 = st.columns(2)
+    with pc1:
+        st.checkbox("Capture cProfile hot functions", value=False, key="profile_cprofile")
+    with pc2:
+        st.checkbox("Track peak memory (tracemalloc)", value=False, key="profile_tracemalloc")
+    last_profile = st.session_state.get("last_run_profile")
+    if last_profile is None:
+        st.info("Generate invoices to see a stage breakdown of the last run.")
+    else:
+        peak = f" · peak traced memory {last_profile.peak_memory_bytes / 1e6:.1f} MB" if last_profile.peak_memory_bytes is not None else ""
+        st.caption(f"Last run: {last_profile.wall_s:.2f}s wall, {last_profile.cpu_s:.2f}s CPU{peak}")
+        st.dataframe(pd.DataFrame(last_profile.summary()), use_container_width=True, hide_index=True)
+        if last_profile.hot_functions:
+            st.markdown("**Hot functions (by self time)**")
+            st.dataframe(pd.DataFrame(last_profile.hot_functions), use_container_width=True, hide_index=True)
+        dc1, dc2 = st.columns(2)
+        with dc1:
+            st.download_button("Download Metrics (JSON)", last_profile.to_json(), "run_metrics.json", "application/json", key="download_metrics_json")
+        with dc2:
+            st.download_button("Download Metrics (OpenMetrics)", last_profile.to_openmetrics(), "run_metrics.prom",
+                               "application/openmetrics-text", key="download_metrics_prom")
+
+@st.experimental_fragment
+def _run_history_panel():
+    st.markdown("**Run history**")
+    st.caption("Every generation run (app, CLI and HTTP API) is recorded next to app_data.db.")
+    history_limit = st.number_input("Runs to show", min_value=10, max_value=10_000, value=200, step=50, key="run_history_limit")
+    try:
+        runs = load_runs(int(history_limit))
+    except sqlite3.Error as e:
+        st.error(f"Failed to read run history: {e}")
+        return
+    if runs.empty:
+        st.info("No runs recorded yet.")
+        return
+    st.caption(f"{len(runs)} run(s) since {runs['started_at'].iloc[0]:%Y-%m-%d %H:%M} UTC")
+    st.line_chart(runs.set_index("started_at")[["lines_per_s"]], y_label="lines / s")
+    configs = compare_configs(runs)
+    st.markdown("**By configuration**")
+    st.dataframe(configs, use_container_width=True, hide_index=True)
+    st.bar_chart(configs.set_index("config")[["lines_per_s"]], y_label="median lines / s", horizontal=True)
+    hc1, hc2 = st.columns(2)
+    with hc1:
+        st.markdown("**Stage wall time per run (s)**")
+        st.bar_chart(stage_seconds(runs))
+    with hc2:
+        st.markdown("**Output bytes per run**")
+        st.bar_chart(artifact_bytes(runs))
+    st.dataframe(runs.drop(columns=["stages", "artifact_bytes"]).iloc[::-1], use_container_width=True, hide_index=True)
+    if st.button("Clear run history", key="clear_run_history"):
+        clear_runs()
+        st.rerun()
+
+with tab_objects[tabs.index("Admin")]:
+    _run_history_panel()
+
 # --- Data Sources tab: upload TK.csv and Line Items CSV ---
-with tab_objects[tabs.index("Data Sources")]:
+def _use_roster(records: list[Dict], synthetic: tuple[int, int] | None = None) -> None:
+    """Swap in a new timekeeper roster and rerun the whole app so the fee controls pick it up."""
+    st.session_state.timekeeper_data = records
+    st.session_state.synthetic_roster = synthetic
+    st.rerun()
+
+@st.experimental_fragment
+def _data_sources_panel():
     st.markdown("<h2 style='color:#1E1E1E;'>Data Sources</h2>", unsafe_allow_html=True)
     st.write("Upload your Timekeeper CSV and optional Line Item CSV here.")
 
@@ -1636,13 +963,31 @@ with tab_objects[tabs.index("Data Sources")]:
         tk_file = st.file_uploader("Upload TK.csv", type=["csv"], key="tk_csv_upl")
         if tk_file is not None:
             try:
-                tk_df = pd.read_csv(tk_file)
-                st.session_state.timekeeper_data = tk_df.to_dict(orient="records")
-                st.success(f"Loaded {len(tk_df)} timekeepers.")
-                st.dataframe(tk_df.head(50), use_container_width=True)
+                tk_records = _read_timekeeper_csv(tk_file.getvalue())
+                if st.session_state.get("tk_csv_sig") != (tk_file.name, tk_file.size):
+                    st.session_state.tk_csv_sig = (tk_file.name, tk_file.size)
+                    _use_roster(tk_records)
+                st.success(f"Loaded {len(tk_records)} timekeepers.")
+                st.dataframe(pd.DataFrame(tk_records).head(50), use_container_width=True)
             except Exception as e:
                 st.error(f"Failed to read TK.csv: {e}")
 
+    with st.expander("Synthetic Timekeeper Roster (optional)", expanded=False):
+        st.caption("Model a large firm without a CSV: timekeepers are drawn with a realistic Partner/Associate/Paralegal mix and per-classification rate bands.")
+        roster_cols = st.columns(2)
+        roster_size = roster_cols[0].number_input("Timekeepers", min_value=1, max_value=50_000, value=500, step=50, key="roster_size")
+        roster_seed = roster_cols[1].number_input("Roster seed", min_value=0, value=0, step=1, key="roster_seed")
+        mix_cols = st.columns(len(CLASSIFICATION_MIX))
+        roster_mix = {label: mix_cols[n].number_input(f"{label} %", min_value=0, max_value=100, value=int(round(share * 100)), step=1, key=f"roster_mix_{label}")
+                      for n, (label, share) in enumerate(CLASSIFICATION_MIX.items())}
+        if st.button("Use synthetic roster", disabled=sum(roster_mix.values()) == 0):
+            _use_roster(synthesize_roster(int(roster_size), int(roster_seed), roster_mix), synthetic=(int(roster_size), int(roster_seed)))
+        if st.session_state.get("synthetic_roster"):
+            st.success("Using {} synthetic timekeepers (seed {}).".format(*st.session_state.synthetic_roster))
+            st.dataframe(roster_summary(st.session_state.timekeeper_data), use_container_width=True, hide_index=True)
+            st.download_button("Download roster as TK.csv", pd.DataFrame(st.session_state.timekeeper_data).to_csv(index=False).encode("utf-8"),
+                               "synthetic_timekeepers.csv", "text/csv", key="download_synthetic_roster")
+
     with st.expander("Custom Line Items CSV (optional)", expanded=True):
         st.caption("Provide preset fee/expense rows to use or mix in.")
         li_file = st.file_uploader("Custom Line Items CSV", type=["csv"], key="li_csv_upl")
@@ -1658,6 +1003,43 @@ with tab_objects[tabs.index("Data Sources")]:
     # Compatibility shim: set this flag based on presence of data (no widget uses this key now)
     st.session_state.use_custom_line_items = bool(st.session_state.get("custom_line_items"))
 
+    with st.expander("Learn From Existing LEDES Files (optional)", expanded=False):
+        st.caption("Use real 1998B invoices as templates: fees and expenses are sampled from their task/activity, rate and expense-amount distributions.")
+        template_files = st.file_uploader("LEDES 1998B template files", type=["txt", "ledes"], accept_multiple_files=True, key="ledes_template_upl")
+        if template_files:
+            try:
+                # Learn once per set of uploads, not on every rerun (the digests catch a re-upload under the same name)
+                template_sig = tuple((f.name, f.size, hashlib.sha256(f.getvalue()).hexdigest()) for f in template_files)
+                if st.session_state.get("ledes_template_sig") != template_sig:
+                    st.session_state.learned_model = learn_ledes_model(template_files)
+                    st.session_state.ledes_template_sig = template_sig
+            except Exception as e:
+                st.error(f"Failed to learn from LEDES files: {e}")
+                logging.error(f"LEDES template ingest error: {e}")
+        learned = st.session_state.get("learned_model")
+        if learned:
+            st.success(f"Learned model: {learned_model_summary(learned)}")
+            st.checkbox("Sample fees and expenses from the learned model", value=True, key="use_learned_model")
+            if learned.get("timekeepers") and st.button("Use learned timekeepers as roster"):
+                _use_roster([
+                    {k: tk[k] for k in ("TIMEKEEPER_NAME", "TIMEKEEPER_CLASSIFICATION", "TIMEKEEPER_ID", "RATE")}
+                    for tk in learned["timekeepers"]
+                ])
+
+    with st.expander("Validate LEDES 1998B File", expanded=False):
+        st.caption("Checks headers, column counts, [] terminators, line totals, invoice totals and billing-period dates.")
+        ledes_check_file = st.file_uploader("LEDES file to validate", type=["txt", "ledes"], key="ledes_validate_upl")
+        if ledes_check_file is not None:
+            report = _validate_ledes_bytes(ledes_check_file.getvalue())
+            if report.ok:
+                st.success(f"Valid: {report.line_count} line items across {report.invoice_count} invoice(s).")
+            else:
+                st.error(f"{len(report.errors)}{'+' if report.truncated else ''} problem(s) found in {report.line_count} line items.")
+                st.dataframe(pd.DataFrame(report.errors, columns=["Line", "Problem"]), use_container_width=True)
+
+with tab_objects[tabs.index("Data Sources")]:
+    _data_sources_panel()
+
 # (Optional but recommended downstream guard when generating)
 # use_cli = st.session_state.get("use_custom_line_items", True) and bool(st.session_state.get("custom_line_items"))
 #import datetime as dt
@@ -0,0 +1,252 @@
+# --- batch_manifest.py (checksummed output manifest, resumable batches, dedup) ---
+"""Write batches to disk with a manifest so interrupted runs can resume.
+
+manifest.jsonl gets one JSON record per finished invoice (index, invoice number, seed, totals and
+every file with its size and SHA-256), appended and fsynced as soon as the invoice's files are on
+disk, then one "batch" record for the combined outputs. A rerun with the same params skips every
+invoice whose record and files are intact (same size and SHA-256). Each invoice's rows and LEDES text are kept in
+.checkpoint/ so combined LEDES and combined PDFs can be rebuilt without regenerating skipped invoices.
+
+Files whose bytes match a file already written (same SHA-256) are hard-linked to it instead of
+being written again; write_zip does the same for attachments as it streams them into a zip.
+"""
+from __future__ import annotations
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+import zipfile
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator
+
+from invoice_pipeline import StageCache, build_jobs, fingerprint, package_batch, plan_batch
+from money import from_cents, to_cents, total_cents
+from run_profiler import RunProfiler
+from sidecar import SIDECAR_NAMES, sidecar_format, write_sidecar
+from spill_store import ScratchFile, attachment_sources, spill_store_for, text_data
+
+MANIFEST_NAME = "manifest.jsonl"
+CHECKPOINT_DIR = ".checkpoint"
+DUPLICATES_NAME = "duplicates.json"
+RUNTIME_KEYS = ("workers", "spill_threshold_mb", "spill_dir")  # params that do not change the output
+
+
+def _canonical(value: Any) -> Any:
+    """value with sets sorted, so its pickle does not depend on the process's hash seed."""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    """Fingerprint of the params that determine a batch's output, stable across processes."""
+    return fingerprint(sorted((k, _canonical(v)) for k, v in params.items() if k not in RUNTIME_KEYS))
+
+
+def file_entry(name: str, data: bytes) -> Dict[str, Any]:
+    return {"name": name, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def _sha256(data: bytes | ScratchFile) -> str:
+    return _file_sha256(data.path) if isinstance(data, ScratchFile) else hashlib.sha256(data).hexdigest()
+
+
+def write_zip(files: Iterable[tuple[str, bytes]], target: str | BinaryIO, dedup: bool = False) -> None:
+    """Stream files into a deflated zip at target (a path or binary file), one attachment at a time.
+
+    Spilled attachments are read back as they are written and ScratchFiles are copied in chunks, so
+    memory does not grow with the batch. With dedup, repeated contents are stored once and listed
+    in duplicates.json."""
+    kept: Dict[str, str] = {}
+    duplicates: Dict[str, str] = {}
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, data in attachment_sources(files):
+            if dedup:
+                digest = _sha256(data)
+                if digest in kept:
+                    duplicates[filename] = kept[digest]
+                    continue
+                kept[digest] = filename
+            if isinstance(data, ScratchFile):
+                # The same entry writestr would make, copied from disk instead of held in memory
+                info = zipfile.ZipInfo(filename, time.localtime(time.time())[:6])
+                info.compress_type, info.external_attr, info.file_size = zipfile.ZIP_DEFLATED, 0o600 << 16, data.size
+                with data.open() as src, zip_file.open(info, "w") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+            else:
+                zip_file.writestr(filename, data)
+        if duplicates:
+            zip_file.writestr(DUPLICATES_NAME, json.dumps(duplicates, indent=1))
+
+
+def zip_files(files: Iterable[tuple[str, bytes]], dedup: bool = False) -> bytes:
+    """write_zip into memory, for small batches and callers that need the bytes."""
+    buf = io.BytesIO()
+    write_zip(files, buf, dedup)
+    return buf.getvalue()
+
+
+class BatchManifest:
+    """Append-only JSONL manifest in an output directory."""
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.error(f"Ignoring truncated manifest record in {self.path}")
+
+    def append(self, record: Dict[str, Any]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def reset(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _intact(self, entry: Dict[str, Any]) -> bool:
+        """The file is on disk with the recorded size and SHA-256 (the size is checked first, as it is free)."""
+        path = os.path.join(self.out_dir, entry["name"])
+        return os.path.isfile(path) and os.path.getsize(path) == entry["size"] and _file_sha256(path) == entry["sha256"]
+
+    def completed(self, key: str) -> Dict[int, Dict[str, Any]]:
+        """Invoice records for params_key `key` whose files and checkpoint are still on disk, by index."""
+        done = {}
+        for record in self.records():
+            if (record.get("type") == "invoice" and record["params_key"] == key
+                    and all(self._intact(e) for e in record["files"])
+                    and os.path.isfile(_checkpoint_path(self.out_dir, record["index"]))):
+                done[record["index"]] = record
+        return done
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _path_entry(out_dir: str, name: str) -> Dict[str, Any]:
+    """file_entry for a file already written to out_dir, hashed in chunks."""
+    path = os.path.join(out_dir, name)
+    return {"name": name, "size": os.path.getsize(path), "sha256": _file_sha256(path)}
+
+
+def _checkpoint_path(out_dir: str, index: int) -> str:
+    return os.path.join(out_dir, CHECKPOINT_DIR, f"{index}.pkl")
+
+
+def _write_file(out_dir: str, name: str, data: bytes | ScratchFile, written: Dict[str, str]) -> Dict[str, Any]:
+    """Write data to out_dir/name, hard-linking to an identical file already written when there is one."""
+    if isinstance(data, ScratchFile):
+        entry = {"name": name, "size": data.size, "sha256": _sha256(data)}
+    else:
+        entry = file_entry(name, data)
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    same = written.get(entry["sha256"])
+    if same and same != name:
+        try:
+            os.link(os.path.join(out_dir, same), path)
+            entry["duplicate_of"] = same
+            return entry
+        except OSError:
+            pass
+    if isinstance(data, ScratchFile):
+        shutil.copyfile(data.path, path)
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+    written.setdefault(entry["sha256"], name)
+    return entry
+
+
+def generate_to_dir(params: Dict[str, Any], out_dir: str, cache: StageCache, resume: bool = True,
+                    profiler: RunProfiler | None = None,
+                    on_invoice: Callable[[int, int, Any, Any], None] | None = None) -> Dict[str, Any]:
+    """generate_batch straight to out_dir, checkpointing each invoice in manifest.jsonl as it finishes.
+
+    With resume, invoices already recorded for the same params (and still intact on disk) are
+    skipped; otherwise any previous manifest is discarded. Returns the per-invoice metadata (as in
+    generate_batch, with files from the manifest), the combined LEDES text when combining, the
+    names of all files, and how many invoices were skipped and files deduplicated.
+    """
+    os.makedirs(os.path.join(out_dir, CHECKPOINT_DIR), exist_ok=True)
+    manifest = BatchManifest(out_dir)
+    key = params_key(params)
+    if not resume:
+        manifest.reset()
+    done = manifest.completed(key)
+    written = {e["sha256"]: e["name"] for r in done.values() for e in r["files"] if "duplicate_of" not in e}
+    combine_ledes, per_matter = bool(params.get("combine_ledes")), bool(params.get("per_matter_ledes"))
+    combined_pdf = bool(params.get("include_pdf")) and params.get("pdf_mode") == "combined"
+    jobs = plan_batch(params)
+    pending = [job for job in jobs if job["index"] not in done]
+    deduplicated = 0
+
+    def checkpoint(job: Dict[str, Any], out: Dict[str, Any]) -> None:
+        nonlocal deduplicated
+        packaged = package_batch([job], [out], combine_ledes, per_matter, False)
+        data = dict(packaged["attachments"])
+        entries = [_write_file(out_dir, name, data[name], written) for name in packaged["invoices"][0]["files"]]
+        deduplicated += sum("duplicate_of" in e for e in entries)
+        with open(_checkpoint_path(out_dir, job["index"]), "wb") as f:
+            pickle.dump({"rows": out["rows"], "total_amount": out["total_amount"], "ledes": out["ledes"]}, f)
+        record = {"type": "invoice", "params_key": key, "index": job["index"], "seed": job["seed"],
+                  "invoice_number": job["invoice_number"], "matter_number": job["matter_number"],
+                  "lines": len(out["rows"]), "total_amount": from_cents(to_cents(out["total_amount"])), "files": entries}
+        manifest.append(record)
+        done[job["index"]] = record
+
+    # The built invoices are checkpointed and reloaded below; past the spill threshold neither copy stays in memory
+    spill = spill_store_for(params)
+    build_jobs(pending, cache, params.get("workers", 1), profiler, on_invoice, on_built=checkpoint, spill=spill)
+
+    built = []
+    for job in jobs:
+        with open(_checkpoint_path(out_dir, job["index"]), "rb") as f:
+            out = {**pickle.load(f), "pdf": None, "receipts": []}
+        built.append(spill.keep(out) if spill is not None else out)
+    batch = package_batch(jobs, built, combine_ledes, per_matter, combined_pdf, profiler, spill=spill)
+    invoice_files = {name for inv in batch["invoices"] for name in inv["files"]}
+    outputs = [(name, data) for name, data in attachment_sources(batch["attachments"]) if name not in invoice_files]
+    if batch["combined_ledes"] is not None:
+        outputs.insert(0, ("LEDES_Combined.txt", text_data(batch["combined_ledes"])))
+    entries = [_write_file(out_dir, name, data, written) for name, data in outputs]
+    if params.get("sidecar"):
+        # Streamed to disk row group by row group rather than built in memory like the other outputs
+        name = SIDECAR_NAMES[sidecar_format()]
+        with profiler.stage("sidecar") if profiler else contextlib.nullcontext() as stats:
+            lines = write_sidecar(jobs, built, os.path.join(out_dir, name))
+            entries.append(_path_entry(out_dir, name))
+            if stats is not None:
+                stats.lines += lines
+                stats.bytes += entries[-1]["size"]
+    manifest.append({"type": "batch", "params_key": key, "seed": params["seed"], "invoices": len(jobs),
+                     "total_amount": from_cents(total_cents(batch["invoices"], "total_amount")), "files": entries})
+
+    invoices = [{**inv, "files": [e["name"] for e in done[inv["index"]]["files"]]} for inv in batch["invoices"]]
+    files = [e["name"] for e in entries] + [e["name"] for inv in jobs for e in done[inv["index"]]["files"]]
+    return {"invoices": invoices, "combined_ledes": batch["combined_ledes"], "files": files,
+            "skipped": len(jobs) - len(pending), "deduplicated": deduplicated}
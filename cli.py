@@ -0,0 +1,201 @@
+# --- cli.py (headless batch generation) ---
+"""Generate LEDES invoices without the Streamlit UI.
+
+Example:
+    python cli.py --timekeepers TK.csv --invoices 50 --fees 40 --expenses 10 --pdf --out out/ --profile
+
+Every run writes OUT/manifest.jsonl (files, sizes, SHA-256, totals); rerun with --resume to
+skip the invoices an interrupted run already finished.
+
+Sharded across nodes (same arguments and --seed everywhere), then merged:
+    python cli.py ... --seed 7 --shard-count 4 --shard-index 0 --out shared/   # on each node, index 0..3
+    python cli.py --merge-shards shared/shard-* --out merged/
+"""
+from __future__ import annotations
+import argparse
+import datetime as dt
+import logging
+import os
+import random
+import sqlite3
+import sys
+
+import pandas as pd
+
+from invoice_engine import (
+    CONFIG, EXPENSE_SETTING_DEFAULTS, RECEIPT_FORMATS, RECEIPT_SETTING_DEFAULTS, _get_logo_bytes,
+)
+from anomalies import ANOMALY_KINDS, anomaly_fractions
+from batch_manifest import generate_to_dir
+from invoice_pipeline import StageCache
+from period_planner import CADENCES
+from roster_synth import synthesize_roster
+from run_metrics import record_run
+from run_profiler import RunProfiler
+from sharding import merge_shards, shard_dir_name, write_shard_manifest
+from spend_rules import load_rules
+
+
+def _date(value: str) -> dt.date:
+    return dt.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _anomalies(specs: list[str] | None) -> dict:
+    anomalies = {}
+    for spec in specs or []:
+        kind, sep, fraction = spec.partition("=")
+        if not sep:
+            raise ValueError(f"--anomaly expects KIND=FRACTION, got {spec!r}")
+        anomalies[kind.strip()] = float(fraction)
+    return anomaly_fractions(anomalies)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    today = dt.date.today()
+    last_month_end = today.replace(day=1) - dt.timedelta(days=1)
+    p = argparse.ArgumentParser(description="Generate LEDES 1998B invoices (and optional PDFs/receipts) headlessly.")
+    p.add_argument("--timekeepers", help="Timekeeper CSV (TIMEKEEPER_NAME, TIMEKEEPER_CLASSIFICATION, TIMEKEEPER_ID, RATE)")
+    p.add_argument("--synthetic-timekeepers", type=int, metavar="N",
+                   help="Use a synthesized roster of N timekeepers instead of --timekeepers")
+    p.add_argument("--roster-seed", type=int, default=0, help="Seed for --synthetic-timekeepers")
+    p.add_argument("--invoices", type=int, default=1)
+    p.add_argument("--fees", type=int, default=20, help="Fee lines per invoice (requires --timekeepers or --synthetic-timekeepers)")
+    p.add_argument("--expenses", type=int, default=10, help="Expense lines per invoice")
+    p.add_argument("--fee-target-total", type=float, default=None, help="Target fee total per invoice")
+    p.add_argument("--max-daily-hours", type=int, default=16)
+    p.add_argument("--start", type=_date, default=last_month_end.replace(day=1), help="Billing start date (YYYY-MM-DD)")
+    p.add_argument("--end", type=_date, default=last_month_end, help="Billing end date (YYYY-MM-DD)")
+    p.add_argument("--multiple-periods", action="store_true", help="One invoice per prior period, newest first")
+    p.add_argument("--cadence", choices=sorted(CADENCES), default="monthly", help="Period calendar for --multiple-periods")
+    p.add_argument("--fiscal-start-month", type=int, default=1, help="First month of the fiscal year (fiscal-quarter cadence)")
+    p.add_argument("--period-days", type=int, default=30, help="Period length for the custom-days cadence")
+    p.add_argument("--client-id", default=CONFIG['DEFAULT_CLIENT_ID'])
+    p.add_argument("--law-firm-id", default=CONFIG['DEFAULT_LAW_FIRM_ID'])
+    p.add_argument("--invoice-number", default="2025MMM-XXXXXX", help="Invoice number base")
+    p.add_argument("--matter-number", default="2025-XXXXXX")
+    p.add_argument("--matter", action="append", help="Additional matter number; every period is generated for each matter")
+    p.add_argument("--per-matter-ledes", action="store_true", help="Write one LEDES file per matter")
+    p.add_argument("--workers", type=int, default=1, help="Build invoices in this many processes")
+    p.add_argument("--spill-mb", type=float, default=None, metavar="MB",
+                   help="Once the process uses this much memory, keep finished invoices in a temporary file (0 = always)")
+    p.add_argument("--spill-dir", default=None, help="Directory for the --spill-mb temporary file (default: system temp)")
+    p.add_argument("--description", action="append", help="Invoice description (repeat once per period)")
+    p.add_argument("--block-billed", action="store_true")
+    p.add_argument("--anomaly", action="append", metavar="KIND=FRACTION",
+                   help=f"Inject labelled violations into this fraction of lines; KIND is one of {', '.join(ANOMALY_KINDS)}")
+    p.add_argument("--spend-rules", metavar="PATH", help="YAML/JSON spend-agent rules: mandatory lines to inject, optionally by probability or every N invoices")
+    p.add_argument("--pdf", action="store_true", help="Also render PDF invoices")
+    p.add_argument("--combined-pdf", action="store_true", help="Render all invoices into one bookmarked PDF")
+    p.add_argument("--no-logo", action="store_true")
+    p.add_argument("--receipts", action="store_true", help="Also render expense receipts")
+    p.add_argument("--receipt-format", choices=sorted(RECEIPT_FORMATS), default="png",
+                   help="png (raster per receipt), pdf (vector per receipt) or pdf-combined (one PDF per invoice)")
+    p.add_argument("--combine", action="store_true", help="Write one combined LEDES file")
+    p.add_argument("--sidecar", action="store_true",
+                   help="Also write every line with invoice metadata and anomaly labels to lines.parquet (lines.csv.gz without pyarrow)")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--shard-count", type=int, default=1, help="Split the batch across this many nodes (requires --seed)")
+    p.add_argument("--shard-index", type=int, default=0, help="This node's shard, 0-based; output goes to OUT/shard-NNNN-of-NNNN")
+    p.add_argument("--merge-shards", nargs="+", metavar="DIR", help="Merge shard directories into --out and exit")
+    p.add_argument("--out", default="out", help="Output directory")
+    p.add_argument("--resume", action="store_true",
+                   help="Skip invoices already recorded in OUT/manifest.jsonl by a run with the same arguments")
+    p.add_argument("--profile", action="store_true", help="Capture cProfile hot functions and tracemalloc peak memory")
+    p.add_argument("--metrics-json", help="Write per-stage metrics as JSON to this path")
+    p.add_argument("--metrics-openmetrics", help="Write per-stage metrics in OpenMetrics text format to this path")
+    return p
+
+
+def params_from_args(args: argparse.Namespace) -> dict:
+    timekeepers = pd.read_csv(args.timekeepers).to_dict(orient="records") if args.timekeepers else None
+    if args.synthetic_timekeepers:
+        timekeepers = synthesize_roster(args.synthetic_timekeepers, args.roster_seed)
+    include_logo = args.pdf and not args.no_logo
+    return {
+        "seed": args.seed if args.seed is not None else random.randint(1, 999_999),
+        "num_invoices": args.invoices, "multiple_periods": args.multiple_periods, "combine_ledes": args.combine,
+        "period_cadence": args.cadence, "fiscal_start_month": args.fiscal_start_month, "period_days": args.period_days,
+        "matters": [args.matter_number] + args.matter if args.matter else None,
+        "per_matter_ledes": args.per_matter_ledes, "workers": args.workers,
+        "spill_threshold_mb": args.spill_mb, "spill_dir": args.spill_dir,
+        "descriptions": args.description or [CONFIG['DEFAULT_INVOICE_DESCRIPTION']],
+        "invoice_number_base": args.invoice_number, "matter_number_base": args.matter_number,
+        "fees": args.fees if timekeepers else 0, "expenses": args.expenses, "timekeeper_data": timekeepers,
+        "client_id": args.client_id, "law_firm_id": args.law_firm_id,
+        "billing_start_date": args.start, "billing_end_date": args.end,
+        "task_activity_desc": CONFIG['DEFAULT_TASK_ACTIVITY_DESC'], "major_task_codes": CONFIG['MAJOR_TASK_CODES'],
+        "max_daily_hours": args.max_daily_hours, "include_block_billed": args.block_billed,
+        "fee_target_total": args.fee_target_total,
+        "expense_settings": dict(EXPENSE_SETTING_DEFAULTS), "receipt_settings": {**RECEIPT_SETTING_DEFAULTS, "rcpt_format": args.receipt_format},
+        "include_pdf": args.pdf, "pdf_mode": "combined" if args.combined_pdf else "individual", "include_logo": include_logo,
+        "logo_bytes": _get_logo_bytes(None, args.law_firm_id, False) if include_logo else b"",
+        "generate_receipts": args.receipts,
+        "spend_rules": load_rules(args.spend_rules) if args.spend_rules else None,
+        "anomalies": _anomalies(args.anomaly), "sidecar": args.sidecar,
+        "shard_index": args.shard_index, "shard_count": args.shard_count,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.merge_shards:
+        try:
+            manifest = merge_shards(args.merge_shards, args.out)
+        except (OSError, ValueError) as e:
+            print(f"Cannot merge shards: {e}", file=sys.stderr)
+            return 2
+        print(f"Merged {manifest['shard_count']} shard(s), {manifest['total_invoices']} invoice(s) "
+              f"and {manifest['total_lines']} line(s) into {args.out}")
+        return 0
+    if args.start > args.end:
+        print("Billing start date must be before end date.", file=sys.stderr)
+        return 2
+    if args.shard_count > 1 and args.seed is None:
+        print("--shard-count needs a --seed shared by every shard.", file=sys.stderr)
+        return 2
+    if args.resume and args.seed is None:
+        print("--resume needs the --seed of the interrupted run.", file=sys.stderr)
+        return 2
+    if not 0 <= args.shard_index < args.shard_count:
+        print("--shard-index must be between 0 and --shard-count - 1.", file=sys.stderr)
+        return 2
+    try:
+        params = params_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read input: {e}", file=sys.stderr)
+        return 2
+    out_dir = args.out
+    if args.shard_count > 1:
+        out_dir = os.path.join(args.out, shard_dir_name(args.shard_index, args.shard_count))
+    os.makedirs(out_dir, exist_ok=True)
+
+    profiler = RunProfiler(capture_cprofile=args.profile, capture_memory=args.profile)
+    with profiler:
+        result = generate_to_dir(params, out_dir, StageCache(), resume=args.resume, profiler=profiler)
+        if args.shard_count > 1:
+            write_shard_manifest(out_dir, params, result["invoices"], result["files"])
+    try:
+        record_run(profiler, params, result["invoices"], "cli")
+    except sqlite3.Error as e:
+        logging.warning(f"Run metrics not recorded: {e}")
+
+    print(f"Wrote {len(result['files'])} file(s) for {len(result['invoices'])} invoice(s) to {out_dir} "
+          f"in {profiler.wall_s:.2f}s (seed {params['seed']}; {result['skipped']} invoice(s) resumed, "
+          f"{result['deduplicated']} identical file(s) linked)")
+    for row in profiler.summary():
+        print(f"  {row['stage']:<10} {row['wall_s']:8.3f}s wall {row['cpu_s']:8.3f}s cpu "
+              f"{row['calls']:6d} calls {row['cached']:6d} cached {row['lines']:8d} lines  {row['wall_pct']:5.1f}%")
+    for fn in profiler.hot_functions[:10]:
+        print(f"  {fn['self_s']:8.3f}s self {fn['cumulative_s']:8.3f}s cum  {fn['function']}")
+    if args.metrics_json:
+        with open(args.metrics_json, "w", encoding="utf-8") as f:
+            f.write(profiler.to_json())
+    if args.metrics_openmetrics:
+        with open(args.metrics_openmetrics, "w", encoding="utf-8") as f:
+            f.write(profiler.to_openmetrics())
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# --- faker_pool.py (pre-generated fake merchant/person data) ---
+from __future__ import annotations
+import json
+import logging
+import os
+import random
+from functools import lru_cache
+
+from faker import Faker
+
+from ids_store import DATA_DIR
+
+POOL_VERSION = 1
+POOL_CACHE_DIR = os.path.join(DATA_DIR, ".faker_pools")
+DEFAULT_POOL_SIZE = 1000
+_FIELDS = ("company", "address", "phone_number", "name", "first_name")
+
+
+class FakerPool:
+    """Seeded lists of Faker values, sampled with the module RNG.
+
+    Implements the handful of Faker methods the generators call, so it can be passed wherever a
+    Faker instance was. Seeding `random` makes the picks reproducible, as with a seeded Faker.
+    """
+
+    def __init__(self, values: dict[str, list[str]]):
+        missing = [f for f in _FIELDS if not values.get(f)]
+        if missing:
+            raise ValueError(f"Faker pool is missing values for: {', '.join(missing)}")
+        self.values = values
+        self._company, self._address, self._phone, self._name, self._first_name = (values[f] for f in _FIELDS)
+
+    def company(self) -> str:
+        return self._company[random.randrange(len(self._company))]
+
+    def address(self) -> str:
+        return self._address[random.randrange(len(self._address))]
+
+    def phone_number(self) -> str:
+        return self._phone[random.randrange(len(self._phone))]
+
+    def name(self) -> str:
+        return self._name[random.randrange(len(self._name))]
+
+    def first_name(self) -> str:
+        return self._first_name[random.randrange(len(self._first_name))]
+
+    def seed_instance(self, seed=None) -> None:
+        """No-op for Faker compatibility; picks follow the module RNG."""
+
+
+def _generate_values(seed: int, size: int) -> dict[str, list[str]]:
+    fake = Faker()
+    fake.seed_instance(seed)
+    return {field: [getattr(fake, field)() for _ in range(size)] for field in _FIELDS}
+
+
+@lru_cache(maxsize=8)
+def build_faker_pool(seed: int = 0, size: int = DEFAULT_POOL_SIZE, persist: bool = True) -> FakerPool:
+    """Build (or load from the on-disk cache) a pool of `size` values per field."""
+    cache_path = os.path.join(POOL_CACHE_DIR, f"pool_v{POOL_VERSION}_{seed}_{size}.json")
+    if persist and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return FakerPool(json.load(f))
+        except Exception as e:
+            logging.error(f"Ignoring unreadable Faker pool cache {cache_path}: {e}")
+    values = _generate_values(seed, size)
+    if persist:
+        try:
+            os.makedirs(POOL_CACHE_DIR, exist_ok=True)
+            tmp = cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(values, f)
+            os.replace(tmp, cache_path)
+        except Exception as e:
+            logging.error(f"Could not write Faker pool cache: {e}")
+    return FakerPool(values)
@@ -0,0 +1,404 @@
+# --- http_api.py (local HTTP service for programmatic invoice generation) ---
+"""Serve the generation engine over HTTP on localhost (stdlib asyncio, no network access needed).
+
+    python http_api.py --port 8765 --workers 2
+
+POST /generate   JSON body (see params_from_request); returns the zip / LEDES body directly,
+                 or 202 {"job_id": ...} when "async": true. With "dedup": true, byte-identical
+                 files are stored once in the zip and listed in duplicates.json. "spend_rules"
+                 takes a rule set in the spend_rules.py format to inject mandatory lines, and
+                 "anomalies" ({kind: fraction}, see anomalies.py) adds labelled rule violations.
+                 "sidecar": true adds lines.parquet (every line with invoice metadata) to the zip.
+GET  /jobs/<id>  job status; GET /jobs/<id>/result streams the finished body.
+GET  /health
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import datetime as dt
+import itertools
+import json
+import logging
+import sqlite3
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, Tuple
+
+from anomalies import anomaly_fractions
+from batch_manifest import zip_files
+from invoice_engine import (
+    CONFIG, EXPENSE_SETTING_DEFAULTS, ID_PROFILES_STR, RECEIPT_SETTING_DEFAULTS, _calculate_max_fees, _get_logo_bytes, _parse_profiles,
+)
+from invoice_pipeline import StageCache, fingerprint, generate_batch, shortest_period
+from period_planner import CADENCES
+from roster_synth import synthesize_roster
+from run_metrics import record_run
+from run_profiler import RunProfiler
+from spend_rules import compile_rules
+from spill_store import text_data
+
+MAX_BODY_BYTES = 1 << 20
+CHUNK_BYTES = 1 << 16
+FORMATS = ("zip", "ledes")
+
+# Per-process stage memo; generation runs in worker processes because it reseeds the module RNG.
+_stage_cache: StageCache | None = None
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _date(value: Any, field: str) -> dt.date:
+    try:
+        return dt.date.fromisoformat(str(value))
+    except ValueError:
+        raise BadRequest(f"{field} must be an ISO date (YYYY-MM-DD)")
+
+
+def _int(body: Dict[str, Any], field: str, default: int, low: int, high: int | None = None) -> int:
+    value = body.get(field, default)
+    try:
+        if isinstance(value, bool) or float(value) != int(value):
+            raise ValueError
+        value = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{field} must be an integer")
+    if value < low or (high is not None and value > high):
+        raise BadRequest(f"{field} must be {low}-{high}" if high is not None else f"{field} must be at least {low}")
+    return value
+
+
+def _strings(body: Dict[str, Any], field: str, max_items: int) -> list[str]:
+    """body[field] as a list of non-empty strings (missing or null gives [])."""
+    value = body.get(field)
+    if value is None:
+        return []
+    if not (isinstance(value, list) and len(value) <= max_items and all(isinstance(v, str) and v.strip() for v in value)):
+        raise BadRequest(f"{field} must be a list of at most {max_items} non-empty strings")
+    return value
+
+
+def params_from_request(body: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    """Translate a request body into generate_batch params and an output format."""
+    if not isinstance(body, dict):
+        raise BadRequest("Request body must be a JSON object")
+    profiles = {p["environment"]: p for p in _parse_profiles(ID_PROFILES_STR)}
+    profile = body.get("profile")
+    if profile is not None and profile not in profiles:
+        raise BadRequest(f"Unknown profile {profile!r}; expected one of {sorted(profiles)}")
+    defaults = profiles.get(profile) or {"client_id": CONFIG['DEFAULT_CLIENT_ID'], "law_firm_id": CONFIG['DEFAULT_LAW_FIRM_ID']}
+    fmt = body.get("format", "zip")
+    if fmt not in FORMATS:
+        raise BadRequest(f"format must be one of {FORMATS}")
+
+    today = dt.date.today()
+    last_month_end = today.replace(day=1) - dt.timedelta(days=1)
+    start = _date(body.get("start", last_month_end.replace(day=1)), "start")
+    end = _date(body.get("end", last_month_end), "end")
+    if start > end:
+        raise BadRequest("Billing start date must be before end date.")
+    try:
+        num_invoices, fees, expenses = int(body.get("invoices", 1)), int(body.get("fees", 20)), int(body.get("expenses", 10))
+    except (TypeError, ValueError):
+        raise BadRequest("invoices, fees and expenses must be integers")
+    if not 1 <= num_invoices <= 1200 or fees < 0 or expenses < 0:
+        raise BadRequest("invoices must be 1-1200 and counts non-negative")
+
+    timekeepers = body.get("timekeepers")
+    if timekeepers is not None and not (isinstance(timekeepers, list) and all(isinstance(t, dict) for t in timekeepers)):
+        raise BadRequest("timekeepers must be a list of objects")
+    if timekeepers is None and body.get("roster_size") is not None:
+        try:
+            roster_size, roster_seed = int(body["roster_size"]), int(body.get("roster_seed", 0))
+        except (TypeError, ValueError):
+            raise BadRequest("roster_size and roster_seed must be integers")
+        if not 1 <= roster_size <= 50_000:
+            raise BadRequest("roster_size must be 1-50000")
+        timekeepers = synthesize_roster(roster_size, roster_seed)
+    spend_rules = None
+    if body.get("spend_rules") is not None:
+        try:
+            spend_rules = compile_rules(body["spend_rules"])
+        except (TypeError, ValueError) as e:
+            raise BadRequest(f"spend_rules: {e}")
+    try:
+        anomalies = anomaly_fractions(body.get("anomalies"))
+    except (AttributeError, TypeError, ValueError) as e:
+        raise BadRequest(f"anomalies: {e}")
+    descriptions = _strings(body, "descriptions", 1200) or [CONFIG['DEFAULT_INVOICE_DESCRIPTION']]
+    cadence = body.get("cadence", "monthly")
+    if cadence not in CADENCES:
+        raise BadRequest(f"cadence must be one of {sorted(CADENCES)}")
+    fiscal_start_month, period_days = _int(body, "fiscal_start_month", 1, 1, 12), _int(body, "period_days", 30, 1, 366)
+    matters = _strings(body, "matters", 1000)
+    max_daily_hours = _int(body, "max_daily_hours", 16, 1, 24)
+    law_firm_id = body.get("law_firm_id", defaults["law_firm_id"])
+    include_pdf = bool(body.get("pdf", False))
+    include_logo = include_pdf and bool(body.get("logo", True))
+    combine = fmt == "ledes" or bool(body.get("combine", False))
+    params = {
+        "seed": body.get("seed"), "num_invoices": num_invoices,
+        "multiple_periods": bool(body.get("multiple_periods", False)), "combine_ledes": combine,
+        "period_cadence": cadence, "fiscal_start_month": fiscal_start_month,
+        "period_days": period_days,
+        "matters": matters or None, "per_matter_ledes": bool(body.get("per_matter_ledes", False)),
+        "descriptions": descriptions,
+        "invoice_number_base": body.get("invoice_number", "2025MMM-XXXXXX"),
+        "matter_number_base": body.get("matter_number", "2025-XXXXXX"),
+        "fees": fees if timekeepers else 0, "expenses": expenses, "timekeeper_data": timekeepers,
+        "client_id": body.get("client_id", defaults["client_id"]), "law_firm_id": law_firm_id,
+        "billing_start_date": start, "billing_end_date": end,
+        "task_activity_desc": CONFIG['DEFAULT_TASK_ACTIVITY_DESC'], "major_task_codes": CONFIG['MAJOR_TASK_CODES'],
+        "max_daily_hours": max_daily_hours,
+        "include_block_billed": bool(body.get("block_billed", False)),
+        "fee_target_total": body.get("fee_target_total"),
+        "expense_settings": {**EXPENSE_SETTING_DEFAULTS, **(body.get("expense_settings") or {})},
+        "receipt_settings": {**RECEIPT_SETTING_DEFAULTS, **(body.get("receipt_settings") or {})},
+        "mandatory_items": [i for i in body.get("mandatory_items") or [] if i in CONFIG['MANDATORY_ITEMS']],
+        "spend_rules": spend_rules, "anomalies": anomalies,
+        "include_pdf": include_pdf and fmt == "zip", "include_logo": include_logo and fmt == "zip",
+        "pdf_mode": "combined" if body.get("pdf_mode") == "combined" else "individual",
+        "generate_receipts": bool(body.get("receipts", False)) and fmt == "zip",
+        "dedup": bool(body.get("dedup", False)),
+        "sidecar": bool(body.get("sidecar", False)) and fmt == "zip",
+    }
+    if params["fees"]:
+        max_fees = _calculate_max_fees(timekeepers, *shortest_period(params), params["max_daily_hours"])
+        if params["fees"] > max_fees:
+            raise BadRequest(f"fees: at most {max_fees} fee lines fit {len(timekeepers)} timekeepers at "
+                             f"{params['max_daily_hours']}h/day over the shortest billing period")
+    return params, fmt
+
+
+def render_batch(params: Dict[str, Any], fmt: str) -> Tuple[bytes, str, str]:
+    """Run one batch and package it as (body, content type, filename); executed in a worker process."""
+    global _stage_cache
+    if _stage_cache is None:
+        _stage_cache = StageCache()
+    params = dict(params)
+    params["logo_bytes"] = _get_logo_bytes(None, params["law_firm_id"], False) if params["include_logo"] else b""
+    profiler = RunProfiler().start()
+    batch = generate_batch(params, _stage_cache, profiler)
+    if fmt == "ledes":
+        result = batch["combined_ledes"].encode("utf-8"), "text/plain; charset=utf-8", "LEDES_Combined.txt"
+    else:
+        files = batch["attachments"]  # spilled attachments are read back one at a time while zipping
+        if batch["combined_ledes"] is not None:
+            files = itertools.chain([("LEDES_Combined.txt", text_data(batch["combined_ledes"]))], files)
+        with profiler.stage("zip") as stats:
+            result = zip_files(files, params.get("dedup", False)), "application/zip", "invoices.zip"
+            stats.lines += len(batch["attachments"]) + (batch["combined_ledes"] is not None)
+            stats.bytes += len(result[0])
+    try:
+        record_run(profiler.stop(), params, batch["invoices"], "http")
+    except sqlite3.Error as e:
+        logging.warning(f"Run metrics not recorded: {e}")
+    return result
+
+
+class GenerationService:
+    """Runs generation jobs with bounded concurrency and an LRU of results for seeded requests.
+
+    Identical seeded requests (same body apart from "async") produce identical bytes, so they are
+    answered from the cache or attached to the job already computing them.
+    """
+
+    def __init__(self, executor: Executor, max_concurrent: int = 2, max_queued: int = 16, cache_entries: int = 64,
+                 job_entries: int = 256):
+        self.executor = executor
+        self.max_queued = max_queued
+        self.cache_entries = cache_entries
+        self.job_entries = max(job_entries, max_queued)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._pending = 0
+        self._results: OrderedDict[str, Tuple[bytes, str, str]] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.jobs: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+
+    async def _compute(self, params: Dict[str, Any], fmt: str) -> Tuple[bytes, str, str]:
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, render_batch, params, fmt)
+
+    def submit(self, params: Dict[str, Any], fmt: str) -> Tuple[asyncio.Future, bool]:
+        """Return (future of the result, served_from_cache). Raises OverflowError when the queue is full."""
+        loop = asyncio.get_running_loop()
+        seeded = params.get("seed") is not None
+        key = fingerprint(params, fmt) if seeded else None
+        if key in self._results:
+            self._results.move_to_end(key)
+            fut = loop.create_future()
+            fut.set_result(self._results[key])
+            return fut, True
+        if key in self._inflight:
+            return self._inflight[key], True
+        if self._pending >= self.max_queued:
+            raise OverflowError("Too many generation requests in progress")
+        if not seeded:
+            params = {**params, "seed": uuid.uuid4().int % 1_000_000}
+        self._pending += 1
+        fut = asyncio.ensure_future(self._compute(params, fmt))
+
+        def done(f: asyncio.Future) -> None:
+            self._pending -= 1
+            if key is None:
+                return
+            self._inflight.pop(key, None)
+            if not f.cancelled() and f.exception() is None:
+                self._results[key] = f.result()
+                while len(self._results) > self.cache_entries:
+                    self._results.popitem(last=False)
+
+        fut.add_done_callback(done)
+        if key is not None:
+            self._inflight[key] = fut
+        return fut, False
+
+    def start_job(self, fut: asyncio.Future) -> str:
+        """Track fut as an async job; beyond job_entries the oldest finished jobs (and their results) are forgotten."""
+        job_id = uuid.uuid4().hex
+        job = self.jobs[job_id] = {"status": "running", "future": fut}
+        finished = [k for k, j in self.jobs.items() if j["status"] != "running"]
+        for old_id in finished[:max(0, len(self.jobs) - self.job_entries)]:
+            del self.jobs[old_id]
+
+        def done(f: asyncio.Future) -> None:
+            if f.cancelled() or f.exception() is not None:
+                job.update(status="failed", error="cancelled" if f.cancelled() else str(f.exception()))
+            else:
+                job["status"] = "done"
+
+        fut.add_done_callback(done)
+        return job_id
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    method, path, _ = request_line.split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise BadRequest("Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, body
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str = "application/json",
+                   extra_headers: Dict[str, str] | None = None) -> None:
+    reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 429: "Too Many Requests", 500: "Internal Server Error"}
+    head = [f"HTTP/1.1 {status} {reasons.get(status, '')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", "Connection: close"]
+    head += [f"{k}: {v}" for k, v in (extra_headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+    view = memoryview(body)
+    for offset in range(0, len(body), CHUNK_BYTES):
+        writer.write(view[offset:offset + CHUNK_BYTES])
+        await writer.drain()
+    await writer.drain()
+
+
+def _json(payload: Any) -> bytes:
+    return json.dumps(payload).encode("utf-8")
+
+
+async def _send_result(writer: asyncio.StreamWriter, result: Tuple[bytes, str, str], cached: bool) -> None:
+    data, content_type, filename = result
+    await _respond(writer, 200, data, content_type, {
+        "Content-Disposition": f'attachment; filename="{filename}"', "X-Cache": "hit" if cached else "miss",
+    })
+
+
+async def handle(service: GenerationService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        try:
+            method, path, raw = await _read_request(reader)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await _respond(writer, 400, _json({"error": str(e) or "Malformed request"}))
+            return
+        if path == "/health":
+            await _respond(writer, 200, _json({"status": "ok"}))
+        elif path == "/generate":
+            if method != "POST":
+                await _respond(writer, 405, _json({"error": "Use POST"}))
+                return
+            try:
+                body = json.loads(raw or b"{}")
+                params, fmt = params_from_request(body)
+                fut, cached = service.submit(params, fmt)
+            except (BadRequest, json.JSONDecodeError) as e:
+                await _respond(writer, 400, _json({"error": str(e)}))
+                return
+            except OverflowError as e:
+                await _respond(writer, 429, _json({"error": str(e)}), extra_headers={"Retry-After": "1"})
+                return
+            if body.get("async"):
+                await _respond(writer, 202, _json({"job_id": service.start_job(fut)}))
+                return
+            try:
+                result = await asyncio.shield(fut)
+            except ValueError as e:
+                # The generators reject settings they cannot satisfy (e.g. more fee lines than hours allow)
+                await _respond(writer, 400, _json({"error": str(e)}))
+                return
+            except Exception as e:
+                logging.exception("Generation failed")
+                await _respond(writer, 500, _json({"error": str(e)}))
+                return
+            await _send_result(writer, result, cached)
+        elif path.startswith("/jobs/"):
+            job_id, _, tail = path[len("/jobs/"):].partition("/")
+            job = service.jobs.get(job_id)
+            if job is None:
+                await _respond(writer, 404, _json({"error": "Unknown job"}))
+            elif tail == "result":
+                if job["status"] != "done":
+                    await _respond(writer, 409, _json({"status": job["status"], "error": job.get("error")}))
+                else:
+                    await _send_result(writer, job["future"].result(), False)
+            else:
+                await _respond(writer, 200, _json({"job_id": job_id, "status": job["status"], "error": job.get("error")}))
+        else:
+            await _respond(writer, 404, _json({"error": "Not found"}))
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = 2, max_queued: int = 16,
+                executor: Executor | None = None, ready: asyncio.Future | None = None) -> None:
+    """Run the service until cancelled; `ready` (if given) receives the bound port."""
+    executor = executor or ProcessPoolExecutor(max_workers=workers)
+    service = GenerationService(executor, max_concurrent=workers, max_queued=max_queued)
+    server = await asyncio.start_server(lambda r, w: handle(service, r, w), host, port)
+    if ready is not None:
+        ready.set_result(server.sockets[0].getsockname()[1])
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    p = argparse.ArgumentParser(description="Local HTTP API for LEDES invoice generation.")
+    p.add_argument("--host", default="127.0.0.1", help="Bind address (keep on localhost)")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--workers", type=int, default=2, help="Concurrent generation processes")
+    p.add_argument("--max-queued", type=int, default=16, help="Reject with 429 beyond this many outstanding jobs")
+    args = p.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Serving on http://{args.host}:{args.port}")
+    asyncio.run(serve(args.host, args.port, args.workers, args.max_queued))
+
+
+if __name__ == "__main__":
+    main()
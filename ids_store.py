@@ -1,19 +1,25 @@
 # --- ids_store.py (Cloud-ready) ---
-import sqlite3, contextlib, os, tempfile
+"""Saved client / law firm IDs and defaults in app_data.db, shared by the app, CLI, HTTP API and their workers.
 
-# Prefer the app folder if writable; else /tmp in Streamlit Cloud
-base_dir = os.path.dirname(__file__)
-try:
-    test = os.path.join(base_dir, ".write_test")
-    open(test, "w").close(); os.remove(test)
-    DATA_DIR = base_dir
-except Exception:
-    DATA_DIR = tempfile.gettempdir()
+The database lives in $LEDES_DATA_DIR (default: the app folder), or exactly at $LEDES_DB_PATH; an
+unwritable location is an error naming those variables. Many processes may use it at once: it runs
+in WAL mode so readers never wait for the writer, every write is one BEGIN IMMEDIATE transaction
+(the write lock is taken up front, so a transaction never fails halfway on a lock upgrade), sqlite
+waits BUSY_TIMEOUT_S for the lock, and a writer that still finds it busy backs off and retries.
+"""
+import sqlite3, contextlib, os, random, time
+
+DATA_DIR = os.environ.get("LEDES_DATA_DIR") or os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get("LEDES_DB_PATH") or os.path.join(DATA_DIR, "app_data.db")
+
+BUSY_TIMEOUT_S = 10.0  # sqlite's own wait for a lock
+RETRIES = 5            # further attempts once that wait runs out
+busy_retries = 0       # attempts retried by this process (see ids_store_bench.py)
 
-DB_PATH = os.path.join(DATA_DIR, "app_data.db")
+_jitter = random.Random()  # not the module RNG, which seeded generation relies on
+_ready = set()             # (db path, schema) pairs this process has already created
 
 SCHEMA = """
-PRAGMA journal_mode=WAL;
 CREATE TABLE IF NOT EXISTS entity_ids (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   entity_type TEXT CHECK(entity_type IN ('client','law_firm')) NOT NULL,
@@ -29,18 +35,73 @@ CREATE TABLE IF NOT EXISTS defaults (
 );
 """
 
+def _is_busy(e):
+  return "locked" in str(e) or "busy" in str(e)
+
+def _with_retry(conn, fn, rollback=True):
+  """fn(), retried with jittered exponential backoff while the database is busy.
+
+  With rollback, a transaction fn left open is rolled back before retrying (fn starts one); without
+  it the transaction is kept (a busy COMMIT leaves it open, and retrying the COMMIT completes it)."""
+  global busy_retries
+  for attempt in range(RETRIES + 1):
+    try:
+      return fn()
+    except sqlite3.OperationalError as e:
+      if rollback and conn.in_transaction:
+        conn.execute("ROLLBACK")
+      if attempt == RETRIES or not _is_busy(e):
+        raise
+      busy_retries += 1
+      time.sleep(_jitter.uniform(0, min(2.0, 0.05 * 2 ** attempt)))
+
+def connect(db_path=None):
+  """Autocommit connection (transactions are explicit) with the busy timeout set."""
+  path = db_path or DB_PATH
+  try:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+  except sqlite3.OperationalError as e:
+    raise sqlite3.OperationalError(f"Cannot open {path}: {e}. Set LEDES_DATA_DIR or LEDES_DB_PATH to a writable location.") from e
+  conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL: a crash can lose the last commits, never corrupt
+  return conn
+
 @contextlib.contextmanager
-def get_conn():
-  conn = sqlite3.connect(DB_PATH)
+def get_conn(write=False, db_path=None):
+  """A connection; with write, inside a BEGIN IMMEDIATE transaction committed on exit (rolled back on error).
+
+  Taking the lock and committing are retried, never the block itself, so a write block runs once; keep it
+  to statements, with no other I/O. A COMMIT that stays busy through every retry rolls the block back."""
+  conn = connect(db_path)
   try:
-    yield conn
+    if write:
+      _with_retry(conn, lambda: conn.execute("BEGIN IMMEDIATE"))
+      try:
+        yield conn
+        _with_retry(conn, lambda: conn.execute("COMMIT"), rollback=False)
+      except BaseException:
+        if conn.in_transaction:
+          conn.execute("ROLLBACK")
+        raise
+    else:
+      yield conn
   finally:
-    conn.commit()
     conn.close()
 
+def ensure_schema(schema, db_path=None):
+  """Switch the database to WAL and run schema (CREATE ... IF NOT EXISTS statements), once per process."""
+  key = (os.path.abspath(db_path or DB_PATH), schema)
+  if key in _ready:
+    return
+  conn = connect(db_path)
+  try:
+    _with_retry(conn, lambda: conn.execute("PRAGMA journal_mode=WAL"))
+    _with_retry(conn, lambda: conn.executescript(f"BEGIN IMMEDIATE;\n{schema}\nCOMMIT;"))
+  finally:
+    conn.close()
+  _ready.add(key)
+
 def init_db():
-  with get_conn() as c:
-    c.executescript(SCHEMA)
+  ensure_schema(SCHEMA)
 
 def list_envs(entity_type):
   with get_conn() as c:
@@ -61,28 +122,36 @@ def fetch_entities(entity_type, environment=None):
     rows = c.execute(q, args).fetchall()
   return [{"row_id":r[0], "name":r[1], "ext_id":r[2], "environment":r[3]} for r in rows]
 
-def upsert_entity(entity_type, name, ext_id, environment, row_id=None):
-  with get_conn() as c:
-    if row_id:
-      c.execute(
-        "UPDATE entity_ids SET name=?, ext_id=?, environment=? WHERE id=? AND entity_type=?",
-        (name, ext_id, environment, row_id, entity_type)
-      )
-      return row_id
-    cur = c.execute(
-        "INSERT OR IGNORE INTO entity_ids (entity_type,name,ext_id,environment) VALUES (?,?,?,?)",
-        (entity_type, name, ext_id, environment)
+def _upsert(c, entity_type, name, ext_id, environment, row_id=None):
+  if row_id:
+    c.execute(
+      "UPDATE entity_ids SET name=?, ext_id=?, environment=? WHERE id=? AND entity_type=?",
+      (name, ext_id, environment, row_id, entity_type)
     )
-    if cur.rowcount == 0:
-      got = c.execute(
-        "SELECT id FROM entity_ids WHERE entity_type=? AND ext_id=? AND environment=?",
-        (entity_type, ext_id, environment)
-      ).fetchone()
-      return got[0]
-    return cur.lastrowid
+    return row_id
+  cur = c.execute(
+      "INSERT OR IGNORE INTO entity_ids (entity_type,name,ext_id,environment) VALUES (?,?,?,?)",
+      (entity_type, name, ext_id, environment)
+  )
+  if cur.rowcount == 0:
+    got = c.execute(
+      "SELECT id FROM entity_ids WHERE entity_type=? AND ext_id=? AND environment=?",
+      (entity_type, ext_id, environment)
+    ).fetchone()
+    return got[0]
+  return cur.lastrowid
+
+def upsert_entity(entity_type, name, ext_id, environment, row_id=None):
+  with get_conn(write=True) as c:
+    return _upsert(c, entity_type, name, ext_id, environment, row_id)
+
+def upsert_entities(entity_type, entities):
+  """Insert or update many (name, ext_id, environment[, row_id]) entries in one transaction; returns their row ids."""
+  with get_conn(write=True) as c:
+    return [_upsert(c, entity_type, *e) for e in entities]
 
 def delete_entity(row_id):
-  with get_conn() as c:
+  with get_conn(write=True) as c:
     c.execute("DELETE FROM entity_ids WHERE id=?", (row_id,))
 
 def get_default(key):
@@ -91,5 +160,5 @@ def get_default(key):
   return row[0] if row else None
 
 def set_default(key, row_id):
-  with get_conn() as c:
+  with get_conn(write=True) as c:
     c.execute("INSERT INTO defaults(key,entity_row_id) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET entity_row_id=excluded.entity_row_id", (key, row_id))
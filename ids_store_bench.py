@@ -0,0 +1,96 @@
+# --- ids_store_bench.py (ids_store under multi-process contention) ---
+"""Hammer one ids_store database from many local processes at once.
+
+Example:
+    python ids_store_bench.py --processes 16 --writes 200 --batch 20
+    python ids_store_bench.py --processes 16 --writes 200 --legacy   # the old per-call connection, for comparison
+
+Every process upserts its own entities (one transaction per --batch entries) and reads the
+default law firm after each transaction, all starting together. Reports
+throughput, busy retries and failed operations; the database must end up holding every write.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict
+
+import ids_store
+
+
+def _legacy_upsert(db_path: str, entity_type: str, name: str, ext_id: str, environment: str) -> None:
+    """upsert_entity as it was: default 5 s timeout, implicit deferred transaction, commit per row."""
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.execute("INSERT OR IGNORE INTO entity_ids (entity_type,name,ext_id,environment) VALUES (?,?,?,?)",
+                           (entity_type, name, ext_id, environment))
+        if cur.rowcount == 0:
+            conn.execute("SELECT id FROM entity_ids WHERE entity_type=? AND ext_id=? AND environment=?",
+                         (entity_type, ext_id, environment)).fetchone()
+    finally:
+        conn.commit()
+        conn.close()
+
+
+def _worker(db_path: str, worker: int, writes: int, batch: int, legacy: bool, start_at: float) -> Dict[str, Any]:
+    ids_store.DB_PATH = db_path
+    entities = [(f"Bench Firm {worker}-{n}", f"B{worker:03d}-{n:05d}", "Bench") for n in range(writes)]
+    failed = 0
+    time.sleep(max(0.0, start_at - time.time()))
+    t0 = time.perf_counter()
+    for n in range(0, writes, batch):
+        chunk = entities[n:n + batch]
+        try:
+            if legacy:
+                for entity in chunk:
+                    _legacy_upsert(db_path, "law_firm", *entity)
+                with contextlib.closing(sqlite3.connect(db_path)) as conn:
+                    conn.execute("SELECT entity_row_id FROM defaults WHERE key=?", ("law_firm_default",)).fetchone()
+            else:
+                ids_store.upsert_entities("law_firm", chunk)
+                ids_store.get_default("law_firm_default")
+        except sqlite3.OperationalError:
+            failed += len(chunk)
+    return {"seconds": time.perf_counter() - t0, "failed": failed, "retries": ids_store.busy_retries}
+
+
+def run(db_path: str, processes: int, writes: int, batch: int, legacy: bool = False) -> Dict[str, Any]:
+    """Run the benchmark against db_path (created if missing) and return its totals."""
+    ids_store.ensure_schema(ids_store.SCHEMA, db_path)
+    with ids_store.get_conn(write=True, db_path=db_path) as conn:
+        conn.execute("DELETE FROM entity_ids WHERE environment='Bench'")
+    start_at = time.time() + 1.0 + 0.1 * processes  # after every worker process has started
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(_worker, [db_path] * processes, range(processes), [writes] * processes,
+                                [batch] * processes, [legacy] * processes, [start_at] * processes))
+    with ids_store.get_conn(db_path=db_path) as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM entity_ids WHERE environment='Bench'").fetchone()[0]
+    wall = max(r["seconds"] for r in results)
+    return {"processes": processes, "writes": processes * writes, "stored": stored, "wall_s": wall,
+            "writes_per_s": stored / wall if wall else 0.0, "failed": sum(r["failed"] for r in results),
+            "retries": sum(r["retries"] for r in results)}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--writes", type=int, default=200, help="entities upserted per process")
+    parser.add_argument("--batch", type=int, default=20, help="entities per write transaction")
+    parser.add_argument("--legacy", action="store_true", help="one implicit transaction per entity with default timeouts")
+    parser.add_argument("--db", help="database to use (default: a temporary file)")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run(args.db or os.path.join(tmp, "bench.db"), args.processes, args.writes, max(1, args.batch), args.legacy)
+    print(f"{result['processes']} processes: {result['stored']}/{result['writes']} writes stored in {result['wall_s']:.2f}s "
+          f"({result['writes_per_s']:.0f}/s), {result['failed']} failed, {result['retries']} busy retries")
+    return 0 if result["failed"] == 0 and result["stored"] == result["writes"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
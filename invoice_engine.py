@@ -0,0 +1,1174 @@
+# --- invoice_engine.py (line-item generation and invoice rendering, no Streamlit widgets) ---
+from __future__ import annotations
+import pandas as pd
+import random
+import datetime as dt
+import heapq
+import io
+import os
+import logging
+import re
+
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterable, Iterator
+from faker import Faker
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable, PageBreak, SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
+from PIL import Image as PILImage, ImageDraw, ImageFont
+from faker_pool import FakerPool
+from logo_registry import SUPPORTED_FORMATS, image_format, logo_from_file, normalized_logo, placeholder_logo
+from ledes_ingest import sample_expense, sample_task_activity
+from line_dates import ISO_FORMAT, LEDES_FORMAT, DateCache, to_date
+from money import format_cents, from_cents, line_cents, split_cents, to_cents, total_cents
+
+# --- Tax rules ---
+TAX_EXEMPT = {
+    "E110","E109","E108","E120","E122","E118","E121","E119","E112","E113","E114"
+}
+DEFAULT_TAX_RATE = 0.085
+
+# Fallbacks (bad logo, unrenderable image) are logged here; the app shows them as warnings
+logger = logging.getLogger(__name__)
+
+# --- Constants ---
+CONFIG = {
+    'EXPENSE_CODES': {
+        "Copying": "E101", "Outside printing": "E102", "Word processing": "E103",
+        "Facsimile": "E104", "Telephone": "E105", "Online research": "E106",
+        "Delivery services/messengers": "E107", "Postage": "E108", "Local travel": "E109",
+        "Out-of-town travel": "E110", "Meals": "E111", "Court fees": "E112",
+        "Subpoena fees": "E113", "Witness fees": "E114", "Deposition transcripts": "E115",
+        "Trial transcripts": "E116", "Trial exhibits": "E117",
+        "Litigation support vendors": "E118", "Experts": "E119",
+        "Private investigators": "E120", "Arbitrators/mediators": "E121",
+        "Local counsel": "E122", "Other professionals": "E123", "Other": "E124",
+    },
+    'DEFAULT_TASK_ACTIVITY_DESC': [
+        ("L100", "A101", "Legal Research: Analyze legal precedents"),
+        ("L110", "A101", "Legal Research: Review statutes and regulations"),
+        ("L120", "A101", "Legal Research: Draft research memorandum"),
+        ("L130", "A102", "Case Assessment: Initial case evaluation"),
+        ("L140", "A102", "Case Assessment: Develop case strategy"),
+        ("L150", "A102", "Case Assessment: Identify key legal issues"),
+        ("L160", "A103", "Fact Investigation: Interview witnesses"),
+        ("L190", "A104", "Pleadings: Draft complaint/petition"),
+        ("L200", "A104", "Pleadings: Prepare answer/response"),
+        ("L210", "A104", "Pleadings: File motion to dismiss"),
+        ("L220", "A105", "Discovery: Draft interrogatories"),
+        ("L230", "A105", "Discovery: Prepare requests for production"),
+        ("L240", "A105", "Discovery: Review opposing party's discovery responses"),
+        ("L250", "A106", "Depositions: Prepare for deposition"),
+        ("L260", "A106", "Depositions: Attend deposition"),
+        ("L300", "A107", "Motions: Argue motion in court"),
+        ("L310", "A108", "Settlement/Mediation: Prepare for mediation"),
+        ("L320", "A108", "Settlement/Mediation: Attend mediation"),
+        ("L330", "A108", "Settlement/Mediation: Draft settlement agreement"),
+        ("L340", "A109", "Trial Preparation: Prepare witness for trial"),
+        ("L350", "A109", "Trial Preparation: Organize trial exhibits"),
+        ("L390", "A110", "Trial: Present closing argument"),
+        ("L400", "A111", "Appeals: Research appellate issues"),
+        ("L410", "A111", "Appeals: Draft appellate brief"),
+        ("L420", "A111", "Appeals: Argue before appellate court"),
+        ("L430", "A112", "Client Communication: Client meeting"),
+        ("L440", "A112", "Client Communication: Phone call with client"),
+        ("L450", "A112", "Client Communication: Email correspondence with client"),
+    ],
+    'FEE_SLIDER_MAX': 200,  # above this many fee lines the UI takes a typed count instead of a slider
+    'MAJOR_TASK_CODES': {"L110", "L120", "L130", "L140", "L150", "L160", "L170", "L180", "L190"},
+    'DEFAULT_CLIENT_ID': "02-4388252",
+    'DEFAULT_LAW_FIRM_ID': "02-1234567",
+    'DEFAULT_INVOICE_DESCRIPTION': "Monthly Legal Services",
+    'MANDATORY_ITEMS': {
+        'KBCG': {
+            'desc': ("Commenced data entry into the KBCG e-licensing portal for Piers Walter Vermont "
+                     "form 1005 application; Drafted deficiency notice to send to client re: same; "
+                     "Scheduled follow-up call with client to review application status and address outstanding deficiencies."),
+            'tk_name': "Tom Delaganis",
+            'task': "L140",
+            'activity': "A107",
+            'is_expense': False
+        },
+        'John Doe': {
+            'desc': ("Reviewed and summarized deposition transcript of John Doe; prepared exhibit index; "
+                     "updated case chronology spreadsheet for attorney review"),
+            'tk_name': "Ryan Kinsey",
+            'task': "L120",
+            'activity': "A102",
+            'is_expense': False
+        },
+        'Uber E110': {
+            'desc': "10-mile Uber ride to client's office",
+            'expense_code': "E110",
+            'is_expense': True
+        },
+    }
+}
+
+# ---------- Static Billing ID Profiles (edit in code) ----------
+ID_PROFILES_STR = """
+Onit ELM|A Onit Inc.|02-4388252|Nelson and Murdock|02-1234567,
+SimpleLegal|Penguin LLC|C004|JDL|JDL001,
+Unity|Unity Demo|uniti-demo|Gold USD|Gold USD
+""".strip()
+
+def _parse_profiles(s: str) -> list[Dict[str, str]]:
+    out = []
+    for raw in [chunk.strip() for chunk in s.split(",") if chunk.strip()]:
+        parts = [p.strip() for p in raw.split("|")]
+        if len(parts) != 5:
+            continue
+        env, c_name, c_id, lf_name, lf_id = parts
+        out.append({
+            "environment": env,
+            "client_name": c_name,
+            "client_id": c_id,
+            "law_firm_name": lf_name,
+            "law_firm_id": lf_id,
+        })
+    return out
+
+EXPENSE_DESCRIPTIONS = list(CONFIG['EXPENSE_CODES'].keys())
+OTHER_EXPENSE_DESCRIPTIONS = [desc for desc in EXPENSE_DESCRIPTIONS if CONFIG['EXPENSE_CODES'][desc] != "E101"]
+
+# --- Widget-backed settings (session_state keys -> defaults) ---
+EXPENSE_SETTING_DEFAULTS = {
+    "mileage_rate_e109": 0.65,
+    "travel_range_e110": (100.0, 800.0),
+    "telephone_range_e105": (5.0, 15.0),
+    "copying_rate_e101": 0.24,
+}
+RECEIPT_SETTING_DEFAULTS = {
+    "rcpt_scale": 1.0, "rcpt_line_weight": 1, "rcpt_dashed": False,
+    "rcpt_show_policy_travel": True, "rcpt_show_policy_meal": True, "rcpt_show_policy_mileage": True,
+    "rcpt_show_policy_supplies": True, "rcpt_show_policy_generic": True,
+    "rcpt_travel_carrier": "", "rcpt_travel_flight": "", "rcpt_travel_seat": "", "rcpt_travel_fare": "",
+    "rcpt_travel_from": "", "rcpt_travel_to": "", "rcpt_travel_autogen": True,
+    "rcpt_meal_table": "", "rcpt_meal_server": "", "rcpt_meal_show_cashier": True,
+    "rcpt_format": "png",
+}
+
+def _settings_from_state(defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """Read the given widget keys from session_state, falling back to defaults outside a session."""
+    try:
+        import streamlit as st
+        return {k: st.session_state.get(k, v) for k, v in defaults.items()}
+    except Exception:
+        return dict(defaults)
+
+def _expense_settings_from_state() -> Dict[str, Any]:
+    return _settings_from_state(EXPENSE_SETTING_DEFAULTS)
+
+def _receipt_settings_from_state() -> Dict[str, Any]:
+    return _settings_from_state(RECEIPT_SETTING_DEFAULTS)
+
+# --- Helper Functions ---
+
+# --- Utility: compute a safe upper bound for expense lines ---
+def _calculate_max_expenses(billing_start_date=None, billing_end_date=None, num_days=None, config=None):
+    try:
+        if num_days is None:
+            start = billing_start_date
+            end = billing_end_date or billing_start_date
+            if isinstance(start, dt.datetime):
+                start = start.date()
+            if isinstance(end, dt.datetime):
+                end = end.date()
+            if isinstance(start, dt.date) and isinstance(end, dt.date):
+                nd = (end - start).days + 1
+            else:
+                nd = 1
+        else:
+            nd = int(num_days)
+    except Exception:
+        nd = 1
+    nd = max(1, int(nd))
+    cap = int((config or {}).get('expense_lines_cap', 120))
+    # heuristic: up to 6 expense lines per day, clamped by cap
+    return max(1, min(cap, nd * 6))
+
+
+def _process_description(description: str, faker_instance: Faker | FakerPool) -> str:
+    """Process description by replacing placeholders and dates."""
+    pattern = r"\b(\d{2}/\d{2}/\d{4})\b"
+    if re.search(pattern, description):
+        days_ago = random.randint(15, 90)
+        new_date = (dt.date.today() - dt.timedelta(days=days_ago)).strftime("%m/%d/%Y")
+        description = re.sub(pattern, new_date, description)
+    if "{NAME_PLACEHOLDER}" in description:
+        description = description.replace("{NAME_PLACEHOLDER}", faker_instance.name())
+    return description
+
+def _is_valid_client_id(client_id: str) -> bool:
+    """Client ID is considered valid if it is a non-empty string."""
+    return bool(str(client_id).strip())
+
+def _is_valid_law_firm_id(law_firm_id: str) -> bool:
+    """Law Firm ID is considered valid if it is a non-empty string."""
+    return bool(str(law_firm_id).strip())
+
+def _fee_capacity(num_timekeepers: int, num_days: int, max_daily_hours: float) -> int:
+    """Most fee lines _allocate_fee_slots can place: every timekeeper-day filled with 0.1h lines."""
+    return num_timekeepers * num_days * int(round(float(max_daily_hours) * 10))
+
+def _calculate_max_fees(timekeeper_data: list[Dict | None], billing_start_date: dt.date, billing_end_date: dt.date, max_daily_hours: float) -> int:
+    """Maximum fee lines _allocate_fee_slots accepts for the timekeepers over the billing period."""
+    if not timekeeper_data:
+        return 1
+    num_days = max(1, (billing_end_date - billing_start_date).days + 1)
+    return max(1, _fee_capacity(len(timekeeper_data), num_days, max_daily_hours))
+
+def _create_ledes_line_1998b(row: Dict, line_no: int, inv_total: float | str, bill_start: dt.date, bill_end: dt.date, invoice_number: str, matter_number: str, dates: DateCache | None = None) -> list[str]:
+    """Create a single LEDES 1998B line; `dates` is the invoice's LEDES DateCache and inv_total may come
+    preformatted. Raises ValueError for a malformed row."""
+    if dates is None:
+        dates = DateCache(LEDES_FORMAT)
+    try:
+        line_date = dates[row["LINE_ITEM_DATE"]]
+        hours = float(row["HOURS"])
+        rate = format_cents(to_cents(row["RATE"]))
+        line_total = format_cents(to_cents(row["LINE_ITEM_TOTAL"]))
+        is_expense = bool(row["EXPENSE_CODE"])
+        adj_type = "E" if is_expense else "F"
+        task_code = "" if is_expense else row.get("TASK_CODE", "")
+        activity_code = "" if is_expense else row.get("ACTIVITY_CODE", "")
+        expense_code = row.get("EXPENSE_CODE", "") if is_expense else ""
+        timekeeper_id = "" if is_expense else row.get("TIMEKEEPER_ID", "")
+        timekeeper_class = "" if is_expense else row.get("TIMEKEEPER_CLASSIFICATION", "")
+        timekeeper_name = "" if is_expense else row.get("TIMEKEEPER_NAME", "")
+        description = str(row.get("DESCRIPTION", "")).replace("|", " - ")
+        return [
+            dates[bill_end],
+            invoice_number,
+            str(row.get("CLIENT_ID", "")),
+            matter_number,
+            inv_total if isinstance(inv_total, str) else format_cents(to_cents(inv_total)),
+            dates[bill_start],
+            dates[bill_end],
+            str(row.get("INVOICE_DESCRIPTION", "")),
+            str(line_no),
+            adj_type,
+            f"{hours:.1f}" if adj_type == "F" else f"{int(hours)}",
+            "0.00",
+            line_total,
+            line_date,
+            task_code,
+            expense_code,
+            activity_code,
+            timekeeper_id,
+            description,
+            str(row.get("LAW_FIRM_ID", "")),
+            rate,
+            timekeeper_name,
+            timekeeper_class,
+            matter_number
+        ]
+    except (KeyError, TypeError, ValueError) as e:
+        # A line that cannot be written must not silently disappear from the invoice
+        raise ValueError(f"Invoice {invoice_number} line {line_no} cannot be written as LEDES: {e!r}") from e
+
+def _create_ledes_1998b_content(rows: list[Dict], inv_total: float, bill_start: dt.date, bill_end: dt.date, invoice_number: str, matter_number: str, is_first_invoice: bool = True) -> str:
+    """Generate LEDES 1998B content from invoice rows."""
+    lines = []
+    if is_first_invoice:
+        header = "LEDES1998B[]"
+        fields = ("INVOICE_DATE|INVOICE_NUMBER|CLIENT_ID|LAW_FIRM_MATTER_ID|INVOICE_TOTAL|BILLING_START_DATE|"
+                  "BILLING_END_DATE|INVOICE_DESCRIPTION|LINE_ITEM_NUMBER|EXP/FEE/INV_ADJ_TYPE|"
+                  "LINE_ITEM_NUMBER_OF_UNITS|LINE_ITEM_ADJUSTMENT_AMOUNT|LINE_ITEM_TOTAL|LINE_ITEM_DATE|"
+                  "LINE_ITEM_TASK_CODE|LINE_ITEM_EXPENSE_CODE|LINE_ITEM_ACTIVITY_CODE|TIMEKEEPER_ID|"
+                  "LINE_ITEM_DESCRIPTION|LAW_FIRM_ID|LINE_ITEM_UNIT_COST|TIMEKEEPER_NAME|"
+                  "TIMEKEEPER_CLASSIFICATION|CLIENT_MATTER_ID[]")
+        lines = [header, fields]
+    dates, inv_total_text = DateCache(LEDES_FORMAT), format_cents(to_cents(inv_total))
+    for i, row in enumerate(rows, start=1):
+        line = _create_ledes_line_1998b(row, i, inv_total_text, bill_start, bill_end, invoice_number, matter_number, dates)
+        lines.append("|".join(map(str, line)) + "[]")
+    return "\n".join(lines)
+
+def _allocate_fee_slots(fee_count: int, timekeeper_data: list[Dict], num_days: int, max_hours_per_tk_per_day: float, target_total: float | None = None) -> list[tuple[Dict, int, float]]:
+    """Plan exactly fee_count (timekeeper, day_offset, hours) slots within each timekeeper's daily cap.
+
+    Every (timekeeper, day) pair is a bucket holding as many lines as its capacity allows at the
+    minimum line size (0.5h, or 0.1h when the requested count needs it). Lines are dealt to open
+    buckets uniformly at random and full buckets are swap-removed, so there is no rejection loop.
+    Hours are then drawn inside each bucket's remaining capacity. With target_total, hours are
+    scaled and topped up (highest rate first, via a heap) to land as close to the target as the
+    0.1h granularity allows without exceeding it. Runs in O(n log n).
+    """
+    if fee_count <= 0 or not timekeeper_data:
+        return []
+    cap_t = int(round(float(max_hours_per_tk_per_day) * 10))  # capacity in tenths of an hour
+    line_max_t = min(80, cap_t)
+    num_buckets = len(timekeeper_data) * num_days
+    capacity = _fee_capacity(len(timekeeper_data), num_days, max_hours_per_tk_per_day)
+    if capacity < fee_count:
+        raise ValueError(f"{fee_count} fee lines exceed the capacity of {len(timekeeper_data)} timekeepers over "
+                         f"{num_days} days at {max_hours_per_tk_per_day}h/day (max {capacity}).")
+    min_t = 5 if num_buckets * (cap_t // 5) >= fee_count else 1
+    per_bucket = cap_t // min_t
+
+    # Deal lines to buckets
+    open_buckets = list(range(num_buckets))
+    bucket_lines: Dict[int, list[int]] = {}
+    line_bucket = []
+    for line in range(fee_count):
+        j = random.randrange(len(open_buckets))
+        b = open_buckets[j]
+        lines = bucket_lines.setdefault(b, [])
+        lines.append(line)
+        if len(lines) == per_bucket:
+            open_buckets[j] = open_buckets[-1]
+            open_buckets.pop()
+        line_bucket.append(b)
+
+    # Draw hours (in tenths) inside each bucket, reserving the minimum for lines still to come
+    hours_t = [min_t] * fee_count
+    bucket_free: Dict[int, int] = {}
+    for b, lines in bucket_lines.items():
+        free = cap_t - len(lines) * min_t
+        for line in lines:
+            extra = random.randint(0, min(line_max_t - min_t, free))
+            hours_t[line] += extra
+            free -= extra
+        bucket_free[b] = free
+
+    rates_c = [int(round(float(timekeeper_data[b // num_days]["RATE"]) * 100)) for b in line_bucket]
+    if target_total is not None:
+        target_c = int(round(float(target_total) * 100))
+        floor_c = sum(min_t * r for r in rates_c) / 10
+        current_c = sum(h * r for h, r in zip(hours_t, rates_c)) / 10
+        if current_c > floor_c:
+            scale = max(0.0, (target_c - floor_c) / (current_c - floor_c))
+            bucket_free = {b: cap_t for b in bucket_lines}
+            for line, b in enumerate(line_bucket):
+                bucket_free[b] -= min_t
+            for line, b in enumerate(line_bucket):
+                extra = min(int((hours_t[line] - min_t) * scale), line_max_t - min_t, bucket_free[b])
+                hours_t[line] = min_t + extra
+                bucket_free[b] -= extra
+        residual_c = target_c - sum(h * r for h, r in zip(hours_t, rates_c)) / 10
+        heap = [(-r, line) for line, r in enumerate(rates_c)]
+        heapq.heapify(heap)
+        while heap and residual_c > 0:
+            neg_r, line = heapq.heappop(heap)
+            step_c = -neg_r / 10
+            room = min(line_max_t - hours_t[line], bucket_free[line_bucket[line]])
+            add = min(room, int(residual_c // step_c)) if step_c > 0 else 0
+            if add > 0:
+                hours_t[line] += add
+                bucket_free[line_bucket[line]] -= add
+                residual_c -= add * step_c
+
+    return [(timekeeper_data[b // num_days], b % num_days, hours_t[line] / 10) for line, b in enumerate(line_bucket)]
+
+def _generate_fees(fee_count: int, timekeeper_data: list[Dict], billing_start_date: dt.date, billing_end_date: dt.date, task_activity_desc: list[tuple[str, str, str]], major_task_codes: set, max_hours_per_tk_per_day: int, faker_instance: Faker | FakerPool, client_id: str, law_firm_id: str, invoice_desc: str, learned_model: Dict | None = None, target_total: float | None = None) -> list[Dict]:
+    """Generate exactly fee_count fee line items; task tuples follow learned_model's frequencies when given."""
+    rows = []
+    delta = billing_end_date - billing_start_date
+    num_days = max(1, delta.days + 1)
+    major_items = [item for item in task_activity_desc if item[0] in major_task_codes]
+    other_items = [item for item in task_activity_desc if item[0] not in major_task_codes] or major_items
+    start_day, iso_dates = billing_start_date.toordinal(), DateCache(ISO_FORMAT)
+    use_learned = bool(learned_model and learned_model.get("task_activity_desc"))
+    if not task_activity_desc and not use_learned:
+        return rows
+
+    for tk_row, random_day_offset, hours_to_bill in _allocate_fee_slots(fee_count, timekeeper_data, num_days, max_hours_per_tk_per_day, target_total):
+        timekeeper_id = tk_row["TIMEKEEPER_ID"]
+        if use_learned:
+            task_code, activity_code, description = sample_task_activity(learned_model)
+        elif major_items and random.random() < 0.7:
+            task_code, activity_code, description = random.choice(major_items)
+        else:
+            task_code, activity_code, description = random.choice(other_items)
+        line_item_date_str = iso_dates[start_day + random_day_offset]
+        hourly_rate = tk_row["RATE"]
+        line_item_total = from_cents(line_cents(hours_to_bill, to_cents(hourly_rate)))
+        description = _process_description(description, faker_instance)
+        row = {
+            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
+            "LINE_ITEM_DATE": line_item_date_str, "TIMEKEEPER_NAME": tk_row["TIMEKEEPER_NAME"],
+            "TIMEKEEPER_CLASSIFICATION": tk_row["TIMEKEEPER_CLASSIFICATION"],
+            "TIMEKEEPER_ID": timekeeper_id, "TASK_CODE": task_code,
+            "ACTIVITY_CODE": activity_code, "EXPENSE_CODE": "", "DESCRIPTION": description,
+            "HOURS": hours_to_bill, "RATE": hourly_rate, "LINE_ITEM_TOTAL": line_item_total
+        }
+        rows.append(row)
+    return rows
+
+
+
+def _generate_expenses(
+    expense_count: int,
+    billing_start_date: dt.date,
+    billing_end_date: dt.date,
+    client_id: str,
+    law_firm_id: str,
+    invoice_desc: str,
+    learned_model: Dict | None = None,
+    expense_settings: Dict | None = None
+) -> list[Dict]:
+    """Generate expense line items for an invoice with realistic amounts."""
+
+    # --- normalize dates (accepts date, datetime, ordinal or common string formats) ---
+    def _to_date(x) -> dt.date:
+        try:
+            return to_date(x)
+        except ValueError:
+            return dt.date.today()
+
+    start = _to_date(billing_start_date)
+    end   = _to_date(billing_end_date)
+
+    delta = end - start
+    num_days = max(1, delta.days + 1)
+    start_day, iso_dates = start.toordinal(), DateCache(ISO_FORMAT)
+
+    # --- tunable expense settings from UI (with safe fallbacks) ---
+    if expense_settings is None:
+        expense_settings = _expense_settings_from_state()
+    mileage_rate_cfg = float(expense_settings.get("mileage_rate_e109", 0.65))
+    travel_rng = expense_settings.get("travel_range_e110", (100.0, 800.0))
+    tel_rng    = expense_settings.get("telephone_range_e105", (5.0, 15.0))
+    copying_rate = float(expense_settings.get("copying_rate_e101", 0.24))
+
+    try:
+        travel_min, travel_max = float(travel_rng[0]), float(travel_rng[1])
+    except Exception:
+        travel_min, travel_max = 100.0, 800.0
+    try:
+        tel_min, tel_max = float(tel_rng[0]), float(tel_rng[1])
+    except Exception:
+        tel_min, tel_max = 5.0, 15.0
+
+    rows: list[Dict] = []
+
+    # --- Learned template: codes and (units, rate) pairs drawn from the ingested LEDES files ---
+    if learned_model and learned_model.get("expenses"):
+        for _ in range(expense_count):
+            expense_code, description, hours, rate = sample_expense(learned_model)
+            random_day_offset = random.randint(0, num_days - 1)
+            rows.append({
+                "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
+                "LINE_ITEM_DATE": iso_dates[start_day + random_day_offset], "TIMEKEEPER_NAME": "",
+                "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "",
+                "TASK_CODE": "", "ACTIVITY_CODE": "", "EXPENSE_CODE": expense_code, "DESCRIPTION": description,
+                "HOURS": int(hours), "RATE": rate, "LINE_ITEM_TOTAL": from_cents(line_cents(int(hours), to_cents(rate)))
+            })
+        return rows
+
+    # --- Always include some Copying (E101) if we have at least 1 expense slot ---
+    e101_actual_count = 0
+    if expense_count > 0:
+        e101_actual_count = random.randint(1, min(3, expense_count))
+
+    for _ in range(e101_actual_count):
+        description = "Copying"
+        expense_code = "E101"
+        pages = random.randint(50, 300)     # number of pages
+        rate_c = to_cents(copying_rate)     # per-page
+        random_day_offset = random.randint(0, num_days - 1)
+        rate, line_item_total = from_cents(rate_c), from_cents(pages * rate_c)
+        row = {
+            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
+            "LINE_ITEM_DATE": iso_dates[start_day + random_day_offset], "TIMEKEEPER_NAME": "",
+            "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "",
+            "TASK_CODE": "", "ACTIVITY_CODE": "", "EXPENSE_CODE": expense_code, "DESCRIPTION": description,
+            "HOURS": pages, "RATE": rate, "LINE_ITEM_TOTAL": line_item_total
+        }
+        rows.append(row)
+
+    # --- Remaining expenses with category-aware amounts ---
+    # Requires OTHER_EXPENSE_DESCRIPTIONS and CONFIG['EXPENSE_CODES'] to exist in your module.
+    remaining = max(0, expense_count - e101_actual_count)
+    for _ in range(remaining):
+        description = random.choice(OTHER_EXPENSE_DESCRIPTIONS)
+        expense_code = CONFIG['EXPENSE_CODES'][description]
+        random_day_offset = random.randint(0, num_days - 1)
+
+        if expense_code == "E109":  # Local travel (mileage)
+            miles = random.randint(5, 50)
+            hours = miles  # store miles in HOURS
+            rate_c = to_cents(mileage_rate_cfg)
+
+        elif expense_code == "E110":  # Out-of-town travel (ticket/transport)
+            hours = 1
+            rate_c = to_cents(random.uniform(travel_min, travel_max))
+
+        elif expense_code == "E105":  # Telephone
+            hours = 1
+            rate_c = to_cents(random.uniform(tel_min, tel_max))
+
+        elif expense_code == "E107":  # Delivery/messenger
+            hours = 1
+            rate_c = to_cents(random.uniform(20.0, 100.0))
+
+        elif expense_code == "E108":  # Postage
+            hours = 1
+            rate_c = to_cents(random.uniform(5.0, 50.0))
+
+        elif expense_code == "E111":  # Meals
+            hours = 1
+            rate_c = to_cents(random.uniform(15.0, 150.0))
+
+        else:
+            hours = random.randint(1, 5)
+            rate_c = to_cents(random.uniform(10.0, 150.0))
+
+        rate, line_item_total = from_cents(rate_c), from_cents(hours * rate_c)
+        row = {
+            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
+            "LINE_ITEM_DATE": iso_dates[start_day + random_day_offset], "TIMEKEEPER_NAME": "",
+            "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "",
+            "TASK_CODE": "", "ACTIVITY_CODE": "", "EXPENSE_CODE": expense_code, "DESCRIPTION": description,
+            "HOURS": hours, "RATE": rate, "LINE_ITEM_TOTAL": line_item_total
+        }
+        rows.append(row)
+
+    return rows
+    
+def _generate_invoice_data(fee_count: int, expense_count: int, timekeeper_data: list[Dict], client_id: str, law_firm_id: str, invoice_desc: str, billing_start_date: dt.date, billing_end_date: dt.date, task_activity_desc: list[tuple[str, str, str]], major_task_codes: set, max_hours_per_tk_per_day: int, include_block_billed: bool, faker_instance: Faker | FakerPool, learned_model: Dict | None = None) -> tuple[list[Dict], float]:
+    """Generate invoice data with fees and expenses."""
+    rows = []
+    rows.extend(_generate_fees(fee_count, timekeeper_data, billing_start_date, billing_end_date, task_activity_desc, major_task_codes, max_hours_per_tk_per_day, faker_instance, client_id, law_firm_id, invoice_desc, learned_model))
+    rows.extend(_generate_expenses(expense_count, billing_start_date, billing_end_date, client_id, law_firm_id, invoice_desc, learned_model))
+    return _apply_block_billing(rows, include_block_billed, client_id, law_firm_id, invoice_desc)
+
+def _apply_block_billing(rows: list[Dict], include_block_billed: bool, client_id: str, law_firm_id: str, invoice_desc: str) -> tuple[list[Dict], float]:
+    """Optionally merge a few fee rows into one block-billed line; returns (rows, total_amount)."""
+    # Filter for fees only before creating block billed items
+    fee_rows = [row for row in rows if not row.get("EXPENSE_CODE")]
+    
+    if include_block_billed and fee_rows:
+        block_size = random.randint(2, 5)
+        selected_rows = random.sample(fee_rows, min(block_size, len(fee_rows)))
+        total_hours = sum(int(round(float(row["HOURS"]) * 10)) for row in selected_rows) / 10
+        total_amount_block = from_cents(total_cents(selected_rows))
+        descriptions = [row["DESCRIPTION"] for row in selected_rows]
+        block_description = "; ".join(descriptions)
+        block_row = {
+            "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
+            "LINE_ITEM_DATE": selected_rows[0]["LINE_ITEM_DATE"], "TIMEKEEPER_NAME": selected_rows[0]["TIMEKEEPER_NAME"],
+            "TIMEKEEPER_CLASSIFICATION": selected_rows[0]["TIMEKEEPER_CLASSIFICATION"],
+            "TIMEKEEPER_ID": selected_rows[0]["TIMEKEEPER_ID"], "TASK_CODE": selected_rows[0]["TASK_CODE"],
+            "ACTIVITY_CODE": selected_rows[0]["ACTIVITY_CODE"], "EXPENSE_CODE": "",
+            "DESCRIPTION": block_description, "HOURS": total_hours, "RATE": selected_rows[0]["RATE"],
+            "LINE_ITEM_TOTAL": total_amount_block
+        }
+        rows = [row for row in rows if row not in selected_rows]
+        rows.append(block_row)
+
+    return rows, from_cents(total_cents(rows))
+
+@lru_cache(maxsize=32)
+def _validate_image_bytes(image_bytes: bytes) -> bool:
+    """Validate that the provided bytes are a JPEG or PNG image (memoized: logos repeat across invoices)."""
+    return image_format(image_bytes) in SUPPORTED_FORMATS
+
+def _default_logo_path(law_firm_id: str) -> str:
+    logo_file_name = "nelsonmurdock2.jpg" if law_firm_id == CONFIG['DEFAULT_LAW_FIRM_ID'] else "icon.jpg"
+    return os.path.join(os.path.dirname(__file__), "assets", logo_file_name)
+
+def _get_logo_bytes(uploaded_logo: Any | None, law_firm_id: str, use_custom: bool = True) -> bytes:
+    """Get normalized logo bytes from the uploaded file, the law firm's default asset, or a placeholder."""
+    if use_custom and uploaded_logo:
+        try:
+            # Streamlit uploads are BytesIO-like; getvalue() survives reruns that already read the stream
+            raw = uploaded_logo.getvalue() if hasattr(uploaded_logo, "getvalue") else uploaded_logo.read()
+            logo_bytes = normalized_logo(raw)
+            if logo_bytes is not None:
+                return logo_bytes
+            logger.warning("Uploaded logo is not a valid JPEG or PNG. Using default logo.")
+        except Exception as e:
+            logging.error(f"Error reading uploaded logo: {e}")
+            logger.warning("Failed to read uploaded logo. Using default logo.")
+
+    logo_path = _default_logo_path(law_firm_id)
+    try:
+        logo_bytes = logo_from_file(logo_path)
+        if logo_bytes is not None:
+            return logo_bytes
+        if os.path.exists(logo_path):
+            logger.warning(f"Default logo ({os.path.basename(logo_path)}) is not a valid JPEG or PNG. Using placeholder.")
+        else:
+            logger.warning(f"Logo file ({os.path.basename(logo_path)}) not found or invalid. Using placeholder.")
+    except Exception as e:
+        logging.error(f"Logo load failed: {e}")
+        logger.warning(f"Logo file ({os.path.basename(logo_path)}) not found or invalid. Using placeholder.")
+    return placeholder_logo()
+
+def _invoice_pdf_story(df: pd.DataFrame, total_amount: float, invoice_number: str, invoice_date: dt.date, billing_start_date: dt.date, billing_end_date: dt.date, client_id: str, law_firm_id: str, logo_bytes: bytes, include_logo: bool = True) -> list:
+    """Platypus flowables for one invoice, matching the provided format."""
+    elements = []
+    styles = getSampleStyleSheet()
+
+    # Define new styles
+    header_info_style = ParagraphStyle(
+        'HeaderInfo',
+        parent=styles['Normal'],
+        fontName='Helvetica-Bold',
+        fontSize=12,
+        leading=14,
+        alignment=TA_LEFT
+    )
+    
+    client_info_style = ParagraphStyle(
+        'ClientInfo',
+        parent=header_info_style,
+        alignment=TA_RIGHT
+    )
+
+    table_header_style = ParagraphStyle(
+        'TableHeader',
+        parent=styles['Normal'],
+        fontName='Helvetica-Bold',
+        fontSize=10,
+        leading=12,
+        alignment=TA_CENTER,
+        wordWrap='CJK'
+    )
+
+    table_data_style = ParagraphStyle(
+        'TableData',
+        parent=styles['Normal'],
+        fontName='Helvetica',
+        fontSize=10,
+        leading=12,
+        alignment=TA_LEFT,
+        wordWrap='CJK'
+    )
+    
+    right_align_style = styles['Heading4']
+
+    # Header with Law Firm on left and Client on right
+    law_firm_info = f"Nelson and Murdock<br/>{law_firm_id}<br/>One Park Avenue<br/>Manhattan, NY 10003"
+    client_info = f"A Onit Inc.<br/>{client_id}<br/>1360 Post Oak Blvd<br/>Houston, TX 77056"
+    
+    law_firm_para = Paragraph(law_firm_info, header_info_style)
+    client_para = Paragraph(client_info, client_info_style)
+
+    header_left_content = law_firm_para
+    if include_logo:
+        try:
+            if not _validate_image_bytes(logo_bytes):
+                raise ValueError("Invalid logo bytes")
+            img = Image(io.BytesIO(logo_bytes), width=0.6 * inch, height=0.6 * inch, kind='direct', hAlign='LEFT')
+            img._restrictSize(0.6 * inch, 0.6 * inch)
+            img.alt = "Law Firm Logo"
+            inner_table_data = [[img, Paragraph(law_firm_info, header_info_style)]]
+            inner_table = Table(inner_table_data, colWidths=[0.7 * inch, None])
+            inner_table.setStyle(TableStyle([
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('LEFTPADDING', (1, 0), (1, 0), 6),
+            ]))
+            header_left_content = inner_table
+        except Exception as e:
+            logging.error(f"Error adding logo to PDF: {e}")
+            logger.warning("Could not add logo to PDF. Using text instead.")
+            header_left_content = law_firm_para
+
+    header_data = [[header_left_content, client_para]]
+    header_table = Table(header_data, colWidths=[3.5 * inch, 4.0 * inch])
+    header_table.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('LEFTPADDING', (0, 0), (0, 0), 0),
+        ('RIGHTPADDING', (0, 0), (0, 0), 0),
+        ('TOPPADDING', (0, 0), (-1, -1), 0),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+    ]))
+    elements.append(header_table)
+    elements.append(Spacer(1, 0.1 * inch))
+
+    # Invoice details
+    invoice_info = f"Invoice #: {invoice_number}<br/>Invoice Date: {invoice_date.strftime('%Y-%m-%d')}<br/>Billing Period: {billing_start_date.strftime('%Y-%m-%d')} to {billing_end_date.strftime('%Y-%m-%d')}"
+    invoice_para = Paragraph(invoice_info, right_align_style)
+    invoice_table = Table([[invoice_para]], colWidths=[7.5 * inch])
+    invoice_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    elements.append(invoice_table)
+    elements.append(Spacer(1, 0.1 * inch))
+
+    # Table with updated columns and wrapped text
+    data = [
+        [
+            Paragraph("Date", table_header_style), 
+            Paragraph("Task<br/>Code", table_header_style), 
+            Paragraph("Activity<br/>Code", table_header_style), 
+            Paragraph("Timekeeper", table_header_style), 
+            Paragraph("Description", table_header_style), 
+            Paragraph("Hours", table_header_style), 
+            Paragraph("Rate", table_header_style), 
+            Paragraph("Total", table_header_style)
+        ]
+    ]
+    for _, row in df.iterrows():
+        date_str = row["LINE_ITEM_DATE"]
+        timekeeper = Paragraph(row["TIMEKEEPER_NAME"] if row["TIMEKEEPER_NAME"] else "N/A", table_data_style)
+        task_code = row.get("TASK_CODE", "") if not row["EXPENSE_CODE"] else ""
+        activity_code = row.get("ACTIVITY_CODE", "") if not row["EXPENSE_CODE"] else ""
+        description = Paragraph(row["DESCRIPTION"], table_data_style)
+        hours = f"{row['HOURS']:.1f}" if not row["EXPENSE_CODE"] else f"{int(row['HOURS'])}"
+        rate = format_cents(to_cents(row["RATE"]), "$") if row["RATE"] else "N/A"
+        total = format_cents(to_cents(row["LINE_ITEM_TOTAL"]), "$")
+        data.append([date_str, task_code, activity_code, timekeeper, description, hours, rate, total])
+
+    table = Table(data, colWidths=[0.8 * inch, 0.7 * inch, 0.7 * inch, 1.3 * inch, 1.8 * inch, 0.8 * inch, 0.8 * inch, 0.8 * inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+        ('ALIGN', (1, 1), (2, -1), 'CENTER'), # Center Task Code and Activity Code data
+        ('ALIGN', (5, 0), (5, -1), 'CENTER'),
+        ('ALIGN', (6, 0), (6, -1), 'RIGHT'),
+        ('ALIGN', (7, 0), (7, -1), 'RIGHT'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 2),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+        ('TOPPADDING', (0, 0), (-1, -1), 2),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+    ]))
+    elements.append(table)
+
+    elements.append(Spacer(1, 0.25 * inch))
+    total_para = Paragraph(f"Total: {format_cents(to_cents(total_amount), '$')}", right_align_style)
+    elements.append(total_para)
+    return elements
+
+
+def _compact_doc(buffer: str | BinaryIO, **kwargs) -> SimpleDocTemplate:
+    # Compressed page streams; invariant output so identical invoices give identical bytes
+    return SimpleDocTemplate(buffer, pagesize=letter, pageCompression=1, invariant=1, **kwargs)
+
+
+def _create_pdf_invoice(df: pd.DataFrame, total_amount: float, invoice_number: str, invoice_date: dt.date, billing_start_date: dt.date, billing_end_date: dt.date, client_id: str, law_firm_id: str, logo_bytes: bytes, include_logo: bool = True) -> io.BytesIO:
+    """Generate a PDF invoice matching the provided format."""
+    buffer = io.BytesIO()
+    _compact_doc(buffer, title=f"Invoice {invoice_number}").build(_invoice_pdf_story(
+        df, total_amount, invoice_number, invoice_date, billing_start_date, billing_end_date, client_id, law_firm_id, logo_bytes, include_logo))
+    buffer.seek(0)
+    return buffer
+
+
+class _Bookmark(Flowable):
+    """Zero-size flowable that adds a top-level outline entry pointing at the current page."""
+
+    def __init__(self, key: str, title: str):
+        super().__init__()
+        self.key, self.title = key, title
+        self.width = self.height = 0
+
+    def draw(self):
+        self.canv.bookmarkPage(self.key)
+        self.canv.addOutlineEntry(self.title, self.key, level=0)
+
+
+class _StoryFeed(list):
+    """A platypus story refilled from `parts` whenever the layout has consumed it.
+
+    doc.build checks len(story) before taking each flowable, so only the invoice being laid out
+    has its flowables in memory."""
+
+    def __init__(self, parts: Iterator[list]):
+        super().__init__()
+        self._parts = parts
+
+    def __len__(self) -> int:
+        while not super().__len__():
+            part = next(self._parts, None)
+            if part is None:
+                break
+            self.extend(part)
+        return super().__len__()
+
+
+def _create_batch_pdf(invoices: Iterable[Dict[str, Any]], target: str | BinaryIO | None = None) -> io.BytesIO | str | BinaryIO:
+    """One PDF holding every invoice, each starting on a new page with its own bookmark.
+
+    `invoices` yields _create_pdf_invoice keyword arguments; each invoice's flowables are built only
+    when the layout reaches it. The document shares one copy of the logo image (reportlab reuses
+    identical image XObjects) and the standard fonts. Written to target (a path or binary file) when
+    given, else to a BytesIO; returns where it was written.
+    """
+    def parts() -> Iterator[list]:
+        for n, kwargs in enumerate(invoices):
+            yield ([PageBreak()] if n else []) + [_Bookmark(f"inv{n}", f"Invoice {kwargs['invoice_number']}")] + _invoice_pdf_story(**kwargs)
+    buffer = io.BytesIO() if target is None else target
+    doc = _compact_doc(buffer, title="Invoices")
+    doc.build(_StoryFeed(parts()), onFirstPage=lambda canv, _doc: canv.showOutline())
+    if target is None:
+        buffer.seek(0)
+    return buffer
+
+
+RECEIPT_SIZE = (600, 950)  # layout units: PNG pixels, or PDF points scaled by RECEIPT_PDF_SCALE
+RECEIPT_PDF_SCALE = 0.5
+RECEIPT_FORMATS = {"png": "PNG image per receipt", "pdf": "Vector PDF per receipt", "pdf-combined": "One vector PDF per invoice"}
+
+def _receipt_content(expense_row: dict, faker_instance: Faker | FakerPool, settings: Dict | None = None) -> Dict[str, Any]:
+    """Everything a receipt shows (merchant, items, tax/tip, card, barcode), independent of the renderer."""
+    # === Receipt Settings read from UI ===
+    if settings is None:
+        settings = _receipt_settings_from_state()
+    rcpt_scale = settings.get("rcpt_scale", 1.0)
+    rcpt_line_weight = int(settings.get("rcpt_line_weight", 1))
+    rcpt_dashed = bool(settings.get("rcpt_dashed", False))
+
+    TAX_MAP = {
+        "E111": 0.085,
+        "E110": 0.000,
+        "E109": 0.000,
+        "E108": 0.000,
+        "E115": 0.085,
+        "E116": 0.085,
+        "E117": 0.085,
+    }
+
+    def mask_card():
+        brands = ["VISA", "MC", "AMEX", "DISC"]
+        brand = random.choice(brands)
+        if brand == "AMEX":
+            masked = f"{brand} ****-******-*{random.randint(1000,9999)}"
+        else:
+            masked = f"{brand} ****-****-****-{random.randint(1000,9999)}"
+        return masked
+
+    def auth_code():
+        return f"APPROVED  AUTH {random.randint(100000,999999)}  REF {random.randint(1000,9999)}"
+
+    def pick_items(expense_code: str, desc: str, total: int):
+        """(name, qty, unit cents, line cents) items for a receipt totalling `total` cents."""
+        items = []
+        if expense_code == "E111":
+            qtys = [1, 2]
+            entree_qty = random.choice(qtys)
+            entree_unit = round(total * 0.45 / max(entree_qty,1))
+            drink_unit = round(total * 0.15)
+            items = [
+                ("Entree", entree_qty, entree_unit, entree_qty*entree_unit),
+                ("Beverage", 1, drink_unit, drink_unit),
+            ]
+        elif expense_code == "E110":
+            miles = random.randint(3, 20)
+            base = max(250, round(total * 0.15))
+            per_mile = max(90, round((total - base) / max(miles,1)))
+            items = [
+                ("Base Fare", 1, base, base),
+                (f"Distance {miles} mi", 1, per_mile*miles, per_mile*miles),
+            ]
+        elif expense_code == "E108":
+            weight = random.uniform(0.5, 4.0)
+            items = [(f"USPS Priority Mail {weight:.1f} lb", 1, total, total)]
+        elif expense_code in ("E115","E116"):
+            pages = random.randint(50, 300)
+            unit = max(200, min(600, round(total/pages)))
+            items = [(f"Transcript ({pages} pages)", pages, unit, pages*unit)]
+        else:
+            n = random.choice([2,3])
+            shares = [random.uniform(0.2, 0.5) for _ in range(n-1)]
+            parts = split_cents(total, shares + [max(0.0, 1.0 - sum(shares))])
+            items = [(f"{desc[:20]} {i+1}", 1, part, part) for i, part in enumerate(parts)]
+        return items
+
+    merchant = faker_instance.company()
+    m_addr = faker_instance.address().replace("\n", ", ")
+    m_phone = faker_instance.phone_number()
+    cashier = faker_instance.first_name()
+
+    try:
+        line_item_date = to_date(expense_row["LINE_ITEM_DATE"])
+    except (KeyError, ValueError):
+        line_item_date = dt.date.today()
+    exp_code = str(expense_row.get("EXPENSE_CODE", "")).strip()
+    desc = str(expense_row.get("DESCRIPTION","")).strip() or "Item"
+    total_amount = to_cents(expense_row.get("LINE_ITEM_TOTAL", 0.0))
+
+    # All amounts in cents: the receipt total equals the expense line's total exactly. Tax and tip
+    # come off the total first, then the subtotal is split over the items in their proportions.
+    items = pick_items(exp_code, desc, total_amount)
+    tax_rate = TAX_MAP.get(exp_code, DEFAULT_TAX_RATE if total_amount > 0 else 0.0)
+    tip_rate = {"E111": 0.15, "E110": 0.10}.get(exp_code, 0.0)
+    subtotal = round(total_amount / (1 + tax_rate + tip_rate))
+    tax = round(subtotal * tax_rate)
+    tip = total_amount - subtotal - tax if tip_rate else 0
+    subtotal = total_amount - tax - tip
+
+    lines = split_cents(subtotal, [x[3] for x in items])
+    items = [(name, qty, unit if line == line_total else round(line / max(qty,1)), line)
+             for (name, qty, unit, line_total), line in zip(items, lines)]
+
+    rnum = f"{random.randint(100000, 999999)}-{random.randint(10,99)}"
+    card = mask_card()
+    auth = auth_code()
+    random.seed(rnum)
+    bars = []
+    x = 40
+    for _ in range(60):
+        bar_h = random.randint(20, 50)
+        bar_w = random.choice([1,1,2])
+        bars.append((x, bar_w, bar_h))
+        x += bar_w + 3
+        if x > RECEIPT_SIZE[0] - 40:
+            break
+
+    return {
+        "merchant": merchant, "address": m_addr, "phone": m_phone, "cashier": cashier,
+        "date": line_item_date, "expense_code": exp_code, "items": items,
+        "subtotal": subtotal, "tax": tax, "tax_rate": tax_rate, "tip": tip, "total": subtotal + tax + tip,
+        "receipt_number": rnum, "card": card, "auth": auth, "bars": bars,
+        "scale": rcpt_scale, "line_weight": rcpt_line_weight, "dashed": rcpt_dashed,
+        "policy": "Returns within 30 days with receipt. Items must be unused and in original packaging.",
+    }
+
+def _receipt_filename(content: Dict[str, Any], ext: str) -> str:
+    return f"Receipt_{content['expense_code']}_{content['date'].strftime('%Y%m%d')}.{ext}"
+
+def _money(cents: int) -> str:
+    return format_cents(cents, "$")
+
+def _create_receipt_image(expense_row: dict, faker_instance: Faker | FakerPool, settings: Dict | None = None) -> tuple[str, io.BytesIO]:
+    """Enhanced realistic receipt generator (see chat notes for details)."""
+    c = _receipt_content(expense_row, faker_instance, settings)
+    width, height = RECEIPT_SIZE
+    bg = (252, 252, 252)
+    fg = (20, 20, 20)
+    faint = (90, 90, 90)
+    line_y_gap = 28
+    rcpt_scale, rcpt_line_weight, rcpt_dashed = c["scale"], c["line_weight"], c["dashed"]
+    money = _money
+
+    img = PILImage.new("RGB", (width, height), bg)
+    draw = ImageDraw.Draw(img)
+
+    try:
+        title_font = ImageFont.truetype("arial.ttf", max(12, int(34*rcpt_scale)))
+        header_font = ImageFont.truetype("arial.ttf", max(10, int(22*rcpt_scale)))
+        mono_font = ImageFont.truetype("arial.ttf", max(10, int(22*rcpt_scale)))
+        small_font = ImageFont.truetype("arial.ttf", max(8, int(18*rcpt_scale)))
+        tiny_font = ImageFont.truetype("arial.ttf", max(8, int(15*rcpt_scale)))
+    except Exception:
+        title_font = ImageFont.load_default()
+        header_font = ImageFont.load_default()
+        mono_font = ImageFont.load_default()
+        small_font = ImageFont.load_default()
+        tiny_font = ImageFont.load_default()
+
+    def draw_hr(y, pad_left=40, pad_right=40, weight=1, dashed=False):
+        if dashed:
+            x = pad_left
+            dash = 8
+            gap = 6
+            while x < width - pad_right:
+                x2 = min(x + dash, width - pad_right)
+                draw.line([(x, y), (x2, y)], fill=faint, width=weight)
+                x = x2 + gap
+        else:
+            draw.line([(pad_left, y), (width - pad_right, y)], fill=faint, width=weight)
+
+    y = 30
+    title = "RECEIPT"
+    tw = draw.textlength(title, font=title_font)
+    draw.text(((width - tw) / 2, y), title, font=title_font, fill=fg)
+    y += 42
+
+    for line in (c["merchant"], c["address"], f"Tel: {c['phone']}"):
+        draw.text((40, y), line, font=header_font, fill=fg)
+        y += 26
+    y += 6
+    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
+
+    draw.text((40, y), f"Date: {c['date'].strftime('%a %b %d, %Y')}", font=mono_font, fill=fg)
+    draw.text((width-300, y), f"Receipt #: {c['receipt_number']}", font=mono_font, fill=fg)
+    y += 30
+    draw.text((40, y), f"Cashier: {c['cashier']}", font=mono_font, fill=(90,90,90))
+    y += 10
+    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 16
+
+    draw.text((40, y), "Item", font=small_font, fill=(90,90,90))
+    draw.text((width-255, y), "Qty", font=small_font, fill=(90,90,90))
+    draw.text((width-180, y), "Price", font=small_font, fill=(90,90,90))
+    draw.text((width-95, y), "Total", font=small_font, fill=(90,90,90))
+    y += 22
+
+    import textwrap as _tw
+    for name, qty, unit, line_total in c["items"]:
+        lines = _tw.wrap(name, width=32) or ["Item"]
+        first = True
+        for wrap_line in lines:
+            draw.text((40, y), wrap_line, font=mono_font, fill=fg)
+            if first:
+                draw.text((width-245, y), str(qty), font=mono_font, fill=fg)
+                draw.text((width-180, y), money(unit), font=mono_font, fill=fg)
+                draw.text((width-95, y), money(line_total), font=mono_font, fill=fg)
+                first = False
+            y += line_y_gap-8
+        y += 2
+    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
+
+    def right_label(label, val):
+        nonlocal y
+        draw.text((width-220, y), label, font=mono_font, fill=fg)
+        draw.text((width-95, y), money(val), font=mono_font, fill=fg)
+        y += 24
+
+    right_label("Subtotal", c["subtotal"])
+    if c["tax"] > 0:
+        right_label(f"Tax ({int(c['tax_rate']*100)}%)", c["tax"])
+    if c["tip"] > 0:
+        right_label("Tip", c["tip"])
+    draw.text((width-220, y), "TOTAL", font=header_font, fill=fg)
+    draw.text((width-95, y), money(c["total"]), font=header_font, fill=fg)
+    y += 30
+    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
+
+    draw.text((40, y), c["card"], font=mono_font, fill=fg)
+    y += 26
+    draw.text((40, y), c["auth"], font=mono_font, fill=(90,90,90))
+    y += 10
+    draw_hr(y, weight=rcpt_line_weight, dashed=rcpt_dashed); y += 14
+
+    for line in _tw.wrap(c["policy"], width=70):
+        draw.text((40, y), line, font=tiny_font, fill=(90,90,90))
+        y += 20
+
+    y = height - 80
+    for x, bar_w, bar_h in c["bars"]:
+        draw.rectangle([x, y, x+bar_w, y+bar_h], fill=(90,90,90))
+
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format="PNG")
+    img_buffer.seek(0)
+
+    return _receipt_filename(c, "png"), img_buffer
+
+def _draw_receipt_vector(canv: canvas.Canvas, c: Dict[str, Any]) -> None:
+    """Draw the _create_receipt_image layout as vector text and lines on the current page."""
+    width, height = RECEIPT_SIZE
+    fg, faint = colors.Color(20/255, 20/255, 20/255), colors.Color(90/255, 90/255, 90/255)
+    scale = c["scale"]
+    title_size, header_size, mono_size = max(12, int(34*scale)), max(10, int(22*scale)), max(10, int(22*scale))
+    small_size, tiny_size = max(8, int(18*scale)), max(8, int(15*scale))
+    line_y_gap = 28
+
+    canv.saveState()
+    # Work in the PNG's top-left layout units so both backends share coordinates
+    canv.translate(0, height * RECEIPT_PDF_SCALE)
+    canv.scale(RECEIPT_PDF_SCALE, RECEIPT_PDF_SCALE)
+
+    def text(x, y, s, size, color=fg, font="Helvetica"):
+        canv.setFont(font, size)
+        canv.setFillColor(color)
+        canv.drawString(x, -(y + size * 0.8), s)
+
+    def draw_hr(y):
+        canv.setStrokeColor(faint)
+        canv.setLineWidth(c["line_weight"])
+        canv.setDash(8, 6) if c["dashed"] else canv.setDash()
+        canv.line(40, -y, width - 40, -y)
+
+    y = 30
+    title = "RECEIPT"
+    text((width - canv.stringWidth(title, "Helvetica-Bold", title_size)) / 2, y, title, title_size, font="Helvetica-Bold")
+    y += 42
+    for line in (c["merchant"], c["address"], f"Tel: {c['phone']}"):
+        text(40, y, line, header_size)
+        y += 26
+    y += 6
+    draw_hr(y); y += 14
+
+    text(40, y, f"Date: {c['date'].strftime('%a %b %d, %Y')}", mono_size)
+    text(width-300, y, f"Receipt #: {c['receipt_number']}", mono_size)
+    y += 30
+    text(40, y, f"Cashier: {c['cashier']}", mono_size, faint)
+    y += 10 + mono_size
+    draw_hr(y); y += 16
+
+    text(40, y, "Item", small_size, faint)
+    text(width-255, y, "Qty", small_size, faint)
+    text(width-180, y, "Price", small_size, faint)
+    text(width-95, y, "Total", small_size, faint)
+    y += 22
+
+    import textwrap as _tw
+    for name, qty, unit, line_total in c["items"]:
+        first = True
+        for wrap_line in _tw.wrap(name, width=32) or ["Item"]:
+            text(40, y, wrap_line, mono_size)
+            if first:
+                text(width-245, y, str(qty), mono_size)
+                text(width-180, y, _money(unit), mono_size)
+                text(width-95, y, _money(line_total), mono_size)
+                first = False
+            y += line_y_gap-8
+        y += 2
+    draw_hr(y); y += 14
+
+    def right_label(label, val, size=mono_size):
+        nonlocal y
+        text(width-220, y, label, size)
+        text(width-95, y, _money(val), size)
+        y += 24
+
+    right_label("Subtotal", c["subtotal"])
+    if c["tax"] > 0:
+        right_label(f"Tax ({int(c['tax_rate']*100)}%)", c["tax"])
+    if c["tip"] > 0:
+        right_label("Tip", c["tip"])
+    right_label("TOTAL", c["total"], header_size)
+    y += 6
+    draw_hr(y); y += 14
+
+    text(40, y, c["card"], mono_size)
+    y += 26
+    text(40, y, c["auth"], mono_size, faint)
+    y += 10 + mono_size
+    draw_hr(y); y += 14
+
+    for line in _tw.wrap(c["policy"], width=70):
+        text(40, y, line, tiny_size, faint)
+        y += 20
+
+    canv.setFillColor(faint)
+    bar_top = height - 80
+    for x, bar_w, bar_h in c["bars"]:
+        canv.rect(x, -(bar_top + bar_h), bar_w, bar_h, stroke=0, fill=1)
+    canv.restoreState()
+
+def _receipt_canvas(buffer: io.BytesIO) -> canvas.Canvas:
+    size = (RECEIPT_SIZE[0] * RECEIPT_PDF_SCALE, RECEIPT_SIZE[1] * RECEIPT_PDF_SCALE)
+    return canvas.Canvas(buffer, pagesize=size, pageCompression=1, invariant=1)
+
+def _create_receipt_pdf(expense_row: dict, faker_instance: Faker | FakerPool, settings: Dict | None = None) -> tuple[str, io.BytesIO]:
+    """One-page vector PDF with the same content and layout as _create_receipt_image."""
+    c = _receipt_content(expense_row, faker_instance, settings)
+    buffer = io.BytesIO()
+    canv = _receipt_canvas(buffer)
+    _draw_receipt_vector(canv, c)
+    canv.showPage()
+    canv.save()
+    buffer.seek(0)
+    return _receipt_filename(c, "pdf"), buffer
+
+def _create_receipts_pdf(expense_rows: list[dict], faker_instance: Faker | FakerPool, settings: Dict | None = None) -> io.BytesIO:
+    """All receipts for an invoice as pages of a single vector PDF, one bookmark per receipt."""
+    buffer = io.BytesIO()
+    canv = _receipt_canvas(buffer)
+    for n, row in enumerate(expense_rows):
+        c = _receipt_content(row, faker_instance, settings)
+        _draw_receipt_vector(canv, c)
+        canv.bookmarkPage(f"r{n}")
+        canv.addOutlineEntry(_receipt_filename(c, "pdf")[:-4], f"r{n}", level=0)
+        canv.showPage()
+    canv.save()
+    buffer.seek(0)
+    return buffer
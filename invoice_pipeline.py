@@ -0,0 +1,495 @@
+# --- invoice_pipeline.py (memoized generation stages) ---
+from __future__ import annotations
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import pickle
+import random
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from invoice_engine import (
+    _apply_block_billing, _create_batch_pdf, _create_ledes_1998b_content, _create_pdf_invoice, _create_receipt_image,
+    _create_receipt_pdf, _create_receipts_pdf, _generate_expenses, _generate_fees,
+)
+from anomalies import LABELS_NAME, anomaly_fractions, anomaly_labels, inject_anomalies
+from faker_pool import FakerPool, build_faker_pool
+from money import from_cents, total_cents
+from period_planner import plan_periods
+from run_profiler import RunProfiler
+from sidecar import SIDECAR_NAMES, sidecar_bytes, sidecar_format, write_sidecar
+from spend_rules import DEFAULT_RULES, batch_rules
+from spill_store import SpillStore, attachment_names, spill_store_for
+
+# Stage dependencies (inputs in brackets, upstream stages without):
+#   fees      <- [timekeepers, tasks, counts, period, fee target, seed]
+#   expenses  <- [expense settings, counts, period, seed]
+#   rows      <- fees, expenses, [block billing, anomaly fractions, spend rules fired for the invoice]
+#   ledes     <- rows, [invoice/matter number]
+#   pdf       <- rows, [logo, invoice number]
+#   receipts  <- expense rows only, [receipt settings (incl. PNG/PDF format), invoice number, seed]
+STAGES = ("fees", "expenses", "rows", "ledes", "pdf", "receipts")
+PREVIEW_LINES = 25  # line items shown by preview_lines (one page)
+PREVIEW_COLUMNS = ["LINE_ITEM_DATE", "TIMEKEEPER_NAME", "TASK_CODE", "EXPENSE_CODE", "DESCRIPTION", "HOURS", "RATE", "LINE_ITEM_TOTAL"]
+
+_worker_cache: StageCache | None = None
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable digest of picklable stage inputs."""
+    return hashlib.sha256(pickle.dumps(parts, protocol=4)).hexdigest()
+
+
+class StageCache:
+    """Bounded LRU memo of stage outputs keyed by a fingerprint of each stage's inputs.
+
+    Downstream stages include the upstream key in their own inputs, so changing one knob only
+    invalidates the stages that (transitively) depend on it.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._store: OrderedDict[str, Any] = OrderedDict()
+        self.hits: Counter = Counter()
+        self.runs: Counter = Counter()
+
+    def run(self, stage: str, inputs: Tuple, fn: Callable[[], Any]) -> Tuple[str, Any]:
+        key = fingerprint(stage, inputs)
+        if key in self._store:
+            self._store.move_to_end(key)
+            self.hits[stage] += 1
+            return key, self._store[key]
+        value = fn()
+        self._store[key] = value
+        self.runs[stage] += 1
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+        return key, value
+
+    def reset_counters(self) -> None:
+        self.hits.clear()
+        self.runs.clear()
+
+    def clear(self) -> None:
+        self._store.clear()
+        self.reset_counters()
+
+
+def _seeded_faker(seed: Any, stage: str, index: int) -> FakerPool:
+    """Seed the module RNG so a stage is a pure function of its inputs; fake names, merchants and
+    addresses come from the shared pre-generated pool, sampled with that RNG."""
+    random.seed(f"{seed}:{stage}:{index}")
+    return build_faker_pool()
+
+
+def _output_size(value: Any) -> Tuple[int, int]:
+    """(lines, bytes) produced by a stage result, for profiling."""
+    if isinstance(value, str):
+        return value.count("\n") + 1, len(value.encode("utf-8"))
+    if isinstance(value, bytes):
+        return 1, len(value)
+    if isinstance(value, tuple):  # rows stage: (rows, total)
+        return len(value[0]), 0
+    if isinstance(value, list):
+        return len(value), sum(len(v[1]) for v in value if isinstance(v, tuple) and isinstance(v[1], bytes))
+    return 0, 0
+
+
+def _run_stage(cache: StageCache, profiler: RunProfiler | None, stage: str, inputs: Tuple,
+               fn: Callable[[], Any]) -> Tuple[str, Any]:
+    """cache.run, recording wall/CPU time, cache hits and output size under `stage` when profiling."""
+    if profiler is None:
+        return cache.run(stage, inputs, fn)
+    with profiler.stage(stage) as stats:
+        runs_before = cache.runs[stage]
+        key, value = cache.run(stage, inputs, fn)
+        stats.cached += cache.runs[stage] == runs_before
+        lines, size = _output_size(value)
+        stats.lines += lines
+        stats.bytes += size
+    return key, value
+
+
+def build_rows(job: Dict[str, Any], cache: StageCache, profiler: RunProfiler | None = None) -> Tuple[str, list[Dict], float]:
+    """The fees, expenses and rows stages of build_invoice: (rows stage key, line items, total)."""
+    def run(stage: str, inputs: Tuple, fn: Callable[[], Any]) -> Tuple[str, Any]:
+        return _run_stage(cache, profiler, stage, inputs, fn)
+
+    seed, index = job["seed"], job["index"]
+    start, end = job["billing_start_date"], job["billing_end_date"]
+    client_id, law_firm_id, desc = job["client_id"], job["law_firm_id"], job["invoice_desc"]
+    learned = job.get("learned_model")
+    learned_key = learned.get("key") if learned else None
+
+    fees_key, fee_rows = run("fees", (
+        seed, index, job["fee_count"], job["timekeeper_data"], job["task_activity_desc"],
+        sorted(job["major_task_codes"]), job["max_daily_hours"], start, end, client_id, law_firm_id, desc, learned_key,
+        job.get("fee_target_total"),
+    ), lambda: _generate_fees(
+        job["fee_count"], job["timekeeper_data"], start, end, job["task_activity_desc"], job["major_task_codes"],
+        job["max_daily_hours"], _seeded_faker(seed, "fees", index), client_id, law_firm_id, desc, learned,
+        job.get("fee_target_total"),
+    ) if job["fee_count"] > 0 and job["timekeeper_data"] else [])
+
+    def expenses_stage():
+        _seeded_faker(seed, "expenses", index)
+        return _generate_expenses(job["expense_count"], start, end, client_id, law_firm_id, desc, learned, job["expense_settings"])
+
+    expenses_key, expense_rows = run("expenses", (
+        seed, index, job["expense_count"], start, end, client_id, law_firm_id, desc, learned_key, job["expense_settings"],
+    ), expenses_stage)
+
+    def rows_stage():
+        _seeded_faker(seed, "rows", index)
+        rows, total_amount = _apply_block_billing(
+            [dict(r) for r in fee_rows + expense_rows], job["include_block_billed"], client_id, law_firm_id, desc
+        )
+        if job.get("anomalies"):
+            rows = inject_anomalies(rows, job["anomalies"], start, end, job["max_daily_hours"], np.random.default_rng(random.getrandbits(64)))
+        if job.get("mandatory_items"):
+            rules = job.get("spend_rules") or DEFAULT_RULES
+            rows = rules.apply(rows, job["mandatory_items"], job["timekeeper_data"], desc, client_id, law_firm_id, start, end)
+        if job.get("anomalies") or job.get("mandatory_items"):
+            total_amount = from_cents(total_cents(rows))
+        return rows, total_amount
+
+    rules = job.get("spend_rules")
+    rows_key, (rows, total_amount) = run("rows", (
+        fees_key, expenses_key, job["include_block_billed"], tuple((job.get("anomalies") or {}).items()),
+        rules.key if rules else None, tuple(job.get("mandatory_items") or ()), job["timekeeper_data"],
+    ), rows_stage)
+
+    return rows_key, rows, total_amount
+
+
+def _receipt_name(invoice_number: str, filename: str, taken: Counter) -> str:
+    """Receipt_<code>_<date>.<ext> renamed Receipt_<invoice>_<code>_<date>[-n].<ext>.
+
+    Receipts of different invoices, and expenses of one invoice, often share a code and date; the
+    invoice number and a per-invoice counter keep every receipt file in a batch distinct.
+    """
+    stem, ext = filename.rsplit(".", 1)
+    taken[stem] += 1
+    suffix = f"-{taken[stem]}" if taken[stem] > 1 else ""
+    return f"Receipt_{invoice_number}_{stem.split('_', 1)[1]}{suffix}.{ext}"
+
+
+def build_invoice(job: Dict[str, Any], cache: StageCache, profiler: RunProfiler | None = None) -> Dict[str, Any]:
+    """Produce rows, LEDES text, PDF bytes and receipts for one invoice, reusing memoized stages.
+
+    `job` carries everything the "Generate Invoice(s)" loop used to pass positionally; see the
+    keys read below and in build_rows. Optional outputs are None (or empty) when their toggle is off.
+    """
+    def run(stage: str, inputs: Tuple, fn: Callable[[], Any]) -> Tuple[str, Any]:
+        return _run_stage(cache, profiler, stage, inputs, fn)
+
+    seed, index = job["seed"], job["index"]
+    start, end = job["billing_start_date"], job["billing_end_date"]
+    client_id, law_firm_id = job["client_id"], job["law_firm_id"]
+    rows_key, rows, total_amount = build_rows(job, cache, profiler)
+
+    invoice_number, matter_number = job["invoice_number"], job["matter_number"]
+    _, ledes = run("ledes", (rows_key, invoice_number, matter_number, job["ledes_header"]),
+                   lambda: _create_ledes_1998b_content(rows, total_amount, start, end, invoice_number, matter_number,
+                                                       is_first_invoice=job["ledes_header"]))
+
+    pdf = None
+    if job.get("include_pdf"):
+        logo_bytes = job.get("logo_bytes") or b""
+        _, pdf = run("pdf", (rows_key, invoice_number, job["invoice_date"], hashlib.sha256(logo_bytes).hexdigest(), job["include_logo"]),
+                     lambda: _create_pdf_invoice(pd.DataFrame(rows), total_amount, invoice_number, job["invoice_date"], start, end,
+                                                 client_id, law_firm_id, logo_bytes, job["include_logo"]).getvalue())
+
+    receipts = []
+    if job.get("generate_receipts"):
+        receipt_rows = [r for r in rows if r.get("EXPENSE_CODE") and r.get("EXPENSE_CODE") != "E101"]  # Exclude Copying (E101)
+
+        receipt_format = job["receipt_settings"].get("rcpt_format", "png")
+
+        def receipts_stage():
+            faker = _seeded_faker(seed, "receipts", index)
+            if receipt_format == "pdf-combined":
+                return [(f"Receipts_{invoice_number}.pdf", _create_receipts_pdf(receipt_rows, faker, job["receipt_settings"]).getvalue())] if receipt_rows else []
+            render = _create_receipt_pdf if receipt_format == "pdf" else _create_receipt_image
+            out, taken = [], Counter()
+            for row in receipt_rows:
+                filename, buf = render(row, faker, job["receipt_settings"])
+                if buf:
+                    out.append((_receipt_name(invoice_number, filename, taken), buf.getvalue()))
+            return out
+
+        _, receipts = run("receipts", (seed, index, invoice_number, receipt_rows, job["receipt_settings"]), receipts_stage)
+
+    return {"rows": rows, "total_amount": total_amount, "ledes": ledes, "pdf": pdf, "receipts": receipts}
+
+
+def _build_in_worker(job: Dict[str, Any], profile: bool = False) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]] | None]:
+    """Process-pool entry point: each worker keeps its own stage memo and RNG state.
+
+    Returns the built invoice and, with profile, its per-stage stats for the parent's RunProfiler."""
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = StageCache()
+    profiler = RunProfiler() if profile else None
+    out = build_invoice(job, _worker_cache, profiler)
+    return out, profiler.to_dict()["stages"] if profiler else None
+
+
+def shard_range(total: int, shard_index: int = 0, shard_count: int = 1) -> range:
+    """Contiguous, balanced slice of range(total) owned by one shard; the first total % shard_count shards get one extra."""
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is out of range for {shard_count} shard(s)")
+    size, extra = divmod(total, shard_count)
+    start = shard_index * size + min(shard_index, extra)
+    return range(start, start + size + (1 if shard_index < extra else 0))
+
+
+def _plan_axes(params: Dict[str, Any]) -> tuple[list[tuple[Any, Any]], list[str]]:
+    num_invoices = int(params.get("num_invoices", 1))
+    start, end = params["billing_start_date"], params["billing_end_date"]
+    if params.get("periods"):
+        periods = list(params["periods"])
+    elif params.get("multiple_periods"):
+        periods = plan_periods(start, end, num_invoices, params.get("period_cadence", "monthly"),
+                               params.get("fiscal_start_month", 1), params.get("period_days", 30))
+    else:
+        periods = [(start, end)] * num_invoices
+    return periods, list(params.get("matters") or [params["matter_number_base"]])
+
+
+def shortest_period(params: Dict[str, Any]) -> Tuple[Any, Any]:
+    """(start, end) of the shortest billing period plan_batch produces for params, which bounds the fee lines per invoice."""
+    periods, _ = _plan_axes(params)
+    return min(periods or [(params["billing_start_date"], params["billing_end_date"])], key=lambda p: p[1] - p[0])
+
+
+def plan_size(params: Dict[str, Any]) -> int:
+    """Number of invoices plan_batch produces for params when unsharded."""
+    periods, matters = _plan_axes(params)
+    return len(periods) * len(matters)
+
+
+def plan_batch(params: Dict[str, Any]) -> list[Dict[str, Any]]:
+    """Expand batch params into one build_invoice job per (matter, period), matter-major.
+
+    Periods come from params["periods"] when given, otherwise from the period planner when
+    "multiple_periods" is set (one per invoice, newest first), otherwise num_invoices copies of the
+    billing period. Descriptions are used one per period and cycle when there are fewer.
+    "index_offset" shifts invoice indexes (seeds and numbers) so several plans can share a run.
+    Spend rules (see spend_rules.batch_rules) are evaluated per invoice; "mandatory_items" on each job
+    names the rules that fire, and each fired rule that replaces a generated line takes one of its slots.
+    "anomalies" ({kind: fraction}, see anomalies.py) is validated here and applied by the rows stage.
+    With "shard_count" > 1 only the contiguous slice for "shard_index" is returned; every job keeps
+    its full-plan index, so shards are byte-identical to the same jobs in an unsharded run.
+    """
+    periods, matters = _plan_axes(params)
+    multiple_periods = bool(params.get("multiple_periods")) or bool(params.get("periods"))
+    combine_ledes = bool(params.get("combine_ledes"))
+    per_matter = bool(params.get("per_matter_ledes"))
+    descriptions = list(params["descriptions"])
+    rules = batch_rules(params)
+    anomalies = anomaly_fractions(params.get("anomalies"))
+    offset = int(params.get("index_offset", 0))
+    combined_pdf = params.get("pdf_mode") == "combined"
+    selected = shard_range(len(matters) * len(periods), int(params.get("shard_index", 0)), int(params.get("shard_count", 1)))
+
+    jobs = []
+    for m, matter_number in enumerate(matters):
+        for p, (period_start, period_end) in enumerate(periods):
+            local = m * len(periods) + p
+            if local not in selected:
+                continue
+            i = offset + local
+            fired = rules.fired(params["seed"], i) if rules else ()
+            fee_slots, expense_slots = rules.slots(fired) if rules else (0, 0)
+            jobs.append({
+                "seed": params["seed"], "index": i,
+                "fee_count": max(0, int(params["fees"]) - fee_slots), "expense_count": max(0, int(params["expenses"]) - expense_slots), "timekeeper_data": params.get("timekeeper_data"),
+                "client_id": params["client_id"], "law_firm_id": params["law_firm_id"],
+                "invoice_desc": descriptions[p % len(descriptions)] if multiple_periods else descriptions[0],
+                "billing_start_date": period_start, "billing_end_date": period_end,
+                "task_activity_desc": params["task_activity_desc"], "major_task_codes": params["major_task_codes"],
+                "max_daily_hours": params["max_daily_hours"], "include_block_billed": params.get("include_block_billed", False),
+                "fee_target_total": params.get("fee_target_total"),
+                "learned_model": params.get("learned_model"), "expense_settings": params["expense_settings"],
+                "spend_rules": rules, "mandatory_items": fired, "anomalies": anomalies,
+                "invoice_number": f"{params['invoice_number_base']}-{i+1}", "matter_number": matter_number,
+                "ledes_header": not (combine_ledes or per_matter) or (local == 0 if combine_ledes else p == 0),
+                "include_pdf": params.get("include_pdf", False) and not combined_pdf, "invoice_date": period_end,
+                "include_logo": params.get("include_logo", False), "logo_bytes": params.get("logo_bytes", b""),
+                "generate_receipts": params.get("generate_receipts", False), "receipt_settings": params["receipt_settings"],
+            })
+    return jobs
+
+
+def preview_lines(params: Dict[str, Any], cache: StageCache, limit: int = PREVIEW_LINES) -> Tuple[Dict[str, Any], list[Dict]]:
+    """(first job, its first `limit` line items) without building the rest of the batch.
+
+    Only the first invoice is planned, and only its fees, expenses and rows stages run (no LEDES,
+    PDF or receipts), so the cost does not grow with the batch size. The stages land in `cache`,
+    so a serial generate_batch with the same params reuses them for its first invoice.
+    """
+    first = plan_batch({**params, "shard_index": 0, "shard_count": max(1, plan_size(params))})
+    if not first:
+        raise ValueError("The batch plans no invoices")
+    job = first[0]
+    _, rows, _ = build_rows(job, cache)
+    return job, rows[:limit]
+
+
+def build_jobs(jobs: list[Dict[str, Any]], cache: StageCache, workers: int = 1, profiler: RunProfiler | None = None,
+               on_invoice: Callable[[int, int, Any, Any], None] | None = None,
+               on_built: Callable[[Dict[str, Any], Dict[str, Any]], None] | None = None,
+               spill: SpillStore | None = None) -> list[Dict[str, Any]]:
+    """build_invoice for every job, in order. With workers > 1 jobs run in a process pool; every stage
+    is seeded from (seed, stage, index), so the output is identical to a serial run. `on_built(job, out)`
+    is called as each invoice finishes (in completion order), e.g. to checkpoint it. With `spill`,
+    invoices finished after the store's memory threshold is crossed are held on disk.
+
+    In a process pool the profiler gets a "build" stage for the whole parallel section, plus each
+    worker's per-stage stats (fees, expenses, ..., receipts) summed over the workers, so stage wall
+    times can add up to more than the run's."""
+    total = len(jobs)
+    workers = min(int(workers or 1), total)
+    built: list[Dict[str, Any] | None] = [None] * total
+    if workers > 1:
+        stats_cm = profiler.stage("build") if profiler else contextlib.nullcontext()
+        with stats_cm as stats, ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(_build_in_worker, job, profiler is not None): n for n, job in enumerate(jobs)}
+            for done, fut in enumerate(as_completed(futures)):
+                n = futures[fut]
+                built[n], stages = fut.result()
+                if stages:
+                    profiler.merge(stages)
+                if on_built:
+                    on_built(jobs[n], built[n])
+                if on_invoice:
+                    on_invoice(done, total, jobs[n]["billing_start_date"], jobs[n]["billing_end_date"])
+                if stats is not None:
+                    stats.lines += len(built[n]["rows"])
+                if spill is not None:
+                    built[n] = spill.keep(built[n])
+    else:
+        for n, job in enumerate(jobs):
+            if on_invoice:
+                on_invoice(n, total, job["billing_start_date"], job["billing_end_date"])
+            built[n] = build_invoice(job, cache, profiler)
+            if on_built:
+                on_built(job, built[n])
+            if spill is not None:
+                built[n] = spill.keep(built[n])
+    return built
+
+
+def package_batch(jobs: list[Dict[str, Any]], built: list[Dict[str, Any]], combine_ledes: bool = False,
+                  per_matter_ledes: bool = False, combined_pdf: bool = False,
+                  profiler: RunProfiler | None = None, sidecar: bool = False,
+                  spill: SpillStore | None = None) -> Dict[str, Any]:
+    """Collect built invoices into attachments, combined LEDES text (when combining) and per-invoice metadata.
+
+    With combined_pdf, all invoices are rendered into one bookmarked Invoices_Combined.pdf (placed
+    first) instead of per-invoice PDFs. Lines tagged by the anomaly engine are listed in anomaly_labels.csv.
+    With sidecar, every line is also exported with its invoice metadata to lines.parquet (see sidecar.py).
+    With spill, attachments packaged after its memory threshold is crossed are held on disk, and the
+    combined outputs (combined and per-matter LEDES, combined PDF, sidecar) are written to its
+    ScratchFiles as they are produced; combined_ledes is then a ScratchFile rather than a str.
+    """
+    per_matter = per_matter_ledes and not combine_ledes
+    attachments: list[Tuple[str, bytes]] = spill.attachments() if spill is not None else []
+    combined_ledes: Any = spill.scratch(".txt") if spill is not None and combine_ledes else ""
+    matter_ledes: Dict[str, Any] = {}
+    invoices: list[Dict[str, Any]] = []
+    for job, out in zip(jobs, built):
+        if spill is not None:
+            spill.should_spill()
+        invoice_number = job["invoice_number"]
+        first_file = len(attachments)
+        if combine_ledes:
+            if spill is not None:
+                combined_ledes.write(out["ledes"] + "\n")
+            else:
+                combined_ledes += out["ledes"] + "\n"
+        elif per_matter:
+            if spill is None:
+                matter_ledes.setdefault(job["matter_number"], []).append(out["ledes"])
+            elif job["matter_number"] in matter_ledes:
+                matter_ledes[job["matter_number"]].write("\n" + out["ledes"])
+            else:
+                matter_ledes[job["matter_number"]] = spill.scratch(".txt")
+                matter_ledes[job["matter_number"]].write(out["ledes"])
+        else:
+            attachments.append((f"LEDES_1998B_{invoice_number}.txt", out["ledes"].encode('utf-8')))
+        if out["pdf"] is not None:
+            attachments.append((f"Invoice_{invoice_number}.pdf", out["pdf"]))
+        attachments.extend(out["receipts"])
+        invoices.append({
+            "index": job["index"], "invoice_number": invoice_number, "matter_number": job["matter_number"],
+            "client_id": job["client_id"], "law_firm_id": job["law_firm_id"],
+            "billing_start": job["billing_start_date"], "billing_end": job["billing_end_date"],
+            "invoice_desc": job["invoice_desc"], "fees_used": job["fee_count"], "expenses_used": job["expense_count"],
+            "rows": out["rows"], "total_amount": out["total_amount"],
+            "files": attachment_names(attachments, first_file),
+        })
+    labels = anomaly_labels(jobs, built)
+    if labels is not None:
+        attachments.append((LABELS_NAME, labels))
+    if sidecar and jobs:
+        with profiler.stage("sidecar") if profiler else contextlib.nullcontext() as stats:
+            if spill is not None:
+                name = SIDECAR_NAMES[sidecar_format()]
+                data = spill.scratch(os.path.splitext(name)[1])
+                write_sidecar(jobs, built, data.path)
+                size = data.size
+            else:
+                name, data = sidecar_bytes(jobs, built)
+                size = len(data)
+            if stats is not None:
+                stats.lines += sum(len(out["rows"]) for out in built)
+                stats.bytes += size
+        attachments.append((name, data))
+    attachments[:0] = [(f"LEDES_1998B_{matter_number}.txt", parts if spill is not None else "\n".join(parts).encode('utf-8'))
+                       for matter_number, parts in matter_ledes.items()]
+    if combined_pdf and jobs:
+        with profiler.stage("pdf") if profiler else contextlib.nullcontext() as stats:
+            pages = ({
+                "df": pd.DataFrame(out["rows"]), "total_amount": out["total_amount"], "invoice_number": job["invoice_number"],
+                "invoice_date": job["invoice_date"], "billing_start_date": job["billing_start_date"],
+                "billing_end_date": job["billing_end_date"], "client_id": job["client_id"], "law_firm_id": job["law_firm_id"],
+                "logo_bytes": job.get("logo_bytes") or b"", "include_logo": job["include_logo"],
+            } for job, out in zip(jobs, built))
+            if spill is not None:
+                pdf = spill.scratch(".pdf")
+                _create_batch_pdf(pages, pdf.path)
+                size = pdf.size
+            else:
+                pdf = _create_batch_pdf(pages).getvalue()
+                size = len(pdf)
+            if stats is not None:
+                stats.lines += 1
+                stats.bytes += size
+        attachments.insert(0, ("Invoices_Combined.pdf", pdf))
+    return {"attachments": attachments, "combined_ledes": combined_ledes if combine_ledes else None, "invoices": invoices}
+
+
+def generate_batch(params: Dict[str, Any], cache: StageCache, profiler: RunProfiler | None = None,
+                   on_invoice: Callable[[int, int, Any, Any], None] | None = None,
+                   on_built: Callable[[Dict[str, Any], Dict[str, Any]], None] | None = None) -> Dict[str, Any]:
+    """Run the "Generate Invoice(s)" loop headlessly; shared by the Streamlit handler, CLI and HTTP API.
+
+    params holds the batch-level settings (counts, dates, IDs, toggles; see plan_batch) plus
+    "workers" for process-parallel builds, "pdf_mode" ("individual" or "combined"), "sidecar"
+    (columnar line export) and "spill_threshold_mb"/"spill_dir" (hold invoices on disk past that RSS;
+    see spill_store.py). Returns the attachment list, combined LEDES text (when combining) and
+    per-invoice metadata, in plan order. `on_built` is passed to build_jobs.
+    """
+    jobs = plan_batch(params)
+    spill = spill_store_for(params)
+    built = build_jobs(jobs, cache, params.get("workers", 1), profiler, on_invoice, on_built, spill)
+    return package_batch(jobs, built, bool(params.get("combine_ledes")), bool(params.get("per_matter_ledes")),
+                         bool(params.get("include_pdf")) and params.get("pdf_mode") == "combined", profiler,
+                         bool(params.get("sidecar")), spill)
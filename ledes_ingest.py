@@ -0,0 +1,178 @@
+# --- ledes_ingest.py (learn generation templates from existing LEDES 1998B files) ---
+from __future__ import annotations
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import random
+from collections import Counter, defaultdict
+from itertools import accumulate
+from typing import Any, Dict, Iterator, Tuple
+
+from ids_store import DATA_DIR
+from ledes_parser import _open_binary, iter_ledes_1998b
+
+MODEL_VERSION = 1
+MODEL_CACHE_DIR = os.path.join(DATA_DIR, ".ledes_models")
+EXPENSE_SAMPLES_PER_CODE = 500
+
+
+def ledes_record_to_row(record: Dict[str, str]) -> Dict[str, Any]:
+    """Convert a parsed LEDES 1998B record into the row dict used by the generators."""
+    is_expense = record.get("EXP/FEE/INV_ADJ_TYPE", "F") in ("E", "IE")
+    try:
+        line_date = dt.datetime.strptime(record["LINE_ITEM_DATE"], "%Y%m%d").date().strftime("%Y-%m-%d")
+    except (KeyError, ValueError):
+        line_date = ""
+    units = float(record.get("LINE_ITEM_NUMBER_OF_UNITS") or 0)
+    return {
+        "INVOICE_DESCRIPTION": record.get("INVOICE_DESCRIPTION", ""),
+        "CLIENT_ID": record.get("CLIENT_ID", ""), "LAW_FIRM_ID": record.get("LAW_FIRM_ID", ""),
+        "LINE_ITEM_DATE": line_date, "TIMEKEEPER_NAME": record.get("TIMEKEEPER_NAME", ""),
+        "TIMEKEEPER_CLASSIFICATION": record.get("TIMEKEEPER_CLASSIFICATION", ""),
+        "TIMEKEEPER_ID": record.get("TIMEKEEPER_ID", ""), "TASK_CODE": record.get("LINE_ITEM_TASK_CODE", ""),
+        "ACTIVITY_CODE": record.get("LINE_ITEM_ACTIVITY_CODE", ""),
+        "EXPENSE_CODE": record.get("LINE_ITEM_EXPENSE_CODE", "") if is_expense else "",
+        "DESCRIPTION": record.get("LINE_ITEM_DESCRIPTION", ""),
+        "HOURS": int(units) if is_expense else units,
+        "RATE": float(record.get("LINE_ITEM_UNIT_COST") or 0),
+        "LINE_ITEM_TOTAL": float(record.get("LINE_ITEM_TOTAL") or 0),
+    }
+
+
+def iter_ledes_rows(source: Any) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Stream (line_no, row dict) pairs from a LEDES 1998B source."""
+    for line_no, record in iter_ledes_1998b(source):
+        try:
+            yield line_no, ledes_record_to_row(record)
+        except ValueError as e:
+            logging.error(f"Skipping unparseable LEDES line {line_no}: {e}")
+
+
+def _source_digest(source: Any) -> str:
+    """SHA-256 of a path, bytes, str content or file-like source, read in chunks.
+
+    The source is opened exactly as the parser opens it, so a str is a path only when the parser reads it as one.
+    """
+    h = hashlib.sha256()
+    fh, should_close = _open_binary(source)
+    try:
+        chunk = fh.read(1 << 20)
+        while chunk:  # b"" ends a binary stream, "" a text one
+            h.update(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            chunk = fh.read(1 << 20)
+    finally:
+        if should_close:
+            fh.close()
+        else:
+            fh.seek(0)
+    return h.hexdigest()
+
+
+def _learn_from_sources(sources: list[Any], rng: random.Random) -> Dict[str, Any]:
+    tasks: Counter = Counter()
+    tk_rates: Dict[str, Counter] = defaultdict(Counter)
+    tk_info: Dict[str, Tuple[str, str]] = {}
+    expense_counts: Counter = Counter()
+    expense_desc: Dict[str, Counter] = defaultdict(Counter)
+    expense_samples: Dict[str, list] = defaultdict(list)
+    lines = 0
+    for source in sources:
+        for _, row in iter_ledes_rows(source):
+            lines += 1
+            code = row["EXPENSE_CODE"]
+            if code:
+                expense_counts[code] += 1
+                expense_desc[code][row["DESCRIPTION"]] += 1
+                # Reservoir sample of (units, rate) keeps memory bounded on very large inputs
+                samples = expense_samples[code]
+                sample = [row["HOURS"], row["RATE"]]
+                if len(samples) < EXPENSE_SAMPLES_PER_CODE:
+                    samples.append(sample)
+                else:
+                    j = rng.randrange(expense_counts[code])
+                    if j < EXPENSE_SAMPLES_PER_CODE:
+                        samples[j] = sample
+            else:
+                if row["TASK_CODE"] or row["DESCRIPTION"]:
+                    tasks[(row["TASK_CODE"], row["ACTIVITY_CODE"], row["DESCRIPTION"])] += 1
+                tk_id = row["TIMEKEEPER_ID"]
+                if tk_id:
+                    tk_rates[tk_id][row["RATE"]] += 1
+                    tk_info.setdefault(tk_id, (row["TIMEKEEPER_NAME"], row["TIMEKEEPER_CLASSIFICATION"]))
+    return {
+        "version": MODEL_VERSION,
+        "lines": lines,
+        "task_activity_desc": [[t, a, d, n] for (t, a, d), n in tasks.most_common()],
+        "timekeepers": [
+            {"TIMEKEEPER_NAME": tk_info[tk_id][0], "TIMEKEEPER_CLASSIFICATION": tk_info[tk_id][1],
+             "TIMEKEEPER_ID": tk_id, "RATE": rates.most_common(1)[0][0], "LINES": sum(rates.values())}
+            for tk_id, rates in tk_rates.items()
+        ],
+        "expenses": {
+            code: {"count": n, "description": expense_desc[code].most_common(1)[0][0], "samples": expense_samples[code]}
+            for code, n in expense_counts.most_common()
+        },
+    }
+
+
+def learn_ledes_model(sources: list[Any], use_cache: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """Build (or load from the on-disk cache) a template model from one or more LEDES 1998B files.
+
+    The model holds weighted task/activity/description tuples, one roster entry per timekeeper with
+    their most frequent rate, and per expense code a bounded sample of (units, rate) pairs.
+    """
+    if not isinstance(sources, (list, tuple)):
+        sources = [sources]
+    key = hashlib.sha256("".join(sorted(_source_digest(s) for s in sources)).encode("ascii")).hexdigest()
+    cache_path = os.path.join(MODEL_CACHE_DIR, f"{key}.json")
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                model = json.load(f)
+            if model.get("version") == MODEL_VERSION:
+                return model
+        except Exception as e:
+            logging.error(f"Ignoring unreadable LEDES model cache {cache_path}: {e}")
+    model = _learn_from_sources(list(sources), random.Random(seed))
+    model["key"] = key
+    if use_cache:
+        try:
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            tmp = cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(model, f)
+            os.replace(tmp, cache_path)
+        except Exception as e:
+            logging.error(f"Could not write LEDES model cache: {e}")
+    return model
+
+
+def _cum_weights(model: Dict[str, Any], name: str, weights: list[int]) -> list[int]:
+    cache = model.setdefault("_cum", {})
+    if name not in cache:
+        cache[name] = list(accumulate(weights))
+    return cache[name]
+
+
+def sample_task_activity(model: Dict[str, Any]) -> tuple[str, str, str]:
+    """Pick a (task, activity, description) tuple with the learned frequencies."""
+    items = model["task_activity_desc"]
+    t, a, d, _ = random.choices(items, cum_weights=_cum_weights(model, "tasks", [i[3] for i in items]))[0]
+    return t, a, d
+
+
+def sample_expense(model: Dict[str, Any]) -> tuple[str, str, float, float]:
+    """Pick an (expense_code, description, units, rate) tuple with the learned frequencies and amounts."""
+    codes = list(model["expenses"])
+    code = random.choices(codes, cum_weights=_cum_weights(model, "expenses", [model["expenses"][c]["count"] for c in codes]))[0]
+    entry = model["expenses"][code]
+    units, rate = random.choice(entry["samples"])
+    return code, entry["description"], units, rate
+
+
+def learned_model_summary(model: Dict[str, Any]) -> str:
+    return (f"{model.get('lines', 0)} lines: {len(model.get('task_activity_desc', []))} task/activity descriptions, "
+            f"{len(model.get('timekeepers', []))} timekeepers, {len(model.get('expenses', {}))} expense codes")
+
@@ -0,0 +1,243 @@
+# --- ledes_parser.py (streaming LEDES 1998B reader/validator) ---
+from __future__ import annotations
+import datetime as dt
+import io
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Tuple
+
+LEDES_1998B_HEADER = "LEDES1998B[]"
+LEDES_1998B_FIELDS = (
+    "INVOICE_DATE", "INVOICE_NUMBER", "CLIENT_ID", "LAW_FIRM_MATTER_ID", "INVOICE_TOTAL",
+    "BILLING_START_DATE", "BILLING_END_DATE", "INVOICE_DESCRIPTION", "LINE_ITEM_NUMBER",
+    "EXP/FEE/INV_ADJ_TYPE", "LINE_ITEM_NUMBER_OF_UNITS", "LINE_ITEM_ADJUSTMENT_AMOUNT",
+    "LINE_ITEM_TOTAL", "LINE_ITEM_DATE", "LINE_ITEM_TASK_CODE", "LINE_ITEM_EXPENSE_CODE",
+    "LINE_ITEM_ACTIVITY_CODE", "TIMEKEEPER_ID", "LINE_ITEM_DESCRIPTION", "LAW_FIRM_ID",
+    "LINE_ITEM_UNIT_COST", "TIMEKEEPER_NAME", "TIMEKEEPER_CLASSIFICATION", "CLIENT_MATTER_ID",
+)
+NUM_FIELDS = len(LEDES_1998B_FIELDS)
+_FIELDS_LINE = ("|".join(LEDES_1998B_FIELDS) + "[]").encode("ascii")
+_LINE_TYPES = {b"F", b"E", b"IF", b"IE"}
+_READ_BUFFER = 1 << 20
+
+# Column positions used on the hot path
+(_INV_DATE, _INV_NUM, _CLIENT, _MATTER, _INV_TOTAL, _BILL_START, _BILL_END, _INV_DESC,
+ _LINE_NO, _TYPE, _UNITS, _ADJ, _LINE_TOTAL, _LINE_DATE, _TASK, _EXPENSE, _ACTIVITY,
+ _TK_ID, _DESC, _FIRM, _RATE, _TK_NAME, _TK_CLASS, _CLIENT_MATTER) = range(NUM_FIELDS)
+
+
+@dataclass
+class LedesValidationReport:
+    """Outcome of validating a LEDES 1998B file; errors are (line_no, message) pairs."""
+    errors: list[Tuple[int, str]] = field(default_factory=list)
+    line_count: int = 0
+    invoices: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    truncated: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def invoice_count(self) -> int:
+        return len(self.invoices)
+
+
+def _open_binary(source: Any):
+    """Return (binary file object, should_close) for a path, bytes, str content or file object."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(bytes(source)), True
+    if isinstance(source, os.PathLike) or (isinstance(source, str) and "\n" not in source and os.path.exists(source)):
+        return open(source, "rb", buffering=_READ_BUFFER), True
+    if isinstance(source, str):
+        return io.BytesIO(source.encode("utf-8")), True
+    if hasattr(source, "seek"):
+        try:
+            source.seek(0)
+        except Exception:
+            pass
+    return source, False
+
+
+def _iter_raw_lines(source: Any) -> Iterator[Tuple[int, bytes]]:
+    """Yield (line_no, line) with line endings stripped, reading the source in large buffered chunks."""
+    fh, should_close = _open_binary(source)
+    try:
+        for line_no, line in enumerate(fh, start=1):
+            if isinstance(line, str):
+                line = line.encode("utf-8")
+            yield line_no, line.rstrip(b"\r\n")
+    finally:
+        if should_close:
+            fh.close()
+
+
+def _to_cents(value: bytes) -> int:
+    return int(round(float(value) * 100))
+
+
+def _start_invoice(parts: list[bytes], line_no: int, err, parse_date) -> Dict[str, Any]:
+    """Check the invoice-level fields on the first line of a new invoice and open its running summary."""
+    if not parts[_INV_NUM]:
+        err(line_no, "INVOICE_NUMBER is empty")
+    try:
+        declared = _to_cents(parts[_INV_TOTAL])
+    except ValueError:
+        err(line_no, "INVOICE_TOTAL is not numeric")
+        declared = None
+    start, end = parse_date(parts[_BILL_START]), parse_date(parts[_BILL_END])
+    if start is None:
+        err(line_no, "BILLING_START_DATE is not a valid YYYYMMDD date")
+    if end is None:
+        err(line_no, "BILLING_END_DATE is not a valid YYYYMMDD date")
+    if start and end and start > end:
+        err(line_no, "BILLING_START_DATE is after BILLING_END_DATE")
+    if parse_date(parts[_INV_DATE]) is None:
+        err(line_no, "INVOICE_DATE is not a valid YYYYMMDD date")
+    return {
+        "first_line": line_no, "lines": 0, "total_cents": 0, "declared_cents": declared,
+        "header": (parts[_INV_TOTAL], parts[_BILL_START], parts[_BILL_END], parts[_INV_DATE]),
+        "ids": (parts[_CLIENT], parts[_FIRM]), "start": start, "end": end,
+    }
+
+
+def iter_ledes_1998b(source: Any) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Stream the line items of a (possibly combined) LEDES 1998B file as (line_no, field dict)."""
+    for line_no, line in _iter_raw_lines(source):
+        if not line.strip() or line == LEDES_1998B_HEADER.encode("ascii") or line == _FIELDS_LINE:
+            continue
+        if line.endswith(b"[]"):
+            line = line[:-2]
+        parts = line.decode("utf-8", errors="replace").split("|")
+        if len(parts) != NUM_FIELDS:
+            continue
+        yield line_no, dict(zip(LEDES_1998B_FIELDS, parts))
+
+
+def validate_ledes_1998b(source: Any, max_errors: int = 1000) -> LedesValidationReport:
+    """Validate structure, per-line totals, invoice totals and date ranges of a LEDES 1998B file.
+
+    Works in a single streaming pass so combined multi-gigabyte files are never held in memory;
+    only one small summary per invoice number is retained.
+    """
+    report = LedesValidationReport()
+    errors = report.errors
+    invoices = report.invoices
+    date_cache: Dict[bytes, dt.date | None] = {}
+
+    def err(line_no: int, message: str) -> None:
+        if len(errors) < max_errors:
+            errors.append((line_no, message))
+        else:
+            report.truncated = True
+
+    def parse_date(value: bytes) -> dt.date | None:
+        try:
+            return date_cache[value]
+        except KeyError:
+            pass
+        try:
+            parsed = dt.datetime.strptime(value.decode("ascii"), "%Y%m%d").date() if len(value) == 8 else None
+        except (ValueError, UnicodeDecodeError):
+            parsed = None
+        date_cache[value] = parsed
+        return parsed
+
+    header_line = LEDES_1998B_HEADER.encode("ascii")
+    header_seen = fields_seen = False
+    line_count = 0
+    fh, should_close = _open_binary(source)
+    try:
+        for line_no, line in enumerate(fh, start=1):
+            if isinstance(line, str):
+                line = line.encode("utf-8")
+            line = line.rstrip(b"\r\n")
+            if not fields_seen or not line[:1].isdigit():
+                # Data lines start with INVOICE_DATE; anything else is a header, blank or malformed line
+                stripped = line.strip()
+                if not stripped:
+                    continue
+                # A missing header or field name line is reported, and the line is then read as what it is
+                if not header_seen:
+                    header_seen = True
+                    if stripped == header_line:
+                        continue
+                    err(line_no, f"Expected header '{LEDES_1998B_HEADER}'")
+                    if not line[:1].isdigit() and stripped != _FIELDS_LINE:
+                        continue  # a malformed header
+                if not fields_seen:
+                    fields_seen = True
+                    if stripped == _FIELDS_LINE:
+                        continue
+                    if not line[:1].isdigit():
+                        err(line_no, "Field name line does not match the LEDES 1998B column list")
+                        continue
+                    err(line_no, "Field name line is missing")
+                elif stripped == _FIELDS_LINE or stripped == header_line:
+                    err(line_no, "Repeated header in the middle of the file")
+                    continue
+
+            if line[-2:] == b"[]":
+                line = line[:-2]
+            else:
+                err(line_no, "Line is not terminated with '[]'")
+            parts = line.split(b"|")
+            if len(parts) != NUM_FIELDS:
+                err(line_no, f"Expected {NUM_FIELDS} fields, found {len(parts)}")
+                continue
+            line_count += 1
+
+            inv_key = parts[_INV_NUM]
+            inv = invoices.get(inv_key)
+            if inv is None:
+                inv = invoices[inv_key] = _start_invoice(parts, line_no, err, parse_date)
+            elif (inv["header"] != (parts[_INV_TOTAL], parts[_BILL_START], parts[_BILL_END], parts[_INV_DATE])
+                  or inv["ids"] != (parts[_CLIENT], parts[_FIRM])):
+                err(line_no, f"Invoice-level fields differ from line {inv['first_line']} of invoice "
+                             f"{inv_key.decode('utf-8', 'replace')}")
+            if not parts[_CLIENT] or not parts[_FIRM]:
+                err(line_no, "CLIENT_ID or LAW_FIRM_ID is empty")
+            if parts[_TYPE] not in _LINE_TYPES:
+                err(line_no, f"Invalid EXP/FEE/INV_ADJ_TYPE '{parts[_TYPE].decode('utf-8', 'replace')}'")
+            n = inv["lines"] = inv["lines"] + 1
+
+            try:
+                if int(parts[_LINE_NO]) != n:
+                    err(line_no, f"LINE_ITEM_NUMBER {int(parts[_LINE_NO])} out of sequence (expected {n})")
+            except ValueError:
+                err(line_no, "LINE_ITEM_NUMBER is not an integer")
+
+            try:
+                line_total = float(parts[_LINE_TOTAL])
+                expected = float(parts[_UNITS]) * float(parts[_RATE]) + (float(parts[_ADJ]) if parts[_ADJ] else 0.0)
+            except ValueError:
+                err(line_no, "Units, unit cost, adjustment or total is not numeric")
+            else:
+                inv["total_cents"] += round(line_total * 100)
+                if abs(expected - line_total) > 0.0101:
+                    err(line_no, f"LINE_ITEM_TOTAL {line_total:.2f} != units x rate {expected:.2f}")
+
+            item_date = date_cache.get(parts[_LINE_DATE]) or parse_date(parts[_LINE_DATE])
+            if item_date is None:
+                err(line_no, "LINE_ITEM_DATE is not a valid YYYYMMDD date")
+            elif inv["start"] and inv["end"] and not (inv["start"] <= item_date <= inv["end"]):
+                err(line_no, f"LINE_ITEM_DATE {item_date:%Y-%m-%d} outside billing period")
+    finally:
+        if should_close:
+            fh.close()
+    report.line_count = line_count
+
+    if not header_seen:
+        err(0, "File is empty")
+    elif report.line_count == 0:
+        err(0, "File contains no line items")
+    for inv_key in list(invoices):
+        inv = invoices.pop(inv_key)
+        inv_num = inv_key.decode("utf-8", errors="replace")
+        declared = inv["declared_cents"]
+        if declared is not None and abs(declared - inv["total_cents"]) > 1:
+            err(inv["first_line"], f"INVOICE_TOTAL {declared / 100:.2f} for invoice {inv_num} does not match "
+                                   f"sum of line totals {inv['total_cents'] / 100:.2f}")
+        del inv["header"], inv["ids"]
+        invoices[inv_num] = inv
+    return report
@@ -0,0 +1,54 @@
+# --- line_dates.py (line-item dates as ordinals, formatted once per distinct day) ---
+"""Date handling for line items.
+
+Generators pick line dates as ordinal day numbers (billing start ordinal + day offset) and never
+build date objects per line. Formatting goes through a DateCache, one per invoice: each distinct
+day is formatted once and every further line on that day is a dict lookup. Rows keep
+LINE_ITEM_DATE as a "%Y-%m-%d" string, the format the PDF, receipts, sidecar and parsers read;
+a LEDES DateCache accepts those strings as keys too.
+"""
+from __future__ import annotations
+import datetime as dt
+from typing import Any
+
+ISO_FORMAT = "%Y-%m-%d"
+LEDES_FORMAT = "%Y%m%d"
+_STRING_FORMATS = (LEDES_FORMAT, "%m/%d/%Y")  # accepted besides ISO
+
+
+def to_ordinal(value: Any) -> int:
+    """Ordinal day of a date, datetime, ordinal int or date string (ISO, YYYYMMDD or MM/DD/YYYY).
+
+    Raises ValueError for anything else."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, dt.datetime):
+        return value.date().toordinal()
+    if isinstance(value, dt.date):
+        return value.toordinal()
+    if isinstance(value, str):
+        text = value.strip()
+        if len(text) == 10 and text[4] == "-":
+            return dt.date.fromisoformat(text).toordinal()
+        for fmt in _STRING_FORMATS:
+            try:
+                return dt.datetime.strptime(text, fmt).toordinal()
+            except ValueError:
+                pass
+    raise ValueError(f"Not a date: {value!r}")
+
+
+def to_date(value: Any) -> dt.date:
+    return dt.date.fromordinal(to_ordinal(value))
+
+
+class DateCache(dict):
+    """Formatted dates keyed by ordinal (or any to_ordinal input); each distinct key is formatted once."""
+
+    def __init__(self, fmt: str = ISO_FORMAT):
+        super().__init__()
+        self.fmt = fmt
+
+    def __missing__(self, day: Any) -> str:
+        value = self[day] = dt.date.fromordinal(to_ordinal(day)).strftime(self.fmt)
+        return value
@@ -0,0 +1,87 @@
+# --- logo_registry.py (validated, downsized, cached PDF logos) ---
+from __future__ import annotations
+import hashlib
+import io
+import os
+from functools import lru_cache
+from typing import Dict, Tuple
+
+from PIL import Image as PILImage, ImageDraw, ImageFont
+
+SUPPORTED_FORMATS = ("JPEG", "PNG")
+LOGO_RENDER_INCHES = 0.6
+LOGO_RENDER_DPI = 200
+LOGO_MAX_PX = int(LOGO_RENDER_INCHES * LOGO_RENDER_DPI)
+JPEG_QUALITY = 85
+
+_by_digest: Dict[str, bytes | None] = {}
+_by_path: Dict[str, Tuple[float, bytes | None]] = {}
+
+
+def image_format(image_bytes: bytes) -> str | None:
+    """PIL format name of an image that opens and verifies cleanly, else None."""
+    try:
+        img = PILImage.open(io.BytesIO(image_bytes))
+        img.verify()
+        return img.format
+    except Exception:
+        return None
+
+
+def _normalize(image_bytes: bytes) -> bytes | None:
+    if image_format(image_bytes) not in SUPPORTED_FORMATS:
+        return None
+    img = PILImage.open(io.BytesIO(image_bytes))
+    img.thumbnail((LOGO_MAX_PX, LOGO_MAX_PX))
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        flat = PILImage.new("RGB", img.size, "white")
+        flat.paste(img, mask=img.split()[-1])
+        img = flat
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def normalized_logo(image_bytes: bytes) -> bytes | None:
+    """JPEG/PNG bytes downsized to the rendered logo box and re-encoded as a small RGB JPEG.
+
+    Returns None for anything that is not a valid JPEG or PNG. Results are cached by SHA-256 of
+    the input, so a logo uploaded once is decoded once per process.
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    if digest not in _by_digest:
+        _by_digest[digest] = _normalize(image_bytes)
+    return _by_digest[digest]
+
+
+def logo_from_file(path: str) -> bytes | None:
+    """normalized_logo for a file on disk, cached until the file's mtime changes. None if missing or invalid."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _by_path.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = _by_path[path] = (mtime, normalized_logo(f.read()))
+    return cached[1]
+
+
+@lru_cache(maxsize=1)
+def placeholder_logo() -> bytes:
+    """Plain "Logo" tile used when no valid logo is available; rendered once."""
+    img = PILImage.new("RGB", (LOGO_MAX_PX, LOGO_MAX_PX), color="white")
+    draw = ImageDraw.Draw(img)
+    draw.text((10, 20), "Logo", font=ImageFont.load_default(), fill=(0, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def clear() -> None:
+    _by_digest.clear()
+    _by_path.clear()
+    placeholder_logo.cache_clear()
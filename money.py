@@ -0,0 +1,49 @@
+# --- money.py (amounts as integer cents, one formatter) ---
+"""Money arithmetic in integer cents.
+
+Line amounts are computed as cents: rates are rounded to the cent once, a line total is units x
+rate-in-cents rounded once, and every invoice, receipt and batch total is an integer sum. Rows keep
+RATE and LINE_ITEM_TOTAL as floats (the format the PDF, sidecar, UI and parsers read), but each is
+exactly cents / 100, so to_cents recovers the integer without drift and the LEDES INVOICE_TOTAL,
+the PDF total and the receipts reconcile to the cent. format_cents is the only money formatter.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Iterable
+
+UNIT_SCALE = 1000  # line_cents resolves units (hours, pages, miles) to a thousandth
+
+
+def to_cents(amount: Any) -> int:
+    """Integer cents of an amount (float, int, numeric string or numpy scalar), rounded to the nearest cent."""
+    return int(round(float(amount) * 100))
+
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+
+def line_cents(units: Any, rate_cents: int) -> int:
+    """Cents of units x rate, rounded half up once (units may be fractional hours)."""
+    return (int(round(float(units) * UNIT_SCALE)) * rate_cents + UNIT_SCALE // 2) // UNIT_SCALE
+
+
+def total_cents(rows: Iterable[Dict[str, Any]], field: str = "LINE_ITEM_TOTAL") -> int:
+    """Integer sum of a money field over rows."""
+    return sum(to_cents(row[field]) for row in rows)
+
+
+def split_cents(total: int, shares: Iterable[float]) -> list[int]:
+    """total split by relative shares into integer parts that add up to total exactly (remainder on the last)."""
+    shares = list(shares)
+    weight = sum(shares) or 1.0
+    parts = [int(total * s / weight) for s in shares[:-1]]
+    return parts + [total - sum(parts)] if shares else []
+
+
+def format_cents(cents: int, currency: str = "") -> str:
+    """"1234.56" (LEDES), or "$1,234.56" with thousands separators when a currency symbol is given."""
+    sign = "-" if cents < 0 else ""
+    whole, frac = divmod(abs(int(cents)), 100)
+    if currency:
+        return f"{sign}{currency}{whole:,}.{frac:02d}"
+    return f"{sign}{whole}.{frac:02d}"
@@ -0,0 +1,65 @@
+# --- period_planner.py (billing period calendars for multi-period backfill) ---
+from __future__ import annotations
+import calendar
+import datetime as dt
+
+CADENCES = {
+    "monthly": "Monthly",
+    "semi-monthly": "Semi-monthly (1st-15th, 16th-end)",
+    "weekly": "Weekly (Monday-Sunday)",
+    "fiscal-quarter": "Fiscal quarter",
+    "custom-days": "Custom length (days)",
+}
+
+
+def _add_months(year: int, month: int, delta: int) -> tuple[int, int]:
+    idx = year * 12 + (month - 1) + delta
+    return idx // 12, idx % 12 + 1
+
+
+def period_containing(day: dt.date, cadence: str = "monthly", fiscal_start_month: int = 1,
+                      period_days: int = 30) -> tuple[dt.date, dt.date]:
+    """(start, end) of the calendar period that contains `day`.
+
+    custom-days periods are fixed-length blocks anchored on 2000-01-01.
+    """
+    if cadence == "monthly":
+        return day.replace(day=1), day.replace(day=calendar.monthrange(day.year, day.month)[1])
+    if cadence == "semi-monthly":
+        if day.day <= 15:
+            return day.replace(day=1), day.replace(day=15)
+        return day.replace(day=16), day.replace(day=calendar.monthrange(day.year, day.month)[1])
+    if cadence == "weekly":
+        start = day - dt.timedelta(days=day.weekday())
+        return start, start + dt.timedelta(days=6)
+    if cadence == "fiscal-quarter":
+        offset = (day.month - fiscal_start_month) % 3
+        y, m = _add_months(day.year, day.month, -offset)
+        ey, em = _add_months(y, m, 2)
+        return dt.date(y, m, 1), dt.date(ey, em, calendar.monthrange(ey, em)[1])
+    if cadence == "custom-days":
+        if period_days < 1:
+            raise ValueError("period_days must be at least 1")
+        anchor = dt.date(2000, 1, 1)
+        start = anchor + dt.timedelta(days=((day - anchor).days // period_days) * period_days)
+        return start, start + dt.timedelta(days=period_days - 1)
+    raise ValueError(f"Unknown billing cadence {cadence!r}; expected one of {sorted(CADENCES)}")
+
+
+def plan_periods(start: dt.date, end: dt.date, count: int, cadence: str = "monthly",
+                 fiscal_start_month: int = 1, period_days: int = 30) -> list[tuple[dt.date, dt.date]]:
+    """Plan `count` billing periods, newest first.
+
+    The first period is the given start/end; each later one is the cadence period ending the day
+    before the previous period starts (so a mid-month start yields a partial first backfill, as
+    the original month-by-month loop did). The whole plan is returned up front so invoices for
+    different periods can be generated independently.
+    """
+    if count < 1:
+        return []
+    periods = [(start, end)]
+    for _ in range(count - 1):
+        prev_end = periods[-1][0] - dt.timedelta(days=1)
+        period_start, _ = period_containing(prev_end, cadence, fiscal_start_month, period_days)
+        periods.append((period_start, prev_end))
+    return periods
@@ -0,0 +1,122 @@
+# --- portfolio.py (multi-client / multi-firm / multi-matter generation) ---
+from __future__ import annotations
+import random
+import re
+from typing import Any, Callable, Dict
+
+import ids_store
+from invoice_pipeline import StageCache, build_jobs, package_batch, plan_batch
+from money import from_cents, total_cents
+from run_profiler import RunProfiler
+from spill_store import renamed_attachments, spill_store_for, text_data
+
+
+def entities_from_ids_store(entity_type: str, environment: str | None = None) -> list[Dict[str, Any]]:
+    """Clients or law firms saved in ids_store, as {"name", "ext_id", "weight"} entries."""
+    ids_store.init_db()
+    return [{"name": e["name"], "ext_id": e["ext_id"], "weight": 1.0}
+            for e in ids_store.fetch_entities(entity_type, environment)]
+
+
+def _weighted_sample(rng: random.Random, items: list[Dict[str, Any]], k: int) -> list[Dict[str, Any]]:
+    """k distinct items drawn with probability proportional to their "weight" (default 1)."""
+    keyed = [(rng.random() ** (1.0 / max(float(item.get("weight", 1.0)), 1e-9)), n) for n, item in enumerate(items)]
+    return [items[n] for _, n in sorted(keyed, reverse=True)[:k]]
+
+
+def plan_portfolio(clients: list[Dict[str, Any]], law_firms: list[Dict[str, Any]], seed: Any,
+                   firms_per_client: int = 1, matters_per_engagement: int | tuple[int, int] = 1,
+                   matter_number_base: str = "2025") -> list[Dict[str, Any]]:
+    """Assign law firms and matters to each client, deterministically for a seed.
+
+    Each client is billed by `firms_per_client` distinct firms, picked by firm weight. Every
+    (client, firm) engagement gets a fixed number of matters or a number drawn from a (min, max)
+    range; matter numbers are unique across the portfolio.
+    """
+    if not clients or not law_firms:
+        raise ValueError("A portfolio needs at least one client and one law firm")
+    rng = random.Random(f"{seed}:portfolio")
+    lo, hi = matters_per_engagement if isinstance(matters_per_engagement, (tuple, list)) else (matters_per_engagement,) * 2
+    engagements = []
+    matter_seq = 0
+    for client in clients:
+        for firm in _weighted_sample(rng, law_firms, min(firms_per_client, len(law_firms))):
+            matters = []
+            for _ in range(rng.randint(int(lo), int(hi))):
+                matter_seq += 1
+                matters.append(f"{matter_number_base}-{matter_seq:06d}")
+            engagements.append({
+                "client_name": client["name"], "client_id": client["ext_id"],
+                "law_firm_name": firm["name"], "law_firm_id": firm["ext_id"], "matters": matters,
+            })
+    return engagements
+
+
+def partition_name(engagement: Dict[str, Any], taken: set[str] | None = None) -> str:
+    """Folder for one client/firm pair's outputs; with `taken`, suffixed (-2, -3, ...) to differ from it, and added to it."""
+    base = name = re.sub(r"[^A-Za-z0-9._-]+", "_", f"{engagement['client_id']}__{engagement['law_firm_id']}")
+    if taken is not None:
+        n = 1
+        while name in taken:
+            n += 1
+            name = f"{base}-{n}"
+        taken.add(name)
+    return name
+
+
+def generate_portfolio(params: Dict[str, Any], engagements: list[Dict[str, Any]], cache: StageCache,
+                       profiler: RunProfiler | None = None,
+                       on_invoice: Callable[[int, int, Any, Any], None] | None = None,
+                       logo_for_firm: Callable[[str], bytes] | None = None,
+                       on_built: Callable[[Dict[str, Any], Dict[str, Any]], None] | None = None) -> Dict[str, Any]:
+    """Generate every engagement's invoices in one run, partitioned by client/law firm.
+
+    The timekeeper roster, task pool, learned model and settings in `params` are shared by all
+    engagements; only client, firm and matters vary. All invoices are planned up front and built
+    together (in a process pool when params["workers"] > 1), with indexes offset so seeds and
+    invoice numbers stay unique. Attachment names are prefixed with the partition folder.
+    `logo_for_firm`, when given, supplies each firm's PDF logo instead of params["logo_bytes"].
+    `on_built` is passed to build_jobs.
+    """
+    plans = []
+    offset = 0
+    logos: Dict[str, bytes] = {}
+    for engagement in engagements:
+        firm_id = engagement["law_firm_id"]
+        overrides = {"client_id": engagement["client_id"], "law_firm_id": firm_id,
+                     "matters": engagement["matters"], "index_offset": offset}
+        if logo_for_firm is not None and params.get("include_logo"):
+            if firm_id not in logos:
+                logos[firm_id] = logo_for_firm(firm_id)
+            overrides["logo_bytes"] = logos[firm_id]
+        jobs = plan_batch({**params, **overrides})
+        offset += len(jobs)
+        plans.append((engagement, jobs))
+    all_jobs = [job for _, jobs in plans for job in jobs]
+    spill = spill_store_for(params)
+    built = build_jobs(all_jobs, cache, params.get("workers", 1), profiler, on_invoice, on_built, spill)
+
+    attachments: list[tuple[str, bytes]] = spill.attachments() if spill is not None else []
+    invoices: list[Dict[str, Any]] = []
+    partitions: list[Dict[str, Any]] = []
+    start = 0
+    folders: set[str] = set()
+    for engagement, jobs in plans:
+        # IDs that sanitize alike, or a pair listed twice, must not merge into one folder
+        folder = partition_name(engagement, folders)
+        out = package_batch(jobs, built[start:start + len(jobs)], bool(params.get("combine_ledes")),
+                            bool(params.get("per_matter_ledes")),
+                            bool(params.get("include_pdf")) and params.get("pdf_mode") == "combined", profiler,
+                            bool(params.get("sidecar")), spill)
+        start += len(jobs)
+        if out["combined_ledes"] is not None:
+            attachments.append((f"{folder}/LEDES_Combined.txt", text_data(out["combined_ledes"])))
+        attachments.extend(renamed_attachments(out["attachments"], lambda filename: f"{folder}/{filename}"))
+        invoices.extend({**inv, "files": [f"{folder}/{name}" for name in inv["files"]]} for inv in out["invoices"])
+        partitions.append({
+            "folder": folder, "client": engagement["client_name"], "client_id": engagement["client_id"],
+            "law_firm": engagement["law_firm_name"], "law_firm_id": engagement["law_firm_id"],
+            "matters": len(engagement["matters"]), "invoices": len(out["invoices"]),
+            "total": from_cents(total_cents(out["invoices"], "total_amount")),
+        })
+    return {"attachments": attachments, "invoices": invoices, "partitions": partitions}
@@ -0,0 +1,73 @@
+# --- roster_synth.py (synthetic timekeeper rosters for large-firm scenarios) ---
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from faker_pool import build_faker_pool
+
+# Share of the roster per classification (roughly an AmLaw 100 leverage ratio).
+CLASSIFICATION_MIX = {"Partner": 0.28, "Associate": 0.42, "Paralegal": 0.30}
+# Hourly rate per classification: (median, log-normal sigma, floor, ceiling).
+RATE_BANDS = {
+    "Partner": (850.0, 0.28, 450.0, 2000.0),
+    "Associate": (525.0, 0.30, 250.0, 1100.0),
+    "Paralegal": (240.0, 0.25, 120.0, 450.0),
+}
+RATE_STEP = 5.0  # rates are billed in $5 increments
+ROSTER_COLUMNS = ["TIMEKEEPER_NAME", "TIMEKEEPER_CLASSIFICATION", "TIMEKEEPER_ID", "RATE"]
+
+
+@lru_cache(maxsize=8)
+def _roster_frame(size: int, seed: int, mix: tuple[tuple[str, float], ...]) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    labels = [label for label, _ in mix]
+    weights = np.array([w for _, w in mix], dtype=float)
+    classes = rng.choice(len(labels), size=size, p=weights / weights.sum())
+
+    rates = np.empty(size)
+    for n, label in enumerate(labels):
+        median, sigma, floor, ceiling = RATE_BANDS.get(label, RATE_BANDS["Associate"])
+        picked = classes == n
+        rates[picked] = rng.lognormal(np.log(median), sigma, int(picked.sum())).clip(floor, ceiling)
+    rates = np.round(rates / RATE_STEP) * RATE_STEP
+
+    pool = build_faker_pool()
+    first = np.array(pool.values["first_name"], dtype=object)
+    last = np.array([n.split()[-1] for n in pool.values["name"]], dtype=object)
+    initials = np.array([chr(c) for c in range(ord("A"), ord("Z") + 1)], dtype=object)
+    names = pd.Series(first[rng.integers(len(first), size=size)] + " " + initials[rng.integers(26, size=size)]
+                      + ". " + last[rng.integers(len(last), size=size)])
+    repeat = names.groupby(names).cumcount()
+    names = names.where(repeat == 0, names + " (" + (repeat + 1).astype(str) + ")")
+
+    return pd.DataFrame({
+        "TIMEKEEPER_NAME": names.to_numpy(),
+        "TIMEKEEPER_CLASSIFICATION": np.array(labels, dtype=object)[classes],
+        "TIMEKEEPER_ID": [f"TK{n:05d}" for n in range(1, size + 1)],
+        "RATE": rates,
+    }, columns=ROSTER_COLUMNS)
+
+
+def synthesize_roster(size: int, seed: int = 0, mix: Dict[str, float] | None = None) -> list[Dict]:
+    """`size` timekeepers in the TK.csv layout, drawn with vectorized sampling.
+
+    Classifications follow `mix` (default CLASSIFICATION_MIX) and each classification's rates
+    are log-normal around its RATE_BANDS median, clipped to the band and rounded to $5. Names
+    are unique. The same (size, seed, mix) always returns the same roster and is cached, so
+    every invoice of a batch (and every shard) shares one roster.
+    """
+    if size < 1:
+        raise ValueError("A roster needs at least one timekeeper")
+    mix_key = tuple(sorted((mix or CLASSIFICATION_MIX).items()))
+    if any(w < 0 for _, w in mix_key) or sum(w for _, w in mix_key) <= 0:
+        raise ValueError("Classification weights must be non-negative and not all zero")
+    return _roster_frame(int(size), int(seed), mix_key).to_dict(orient="records")
+
+
+def roster_summary(roster: list[Dict]) -> pd.DataFrame:
+    """Headcount and rate range per classification."""
+    df = pd.DataFrame(roster)
+    return df.groupby("TIMEKEEPER_CLASSIFICATION")["RATE"].agg(count="count", min="min", median="median", max="max").reset_index()
@@ -0,0 +1,135 @@
+# --- run_metrics.py (history of generation runs for the Admin dashboard) ---
+"""Every generation run as a row of the run_metrics table in app_data.db.
+
+record_run stores what a RunProfiler measured, with the shape of the batch and the settings
+that drive its cost:
+- invoices, lines and worker count;
+- wall/CPU seconds and peak RSS;
+- bytes per artifact type (LEDES, PDF, receipts, sidecar, ZIP);
+- per-stage timings as JSON;
+- a configuration label, so runs with the same settings can be compared.
+
+load_runs reads the history back as a DataFrame with throughput columns. compare_configs and
+stage_seconds summarize it for charting.
+"""
+from __future__ import annotations
+import datetime as dt
+import json
+import sqlite3
+from typing import Any, ContextManager, Dict
+
+import pandas as pd
+
+import ids_store
+from run_profiler import RunProfiler
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS run_metrics (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  started_at TEXT NOT NULL,
+  source TEXT NOT NULL,
+  config TEXT NOT NULL,
+  invoices INTEGER NOT NULL,
+  lines INTEGER NOT NULL,
+  workers INTEGER NOT NULL,
+  wall_s REAL NOT NULL,
+  cpu_s REAL NOT NULL,
+  peak_rss_bytes INTEGER,
+  peak_traced_bytes INTEGER,
+  artifact_bytes TEXT NOT NULL,
+  stages TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS run_metrics_started ON run_metrics(started_at);
+"""
+ARTIFACT_STAGES = ("ledes", "pdf", "receipts", "sidecar", "zip")
+COLUMNS = ["id", "started_at", "source", "config", "invoices", "lines", "workers", "wall_s", "cpu_s",
+           "peak_rss_bytes", "peak_traced_bytes", "artifact_bytes", "stages"]
+
+
+def _connect(db_path: str | None, write: bool = False) -> ContextManager[sqlite3.Connection]:
+    """ids_store's connection (busy timeout, BEGIN IMMEDIATE writes with retry) to the database holding run_metrics."""
+    ids_store.ensure_schema(SCHEMA, db_path)
+    return ids_store.get_conn(write, db_path)
+
+
+def config_label(params: Dict[str, Any]) -> str:
+    """Short description of the settings that drive a batch's cost, e.g. "20F/10E, 12 TK, 2w, PDF, receipts"."""
+    timekeepers = len(params.get("timekeeper_data") or [])
+    parts = [f"{params.get('fees', 0)}F/{params.get('expenses', 0)}E", f"{timekeepers} TK",
+             f"{int(params.get('workers') or 1)}w"]
+    if params.get("include_pdf"):
+        parts.append("combined PDF" if params.get("pdf_mode") == "combined" else "PDF")
+    for key, label in (("generate_receipts", "receipts"), ("sidecar", "sidecar"), ("anomalies", "anomalies"),
+                       ("spend_rules", "rules"), ("include_block_billed", "block billing")):
+        if params.get(key):
+            parts.append(label)
+    if params.get("spill_threshold_mb") is not None:
+        parts.append("spill")
+    return ", ".join(parts)
+
+
+def run_record(profiler: RunProfiler, params: Dict[str, Any], invoices: list[Dict[str, Any]],
+               source: str = "app", started_at: dt.datetime | None = None) -> Dict[str, Any]:
+    """The run_metrics row for a finished run (profiler stopped, invoices as returned by generate_batch)."""
+    stages = {name: s.as_dict() for name, s in profiler.stages.items()}
+    started_at = started_at or dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=profiler.wall_s)
+    return {
+        "started_at": started_at.isoformat(timespec="seconds"), "source": source, "config": config_label(params),
+        "invoices": len(invoices), "lines": sum(len(inv["rows"]) for inv in invoices),
+        "workers": int(params.get("workers") or 1), "wall_s": profiler.wall_s, "cpu_s": profiler.cpu_s,
+        "peak_rss_bytes": profiler.peak_rss_bytes or None, "peak_traced_bytes": profiler.peak_memory_bytes,
+        "artifact_bytes": json.dumps({name: stages[name]["bytes"] for name in ARTIFACT_STAGES if stages.get(name, {}).get("bytes")}),
+        "stages": json.dumps({name: {"wall_s": s["wall_s"], "cpu_s": s["cpu_s"], "calls": s["calls"], "cached": s["cached"]}
+                              for name, s in stages.items()}),
+    }
+
+
+def record_run(profiler: RunProfiler, params: Dict[str, Any], invoices: list[Dict[str, Any]],
+               source: str = "app", db_path: str | None = None) -> int:
+    """Append a finished run to the history; returns its id."""
+    record = run_record(profiler, params, invoices, source)
+    with _connect(db_path, write=True) as conn:
+        cursor = conn.execute(f"INSERT INTO run_metrics ({', '.join(record)}) VALUES ({', '.join('?' * len(record))})",
+                              tuple(record.values()))
+        return cursor.lastrowid
+
+
+def load_runs(limit: int = 1000, db_path: str | None = None) -> pd.DataFrame:
+    """The latest `limit` runs, oldest first, with lines_per_s, invoices_per_s and peak_rss_mb added."""
+    with _connect(db_path) as conn:
+        rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM run_metrics ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    runs = pd.DataFrame(rows[::-1], columns=COLUMNS)
+    runs["started_at"] = pd.to_datetime(runs["started_at"])
+    wall = runs["wall_s"].astype(float).where(runs["wall_s"] > 0)
+    runs["lines_per_s"] = (runs["lines"].astype(float) / wall).round(1)
+    runs["invoices_per_s"] = (runs["invoices"].astype(float) / wall).round(3)
+    runs["peak_rss_mb"] = (runs["peak_rss_bytes"].astype(float) / 2**20).round(1)
+    return runs
+
+
+def compare_configs(runs: pd.DataFrame) -> pd.DataFrame:
+    """One row per configuration label: run count, median throughput and wall time, worst peak RSS."""
+    if runs.empty:
+        return pd.DataFrame(columns=["config", "runs", "lines_per_s", "wall_s", "peak_rss_mb", "last_run"])
+    grouped = runs.groupby("config")
+    return pd.DataFrame({
+        "runs": grouped.size(), "lines_per_s": grouped["lines_per_s"].median(), "wall_s": grouped["wall_s"].median().round(2),
+        "peak_rss_mb": grouped["peak_rss_mb"].max(), "last_run": grouped["started_at"].max(),
+    }).reset_index().sort_values("last_run", ascending=False)
+
+
+def stage_seconds(runs: pd.DataFrame) -> pd.DataFrame:
+    """Wall seconds per stage (columns) for each run (indexed by id)."""
+    return pd.DataFrame([{name: s["wall_s"] for name, s in json.loads(stages).items()} for stages in runs["stages"]],
+                        index=runs["id"]).fillna(0.0)
+
+
+def artifact_bytes(runs: pd.DataFrame) -> pd.DataFrame:
+    """Bytes per artifact type (columns) for each run (indexed by id)."""
+    return pd.DataFrame([json.loads(sizes) for sizes in runs["artifact_bytes"]], index=runs["id"],
+                        columns=list(ARTIFACT_STAGES)).fillna(0).astype("int64")
+
+
+def clear_runs(db_path: str | None = None) -> None:
+    with _connect(db_path, write=True) as conn:
+        conn.execute("DELETE FROM run_metrics")
@@ -0,0 +1,172 @@
+# --- run_profiler.py (per-stage timing and optional cProfile/tracemalloc capture) ---
+from __future__ import annotations
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process; the peak RSS where the current one is not available, else 0."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageStats:
+    """Accumulated timings for one pipeline stage."""
+    __slots__ = ("calls", "cached", "wall_s", "cpu_s", "lines", "bytes")
+
+    def __init__(self):
+        self.calls = self.cached = self.lines = self.bytes = 0
+        self.wall_s = self.cpu_s = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class RunProfiler:
+    """Collects wall/CPU time, line and byte counts per stage of a generation run.
+
+    Stage timers are always cheap enough to leave on, and so is peak RSS, sampled as each stage
+    ends. cProfile and tracemalloc are opt-in because they slow generation noticeably; their
+    results are summarized when the run stops.
+    """
+
+    def __init__(self, capture_cprofile: bool = False, capture_memory: bool = False, top_n: int = 25):
+        self.capture_cprofile = capture_cprofile
+        self.capture_memory = capture_memory
+        self.top_n = top_n
+        self.stages: Dict[str, StageStats] = {}
+        self.wall_s = self.cpu_s = 0.0
+        self.peak_memory_bytes: int | None = None
+        self.peak_rss_bytes = 0
+        self.hot_functions: list[Dict[str, Any]] = []
+        self._profile: cProfile.Profile | None = None
+        self._t0 = self._c0 = 0.0
+        self._started_tracemalloc = False
+
+    def start(self) -> "RunProfiler":
+        self._t0, self._c0 = time.perf_counter(), time.process_time()
+        self.peak_rss_bytes = rss_bytes()
+        if self.capture_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if self.capture_cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def stop(self) -> "RunProfiler":
+        if self._profile is not None:
+            self._profile.disable()
+            self.hot_functions = self._top_functions(self._profile)
+            self._profile = None
+        if self._started_tracemalloc:
+            self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self.wall_s = time.perf_counter() - self._t0
+        self.cpu_s = time.process_time() - self._c0
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss_bytes())
+        return self
+
+    def __enter__(self) -> "RunProfiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        """Time a block; callers may add to .lines/.bytes and set .cached on the yielded stats."""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield stats
+        finally:
+            stats.calls += 1
+            stats.wall_s += time.perf_counter() - t0
+            stats.cpu_s += time.process_time() - c0
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss_bytes())
+
+    def merge(self, stages: Dict[str, Dict[str, Any]]) -> None:
+        """Add stage stats recorded by another profiler (its to_dict()["stages"], e.g. from a worker process)."""
+        for name, other in stages.items():
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            for key in StageStats.__slots__:
+                setattr(stats, key, getattr(stats, key) + other[key])
+
+    def _top_functions(self, profile: cProfile.Profile) -> list[Dict[str, Any]]:
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({"function": f"{func} ({filename.rsplit('/', 1)[-1]}:{line})", "calls": nc,
+                         "self_s": round(tt, 6), "cumulative_s": round(ct, 6)})
+        rows.sort(key=lambda r: r["self_s"], reverse=True)
+        return rows[:self.top_n]
+
+    def summary(self) -> list[Dict[str, Any]]:
+        """One row per stage, slowest first, with its share of total wall time."""
+        total = self.wall_s or sum(s.wall_s for s in self.stages.values()) or 1.0
+        rows = [{"stage": name, **s.as_dict(), "wall_pct": round(100.0 * s.wall_s / total, 1)} for name, s in self.stages.items()]
+        rows.sort(key=lambda r: r["wall_s"], reverse=True)
+        return rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "wall_s": self.wall_s, "cpu_s": self.cpu_s, "peak_memory_bytes": self.peak_memory_bytes,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "stages": {name: s.as_dict() for name, s in self.stages.items()},
+            "hot_functions": self.hot_functions,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_openmetrics(self, prefix: str = "ledes_gen") -> str:
+        """Render stage counters in the OpenMetrics text exposition format."""
+        metrics = (("stage_wall_seconds", "wall_s", "Wall-clock seconds spent in the stage"),
+                   ("stage_cpu_seconds", "cpu_s", "Process CPU seconds spent in the stage"),
+                   ("stage_calls", "calls", "Times the stage ran or was served from cache"),
+                   ("stage_cached", "cached", "Times the stage was served from cache"),
+                   ("stage_lines", "lines", "Line items or files produced by the stage"),
+                   ("stage_bytes", "bytes", "Bytes produced by the stage"))
+        out = []
+        for metric, attr, help_text in metrics:
+            out.append(f"# TYPE {prefix}_{metric} counter")
+            out.append(f"# HELP {prefix}_{metric} {help_text}.")
+            for name, s in self.stages.items():
+                out.append(f'{prefix}_{metric}_total{{stage="{name}"}} {getattr(s, attr)}')
+        out.append(f"# TYPE {prefix}_run_wall_seconds gauge")
+        out.append(f"{prefix}_run_wall_seconds {self.wall_s}")
+        out.append(f"# TYPE {prefix}_run_cpu_seconds gauge")
+        out.append(f"{prefix}_run_cpu_seconds {self.cpu_s}")
+        out.append(f"# TYPE {prefix}_run_peak_rss_bytes gauge")
+        out.append(f"{prefix}_run_peak_rss_bytes {self.peak_rss_bytes}")
+        if self.peak_memory_bytes is not None:
+            out.append(f"# TYPE {prefix}_run_peak_memory_bytes gauge")
+            out.append(f"{prefix}_run_peak_memory_bytes {self.peak_memory_bytes}")
+        out.append("# EOF")
+        return "\n".join(out) + "\n"
@@ -0,0 +1,175 @@
+# --- sharding.py (deterministic multi-node generation and shard merging) ---
+"""Split one large batch across machines and merge the results.
+
+Every node runs the same batch params plus its shard_index/shard_count. plan_batch keeps each
+job's full-plan index, so seeds, invoice numbers and file contents do not depend on how the batch
+was split. Each node writes its files and a shard.json manifest into its own directory; merge_shards
+then checks that the shards form one complete plan and writes the combined LEDES file(s) and a
+manifest.json covering every invoice.
+"""
+from __future__ import annotations
+import datetime as dt
+import itertools
+import json
+import os
+import shutil
+from typing import Any, Dict
+
+from anomalies import LABELS_NAME
+from invoice_pipeline import StageCache, generate_batch, plan_size, shard_range
+from money import from_cents, to_cents, total_cents
+from run_profiler import RunProfiler
+from sidecar import SIDECAR_NAMES, merge_sidecars
+from spill_store import ScratchFile, attachment_sources, text_data
+
+MANIFEST_VERSION = 1
+SHARD_MANIFEST = "shard.json"
+LEDES_HEADER_LINES = 2  # "LEDES1998B[]" and the field list
+
+
+def shard_dir_name(shard_index: int, shard_count: int) -> str:
+    return f"shard-{shard_index + 1:04d}-of-{shard_count:04d}"
+
+
+def _jsonable(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, (dt.date, dt.datetime)) else str(value)
+
+
+def write_shard(out_dir: str, params: Dict[str, Any], batch: Dict[str, Any]) -> Dict[str, Any]:
+    """Write one shard's generate_batch output and its shard.json manifest to out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    files = attachment_sources(batch["attachments"])  # spilled attachments are read back one at a time
+    if batch["combined_ledes"] is not None:
+        files = itertools.chain([("LEDES_Combined.txt", text_data(batch["combined_ledes"]))], files)
+    names = []
+    for filename, data in files:
+        path = os.path.join(out_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, ScratchFile):
+            shutil.copyfile(data.path, path)
+        else:
+            with open(path, "wb") as f:
+                f.write(data)
+        names.append(filename)
+    return write_shard_manifest(out_dir, params, batch["invoices"], names)
+
+
+def write_shard_manifest(out_dir: str, params: Dict[str, Any], invoices: list[Dict[str, Any]],
+                         file_names: list[str]) -> Dict[str, Any]:
+    """Write shard.json for a shard whose files are already in out_dir."""
+    shard_index, shard_count = int(params.get("shard_index", 0)), int(params.get("shard_count", 1))
+    total = plan_size(params)
+    selected = shard_range(total, shard_index, shard_count)
+    manifest = {
+        "version": MANIFEST_VERSION, "seed": params["seed"], "invoice_number_base": params["invoice_number_base"],
+        "shard_index": shard_index, "shard_count": shard_count, "total_invoices": total,
+        "start": selected.start, "stop": selected.stop,
+        "combine_ledes": bool(params.get("combine_ledes")),
+        "per_matter_ledes": bool(params.get("per_matter_ledes")) and not params.get("combine_ledes"),
+        "ledes_files": [name for name in file_names if name.startswith("LEDES_")],
+        "label_files": [name for name in file_names if name == LABELS_NAME],
+        "sidecar_files": [name for name in file_names if name in SIDECAR_NAMES.values()],
+        "invoices": [{
+            "index": inv["index"], "invoice_number": inv["invoice_number"], "matter_number": inv["matter_number"],
+            "billing_start": inv["billing_start"].isoformat(), "billing_end": inv["billing_end"].isoformat(),
+            "lines": len(inv["rows"]), "total_amount": from_cents(to_cents(inv["total_amount"])), "files": inv["files"],
+        } for inv in invoices],
+    }
+    with open(os.path.join(out_dir, SHARD_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, default=_jsonable)
+    return manifest
+
+
+def run_shard(params: Dict[str, Any], out_dir: str, profiler: RunProfiler | None = None) -> Dict[str, Any]:
+    """Generate params' shard and write it to out_dir; what each node runs."""
+    return write_shard(out_dir, params, generate_batch(params, StageCache(), profiler))
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def merge_shards(shard_dirs: list[str], out_dir: str) -> Dict[str, Any]:
+    """Validate a complete set of shard directories and write the merged LEDES and manifest.json to out_dir.
+
+    Combined and per-matter LEDES parts are concatenated in plan order, which reproduces the
+    unsharded files exactly. When each invoice was written to its own LEDES file, the files are
+    joined into one LEDES_Combined.txt with a single header. LEDES line item numbers restart on
+    each invoice (they are unique within an invoice); the manifest also gives every invoice a
+    "first_line" so lines can be numbered uniquely across the whole batch. Anomaly label files are
+    concatenated under one header, and line sidecars row group by row group.
+    """
+    shards = []
+    for shard_dir in shard_dirs:
+        with open(os.path.join(shard_dir, SHARD_MANIFEST), "r", encoding="utf-8") as f:
+            shards.append((json.load(f), shard_dir))
+    if not shards:
+        raise ValueError("No shards to merge")
+    shards.sort(key=lambda s: s[0]["shard_index"])
+    first = shards[0][0]
+    plan_keys = ("version", "seed", "invoice_number_base", "shard_count", "total_invoices", "combine_ledes", "per_matter_ledes")
+    for manifest, shard_dir in shards:
+        mismatched = [k for k in plan_keys if manifest[k] != first[k]]
+        if mismatched:
+            raise ValueError(f"Shard {shard_dir} belongs to a different batch ({', '.join(mismatched)} differ)")
+    indexes = [m["shard_index"] for m, _ in shards]
+    if indexes != list(range(first["shard_count"])):
+        missing = sorted(set(range(first["shard_count"])) - set(indexes))
+        raise ValueError(f"Expected shards 0..{first['shard_count'] - 1} exactly once; missing {missing}, got {indexes}")
+
+    invoices = []
+    next_line = 1
+    for manifest, shard_dir in shards:
+        for inv in manifest["invoices"]:
+            invoices.append({**inv, "shard": os.path.basename(os.path.normpath(shard_dir)), "first_line": next_line})
+            next_line += inv["lines"]
+    numbers = [inv["invoice_number"] for inv in invoices]
+    if len(set(numbers)) != len(numbers):
+        raise ValueError("Shards contain duplicate invoice numbers")
+    if len(invoices) != first["total_invoices"]:
+        raise ValueError(f"Shards hold {len(invoices)} invoice(s); the plan has {first['total_invoices']}")
+
+    sidecars = [(name, os.path.join(shard_dir, name)) for manifest, shard_dir in shards for name in manifest.get("sidecar_files", [])]
+    if len({name for name, _ in sidecars}) > 1:
+        raise ValueError("Shards wrote their line sidecars in different formats")
+
+    os.makedirs(out_dir, exist_ok=True)
+    merged: Dict[str, list[str]] = {}
+    for manifest, shard_dir in shards:
+        for name in manifest["ledes_files"]:
+            text = _read_text(os.path.join(shard_dir, name))
+            if manifest["combine_ledes"]:
+                merged.setdefault(name, []).append(text)
+            elif manifest["per_matter_ledes"]:
+                merged.setdefault(name, []).append(text + "\n")
+            else:
+                lines = text.split("\n")
+                if "LEDES_Combined.txt" in merged:
+                    lines = lines[LEDES_HEADER_LINES:]
+                merged.setdefault("LEDES_Combined.txt", []).append("\n".join(lines) + "\n")
+    for name, parts in merged.items():
+        text = "".join(parts)
+        if first["per_matter_ledes"]:
+            text = text[:-1]
+        with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    labels = [_read_text(os.path.join(shard_dir, name)) for manifest, shard_dir in shards for name in manifest.get("label_files", [])]
+    if labels:
+        with open(os.path.join(out_dir, LABELS_NAME), "w", encoding="utf-8") as f:
+            f.write(labels[0] + "".join(text.split("\n", 1)[1] for text in labels[1:]))
+
+    if sidecars:
+        merge_sidecars([path for _, path in sidecars], os.path.join(out_dir, sidecars[0][0]))
+
+    manifest = {
+        "version": MANIFEST_VERSION, "seed": first["seed"], "invoice_number_base": first["invoice_number_base"],
+        "shard_count": first["shard_count"], "total_invoices": first["total_invoices"],
+        "total_lines": next_line - 1, "total_amount": from_cents(total_cents(invoices, "total_amount")),
+        "ledes_files": sorted(merged), "label_files": [LABELS_NAME] if labels else [],
+        "sidecar_files": [sidecars[0][0]] if sidecars else [], "invoices": invoices,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
@@ -0,0 +1,162 @@
+# --- sidecar.py (columnar per-line export alongside the LEDES files) ---
+"""Every generated line with its invoice metadata and anomaly labels, ready for analytics.
+
+Written as Parquet when pyarrow is installed, otherwise as gzip-compressed CSV with the same
+columns. Lines are written in row groups of about ROW_GROUP_LINES (whole invoices per group), so a
+batch is never converted as one big table. read_sidecar loads either format into pandas.
+"""
+from __future__ import annotations
+import contextlib
+import gzip
+import io
+import os
+from typing import Any, BinaryIO, Dict, Iterable, Iterator
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # compressed CSV fallback
+    pa = pq = None
+
+SIDECAR_NAMES = {"parquet": "lines.parquet", "csv.gz": "lines.csv.gz"}
+ROW_GROUP_LINES = 65_536
+INVOICE_COLUMNS = ["INVOICE_NUMBER", "MATTER_NUMBER", "CLIENT_ID", "LAW_FIRM_ID", "BILLING_START_DATE",
+                   "BILLING_END_DATE", "INVOICE_DESCRIPTION", "LINE_ITEM_NUMBER"]
+LINE_COLUMNS = ["LINE_ITEM_DATE", "TIMEKEEPER_NAME", "TIMEKEEPER_CLASSIFICATION", "TIMEKEEPER_ID", "TASK_CODE",
+                "ACTIVITY_CODE", "EXPENSE_CODE", "DESCRIPTION", "HOURS", "RATE", "LINE_ITEM_TOTAL"]
+LABEL_COLUMNS = ["ANOMALY", "ANOMALY_FIELD", "ANOMALY_ORIGINAL"]
+SIDECAR_COLUMNS = INVOICE_COLUMNS + LINE_COLUMNS + LABEL_COLUMNS
+_NUMERIC = {"HOURS", "RATE", "LINE_ITEM_TOTAL"}
+_DATES = {"BILLING_START_DATE", "BILLING_END_DATE", "LINE_ITEM_DATE"}
+
+
+def sidecar_format() -> str:
+    return "parquet" if pq is not None else "csv.gz"
+
+
+def _schema():
+    def column_type(name: str):
+        if name in _NUMERIC:
+            return pa.float64()
+        if name in _DATES:
+            return pa.date32()
+        return pa.int32() if name == "LINE_ITEM_NUMBER" else pa.string()
+    return pa.schema([(name, column_type(name)) for name in SIDECAR_COLUMNS])
+
+
+def _columns(jobs: Iterable[Dict[str, Any]], built: Iterable[Dict[str, Any]],
+             group_lines: int) -> Iterator[Dict[str, list]]:
+    """Column lists for successive row groups of about group_lines lines (whole invoices per group)."""
+    columns: Dict[str, list] = {name: [] for name in SIDECAR_COLUMNS}
+    for job, out in zip(jobs, built):
+        rows = out["rows"]
+        n = len(rows)
+        invoice_values = (job["invoice_number"], job["matter_number"], job["client_id"], job["law_firm_id"],
+                          job["billing_start_date"], job["billing_end_date"], job["invoice_desc"])
+        for name, value in zip(INVOICE_COLUMNS, invoice_values):
+            columns[name].extend([value] * n)
+        columns["LINE_ITEM_NUMBER"].extend(range(1, n + 1))
+        for name in LINE_COLUMNS:
+            if name in _NUMERIC:
+                columns[name].extend(float(r.get(name) or 0.0) for r in rows)
+            else:
+                columns[name].extend(str(r.get(name, "")) for r in rows)
+        for name in LABEL_COLUMNS:
+            columns[name].extend(None if r.get(name) is None else str(r[name]) for r in rows)
+        if len(columns["LINE_ITEM_NUMBER"]) >= group_lines:
+            yield columns
+            columns = {name: [] for name in SIDECAR_COLUMNS}
+    if columns["LINE_ITEM_NUMBER"]:
+        yield columns
+
+
+def write_sidecar(jobs: Iterable[Dict[str, Any]], built: Iterable[Dict[str, Any]], target: str | BinaryIO,
+                  fmt: str | None = None, group_lines: int = ROW_GROUP_LINES) -> int:
+    """Write the lines of built invoices to target (a path or binary file) in fmt; returns the line count."""
+    fmt = fmt or sidecar_format()
+    if fmt not in SIDECAR_NAMES:
+        raise ValueError(f"Sidecar format must be one of {list(SIDECAR_NAMES)}")
+    if fmt == "parquet" and pq is None:
+        raise ValueError("Parquet sidecars need pyarrow (pip install pyarrow); use csv.gz instead")
+    lines = 0
+    if fmt == "parquet":
+        schema = _schema()
+        with pq.ParquetWriter(target, schema, compression="zstd") as writer:
+            for columns in _columns(jobs, built, group_lines):
+                line_dates = pa.array(columns["LINE_ITEM_DATE"], pa.string()).cast(pa.date32())
+                arrays = [line_dates if name == "LINE_ITEM_DATE" else pa.array(columns[name], schema.field(name).type)
+                          for name in SIDECAR_COLUMNS]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                lines += len(columns["LINE_ITEM_NUMBER"])
+            if not lines:
+                writer.write_table(schema.empty_table())
+        return lines
+    with contextlib.ExitStack() as stack:
+        if isinstance(target, (str, os.PathLike)):
+            target = stack.enter_context(open(target, "wb"))
+        # No file name and mtime=0 in the gzip header: identical batches give identical bytes wherever they are written
+        raw = gzip.GzipFile(filename="", fileobj=target, mode="wb", mtime=0)
+        with io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+            header = True
+            for columns in _columns(jobs, built, group_lines):
+                pd.DataFrame(columns, columns=SIDECAR_COLUMNS).to_csv(f, index=False, header=header)
+                header = False
+                lines += len(columns["LINE_ITEM_NUMBER"])
+            if header:
+                f.write(",".join(SIDECAR_COLUMNS) + "\n")
+    return lines
+
+
+def sidecar_bytes(jobs: list[Dict[str, Any]], built: list[Dict[str, Any]], fmt: str | None = None) -> tuple[str, bytes]:
+    """(file name, contents) of the sidecar for an in-memory batch."""
+    fmt = fmt or sidecar_format()
+    buf = io.BytesIO()
+    write_sidecar(jobs, built, buf, fmt)
+    return SIDECAR_NAMES[fmt], buf.getvalue()
+
+
+def read_sidecar(source: str | bytes) -> pd.DataFrame:
+    """Load a sidecar written by write_sidecar (path or bytes; the format is detected from its content)."""
+    data = source if isinstance(source, bytes) else None
+    if data is None:
+        with open(source, "rb") as f:
+            magic = f.read(4)
+    else:
+        magic = data[:4]
+    handle = io.BytesIO(data) if data is not None else source
+    if magic == b"PAR1":
+        return pd.read_parquet(handle)
+    # Text columns stay text (matter numbers and IDs can look numeric), as in the Parquet schema
+    dtypes = {name: str for name in SIDECAR_COLUMNS if name not in _NUMERIC}
+    dtypes["LINE_ITEM_NUMBER"] = "int32"
+    df = pd.read_csv(handle, compression="gzip", keep_default_na=False,
+                     na_values={name: [""] for name in LABEL_COLUMNS}, dtype=dtypes)
+    for name in _DATES:
+        df[name] = pd.to_datetime(df[name]).dt.date
+    return df
+
+
+def merge_sidecars(paths: list[str], out_path: str) -> int:
+    """Concatenate sidecars of one format (e.g. one per shard) into out_path, a row group at a time."""
+    lines = 0
+    if paths[0].endswith(".parquet"):
+        with pq.ParquetWriter(out_path, _schema(), compression="zstd") as writer:
+            for path in paths:
+                parquet = pq.ParquetFile(path)
+                for group in range(parquet.num_row_groups):
+                    table = parquet.read_row_group(group)
+                    writer.write_table(table)
+                    lines += table.num_rows
+        return lines
+    with open(out_path, "wb") as raw, gzip.GzipFile(filename="", fileobj=raw, mode="wb", mtime=0) as out:
+        for n, path in enumerate(paths):
+            with gzip.open(path, "rb") as f:
+                header = f.readline()
+                if n == 0:
+                    out.write(header)
+                for line in f:
+                    out.write(line)
+                    lines += 1
+    return lines
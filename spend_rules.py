@@ -0,0 +1,264 @@
+# --- spend_rules.py (declarative mandatory-item rules for spend-agent scenarios) ---
+"""Mandatory line items described as data instead of code.
+
+A rule set is JSON or YAML, either a list of rules or {"rules": [...]}:
+
+    rules:
+      - name: KBCG
+        type: fee                    # fee or expense
+        description: Commenced data entry into the KBCG e-licensing portal
+        timekeeper: Tom Delaganis    # or classification: Partner (a random one), or neither (any)
+        task: L140
+        activity: A107
+        hours: [0.5, 8.0]            # fee lines: hours drawn uniformly, 0.1h steps
+      - name: Uber E110
+        type: expense
+        description: 10-mile Uber ride to client's office
+        expense_code: E110
+        units: [1, 10]               # expense lines: whole units and a unit rate
+        rate: [5.0, 100.0]
+        when: {every: 10, offset: 3} # invoices 3, 13, 23, ...; or {probability: 0.2}; both must hold
+        replaces_generated: true     # the line takes one of the invoice's generated fee/expense slots
+
+compile_rules validates a spec once and returns a RuleSet. plan_batch asks it which rules fire for
+each invoice (a pure function of seed, invoice index and rule name, so shards and workers agree)
+and the rows stage injects those lines, looking timekeepers up by name or classification in an index
+built once per roster.
+"""
+from __future__ import annotations
+import datetime as dt
+import hashlib
+import json
+import os
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable
+
+from invoice_engine import CONFIG
+from line_dates import DateCache
+from money import from_cents, line_cents, to_cents
+
+RULE_TYPES = ("fee", "expense")
+DEFAULT_HOURS = (0.5, 8.0)
+DEFAULT_UNITS = (1, 10)
+DEFAULT_RATE = (5.0, 100.0)
+
+
+@dataclass(frozen=True)
+class Rule:
+    """One compiled rule; see the module docstring for the fields' meaning."""
+    name: str
+    type: str
+    description: str
+    timekeeper: str = ""
+    classification: str = ""
+    task: str = ""
+    activity: str = ""
+    expense_code: str = ""
+    hours: tuple[float, float] = DEFAULT_HOURS
+    units: tuple[int, int] = DEFAULT_UNITS
+    rate: tuple[float, float] = DEFAULT_RATE
+    probability: float = 1.0
+    every: int = 1
+    offset: int = 0
+    replaces_generated: bool = True
+
+    def fires(self, seed: Any, index: int) -> bool:
+        if index < self.offset or (index - self.offset) % self.every:
+            return False
+        if self.probability >= 1.0:
+            return True
+        digest = hashlib.blake2b(f"{seed}:{self.name}:{index}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2**64 < self.probability
+
+
+def _pair(spec: Dict[str, Any], key: str, default: tuple, cast, name: str) -> tuple:
+    value = spec.get(key, default)
+    if not (isinstance(value, (list, tuple)) and len(value) == 2):
+        raise ValueError(f"Rule {name!r}: {key} must be a [low, high] pair")
+    low, high = cast(value[0]), cast(value[1])
+    if low < 0 or low > high:
+        raise ValueError(f"Rule {name!r}: {key} needs 0 <= low <= high")
+    return low, high
+
+
+def _compile_rule(spec: Any) -> Rule:
+    if not isinstance(spec, dict):
+        raise ValueError("Each rule must be a mapping")
+    name = str(spec.get("name") or "").strip()
+    if not name:
+        raise ValueError("Every rule needs a name")
+    kind = spec.get("type") or ("expense" if spec.get("expense_code") else "fee")
+    if kind not in RULE_TYPES:
+        raise ValueError(f"Rule {name!r}: type must be one of {RULE_TYPES}")
+    if not spec.get("description"):
+        raise ValueError(f"Rule {name!r}: description is required")
+    if kind == "expense" and not spec.get("expense_code"):
+        raise ValueError(f"Rule {name!r}: expense rules need an expense_code")
+    when = spec.get("when") or {}
+    if not isinstance(when, dict):
+        raise ValueError(f"Rule {name!r}: when must be a mapping")
+    unknown = set(when) - {"probability", "every", "offset"}
+    if unknown:
+        raise ValueError(f"Rule {name!r}: unknown condition(s) {sorted(unknown)}")
+    probability, every, offset = float(when.get("probability", 1.0)), int(when.get("every", 1)), int(when.get("offset", 0))
+    if not 0.0 <= probability <= 1.0:
+        raise ValueError(f"Rule {name!r}: probability must be between 0 and 1")
+    if every < 1 or offset < 0:
+        raise ValueError(f"Rule {name!r}: every must be at least 1 and offset non-negative")
+    return Rule(
+        name=name, type=kind, description=str(spec["description"]),
+        timekeeper=str(spec.get("timekeeper") or ""), classification=str(spec.get("classification") or ""),
+        task=str(spec.get("task") or ""), activity=str(spec.get("activity") or ""),
+        expense_code=str(spec.get("expense_code") or ""),
+        hours=_pair(spec, "hours", DEFAULT_HOURS, float, name), units=_pair(spec, "units", DEFAULT_UNITS, int, name),
+        rate=_pair(spec, "rate", DEFAULT_RATE, float, name),
+        probability=probability, every=every, offset=offset,
+        replaces_generated=bool(spec.get("replaces_generated", True)),
+    )
+
+
+class RuleSet:
+    """Compiled, ordered rules. Picklable, so it travels inside jobs to worker processes."""
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = tuple(rules)
+        names = [r.name for r in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Rule names must be unique")
+        self._by_name = {r.name: r for r in self.rules}
+        self.key = hashlib.sha256(repr(self.rules).encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @property
+    def names(self) -> list[str]:
+        return [r.name for r in self.rules]
+
+    def only(self, names: Iterable[str]) -> RuleSet:
+        """The rules named in `names`, in rule-set order; unknown names are ignored."""
+        wanted = set(names)
+        return RuleSet(r for r in self.rules if r.name in wanted)
+
+    def fired(self, seed: Any, index: int) -> tuple[str, ...]:
+        """Names of the rules that inject a line into invoice `index` of a batch seeded `seed`."""
+        return tuple(r.name for r in self.rules if r.fires(seed, index))
+
+    def slots(self, fired: Iterable[str]) -> tuple[int, int]:
+        """(fee, expense) generated lines taken over by the fired rules."""
+        taken = [self._by_name[n] for n in fired if self._by_name[n].replaces_generated]
+        return sum(r.type == "fee" for r in taken), sum(r.type == "expense" for r in taken)
+
+    def apply(self, rows: list[Dict], fired: Iterable[str], timekeepers: list[Dict] | None, invoice_desc: str,
+              client_id: str, law_firm_id: str, billing_start_date: dt.date, billing_end_date: dt.date) -> list[Dict]:
+        """Append one line per fired rule to rows (drawing dates and amounts from the module RNG)."""
+        num_days = max(1, (billing_end_date - billing_start_date).days + 1)
+        index = timekeeper_index(timekeepers)
+        start_day, iso_dates = billing_start_date.toordinal(), DateCache()
+        for name in fired:
+            rule = self._by_name[name]
+            row = {
+                "INVOICE_DESCRIPTION": invoice_desc, "CLIENT_ID": client_id, "LAW_FIRM_ID": law_firm_id,
+                "LINE_ITEM_DATE": iso_dates[start_day + random.randint(0, num_days - 1)], "TIMEKEEPER_NAME": "",
+                "TIMEKEEPER_CLASSIFICATION": "", "TIMEKEEPER_ID": "", "TASK_CODE": "", "ACTIVITY_CODE": "",
+                "EXPENSE_CODE": "", "DESCRIPTION": rule.description,
+            }
+            if rule.type == "expense":
+                row.update(EXPENSE_CODE=rule.expense_code, HOURS=random.randint(*rule.units),
+                           RATE=from_cents(to_cents(random.uniform(*rule.rate))))
+            else:
+                tk = index.pick(rule)
+                row.update(TASK_CODE=rule.task, ACTIVITY_CODE=rule.activity, HOURS=round(random.uniform(*rule.hours), 1),
+                           TIMEKEEPER_NAME=rule.timekeeper or (tk or {}).get("TIMEKEEPER_NAME", ""), RATE=0.0)
+                if tk is not None:
+                    row["TIMEKEEPER_ID"] = tk.get("TIMEKEEPER_ID", "")
+                    row["TIMEKEEPER_CLASSIFICATION"] = tk.get("TIMEKEEPER_CLASSIFICATION", "")
+                    row["RATE"] = float(tk.get("RATE", 0.0))
+            row["LINE_ITEM_TOTAL"] = from_cents(line_cents(row["HOURS"], to_cents(row["RATE"])))
+            rows.append(row)
+        return rows
+
+
+class TimekeeperIndex:
+    """Timekeepers by lower-cased name and by classification."""
+
+    def __init__(self, timekeepers: list[Dict] | None):
+        self.timekeepers = list(timekeepers or [])
+        self.by_name: Dict[str, Dict] = {}
+        self.by_class: Dict[str, list[Dict]] = {}
+        for tk in self.timekeepers:
+            self.by_name.setdefault(str(tk.get("TIMEKEEPER_NAME", "")).strip().lower(), tk)
+            self.by_class.setdefault(str(tk.get("TIMEKEEPER_CLASSIFICATION", "")).strip().lower(), []).append(tk)
+
+    def pick(self, rule: Rule) -> Dict | None:
+        """The rule's named timekeeper (else the first on the roster), or a random one of its classification."""
+        if not self.timekeepers:
+            return None
+        if rule.timekeeper:
+            return self.by_name.get(rule.timekeeper.strip().lower(), self.timekeepers[0])
+        return random.choice(self.by_class.get(rule.classification.strip().lower()) or self.timekeepers)
+
+
+_last_index: tuple[list[Dict] | None, TimekeeperIndex] | None = None
+
+
+def timekeeper_index(timekeepers: list[Dict] | None) -> TimekeeperIndex:
+    """TimekeeperIndex for a roster, rebuilt only when a different roster list is passed."""
+    global _last_index
+    if _last_index is None or _last_index[0] is not timekeepers:
+        _last_index = (timekeepers, TimekeeperIndex(timekeepers))
+    return _last_index[1]
+
+
+def compile_rules(spec: Any) -> RuleSet:
+    """RuleSet from a parsed spec: a list of rule mappings or {"rules": [...]}. Raises ValueError when invalid."""
+    if isinstance(spec, dict):
+        spec = spec.get("rules")
+    if not isinstance(spec, list):
+        raise ValueError("A rule set is a list of rules or a mapping with a 'rules' list")
+    return RuleSet(_compile_rule(s) for s in spec)
+
+
+def parse_rules(text: str | bytes) -> RuleSet:
+    """Compile rules from JSON or YAML text (YAML needs PyYAML)."""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    try:
+        spec = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("Rules are not valid JSON, and reading YAML rules needs PyYAML (pip install pyyaml)")
+        try:
+            spec = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Rules are neither valid JSON nor valid YAML: {e}")
+    return compile_rules(spec)
+
+
+def load_rules(path: str | os.PathLike) -> RuleSet:
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_rules(f.read())
+
+
+def rules_from_items(items: Dict[str, Dict[str, Any]]) -> RuleSet:
+    """RuleSet equivalent to a CONFIG['MANDATORY_ITEMS']-style dict (every item on every invoice)."""
+    return compile_rules([{
+        "name": name, "type": "expense" if item.get("is_expense") else "fee", "description": item["desc"],
+        "timekeeper": item.get("tk_name"), "task": item.get("task"), "activity": item.get("activity"),
+        "expense_code": item.get("expense_code"),
+    } for name, item in items.items()])
+
+
+DEFAULT_RULES = rules_from_items(CONFIG['MANDATORY_ITEMS'])
+
+
+def batch_rules(params: Dict[str, Any]) -> RuleSet | None:
+    """The rules a batch applies: params["spend_rules"] when given, else the default items named in
+    params["mandatory_items"]; None when neither selects any rule."""
+    rules = params.get("spend_rules")
+    if rules is None and params.get("mandatory_items"):
+        rules = DEFAULT_RULES.only(params["mandatory_items"])
+    return rules if rules else None
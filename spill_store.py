@@ -0,0 +1,317 @@
+# --- spill_store.py (on-disk spill of built invoices and attachments for very large batches) ---
+"""Keep a batch's finished invoices on disk instead of in memory once the process grows too large.
+
+params["spill_threshold_mb"] turns spilling on: while the process RSS stays below the threshold
+everything is kept in memory as before; once it is crossed, every invoice built afterwards has
+its rows, LEDES text, PDF and receipts written to a temporary SQLite file, and so does every
+attachment packaged afterwards. What stays in memory are small stand-ins:
+
+- SpilledInvoice, a read-only mapping that loads a value from disk each time it is read;
+- SpilledRows, a sequence that knows its length and loads the rows when iterated or indexed;
+- SpilledAttachments, a list of (name, bytes) that yields one attachment's bytes at a time;
+- ScratchFile, a combined output (combined or per-matter LEDES, combined PDF, sidecar) written to
+  its own temporary file as it is produced, and streamed from there into zips and output folders.
+
+Loaded values are never cached, so packaging, zipping and emailing walk the batch one invoice at a
+time. The RSS is checked once per invoice, not per value. The file is deleted when the last
+stand-in referring to the store is garbage collected, or by close().
+"""
+from __future__ import annotations
+import os
+import pickle
+import sqlite3
+import tempfile
+import weakref
+from collections.abc import Mapping, MutableSequence, Sequence
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Tuple
+
+from run_profiler import rss_bytes
+
+DEFAULT_SPILL_MB = 1024
+
+Attachment = Tuple[str, bytes]
+
+
+class _Blob:
+    """Reference to a value stored in a SpillStore."""
+    __slots__ = ("id",)
+
+    def __init__(self, blob_id: int):
+        self.id = blob_id
+
+
+def _remove(conn: sqlite3.Connection | None, path: str) -> None:
+    if conn is not None:
+        conn.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SpillStore:
+    """Values in a temporary SQLite file, used once the process RSS reaches threshold_mb (0 spills everything)."""
+
+    def __init__(self, threshold_mb: float = DEFAULT_SPILL_MB, directory: str | None = None):
+        self.threshold_bytes = int(float(threshold_mb) * 2**20)
+        self.directory = directory
+        self.spilling = False
+        self.path: str | None = None
+        self.blobs = self.bytes = 0
+        self._conn: sqlite3.Connection | None = None
+        self._scratch: list[weakref.finalize] = []
+
+    def should_spill(self) -> bool:
+        """Whether new values go to disk; once the threshold is crossed the store keeps spilling.
+
+        Reads the RSS, so it is called once per invoice (by keep, and by package_batch); values
+        stored in between follow `spilling`."""
+        if not self.spilling and rss_bytes() >= self.threshold_bytes:
+            self.spilling = True
+        return self.spilling
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            fd, path = tempfile.mkstemp(prefix="invoice-spill-", suffix=".db", dir=self.directory)
+            os.close(fd)
+            # A scratch file: no journal and no fsync, it is thrown away with the batch anyway
+            conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE blobs (id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+            self._conn, self.path = conn, path
+            weakref.finalize(self, _remove, conn, path)
+        return self._conn
+
+    def put(self, data: bytes) -> _Blob:
+        cursor = self._db().execute("INSERT INTO blobs (data) VALUES (?)", (data,))
+        self.blobs += 1
+        self.bytes += len(data)
+        return _Blob(cursor.lastrowid)
+
+    def get(self, blob: _Blob) -> bytes:
+        return self._conn.execute("SELECT data FROM blobs WHERE id = ?", (blob.id,)).fetchone()[0]
+
+    def put_object(self, value: Any) -> _Blob:
+        return self.put(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def get_object(self, blob: _Blob) -> Any:
+        return pickle.loads(self.get(blob))
+
+    def keep(self, out: Dict[str, Any]) -> Dict[str, Any]:
+        """A built invoice as it should be held: itself below the threshold, else a SpilledInvoice."""
+        return SpilledInvoice(self, out) if self.should_spill() else out
+
+    def attachments(self, items: Iterable[Attachment] = ()) -> SpilledAttachments:
+        return SpilledAttachments(self, items)
+
+    def scratch(self, suffix: str = "") -> ScratchFile:
+        scratch = ScratchFile(self.directory, suffix)
+        self._scratch.append(scratch._finalizer)
+        return scratch
+
+    def close(self) -> None:
+        """Delete the spill files now; stand-ins from this store can no longer be read."""
+        if self._conn is not None:
+            _remove(self._conn, self.path)
+            self._conn = None
+        for finalizer in self._scratch:
+            finalizer()
+        self._scratch.clear()
+
+
+def spill_store_for(params: Dict[str, Any]) -> SpillStore | None:
+    """The SpillStore a batch uses: params["spill_threshold_mb"] (MB of RSS) and optional "spill_dir", or None."""
+    threshold = params.get("spill_threshold_mb")
+    return None if threshold is None else SpillStore(threshold, params.get("spill_dir"))
+
+
+class ScratchFile:
+    """Bytes or UTF-8 text appended to a temporary file, standing in for the combined bytes or str.
+
+    read() and encode() load it whole (encode makes it usable wherever the combined LEDES str was
+    encoded); open() and path let zips and output folders copy it in chunks instead."""
+
+    def __init__(self, directory: str | None = None, suffix: str = ""):
+        fd, self.path = tempfile.mkstemp(prefix="invoice-spill-", suffix=suffix, dir=directory)
+        self._writer: BinaryIO | None = os.fdopen(fd, "wb")
+        self._finalizer = weakref.finalize(self, _remove, None, self.path)
+
+    def write(self, data: bytes | str) -> None:
+        if self._writer is None:
+            self._writer = open(self.path, "ab")
+        self._writer.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def _finish(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    @property
+    def size(self) -> int:
+        self._finish()
+        return os.path.getsize(self.path)
+
+    def open(self) -> BinaryIO:
+        self._finish()
+        return open(self.path, "rb")
+
+    def read(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def encode(self, encoding: str = "utf-8") -> bytes:
+        return self.read()
+
+
+class SpilledRows(Sequence):
+    """Line items stored in a SpillStore; loaded from disk on every iteration or index."""
+
+    def __init__(self, store: SpillStore, rows: list[Dict]):
+        self._store = store
+        self._blob = store.put_object(list(rows))
+        self._len = len(rows)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        return self._store.get_object(self._blob)[index]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._store.get_object(self._blob))
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+
+class SpilledInvoice(Mapping):
+    """A build_invoice result whose rows, LEDES, PDF and receipts live in a SpillStore."""
+
+    def __init__(self, store: SpillStore, out: Dict[str, Any]):
+        self._store = store
+        self._values: Dict[str, Any] = {}
+        for key, value in out.items():
+            if key == "rows":
+                value = SpilledRows(store, value)
+            elif key == "receipts":
+                value = SpilledAttachments(store, value, spill=True)
+            elif isinstance(value, (bytes, str)):
+                value = store.put_object(value)
+            self._values[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._values[key]
+        return self._store.get_object(value) if isinstance(value, _Blob) else value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class SpilledAttachments(MutableSequence):
+    """(name, bytes) attachments; data added while the store is spilling is kept on disk and read back per item.
+
+    Slicing, select and renamed share the stored data instead of loading it."""
+
+    def __init__(self, store: SpillStore, items: Iterable[Attachment] = (), spill: bool = False):
+        self._store = store
+        self._spill = spill
+        self._items: list[tuple[str, bytes | _Blob | ScratchFile]] = []
+        self.extend(items)
+
+    def _pack(self, item: Attachment) -> tuple[str, bytes | _Blob | ScratchFile]:
+        name, data = item
+        if isinstance(data, (_Blob, ScratchFile)) or not (self._spill or self._store.spilling):
+            return name, data
+        return name, self._store.put(bytes(data))
+
+    def _unpack(self, entry: tuple[str, bytes | _Blob | ScratchFile]) -> Attachment:
+        name, data = entry
+        if isinstance(data, _Blob):
+            return name, self._store.get(data)
+        return name, data.read() if isinstance(data, ScratchFile) else data
+
+    def sources(self) -> Iterator[tuple[str, bytes | ScratchFile]]:
+        """(name, data) with scratch files left on disk for the caller to stream."""
+        for name, data in self._items:
+            yield name, self._store.get(data) if isinstance(data, _Blob) else data
+
+    def _shared(self, entries: list[tuple[str, bytes | _Blob | ScratchFile]]) -> SpilledAttachments:
+        view = SpilledAttachments(self._store, spill=self._spill)
+        view._items = entries
+        return view
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._shared(self._items[index])
+        return self._unpack(self._items[index])
+
+    def __setitem__(self, index, value) -> None:
+        if isinstance(index, slice):
+            self._items[index] = [self._pack(item) for item in value]
+        else:
+            self._items[index] = self._pack(value)
+
+    def __delitem__(self, index) -> None:
+        del self._items[index]
+
+    def __iter__(self) -> Iterator[Attachment]:
+        for entry in self._items:
+            yield self._unpack(entry)
+
+    def insert(self, index: int, value: Attachment) -> None:
+        self._items.insert(index, self._pack(value))
+
+    def extend(self, values: Iterable[Attachment]) -> None:
+        if isinstance(values, SpilledAttachments) and values._store is self._store:
+            self._items.extend(values._items)
+        else:
+            self._items.extend(self._pack(item) for item in values)
+
+    def names(self, start: int = 0) -> list[str]:
+        return [name for name, _ in self._items[start:]]
+
+    def select(self, keep: Callable[[str], bool]) -> SpilledAttachments:
+        return self._shared([entry for entry in self._items if keep(entry[0])])
+
+    def renamed(self, rename: Callable[[str], str]) -> SpilledAttachments:
+        return self._shared([(rename(name), data) for name, data in self._items])
+
+
+def text_data(text: str | ScratchFile) -> bytes | ScratchFile:
+    """Attachment data for combined text: a ScratchFile stays on disk, a str is UTF-8 encoded."""
+    return text if isinstance(text, ScratchFile) else text.encode("utf-8")
+
+
+def attachment_sources(attachments: Iterable[Attachment]) -> Iterator[tuple[str, bytes | ScratchFile]]:
+    """(name, data) pairs one at a time, where data may be a ScratchFile to copy in chunks."""
+    if isinstance(attachments, SpilledAttachments):
+        return attachments.sources()
+    return iter(attachments)
+
+
+def attachment_names(attachments: Sequence[Attachment], start: int = 0) -> list[str]:
+    """Names of attachments[start:] without reading spilled data."""
+    if isinstance(attachments, SpilledAttachments):
+        return attachments.names(start)
+    return [name for name, _ in attachments[start:]]
+
+
+def select_attachments(attachments: Sequence[Attachment], keep: Callable[[str], bool]) -> Sequence[Attachment]:
+    """The attachments whose name passes keep, without reading spilled data."""
+    if isinstance(attachments, SpilledAttachments):
+        return attachments.select(keep)
+    return [item for item in attachments if keep(item[0])]
+
+
+def renamed_attachments(attachments: Sequence[Attachment], rename: Callable[[str], str]) -> Iterable[Attachment]:
+    """attachments with rename applied to each name, without reading spilled data."""
+    if isinstance(attachments, SpilledAttachments):
+        return attachments.renamed(rename)
+    return [(rename(name), data) for name, data in attachments]
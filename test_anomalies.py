@@ -0,0 +1,57 @@
+import unittest
+import csv
+import datetime as dt
+import io
+from anomalies import ANOMALY_KINDS, LABELS_NAME, anomaly_fractions
+from invoice_pipeline import StageCache, generate_batch
+from test_invoice_pipeline import TIMEKEEPERS, make_batch
+
+TAGS = ("ANOMALY", "ANOMALY_FIELD", "ANOMALY_ORIGINAL")
+
+class TestAnomalies(unittest.TestCase):
+    def test_injected_violations_match_labels(self):
+        params = make_batch(num_invoices=2, fees=40, expenses=10, max_daily_hours=10,
+                            anomalies={kind: 0.05 for kind in ANOMALY_KINDS})
+        batch = generate_batch(params, StageCache())
+        self.assertEqual(generate_batch(params, StageCache())["attachments"], batch["attachments"])
+        labels = list(csv.DictReader(io.StringIO(dict(batch["attachments"])[LABELS_NAME].decode("utf-8"))))
+        rates = {tk["TIMEKEEPER_ID"]: tk["RATE"] for tk in TIMEKEEPERS}
+        for invoice in batch["invoices"]:
+            rows = invoice["rows"]
+            mine = [l for l in labels if l["INVOICE_NUMBER"] == invoice["invoice_number"]]
+            self.assertEqual(sorted(l["ANOMALY"] for l in mine), sorted(list(ANOMALY_KINDS) * 2))  # 5% of 50 lines
+            self.assertEqual(sum(bool(r.get("ANOMALY")) for r in rows), len(mine))
+            start, end = invoice["billing_start"], invoice["billing_end"]
+            for label in mine:
+                row = rows[int(label["LINE_ITEM_NUMBER"]) - 1]
+                kind = row["ANOMALY"]
+                self.assertEqual(kind, label["ANOMALY"])
+                date = dt.date.fromisoformat(row["LINE_ITEM_DATE"])
+                if kind == "rate_deviation":
+                    self.assertGreater(row["RATE"], rates[row["TIMEKEEPER_ID"]] * 1.09)
+                elif kind == "excessive_hours":
+                    self.assertGreater(row["HOURS"], 10)
+                elif kind == "missing_task_code":
+                    self.assertEqual(row["TASK_CODE"], "")
+                elif kind == "out_of_period":
+                    self.assertTrue(date < start or date > end)
+                elif kind == "weekend_date":
+                    self.assertTrue(start <= date <= end and date.weekday() >= 5)
+                else:
+                    original = rows[int(label["ORIGINAL"]) - 1]
+                    self.assertEqual({k: v for k, v in row.items() if k not in TAGS}, original)
+                self.assertAlmostEqual(row["LINE_ITEM_TOTAL"], round(row["HOURS"] * row["RATE"], 2))
+            self.assertAlmostEqual(invoice["total_amount"], sum(r["LINE_ITEM_TOTAL"] for r in rows), places=2)
+
+    def test_no_anomalies_no_labels(self):
+        batch = generate_batch(make_batch(num_invoices=1), StageCache())
+        self.assertNotIn(LABELS_NAME, dict(batch["attachments"]))
+
+    def test_invalid_fractions_are_rejected(self):
+        for spec in ({"typo": 0.1}, {"duplicate_line": 1.5}, {"duplicate_line": 0.6, "weekend_date": 0.6}):
+            with self.assertRaises(ValueError):
+                anomaly_fractions(spec)
+        self.assertEqual(anomaly_fractions({"weekend_date": 0.2, "rate_deviation": 0}), {"weekend_date": 0.2})
+
+if __name__ == '__main__':
+    unittest.main()
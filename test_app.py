@@ -1,7 +1,20 @@
+import os
 import unittest
 import io
+import statistics
+import tempfile
+import time
+from dataclasses import replace
+from unittest import mock
 from PIL import Image
-from app import _validate_image_bytes, _get_logo_bytes
+from streamlit.runtime.fragment import MemoryFragmentStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, app_test
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+import ids_store
+import ledes_ingest
+import streamlit as st
+from invoice_engine import _validate_image_bytes, _get_logo_bytes
 
 class TestImageHandling(unittest.TestCase):
     def test_validate_image_bytes(self):
@@ -36,8 +49,86 @@ class TestImageHandling(unittest.TestCase):
         class MockInvalidUploader:
             def read(self):
                 return b"invalid_data"
-        logo_bytes = _get_logo_bytes(MockInvalidUploader(), "02-1234567")
+        with self.assertLogs("invoice_engine", "WARNING") as logs:
+            logo_bytes = _get_logo_bytes(MockInvalidUploader(), "02-1234567")
         self.assertTrue(_validate_image_bytes(logo_bytes))  # Should return placeholder
+        self.assertIn("Uploaded logo is not a valid JPEG or PNG", logs.output[0])
+
+class _FragmentRunner(LocalScriptRunner):
+    """AppTest's runner, but like a live session it keeps the compiled script and the declared
+    fragments across runs, and when queue is set it reruns only those fragments."""
+    cache = ScriptCache()
+    storage = MemoryFragmentStorage()
+    queue: list[str] = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._script_cache, self._fragment_storage = self.cache, self.storage
+
+    def request_rerun(self, rerun_data):
+        return super().request_rerun(replace(rerun_data, fragment_id_queue=list(self.queue)))
+
+    @classmethod
+    def fragment_id(cls, name: str) -> str:
+        """Id of the declared fragment wrapping the function called name."""
+        return next(fid for fid, fragment in cls.storage._fragments.items()
+                    if any(getattr(cell.cell_contents, "__name__", None) == name for cell in fragment.__closure__ or ()))
+
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        # Keep the app's run history and saved IDs out of the repo's app_data.db
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patch = mock.patch.object(ids_store, "DB_PATH", os.path.join(tmp.name, "app_data.db"))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+class TestDataSourcesPanel(AppTestCase):
+    def test_synthetic_roster_enables_fee_controls(self):
+        at = AppTest.from_file(os.path.join(os.path.dirname(__file__), "app.py"), default_timeout=60).run()
+        self.assertTrue(any("No timekeeper CSV" in i.value for i in at.info))
+        at.number_input(key="roster_size").set_value(300)
+        next(b for b in at.button if b.label == "Use synthetic roster").click().run()
+        self.assertFalse(at.exception)
+        self.assertEqual(len(at.session_state.timekeeper_data), 300)
+        self.assertTrue(any("Maximum fee lines allowed" in c.value for c in at.caption))
+        fee_count = next(n for n in at.number_input if n.label == "Number of Fee Line Items")  # typed: far above the slider range
+        fee_count.set_value(5000).run()
+        self.assertFalse(at.exception)
+        self.assertEqual(next(n for n in at.number_input if n.label == "Number of Fee Line Items").value, 5000)
+
+    def test_learned_model_is_reused_across_reruns(self):
+        from test_ledes_parser import HEADER, _line
+        upload = io.BytesIO((HEADER + _line(total="250.00")).encode())  # what UploadedFile is, plus name and size
+        upload.name, upload.size = "template.txt", len(upload.getvalue())
+        file_uploader = st.file_uploader
+        def fake_uploader(label, *args, **kwargs):
+            return [upload] if kwargs.get("key") == "ledes_template_upl" else file_uploader(label, *args, **kwargs)
+        with mock.patch("streamlit.file_uploader", fake_uploader), \
+             mock.patch("ledes_ingest.learn_ledes_model", wraps=ledes_ingest.learn_ledes_model) as learn:
+            at = AppTest.from_file(os.path.join(os.path.dirname(__file__), "app.py"), default_timeout=60).run()
+            at.run()
+        self.assertFalse(at.exception)
+        self.assertEqual(learn.call_count, 1)
+        self.assertEqual(at.session_state.learned_model["lines"], 1)
+
+class TestRerunLatency(AppTestCase):
+    def test_receipt_settings_rerun_only_their_fragment_under_50ms(self):
+        with mock.patch.object(app_test, "LocalScriptRunner", _FragmentRunner), \
+             mock.patch.multiple(_FragmentRunner, cache=ScriptCache(), storage=MemoryFragmentStorage(), queue=[]):
+            at = AppTest.from_file(os.path.join(os.path.dirname(__file__), "app.py"), default_timeout=60).run()
+            next(c for c in at.checkbox if c.label.startswith("Generate Sample Receipts")).check().run()
+            _FragmentRunner.queue = [_FragmentRunner.fragment_id("_receipt_settings_panel")]
+            seconds = []
+            for dashed in (True, False, True, False, True):
+                t0 = time.perf_counter()
+                at.checkbox(key="rcpt_dashed").set_value(dashed).run()
+                seconds.append(time.perf_counter() - t0)
+                self.assertFalse(at.exception)
+                self.assertIs(at.session_state.rcpt_dashed, dashed)
+        # Only the panel ran: the sidebar and the other tabs were not redrawn
+        self.assertFalse([c for c in at.checkbox if c.label.startswith("Generate Sample Receipts")])
+        self.assertLess(statistics.median(seconds), 0.05)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+import datetime as dt
+import hashlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import zipfile
+
+from batch_manifest import BatchManifest, _write_file, generate_to_dir, params_key, zip_files
+from invoice_engine import CONFIG
+from invoice_pipeline import StageCache, generate_batch
+from test_invoice_pipeline import make_batch
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestBatchManifest(unittest.TestCase):
+    def test_manifest_records_every_file_with_checksums(self):
+        params = make_batch(num_invoices=3, include_pdf=True, generate_receipts=True, expenses=4)
+        with tempfile.TemporaryDirectory() as out:
+            result = generate_to_dir(params, out, StageCache())
+            records = list(BatchManifest(out).records())
+            self.assertEqual([r["type"] for r in records], ["invoice"] * 3 + ["batch"])
+            for record in records:
+                for entry in record["files"]:
+                    with open(os.path.join(out, entry["name"]), "rb") as f:
+                        data = f.read()
+                    self.assertEqual((entry["size"], entry["sha256"]), (len(data), hashlib.sha256(data).hexdigest()))
+            batch = generate_batch(params, StageCache())
+            self.assertEqual(sorted(result["files"]), sorted(name for name, _ in batch["attachments"]))
+            self.assertEqual([r["total_amount"] for r in records[:3]], [round(i["total_amount"], 2) for i in batch["invoices"]])
+
+    def test_resume_skips_finished_invoices(self):
+        params = make_batch(num_invoices=4, combine_ledes=True, include_pdf=True, pdf_mode="combined")
+
+        def stop_at_third(n, total, start, end):
+            if n == 2:
+                raise Interrupted()
+
+        with tempfile.TemporaryDirectory() as out:
+            with self.assertRaises(Interrupted):
+                generate_to_dir(params, out, StageCache(), on_invoice=stop_at_third)
+            self.assertEqual(len(BatchManifest(out).completed(params_key(params))), 2)
+            cache = StageCache()
+            result = generate_to_dir(params, out, cache)
+            self.assertEqual(result["skipped"], 2)
+            self.assertEqual(cache.runs["fees"], 2)
+            self.assertEqual(result["combined_ledes"], generate_batch(params, StageCache())["combined_ledes"])
+            self.assertTrue(os.path.exists(os.path.join(out, "Invoices_Combined.pdf")))
+            self.assertEqual(generate_to_dir({**params, "seed": 43}, out, StageCache())["skipped"], 0)
+            self.assertEqual(generate_to_dir(params, out, StageCache(), resume=False)["skipped"], 0)
+
+    def test_resume_regenerates_a_corrupted_file_of_the_same_size(self):
+        params = make_batch(num_invoices=2)
+        with tempfile.TemporaryDirectory() as out:
+            generate_to_dir(params, out, StageCache())
+            first = next(BatchManifest(out).records())["files"][0]
+            path = os.path.join(out, first["name"])
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path, "wb") as f:
+                f.write(data[::-1])
+            self.assertEqual(sorted(BatchManifest(out).completed(params_key(params))), [1])
+            self.assertEqual(generate_to_dir(params, out, StageCache())["skipped"], 1)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+    def test_resume_with_receipts_skips_every_invoice(self):
+        # Receipts sharing an expense code and date across invoices must not overwrite each other's files
+        params = make_batch(num_invoices=6, expenses=8, generate_receipts=True, multiple_periods=False,
+                            billing_start_date=dt.date(2025, 1, 1), billing_end_date=dt.date(2025, 1, 7))
+        with tempfile.TemporaryDirectory() as out:
+            first = generate_to_dir(params, out, StageCache())
+            self.assertEqual(len(first["files"]), len(set(first["files"])))
+            self.assertEqual(len(first["files"]), len(generate_batch(params, StageCache())["attachments"]))
+            self.assertEqual(generate_to_dir(params, out, StageCache())["skipped"], 6)
+
+    def test_params_key_ignores_set_order_and_workers(self):
+        params = make_batch()
+        reordered = {**params, "major_task_codes": set(sorted(CONFIG['MAJOR_TASK_CODES'], reverse=True)), "workers": 4}
+        self.assertEqual(params_key(params), params_key(reordered))
+        self.assertNotEqual(params_key(params), params_key({**params, "fees": 7}))
+
+    def test_identical_files_are_stored_once(self):
+        files = [("a.pdf", b"same"), ("b.pdf", b"other"), ("c.pdf", b"same")]
+        with zipfile.ZipFile(io.BytesIO(zip_files(files, dedup=True))) as z:
+            self.assertEqual(z.namelist(), ["a.pdf", "b.pdf", "duplicates.json"])
+            self.assertEqual(json.loads(z.read("duplicates.json")), {"c.pdf": "a.pdf"})
+        with zipfile.ZipFile(io.BytesIO(zip_files(files))) as z:
+            self.assertEqual(len(z.namelist()), 3)
+        with tempfile.TemporaryDirectory() as out:
+            written = {}
+            entries = [_write_file(out, name, data, written) for name, data in files]
+            self.assertEqual(entries[2]["duplicate_of"], "a.pdf")
+            self.assertEqual(os.stat(os.path.join(out, "a.pdf")).st_ino, os.stat(os.path.join(out, "c.pdf")).st_ino)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import random
+import tempfile
+from unittest import mock
+import faker_pool
+from faker_pool import FakerPool, build_faker_pool
+from invoice_engine import _process_description
+
+class TestFakerPool(unittest.TestCase):
+    def test_pool_is_seeded_persisted_and_sampled_by_rng(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(faker_pool, "POOL_CACHE_DIR", tmp):
+            build_faker_pool.cache_clear()
+            first = build_faker_pool(seed=3, size=20)
+            build_faker_pool.cache_clear()
+            with mock.patch.object(faker_pool, "_generate_values", side_effect=AssertionError("should load from disk")):
+                loaded = build_faker_pool(seed=3, size=20)
+            build_faker_pool.cache_clear()
+        self.assertEqual(first.values, loaded.values)
+        self.assertEqual(len(first.values["company"]), 20)
+        random.seed(1)
+        picks = [first.company(), first.address(), first.phone_number(), first.first_name()]
+        random.seed(1)
+        self.assertEqual(picks, [loaded.company(), loaded.address(), loaded.phone_number(), loaded.first_name()])
+
+    def test_generators_accept_pool(self):
+        pool = FakerPool({f: [f"{f}-x"] for f in ("company", "address", "phone_number", "name", "first_name")})
+        self.assertEqual(_process_description("Call with {NAME_PLACEHOLDER}", pool), "Call with name-x")
+        with self.assertRaises(ValueError):
+            FakerPool({"company": ["a"]})
+
+if __name__ == "__main__":
+    unittest.main()
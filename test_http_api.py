@@ -0,0 +1,114 @@
+import unittest
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+import ids_store
+from http_api import GenerationService, serve
+from ledes_parser import validate_ledes_1998b
+from run_metrics import load_runs
+from test_invoice_pipeline import TIMEKEEPERS
+
+class TestHttpApi(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Workers record run metrics: point them (forked or spawned) at a scratch database, not the repo's app_data.db
+        cls.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(cls.tmp.name, "app_data.db")
+        cls.patches = [mock.patch.object(ids_store, "DB_PATH", db_path), mock.patch.dict(os.environ, {"LEDES_DB_PATH": db_path})]
+        for patch in cls.patches:
+            patch.start()
+        cls.loop = asyncio.new_event_loop()
+        ready = cls.loop.create_future()
+        cls.task = cls.loop.create_task(serve(port=0, executor=ProcessPoolExecutor(max_workers=1), ready=ready))
+        cls.thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.thread.start()
+        while not ready.done():
+            time.sleep(0.01)
+        cls.port = ready.result()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop.call_soon_threadsafe(cls.task.cancel)
+        time.sleep(0.2)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(5)
+        for patch in cls.patches:
+            patch.stop()
+        cls.tmp.cleanup()
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(f"http://127.0.0.1:{self.port}{path}", data=data, method="POST" if data else "GET")
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                return resp.status, dict(resp.headers), resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, dict(e.headers), e.read()
+
+    def test_seeded_ledes_request_is_cached(self):
+        body = {"profile": "SimpleLegal", "format": "ledes", "invoices": 2, "fees": 6, "expenses": 1,
+                "timekeepers": TIMEKEEPERS, "start": "2025-01-01", "end": "2025-01-31", "seed": 7}
+        status, headers, first = self.request("/generate", body)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["X-Cache"], "miss")
+        self.assertTrue(first.startswith(b"LEDES1998B[]"))
+        report = validate_ledes_1998b(first)
+        self.assertTrue(report.ok, report.errors)
+        self.assertEqual(report.invoice_count, 2)
+        status, headers, second = self.request("/generate", body)
+        self.assertEqual(headers["X-Cache"], "hit")
+        self.assertEqual(first, second)
+
+    def test_async_zip_job(self):
+        status, _, raw = self.request("/generate", {"async": True, "invoices": 2, "expenses": 1, "start": "2025-02-01", "end": "2025-02-28"})
+        self.assertEqual(status, 202)
+        job_id = json.loads(raw)["job_id"]
+        for _ in range(600):
+            job = json.loads(self.request(f"/jobs/{job_id}")[2])
+            if job["status"] != "running":
+                break
+            time.sleep(0.05)
+        self.assertEqual(job["status"], "done")
+        status, headers, data = self.request(f"/jobs/{job_id}/result")
+        self.assertEqual(headers["Content-Type"], "application/zip")
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(data)).namelist()), 2)
+        self.assertIn("http", set(load_runs()["source"]))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.request("/generate", {"profile": "Nope"})[0], 400)
+        self.assertEqual(self.request("/generate", {"start": "2025-02-01", "end": "2025-01-01"})[0], 400)
+        for bad in ({"max_daily_hours": "x"}, {"max_daily_hours": None}, {"max_daily_hours": 0}, {"descriptions": "abc"},
+                    {"descriptions": ["ok", 3]}, {"matters": "M-1"}, {"matters": [1, 2]},
+                    {"fiscal_start_month": "x"}, {"fiscal_start_month": 13}, {"period_days": None}, {"period_days": 0}):
+            self.assertEqual(self.request("/generate", bad)[0], 400, bad)
+        too_many_fees = {"fees": 64, "timekeepers": TIMEKEEPERS[:1], "start": "2025-01-01", "end": "2025-01-02", "max_daily_hours": 1}
+        self.assertEqual(self.request("/generate", too_many_fees)[0], 400)
+        self.assertEqual(self.request("/jobs/missing")[0], 404)
+        self.assertEqual(self.request("/health")[0], 200)
+
+    def test_finished_jobs_are_evicted(self):
+        service = GenerationService(executor=None, max_queued=1, job_entries=2)
+
+        async def start_jobs():
+            ids = []
+            for n in range(4):
+                fut = asyncio.get_running_loop().create_future()
+                ids.append(service.start_job(fut))
+                fut.set_result(n)
+                await asyncio.sleep(0)
+            return ids
+
+        ids = asyncio.run(start_jobs())
+        self.assertEqual(list(service.jobs), ids[-2:])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+import ids_store
+import ids_store_bench
+
+class TestIdsStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "app_data.db")
+        for patch in (mock.patch.object(ids_store, "DB_PATH", self.db_path), mock.patch.object(ids_store, "BUSY_TIMEOUT_S", 0.05)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        ids_store.init_db()
+
+    def test_batched_upserts_and_busy_retry(self):
+        ids = ids_store.upsert_entities("client", [("Acme", "C-1", "Prod"), ("Bolt", "C-2", "Test"), ("Acme", "C-1", "Prod")])
+        self.assertEqual(ids[0], ids[2])
+        self.assertEqual(ids_store.list_envs("client"), ["Prod", "Test"])
+        with self.assertRaises(ZeroDivisionError), ids_store.get_conn(write=True) as c:
+            c.execute("INSERT INTO entity_ids (entity_type,name,ext_id) VALUES ('client','Cato','C-3')")
+            1 / 0
+        self.assertEqual([e["name"] for e in ids_store.fetch_entities("client")], ["Acme", "Bolt"])
+
+        holder = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        holder.execute("BEGIN IMMEDIATE")
+        threading.Timer(0.2, holder.rollback).start()
+        retries = ids_store.busy_retries
+        ids_store.set_default("client_default", ids[1])
+        self.assertGreater(ids_store.busy_retries, retries)
+        self.assertEqual(ids_store.get_default("client_default"), ids[1])
+
+        holder.execute("BEGIN IMMEDIATE")
+        with mock.patch.object(ids_store, "RETRIES", 1), self.assertRaises(sqlite3.OperationalError):
+            ids_store.delete_entity(ids[1])
+        holder.rollback()
+        holder.close()
+
+    def test_busy_commit_is_retried_without_losing_the_write(self):
+        class BusyCommit:
+            """A connection whose first COMMIT reports the database busy."""
+            def __init__(self, conn):
+                self.conn, self.calls = conn, []
+            def __getattr__(self, name):
+                return getattr(self.conn, name)
+            def execute(self, sql, *args):
+                self.calls.append(sql.split()[0])
+                if sql == "COMMIT" and self.calls.count("COMMIT") == 1:
+                    raise sqlite3.OperationalError("database is locked")
+                return self.conn.execute(sql, *args)
+
+        conns = []
+        connect = ids_store.connect
+
+        def busy_connect(db_path=None):
+            conns.append(BusyCommit(connect(db_path)))
+            return conns[-1]
+
+        with mock.patch.object(ids_store, "connect", busy_connect):
+            row_id = ids_store.upsert_entity("law_firm", "Acme LLP", "F-1", "Prod")
+        self.assertEqual([c for c in conns[0].calls if c in ("COMMIT", "ROLLBACK")], ["COMMIT", "COMMIT"])
+        self.assertEqual([e["row_id"] for e in ids_store.fetch_entities("law_firm")], [row_id])
+
+    def test_concurrent_processes_store_every_write(self):
+        result = ids_store_bench.run(self.db_path, processes=4, writes=50, batch=10)
+        self.assertEqual((result["stored"], result["failed"]), (200, 0))
+
+if __name__ == '__main__':
+    unittest.main()
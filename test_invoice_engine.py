@@ -0,0 +1,78 @@
+import unittest
+import random
+import itertools
+import datetime as dt
+from collections import defaultdict
+from faker import Faker
+from invoice_engine import CONFIG, RECEIPT_SETTING_DEFAULTS, _allocate_fee_slots, _calculate_max_fees, _generate_fees, _receipt_content
+from invoice_pipeline import StageCache, generate_batch
+from ledes_parser import iter_ledes_1998b
+from money import format_cents, line_cents, split_cents, to_cents
+from test_invoice_pipeline import TIMEKEEPERS, make_batch
+
+class TestFeeAllocation(unittest.TestCase):
+    def _fees(self, count, days=1, max_hours=16, target_total=None):
+        start = dt.date(2025, 1, 1)
+        return _generate_fees(count, TIMEKEEPERS, start, start + dt.timedelta(days=days - 1), CONFIG['DEFAULT_TASK_ACTIVITY_DESC'],
+                              CONFIG['MAJOR_TASK_CODES'], max_hours, Faker(), "C1", "LF1", "Services", target_total=target_total)
+
+    def test_exact_line_count_within_daily_cap(self):
+        random.seed(3)
+        for count in (1, 40, 64, 200, 320):
+            rows = self._fees(count, days=1, max_hours=16)
+            self.assertEqual(len(rows), count)
+            per_day = defaultdict(float)
+            for row in rows:
+                per_day[(row["TIMEKEEPER_ID"], row["LINE_ITEM_DATE"])] += row["HOURS"]
+            self.assertTrue(all(h <= 16 + 1e-9 for h in per_day.values()))
+
+    def test_capacity_exceeded_raises(self):
+        day = dt.date(2025, 1, 1)
+        capacity = _calculate_max_fees(TIMEKEEPERS, day, day, 16)
+        self.assertEqual(len(_allocate_fee_slots(capacity, TIMEKEEPERS, 1, 16)), capacity)
+        with self.assertRaises(ValueError):
+            _allocate_fee_slots(capacity + 1, TIMEKEEPERS, 1, 16)
+        self.assertEqual(_calculate_max_fees(TIMEKEEPERS[:1], day, day + dt.timedelta(days=1), 1), 20)
+        self.assertEqual(_calculate_max_fees(TIMEKEEPERS, day, day + dt.timedelta(days=29), 16), len(TIMEKEEPERS) * 30 * 160)
+
+    def test_target_total_is_approached_from_below(self):
+        random.seed(5)
+        rows = self._fees(50, days=20, target_total=30000)
+        total = sum(r["LINE_ITEM_TOTAL"] for r in rows)
+        self.assertEqual(len(rows), 50)
+        self.assertLessEqual(total, 30000)
+        self.assertGreater(total, 30000 - 20)  # within one 0.1h step of the cheapest rate
+
+class TestMoney(unittest.TestCase):
+    def test_cent_arithmetic_and_formatting(self):
+        self.assertEqual(line_cents(2.3, 33333), 76666)
+        self.assertEqual(line_cents(0.1, 5), 1)  # half a cent rounds up once
+        self.assertEqual(sum(to_cents(0.1) for _ in range(10)), 100)
+        self.assertEqual([format_cents(c) for c in (0, 5, -1050, 123456)], ["0.00", "0.05", "-10.50", "1234.56"])
+        self.assertEqual(format_cents(123456789, "$"), "$1,234,567.89")
+        self.assertEqual(split_cents(1001, [0.3, 0.3, 0.4]), [300, 300, 401])
+        self.assertEqual(sum(split_cents(-735, [0.45, 0.5, 0.05])), -735)
+
+    def test_receipts_and_ledes_reconcile_to_the_cent(self):
+        random.seed(11)
+        for code in ("E101", "E105", "E108", "E110", "E111", "E115", "E124"):
+            for amount in (0.01, 7.35, 123.45, 999.99):
+                c = _receipt_content({"LINE_ITEM_DATE": "2025-01-02", "EXPENSE_CODE": code, "DESCRIPTION": "Item",
+                                      "LINE_ITEM_TOTAL": amount}, Faker(), dict(RECEIPT_SETTING_DEFAULTS))
+                self.assertEqual(c["total"], to_cents(amount))
+                self.assertEqual(c["subtotal"], sum(item[3] for item in c["items"]))
+                self.assertEqual(c["subtotal"] + c["tax"] + c["tip"], c["total"])
+        for code, amount, seed in itertools.product(("E115", "E124"), (0.01, 123.45), range(150)):
+            random.seed(seed)  # the subtotal is split over the items with split_cents, never below zero
+            c = _receipt_content({"LINE_ITEM_DATE": "2025-01-02", "EXPENSE_CODE": code, "DESCRIPTION": "Item",
+                                  "LINE_ITEM_TOTAL": amount}, Faker(), dict(RECEIPT_SETTING_DEFAULTS))
+            self.assertTrue(all(item[3] >= 0 for item in c["items"]), c["items"])
+        batch = generate_batch(make_batch(combine_ledes=True, expenses=8), StageCache())
+        lines = [fields for _, fields in iter_ledes_1998b(batch["combined_ledes"])]
+        for invoice in batch["invoices"]:
+            own = [f for f in lines if f["INVOICE_NUMBER"] == invoice["invoice_number"]]
+            self.assertEqual({f["INVOICE_TOTAL"] for f in own}, {format_cents(to_cents(invoice["total_amount"]))})
+            self.assertEqual(sum(to_cents(f["LINE_ITEM_TOTAL"]) for f in own), to_cents(invoice["total_amount"]))
+
+if __name__ == '__main__':
+    unittest.main()
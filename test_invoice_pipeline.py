@@ -0,0 +1,124 @@
+import unittest
+import datetime as dt
+from invoice_engine import CONFIG, EXPENSE_SETTING_DEFAULTS, RECEIPT_SETTING_DEFAULTS
+from invoice_pipeline import StageCache, build_invoice, generate_batch, preview_lines
+
+TIMEKEEPERS = [
+    {"TIMEKEEPER_NAME": "Tom Delaganis", "TIMEKEEPER_CLASSIFICATION": "Partner", "TIMEKEEPER_ID": "TD001", "RATE": 250.0},
+    {"TIMEKEEPER_NAME": "Ryan Kinsey", "TIMEKEEPER_CLASSIFICATION": "Associate", "TIMEKEEPER_ID": "RK001", "RATE": 200.0},
+]
+
+def make_job(**overrides):
+    job = {
+        "seed": 42, "index": 0, "fee_count": 8, "expense_count": 1, "timekeeper_data": TIMEKEEPERS,
+        "client_id": "02-4388252", "law_firm_id": "02-1234567", "invoice_desc": "Services",
+        "billing_start_date": dt.date(2025, 1, 1), "billing_end_date": dt.date(2025, 1, 31),
+        "task_activity_desc": CONFIG['DEFAULT_TASK_ACTIVITY_DESC'], "major_task_codes": CONFIG['MAJOR_TASK_CODES'],
+        "max_daily_hours": 16, "include_block_billed": False, "learned_model": None,
+        "expense_settings": dict(EXPENSE_SETTING_DEFAULTS), "mandatory_items": [],
+        "invoice_number": "INV-1", "matter_number": "M-1", "ledes_header": True,
+        "include_pdf": True, "invoice_date": dt.date(2025, 1, 31), "include_logo": False, "logo_bytes": b"",
+        "generate_receipts": True, "receipt_settings": dict(RECEIPT_SETTING_DEFAULTS),
+    }
+    job.update(overrides)
+    return job
+
+def make_batch(**overrides):
+    params = {
+        "seed": 42, "num_invoices": 3, "multiple_periods": True, "combine_ledes": False, "descriptions": ["Services"],
+        "invoice_number_base": "INV", "matter_number_base": "M-1", "fees": 6, "expenses": 1, "timekeeper_data": TIMEKEEPERS,
+        "client_id": "02-4388252", "law_firm_id": "02-1234567",
+        "billing_start_date": dt.date(2025, 3, 1), "billing_end_date": dt.date(2025, 3, 31),
+        "task_activity_desc": CONFIG['DEFAULT_TASK_ACTIVITY_DESC'], "major_task_codes": CONFIG['MAJOR_TASK_CODES'],
+        "max_daily_hours": 16, "expense_settings": dict(EXPENSE_SETTING_DEFAULTS), "receipt_settings": dict(RECEIPT_SETTING_DEFAULTS),
+    }
+    params.update(overrides)
+    return params
+
+class TestInvoicePipeline(unittest.TestCase):
+    def test_same_inputs_are_deterministic_and_memoized(self):
+        cache = StageCache()
+        first = build_invoice(make_job(), cache)
+        second = build_invoice(make_job(), cache)
+        self.assertEqual(sum(cache.runs.values()), 6)
+        self.assertEqual(sum(cache.hits.values()), 6)
+        self.assertIs(first["pdf"], second["pdf"])
+        self.assertEqual(build_invoice(make_job(), StageCache())["rows"], first["rows"])
+
+    def test_receipt_settings_do_not_rerender_pdf(self):
+        cache = StageCache()
+        build_invoice(make_job(), cache)
+        cache.reset_counters()
+        build_invoice(make_job(receipt_settings=dict(RECEIPT_SETTING_DEFAULTS, rcpt_scale=1.2)), cache)
+        self.assertEqual(dict(cache.runs), {"receipts": 1})
+
+    def test_block_billing_reuses_fees_and_expenses(self):
+        cache = StageCache()
+        build_invoice(make_job(), cache)
+        cache.reset_counters()
+        build_invoice(make_job(include_block_billed=True), cache)
+        self.assertEqual(cache.hits["fees"], 1)
+        self.assertEqual(cache.hits["expenses"], 1)
+        self.assertEqual(cache.hits["receipts"], 1)
+        self.assertEqual(cache.runs["pdf"], 1)
+
+    def test_batch_across_matters_and_periods(self):
+        batch = generate_batch(make_batch(matters=["M-1", "M-2"], per_matter_ledes=True, period_cadence="semi-monthly"), StageCache())
+        invoices = batch["invoices"]
+        self.assertEqual([i["invoice_number"] for i in invoices], [f"INV-{n}" for n in range(1, 7)])
+        self.assertEqual([i["matter_number"] for i in invoices], ["M-1"] * 3 + ["M-2"] * 3)
+        self.assertEqual([i["billing_start"] for i in invoices[:3]], [dt.date(2025, 3, 1), dt.date(2025, 2, 16), dt.date(2025, 2, 1)])
+        self.assertEqual([name for name, _ in batch["attachments"]], ["LEDES_1998B_M-1.txt", "LEDES_1998B_M-2.txt"])
+        self.assertTrue(all(data.count(b"LEDES1998B[]") == 1 for _, data in batch["attachments"]))
+
+    def test_parallel_batch_matches_serial(self):
+        serial = generate_batch(make_batch(combine_ledes=True), StageCache())
+        parallel = generate_batch(make_batch(combine_ledes=True, workers=2), StageCache())
+        self.assertEqual(parallel["combined_ledes"], serial["combined_ledes"])
+        self.assertEqual([i["rows"] for i in parallel["invoices"]], [i["rows"] for i in serial["invoices"]])
+
+    def test_combined_pdf_shares_logo_and_bookmarks_each_invoice(self):
+        from invoice_engine import _get_logo_bytes
+        batch = generate_batch(make_batch(include_pdf=True, pdf_mode="combined", include_logo=True,
+                                          logo_bytes=_get_logo_bytes(None, "02-1234567", False)), StageCache())
+        pdfs = [(name, data) for name, data in batch["attachments"] if name.endswith(".pdf")]
+        self.assertEqual([name for name, _ in pdfs], ["Invoices_Combined.pdf"])
+        pdf = pdfs[0][1]
+        self.assertEqual(pdf.count(b"/Subtype /Image"), 1)
+        self.assertIn(b"/Outlines", pdf)
+        self.assertEqual(pdf.count(b"/Title (Invoice INV-"), 3)
+
+    def test_vector_receipts_match_png_receipts(self):
+        def receipts(fmt):
+            return build_invoice(make_job(expense_count=6, include_pdf=False,
+                                          receipt_settings=dict(RECEIPT_SETTING_DEFAULTS, rcpt_format=fmt)), StageCache())["receipts"]
+        png, pdf, combined = receipts("png"), receipts("pdf"), receipts("pdf-combined")
+        self.assertTrue(png)
+        self.assertEqual([n[:-4] for n, _ in pdf], [n[:-4] for n, _ in png])
+        self.assertTrue(all(data.startswith(b"%PDF") and b"/Subtype /Image" not in data for _, data in pdf))
+        self.assertLess(sum(len(d) for _, d in pdf), sum(len(d) for _, d in png) / 3)
+        self.assertEqual([n for n, _ in combined], ["Receipts_INV-1.pdf"])
+        self.assertEqual(combined[0][1].count(b"/Type /Page\n"), len(png))
+        self.assertEqual(receipts("pdf"), pdf)
+
+    def test_preview_builds_only_the_first_invoice_rows(self):
+        cache = StageCache()
+        job, rows = preview_lines(make_batch(num_invoices=400, fees=20, include_pdf=True, generate_receipts=True), cache, limit=5)
+        self.assertEqual(job["invoice_number"], "INV-1")
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(dict(cache.runs), {"fees": 1, "expenses": 1, "rows": 1})
+        self.assertEqual(preview_lines(make_batch(num_invoices=1, fees=20), StageCache(), limit=5)[1], rows)
+        batch = generate_batch(make_batch(fees=20), cache)
+        self.assertEqual(batch["invoices"][0]["rows"][:5], rows)
+        self.assertEqual(cache.hits["rows"], 1)
+
+    def test_ledes_has_a_line_per_row(self):
+        from ledes_parser import iter_ledes_1998b
+        batch = generate_batch(make_batch(combine_ledes=True, anomalies={"out_of_period": 0.2}), StageCache())
+        lines = [fields for _, fields in iter_ledes_1998b(batch["combined_ledes"])]
+        rows = [row for invoice in batch["invoices"] for row in invoice["rows"]]
+        self.assertEqual(len(lines), len(rows))
+        self.assertEqual([f["LINE_ITEM_DATE"] for f in lines], [r["LINE_ITEM_DATE"].replace("-", "") for r in rows])
+
+if __name__ == '__main__':
+    unittest.main()
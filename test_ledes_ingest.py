@@ -0,0 +1,34 @@
+import unittest
+import random
+import io
+from ledes_ingest import _source_digest, learn_ledes_model, sample_expense, sample_task_activity
+from test_ledes_parser import HEADER, _line
+
+class TestLedesIngest(unittest.TestCase):
+    def setUp(self):
+        expense = _line(line_no=3, kind="E", units="1", line_total="42.50", rate="42.50", total="742.50")
+        expense = expense.replace("|L100||A101|TK1|Research|", "||E105|||Telephone|")
+        self.content = (HEADER + _line(total="742.50") + _line(total="742.50", line_no=2, units="1.0", line_total="250.00") + expense).encode()
+
+    def test_learns_frequency_tables(self):
+        model = learn_ledes_model([self.content], use_cache=False)
+        self.assertEqual(model["lines"], 3)
+        self.assertEqual(model["task_activity_desc"], [["L100", "A101", "Research", 2]])
+        self.assertEqual(model["timekeepers"][0]["RATE"], 250.0)
+        self.assertEqual(model["expenses"]["E105"]["samples"], [[1, 42.5]])
+
+    def test_sampling(self):
+        model = learn_ledes_model([self.content], use_cache=False)
+        random.seed(1)
+        self.assertEqual(sample_task_activity(model), ("L100", "A101", "Research"))
+        self.assertEqual(sample_expense(model), ("E105", "Telephone", 1, 42.5))
+
+    def test_str_content_is_digested_like_the_parser_reads_it(self):
+        text = self.content.decode()
+        digest = _source_digest(self.content)
+        self.assertEqual(_source_digest(text), digest)
+        self.assertEqual(_source_digest(io.StringIO(text)), digest)
+        self.assertEqual(learn_ledes_model([text], use_cache=False)["key"], learn_ledes_model([self.content], use_cache=False)["key"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from ledes_parser import LEDES_1998B_FIELDS, iter_ledes_1998b, validate_ledes_1998b
+
+HEADER = "LEDES1998B[]\n" + "|".join(LEDES_1998B_FIELDS) + "[]\n"
+
+def _line(inv="INV-1", total="700.00", line_no=1, kind="F", units="2.0", line_total="500.00", date="20250115", rate="250.00"):
+    fields = ["20250131", inv, "C1", "M1", total, "20250101", "20250131", "Services", str(line_no), kind,
+              units, "0.00", line_total, date, "L100", "", "A101", "TK1", "Research", "LF1", rate,
+              "Tom", "Partner", "M1"]
+    return "|".join(fields) + "[]\n"
+
+class TestLedesParser(unittest.TestCase):
+    def test_valid_combined_file(self):
+        content = HEADER + _line() + _line(line_no=2, units="1.0", line_total="200.00", rate="200.00")
+        content += _line(inv="INV-2", total="250.00", line_total="250.00", units="1.0")
+        report = validate_ledes_1998b(content.encode())
+        self.assertTrue(report.ok, report.errors)
+        self.assertEqual(report.line_count, 3)
+        self.assertEqual(report.invoice_count, 2)
+        self.assertEqual(len(list(iter_ledes_1998b(content.encode()))), 3)
+
+    def test_reports_errors_with_line_numbers(self):
+        content = HEADER + _line(total="950.00", line_total="400.00") + _line(total="950.00", line_no=2, date="20250301").rstrip("[]\n") + "\n"
+        errors = validate_ledes_1998b(content.encode()).errors
+        self.assertTrue(any(ln == 3 and "units x rate" in m for ln, m in errors))
+        self.assertTrue(any(ln == 4 and "terminated" in m for ln, m in errors))
+        self.assertTrue(any(ln == 4 and "outside billing period" in m for ln, m in errors))
+        self.assertTrue(any("INVOICE_TOTAL" in m for ln, m in errors))
+
+    def test_missing_header(self):
+        report = validate_ledes_1998b(_line().encode())
+        self.assertFalse(report.ok)
+        self.assertEqual(report.errors[0][0], 1)
+
+    def test_file_without_header_lines_is_still_validated(self):
+        content = _line(total="1500.00") + _line(total="1500.00", line_no=2, units="3.0") + _line(total="1500.00", line_no=3)
+        report = validate_ledes_1998b(content.encode())
+        self.assertEqual(report.line_count, 3)
+        self.assertEqual([m for ln, m in report.errors if ln == 1], ["Expected header 'LEDES1998B[]'", "Field name line is missing"])
+        self.assertTrue(any(ln == 2 and "units x rate" in m for ln, m in report.errors))
+        self.assertEqual(report.invoices["INV-1"]["lines"], 3)
+        fields_only = validate_ledes_1998b(("|".join(LEDES_1998B_FIELDS) + "[]\n" + _line(total="500.00")).encode())
+        self.assertEqual(fields_only.errors, [(1, "Expected header 'LEDES1998B[]'")])
+
+if __name__ == '__main__':
+    unittest.main()
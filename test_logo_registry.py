@@ -0,0 +1,33 @@
+import unittest
+import io
+from unittest import mock
+from PIL import Image
+import logo_registry
+from logo_registry import LOGO_MAX_PX, logo_from_file, normalized_logo, placeholder_logo
+
+def image_bytes(fmt, size=(800, 400), mode="RGB"):
+    buf = io.BytesIO()
+    Image.new(mode, size, color="blue").save(buf, format=fmt)
+    return buf.getvalue()
+
+class TestLogoRegistry(unittest.TestCase):
+    def setUp(self):
+        logo_registry.clear()
+
+    def test_normalizes_to_render_size_and_caches_by_digest(self):
+        logo = normalized_logo(image_bytes("PNG", mode="RGBA"))
+        img = Image.open(io.BytesIO(logo))
+        self.assertEqual(img.format, "JPEG")
+        self.assertEqual(max(img.size), LOGO_MAX_PX)
+        with mock.patch.object(logo_registry, "_normalize", side_effect=AssertionError("decoded twice")):
+            self.assertEqual(normalized_logo(image_bytes("PNG", mode="RGBA")), logo)
+        self.assertIsNone(normalized_logo(image_bytes("GIF")))
+        self.assertIsNone(normalized_logo(b"invalid"))
+
+    def test_files_and_placeholder(self):
+        self.assertIsNone(logo_from_file("/nonexistent/logo.jpg"))
+        self.assertIsNotNone(logo_from_file("assets/nelsonmurdock2.jpg"))
+        self.assertIs(placeholder_logo(), placeholder_logo())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+import datetime as dt
+from period_planner import period_containing, plan_periods
+
+class TestPeriodPlanner(unittest.TestCase):
+    def test_monthly_matches_month_by_month_backfill(self):
+        periods = plan_periods(dt.date(2025, 3, 1), dt.date(2025, 3, 31), 14)
+        self.assertEqual(len(periods), 14)
+        self.assertEqual(periods[1], (dt.date(2025, 2, 1), dt.date(2025, 2, 28)))
+        self.assertEqual(periods[-1], (dt.date(2024, 2, 1), dt.date(2024, 2, 29)))
+        for newer, older in zip(periods, periods[1:]):
+            self.assertEqual(older[1] + dt.timedelta(days=1), newer[0])
+
+    def test_other_cadences(self):
+        semi = plan_periods(dt.date(2025, 3, 1), dt.date(2025, 3, 15), 3, "semi-monthly")
+        self.assertEqual(semi[1:], [(dt.date(2025, 2, 16), dt.date(2025, 2, 28)), (dt.date(2025, 2, 1), dt.date(2025, 2, 15))])
+        weekly = plan_periods(dt.date(2025, 3, 3), dt.date(2025, 3, 9), 2, "weekly")
+        self.assertEqual(weekly[1], (dt.date(2025, 2, 24), dt.date(2025, 3, 2)))
+        self.assertEqual(period_containing(dt.date(2025, 8, 20), "fiscal-quarter", fiscal_start_month=7),
+                         (dt.date(2025, 7, 1), dt.date(2025, 9, 30)))
+        self.assertEqual(period_containing(dt.date(2025, 1, 5), "fiscal-quarter", fiscal_start_month=11),
+                         (dt.date(2024, 11, 1), dt.date(2025, 1, 31)))
+        custom = plan_periods(dt.date(2025, 3, 1), dt.date(2025, 3, 28), 3, "custom-days", period_days=28)
+        self.assertTrue(all((e - s).days == 27 for s, e in custom[2:]))
+        with self.assertRaises(ValueError):
+            period_containing(dt.date(2025, 1, 1), "fortnightly")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from invoice_pipeline import StageCache
+from portfolio import generate_portfolio, plan_portfolio
+from test_invoice_pipeline import make_batch
+
+CLIENTS = [{"name": "Acme", "ext_id": "C-1"}, {"name": "Globex", "ext_id": "C-2"}, {"name": "Initech", "ext_id": "C-3"}]
+FIRMS = [{"name": "Nelson and Murdock", "ext_id": "02-1234567"}, {"name": "JDL", "ext_id": "JDL001", "weight": 3.0}]
+
+class TestPortfolio(unittest.TestCase):
+    def test_plan_is_deterministic_with_unique_matters(self):
+        plan = plan_portfolio(CLIENTS, FIRMS, seed=5, firms_per_client=2, matters_per_engagement=(1, 4), matter_number_base="M")
+        self.assertEqual(plan, plan_portfolio(CLIENTS, FIRMS, seed=5, firms_per_client=2, matters_per_engagement=(1, 4), matter_number_base="M"))
+        self.assertEqual(len(plan), 6)
+        matters = [m for e in plan for m in e["matters"]]
+        self.assertEqual(len(matters), len(set(matters)))
+        self.assertTrue(all(1 <= len(e["matters"]) <= 4 for e in plan))
+        with self.assertRaises(ValueError):
+            plan_portfolio([], FIRMS, seed=5)
+
+    def test_outputs_are_partitioned_by_client_and_firm(self):
+        plan = plan_portfolio(CLIENTS[:2], FIRMS, seed=1, matters_per_engagement=2)
+        batch = generate_portfolio(make_batch(num_invoices=2, combine_ledes=True), plan, StageCache())
+        self.assertEqual(len(batch["invoices"]), 8)
+        numbers = [i["invoice_number"] for i in batch["invoices"]]
+        self.assertEqual(len(numbers), len(set(numbers)))
+        self.assertEqual([name for name, _ in batch["attachments"]], [f"{p['folder']}/LEDES_Combined.txt" for p in batch["partitions"]])
+        for part, (_, data) in zip(batch["partitions"], batch["attachments"]):
+            self.assertEqual(data.count(b"LEDES1998B[]"), 1)
+            self.assertEqual(part["invoices"], 4)
+        self.assertEqual({i["client_id"] for i in batch["invoices"]}, {"C-1", "C-2"})
+
+    def test_partition_folders_are_unique(self):
+        plan = plan_portfolio([CLIENTS[0], {"name": "Acme East", "ext_id": "C/1"}, CLIENTS[0]], FIRMS[:1], seed=1)
+        batch = generate_portfolio(make_batch(num_invoices=1, combine_ledes=True), plan, StageCache())
+        folders = [p["folder"] for p in batch["partitions"]]
+        self.assertEqual(folders, ["C-1__02-1234567", "C_1__02-1234567", "C-1__02-1234567-2"])
+        self.assertEqual(len({name for name, _ in batch["attachments"]}), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import datetime as dt
+import random
+import unittest
+
+from faker_pool import build_faker_pool
+from invoice_engine import CONFIG, _generate_fees
+from roster_synth import RATE_BANDS, ROSTER_COLUMNS, roster_summary, synthesize_roster
+
+class TestRosterSynth(unittest.TestCase):
+    def test_roster_is_seeded_and_unique(self):
+        roster = synthesize_roster(3000, seed=5)
+        self.assertEqual(roster, synthesize_roster(3000, seed=5))
+        self.assertNotEqual(roster, synthesize_roster(3000, seed=6))
+        self.assertEqual(list(roster[0]), ROSTER_COLUMNS)
+        self.assertEqual(len({tk["TIMEKEEPER_NAME"] for tk in roster}), 3000)
+        self.assertEqual(len({tk["TIMEKEEPER_ID"] for tk in roster}), 3000)
+
+    def test_mix_and_rate_bands(self):
+        summary = roster_summary(synthesize_roster(5000, seed=1, mix={"Partner": 1, "Paralegal": 3})).set_index("TIMEKEEPER_CLASSIFICATION")
+        self.assertEqual(set(summary.index), {"Partner", "Paralegal"})
+        self.assertAlmostEqual(summary.loc["Paralegal", "count"] / 5000, 0.75, delta=0.03)
+        for label, row in summary.iterrows():
+            median, _, floor, ceiling = RATE_BANDS[label]
+            self.assertTrue(floor <= row["min"] and row["max"] <= ceiling)
+            self.assertAlmostEqual(row["median"], median, delta=median * 0.1)
+        with self.assertRaises(ValueError):
+            synthesize_roster(0)
+
+    def test_roster_feeds_fee_generation(self):
+        roster = synthesize_roster(2000, seed=3)
+        random.seed(1)
+        rows = _generate_fees(300, roster, dt.date(2025, 1, 1), dt.date(2025, 1, 31), CONFIG['DEFAULT_TASK_ACTIVITY_DESC'],
+                              CONFIG['MAJOR_TASK_CODES'], 16, build_faker_pool(), "02-4388252", "02-1234567", "Services")
+        self.assertEqual(len(rows), 300)
+        rates = {tk["TIMEKEEPER_ID"]: tk["RATE"] for tk in roster}
+        self.assertTrue(all(rates[r["TIMEKEEPER_ID"]] == r["RATE"] for r in rows))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import tempfile
+from invoice_pipeline import StageCache, generate_batch
+from run_metrics import artifact_bytes, clear_runs, compare_configs, config_label, load_runs, record_run, stage_seconds
+from run_profiler import RunProfiler
+from test_invoice_pipeline import make_batch
+
+class TestRunMetrics(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "metrics.db")
+
+    def run_batch(self, **overrides):
+        params = make_batch(num_invoices=2, **overrides)
+        with RunProfiler() as profiler:
+            batch = generate_batch(params, StageCache(), profiler)
+        return record_run(profiler, params, batch["invoices"], db_path=self.db_path), params, batch
+
+    def test_runs_are_recorded_and_compared_by_config(self):
+        self.run_batch()
+        self.run_batch()
+        run_id, params, batch = self.run_batch(include_pdf=True)
+        runs = load_runs(db_path=self.db_path)
+        self.assertEqual(len(runs), 3)
+        last = runs.iloc[-1]
+        self.assertEqual(last["id"], run_id)
+        self.assertEqual(last["lines"], sum(len(i["rows"]) for i in batch["invoices"]))
+        self.assertEqual(last["config"], config_label(params))
+        self.assertIn("PDF", last["config"])
+        self.assertGreater(last["lines_per_s"], 0)
+        self.assertGreater(last["peak_rss_mb"], 0)
+        sizes = artifact_bytes(runs)
+        self.assertGreater(sizes.loc[run_id, "pdf"], 0)
+        self.assertEqual(sizes.loc[runs.iloc[0]["id"], "pdf"], 0)
+        self.assertIn("fees", stage_seconds(runs).columns)
+        configs = compare_configs(runs)
+        self.assertEqual(sorted(configs["runs"]), [1, 2])
+
+    def test_limit_and_clear(self):
+        for _ in range(3):
+            self.run_batch()
+        self.assertEqual(list(load_runs(2, self.db_path)["id"]), [2, 3])
+        clear_runs(self.db_path)
+        self.assertTrue(load_runs(db_path=self.db_path).empty)
+        self.assertTrue(compare_configs(load_runs(db_path=self.db_path)).empty)
+
+if __name__ == "__main__":
+    unittest.main()
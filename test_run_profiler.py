@@ -0,0 +1,49 @@
+import unittest
+from invoice_pipeline import StageCache, build_invoice, generate_batch
+from run_profiler import RunProfiler
+from test_invoice_pipeline import make_batch, make_job
+
+class TestRunProfiler(unittest.TestCase):
+    def test_stage_timings_and_cache_hits(self):
+        cache = StageCache()
+        profiler = RunProfiler()
+        with profiler:
+            build_invoice(make_job(), cache, profiler)
+            build_invoice(make_job(), cache, profiler)
+        fees = profiler.stages["fees"]
+        self.assertEqual(fees.calls, 2)
+        self.assertEqual(fees.cached, 1)
+        self.assertEqual(fees.lines, 16)
+        self.assertGreater(profiler.stages["pdf"].bytes, 0)
+        self.assertGreater(profiler.peak_rss_bytes, 0)
+        self.assertGreaterEqual(profiler.wall_s, sum(s.wall_s for s in profiler.stages.values()))
+        self.assertEqual({r["stage"] for r in profiler.summary()}, set(profiler.stages))
+
+    def test_parallel_build_records_worker_stages(self):
+        params = make_batch(num_invoices=3, include_pdf=True, generate_receipts=True, expenses=3)
+        serial, parallel = RunProfiler(), RunProfiler()
+        with serial:
+            generate_batch(params, StageCache(), serial)
+        with parallel:
+            generate_batch({**params, "workers": 2}, StageCache(), parallel)
+        self.assertEqual(parallel.stages["build"].lines, serial.stages["rows"].lines)
+        for name in ("fees", "expenses", "rows", "ledes", "pdf", "receipts"):
+            self.assertEqual(parallel.stages[name].calls, 3, name)
+            self.assertEqual((parallel.stages[name].lines, parallel.stages[name].bytes),
+                             (serial.stages[name].lines, serial.stages[name].bytes), name)
+            self.assertGreater(parallel.stages[name].wall_s, 0, name)
+
+    def test_optional_captures_and_exports(self):
+        profiler = RunProfiler(capture_cprofile=True, capture_memory=True)
+        with profiler:
+            with profiler.stage("work") as stats:
+                stats.lines += len([str(i) for i in range(10000)])
+        self.assertTrue(profiler.hot_functions)
+        self.assertGreater(profiler.peak_memory_bytes, 0)
+        text = profiler.to_openmetrics()
+        self.assertIn('ledes_gen_stage_lines_total{stage="work"} 10000', text)
+        self.assertTrue(text.endswith("# EOF\n"))
+        self.assertIn('"work"', profiler.to_json())
+
+if __name__ == "__main__":
+    unittest.main()
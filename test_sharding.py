@@ -0,0 +1,82 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from invoice_pipeline import StageCache, generate_batch, plan_batch, shard_range
+from sharding import merge_shards, run_shard, shard_dir_name
+from test_invoice_pipeline import make_batch
+
+
+def run_shards(params, shard_count, root):
+    dirs = [os.path.join(root, shard_dir_name(n, shard_count)) for n in range(shard_count)]
+    with ProcessPoolExecutor(max_workers=shard_count, mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(run_shard, [{**params, "shard_index": n, "shard_count": shard_count} for n in range(shard_count)], dirs))
+    return dirs
+
+
+def run_shards_serially(params, shard_count, root):
+    dirs = [os.path.join(root, shard_dir_name(n, shard_count)) for n in range(shard_count)]
+    for n, shard_dir in enumerate(dirs):
+        run_shard({**params, "shard_index": n, "shard_count": shard_count}, shard_dir)
+    return dirs
+
+
+class TestSharding(unittest.TestCase):
+    def test_shard_ranges_cover_plan_once(self):
+        self.assertEqual([list(shard_range(7, n, 3)) for n in range(3)], [[0, 1, 2], [3, 4], [5, 6]])
+        self.assertEqual(list(shard_range(2, 3, 4)), [])
+        with self.assertRaises(ValueError):
+            shard_range(5, 2, 2)
+
+    def test_sharded_jobs_keep_global_numbers(self):
+        params = make_batch(num_invoices=4, matters=["M-1", "M-2"])
+        full = [j["invoice_number"] for j in plan_batch(params)]
+        sharded = [j["invoice_number"] for n in range(3) for j in plan_batch({**params, "shard_index": n, "shard_count": 3})]
+        self.assertEqual(sharded, full)
+        self.assertEqual(len(set(full)), 8)
+
+    def test_merged_shards_match_unsharded_run(self):
+        params = make_batch(num_invoices=5, combine_ledes=True)
+        single = generate_batch(params, StageCache())
+        with tempfile.TemporaryDirectory() as root:
+            dirs = run_shards(params, 3, root)
+            manifest = merge_shards(dirs, os.path.join(root, "merged"))
+            with open(os.path.join(root, "merged", "LEDES_Combined.txt"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), single["combined_ledes"])
+            with open(os.path.join(root, "merged", "manifest.json"), encoding="utf-8") as f:
+                self.assertEqual(json.load(f), manifest)
+        self.assertEqual([i["invoice_number"] for i in manifest["invoices"]], [i["invoice_number"] for i in single["invoices"]])
+        self.assertEqual(manifest["total_lines"], sum(len(i["rows"]) for i in single["invoices"]))
+        self.assertEqual([i["first_line"] for i in manifest["invoices"]][:2], [1, 1 + len(single["invoices"][0]["rows"])])
+
+    def test_merge_per_invoice_and_per_matter_ledes(self):
+        params = make_batch(num_invoices=2, matters=["M-1", "M-2"])
+        with tempfile.TemporaryDirectory() as root:
+            merge_shards(run_shards_serially(params, 3, os.path.join(root, "individual")), os.path.join(root, "merged"))
+            with open(os.path.join(root, "merged", "LEDES_Combined.txt"), encoding="utf-8") as f:
+                text = f.read()
+            self.assertEqual(text, generate_batch({**params, "combine_ledes": True}, StageCache())["combined_ledes"])
+
+            per_matter = {**params, "per_matter_ledes": True}
+            merge_shards(run_shards_serially(per_matter, 3, os.path.join(root, "per-matter")), os.path.join(root, "pm"))
+            expected = dict(generate_batch(per_matter, StageCache())["attachments"])
+            for matter in ("M-1", "M-2"):
+                with open(os.path.join(root, "pm", f"LEDES_1998B_{matter}.txt"), "rb") as f:
+                    self.assertEqual(f.read(), expected[f"LEDES_1998B_{matter}.txt"])
+
+    def test_merge_rejects_incomplete_or_mixed_shards(self):
+        params = make_batch(num_invoices=3, combine_ledes=True)
+        with tempfile.TemporaryDirectory() as root:
+            dirs = [os.path.join(root, str(n)) for n in range(3)]
+            for n, d in enumerate(dirs):
+                run_shard({**params, "shard_index": n, "shard_count": 3, "seed": 42 if n else 7}, d)
+            with self.assertRaises(ValueError):
+                merge_shards(dirs[1:], os.path.join(root, "merged"))
+            with self.assertRaises(ValueError):
+                merge_shards(dirs, os.path.join(root, "merged"))
+
+if __name__ == '__main__':
+    unittest.main()
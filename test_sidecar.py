@@ -0,0 +1,71 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from invoice_pipeline import StageCache, build_jobs, generate_batch, plan_batch
+from sidecar import SIDECAR_COLUMNS, SIDECAR_NAMES, merge_sidecars, read_sidecar, sidecar_bytes, sidecar_format, write_sidecar
+from test_invoice_pipeline import make_batch
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; sidecars fall back to csv.gz
+    pq = None
+
+class TestSidecar(unittest.TestCase):
+    def setUp(self):
+        self.params = make_batch(num_invoices=4, fees=12, expenses=3, anomalies={"duplicate_line": 0.1, "rate_deviation": 0.1})
+        self.jobs = plan_batch(self.params)
+        self.built = build_jobs(self.jobs, StageCache())
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_batch_sidecar_has_every_line_with_metadata_and_labels(self):
+        batch = generate_batch({**self.params, "sidecar": True}, StageCache())
+        df = read_sidecar(dict(batch["attachments"])[SIDECAR_NAMES[sidecar_format()]])
+        self.assertEqual(list(df.columns), SIDECAR_COLUMNS)
+        self.assertEqual(len(df), sum(len(i["rows"]) for i in batch["invoices"]))
+        for invoice in batch["invoices"]:
+            lines = df[df["INVOICE_NUMBER"] == invoice["invoice_number"]]
+            self.assertEqual(list(lines["LINE_ITEM_NUMBER"]), list(range(1, len(invoice["rows"]) + 1)))
+            self.assertEqual(set(lines["BILLING_START_DATE"]), {invoice["billing_start"]})
+            self.assertAlmostEqual(lines["LINE_ITEM_TOTAL"].sum(), invoice["total_amount"], places=2)
+            self.assertEqual(list(lines["ANOMALY"].fillna("")), [r.get("ANOMALY", "") for r in invoice["rows"]])
+
+    def _check_merge(self, fmt, expected, lines):
+        halves = [os.path.join(self.tmp.name, f"half{n}.{fmt}") for n in (0, 1)]
+        write_sidecar(self.jobs[:2], self.built[:2], halves[0], fmt=fmt)
+        write_sidecar(self.jobs[2:], self.built[2:], halves[1], fmt=fmt)
+        merged = os.path.join(self.tmp.name, f"merged.{fmt}")
+        self.assertEqual(merge_sidecars(halves, merged), lines)
+        self.assertTrue(read_sidecar(merged).fillna("").equals(expected.fillna("")))
+
+    def test_csv_fallback_without_pyarrow(self):
+        with mock.patch("sidecar.pq", None):
+            self.assertEqual(sidecar_format(), "csv.gz")
+            with self.assertRaises(ValueError):
+                write_sidecar(self.jobs, self.built, os.path.join(self.tmp.name, "lines.parquet"), fmt="parquet")
+            batch = generate_batch({**self.params, "sidecar": True}, StageCache())
+            self.assertIn("lines.csv.gz", dict(batch["attachments"]))
+        csv_gz = os.path.join(self.tmp.name, "lines.csv.gz")
+        lines = write_sidecar(self.jobs, self.built, csv_gz, fmt="csv.gz", group_lines=10)
+        self.assertEqual(lines, sum(len(out["rows"]) for out in self.built))
+        with open(csv_gz, "rb") as f:  # the same bytes whether written to a path or in memory
+            self.assertEqual(f.read(), sidecar_bytes(self.jobs, self.built, "csv.gz")[1])
+        expected = read_sidecar(csv_gz)
+        self.assertEqual(list(expected.columns), SIDECAR_COLUMNS)
+        self.assertEqual(list(expected["INVOICE_NUMBER"]), [job["invoice_number"] for job, out in zip(self.jobs, self.built) for _ in out["rows"]])
+        self._check_merge("csv.gz", expected, lines)
+
+    @unittest.skipUnless(pq, "pyarrow is not installed")
+    def test_parquet_row_groups_match_csv_and_merge(self):
+        parquet, csv_gz = os.path.join(self.tmp.name, "lines.parquet"), os.path.join(self.tmp.name, "lines.csv.gz")
+        lines = write_sidecar(self.jobs, self.built, parquet, group_lines=10)
+        self.assertEqual(lines, sum(len(out["rows"]) for out in self.built))
+        self.assertEqual(pq.ParquetFile(parquet).num_row_groups, 4)  # whole invoices per group
+        write_sidecar(self.jobs, self.built, csv_gz, fmt="csv.gz")
+        expected = read_sidecar(parquet)
+        self.assertTrue(read_sidecar(csv_gz).fillna("").equals(expected.fillna("")))
+        self._check_merge("parquet", expected, lines)
+
+if __name__ == '__main__':
+    unittest.main()
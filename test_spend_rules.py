@@ -0,0 +1,81 @@
+import unittest
+import datetime as dt
+import pickle
+import random
+import sys
+from unittest import mock
+from invoice_pipeline import StageCache, generate_batch, plan_batch
+from spend_rules import DEFAULT_RULES, compile_rules, parse_rules
+from test_invoice_pipeline import TIMEKEEPERS, make_batch
+
+RULES_YAML = """
+rules:
+  - name: Audit ride
+    type: expense
+    description: Ride to audit site
+    expense_code: E110
+    when: {every: 4, offset: 1}
+  - name: Partner review
+    type: fee
+    description: Partner review of deficiency notice
+    classification: Associate
+    task: L140
+    activity: A107
+    hours: [1.0, 1.0]
+    when: {probability: 0.5}
+    replaces_generated: false
+"""
+
+class TestSpendRules(unittest.TestCase):
+    def test_default_rules_match_mandatory_items(self):
+        jobs = plan_batch(make_batch(num_invoices=2, mandatory_items=["KBCG", "Uber E110"]))
+        self.assertEqual([j["mandatory_items"] for j in jobs], [("KBCG", "Uber E110")] * 2)
+        self.assertEqual((jobs[0]["fee_count"], jobs[0]["expense_count"]), (5, 0))
+        random.seed(1)
+        rows = DEFAULT_RULES.apply([], ["KBCG", "John Doe"], TIMEKEEPERS, "Services", "C", "F",
+                                   dt.date(2025, 1, 1), dt.date(2025, 1, 31))
+        self.assertEqual([(r["TIMEKEEPER_NAME"], r["TIMEKEEPER_ID"], r["RATE"]) for r in rows],
+                         [("Tom Delaganis", "TD001", 250.0), ("Ryan Kinsey", "RK001", 200.0)])
+        self.assertEqual(rows[0]["LINE_ITEM_TOTAL"], round(rows[0]["HOURS"] * 250.0, 2))
+
+    def test_conditional_rules_are_deterministic_per_invoice(self):
+        rules = parse_rules(RULES_YAML)
+        params = make_batch(num_invoices=40, multiple_periods=False, spend_rules=rules)
+        jobs = plan_batch(params)
+        rides = [j["index"] for j in jobs if "Audit ride" in j["mandatory_items"]]
+        self.assertEqual(rides, list(range(1, 40, 4)))
+        self.assertTrue(all(j["expense_count"] == (0 if j["index"] in rides else 1) for j in jobs))
+        reviews = sum("Partner review" in j["mandatory_items"] for j in jobs)
+        self.assertTrue(8 < reviews < 32)
+        self.assertTrue(all(j["fee_count"] == 6 for j in jobs))
+        self.assertEqual([j["mandatory_items"] for j in plan_batch({**params, "shard_count": 4, "shard_index": 2})],
+                         [j["mandatory_items"] for j in jobs[20:30]])
+        self.assertEqual(pickle.loads(pickle.dumps(rules)).key, rules.key)
+
+        batch = generate_batch({**params, "num_invoices": 6}, StageCache())
+        for job, invoice in zip(jobs, batch["invoices"]):
+            review = [r for r in invoice["rows"] if r["DESCRIPTION"] == "Partner review of deficiency notice"]
+            self.assertEqual(len(review), "Partner review" in job["mandatory_items"])
+            self.assertTrue(all(r["TIMEKEEPER_CLASSIFICATION"] == "Associate" and r["HOURS"] == 1.0 for r in review))
+            self.assertAlmostEqual(invoice["total_amount"], sum(r["LINE_ITEM_TOTAL"] for r in invoice["rows"]), places=2)
+
+    def test_invalid_rules_are_rejected(self):
+        for spec in ({"rules": [{"name": "x", "type": "fee"}]},
+                     [{"name": "x", "description": "d", "type": "expense"}],
+                     [{"name": "x", "description": "d", "when": {"probability": 2}}],
+                     [{"name": "x", "description": "d", "when": {"weekday": 1}}],
+                     [{"name": "x", "description": "d"}, {"name": "x", "description": "e"}],
+                     "rules"):
+            with self.assertRaises(ValueError):
+                compile_rules(spec)
+        with self.assertRaises(ValueError):
+            parse_rules("rules: [unclosed")
+
+    def test_yaml_without_pyyaml_asks_to_install_it(self):
+        with mock.patch.dict(sys.modules, {"yaml": None}):  # import yaml raises ImportError
+            with self.assertRaisesRegex(ValueError, "pip install pyyaml"):
+                parse_rules(RULES_YAML)
+            self.assertEqual(parse_rules('[{"name": "x", "description": "d"}]').names, ["x"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import gc
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
+from batch_manifest import generate_to_dir, write_zip, zip_files
+from invoice_pipeline import StageCache, build_jobs, generate_batch, package_batch, plan_batch
+from spill_store import ScratchFile, SpillStore, SpilledAttachments, SpilledInvoice, attachment_sources, select_attachments
+from test_invoice_pipeline import make_batch
+
+class TestSpillStore(unittest.TestCase):
+    def setUp(self):
+        self.params = make_batch(num_invoices=4, fees=10, expenses=3, include_pdf=True, generate_receipts=True,
+                                 matters=["M-1", "M-2"], per_matter_ledes=True, anomalies={"duplicate_line": 0.1})
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_spilled_batch_matches_in_memory_batch(self):
+        expected = generate_batch(self.params, StageCache())
+        jobs = plan_batch(self.params)
+        store = SpillStore(0, self.tmp.name)
+        built = build_jobs(jobs, StageCache(), spill=store)
+        self.assertTrue(all(isinstance(out, SpilledInvoice) for out in built))
+        batch = package_batch(jobs, built, per_matter_ledes=True, spill=store)
+        self.assertIsInstance(batch["attachments"], SpilledAttachments)
+        self.assertEqual(list(batch["attachments"]), expected["attachments"])
+        self.assertEqual([i["files"] for i in batch["invoices"]], [i["files"] for i in expected["invoices"]])
+        self.assertEqual([list(i["rows"]) for i in batch["invoices"]], [i["rows"] for i in expected["invoices"]])
+        pdfs = select_attachments(batch["attachments"], lambda name: name.endswith(".pdf"))
+        self.assertEqual(zip_files(pdfs), zip_files([a for a in expected["attachments"] if a[0].endswith(".pdf")]))
+        self.assertGreater(store.blobs, 0)
+        path = store.path
+        del store, built, batch, pdfs
+        gc.collect()
+        self.assertFalse(os.path.exists(path))
+
+    def test_spilling_starts_at_the_threshold_and_skips_output_params(self):
+        self.assertFalse(SpillStore(1e9).should_spill())
+        plain = generate_to_dir(self.params, os.path.join(self.tmp.name, "plain"), StageCache())
+        spilled = generate_to_dir({**self.params, "spill_threshold_mb": 0, "spill_dir": self.tmp.name},
+                                  os.path.join(self.tmp.name, "spilled"), StageCache())
+        self.assertEqual(spilled["files"], plain["files"])
+        for name in plain["files"]:
+            with open(os.path.join(self.tmp.name, "plain", name), "rb") as a, open(os.path.join(self.tmp.name, "spilled", name), "rb") as b:
+                self.assertEqual(a.read(), b.read(), name)
+
+    def test_combined_outputs_are_streamed_through_scratch_files(self):
+        params = {**self.params, "per_matter_ledes": False, "combine_ledes": True, "pdf_mode": "combined", "sidecar": True}
+        expected = generate_batch(params, StageCache())
+        batch = generate_batch({**params, "spill_threshold_mb": 0, "spill_dir": self.tmp.name}, StageCache())
+        self.assertIsInstance(batch["combined_ledes"], ScratchFile)
+        self.assertEqual(batch["combined_ledes"].encode("utf-8"), expected["combined_ledes"].encode("utf-8"))
+        sources = dict(attachment_sources(batch["attachments"]))
+        self.assertIsInstance(sources["Invoices_Combined.pdf"], ScratchFile)
+        self.assertEqual(list(batch["attachments"]), expected["attachments"])
+        with open(os.path.join(self.tmp.name, "batch.zip"), "wb") as f:
+            write_zip(batch["attachments"], f, dedup=True)
+        with zipfile.ZipFile(os.path.join(self.tmp.name, "batch.zip")) as spilled, \
+                zipfile.ZipFile(io.BytesIO(zip_files(expected["attachments"], dedup=True))) as plain:
+            self.assertEqual(spilled.namelist(), plain.namelist())
+            self.assertTrue(all(spilled.read(name) == plain.read(name) for name in plain.namelist()))
+
+    def test_rss_is_read_once_per_invoice(self):
+        jobs = plan_batch(self.params)
+        store = SpillStore(1e9, self.tmp.name)
+        with mock.patch("spill_store.rss_bytes", return_value=0) as rss:
+            package_batch(jobs, build_jobs(jobs, StageCache(), spill=store), per_matter_ledes=True, spill=store)
+        self.assertEqual(rss.call_count, 2 * len(jobs))  # once when built, once when packaged
+
+if __name__ == '__main__':
+    unittest.main()